@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the FaCollection methods (no R needed).
+
+@author: thoverga
+"""
+
+import shutil
+import tempfile
+
+import pyfa_tool.modules.synthetic as synthetic
+from pyfa_tool.collection import FaCollection
+
+from . import common
+
+
+class CombineByValidate:
+    """Combining multiple FaDatasets along the validate dimension."""
+
+    params = ([(50, 40, 10), (200, 200, 46)], [3, 12])
+    param_names = ['nx, ny, nlev', 'nfiles']
+    timeout = 600
+
+    def setup(self, grid, nfiles):
+        nx, ny, nlev = grid
+        payloads = synthetic.synthetic_collection_payloads(nfiles=nfiles, nx=nx,
+                                                           ny=ny, nlev=nlev)
+        self.datasets = [common.payload_to_fadataset(payload) for payload in payloads]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown(self, grid, nfiles):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _collection(self):
+        # combining drops attributes of the datasets, so work on copies
+        datasets = [common.fresh_fadataset(dataset.ds) for dataset in self.datasets]
+        return FaCollection(FaDatasets=datasets)
+
+    def time_combine_by_validate(self, grid, nfiles):
+        self._collection().combine_by_validate()
+
+    def peakmem_combine_by_validate(self, grid, nfiles):
+        self._collection().combine_by_validate()
+
+    def time_save_nc(self, grid, nfiles):
+        collection = self._collection()
+        collection.combine_by_validate()
+        collection.save_nc(outputfolder=self.tmpdir, filename='collection',
+                           overwrite=True)
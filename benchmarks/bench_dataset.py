@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the FaDataset building blocks (no R needed).
+
+@author: thoverga
+"""
+
+import shutil
+import tempfile
+
+import pyfa_tool.modules.reading_fa as reading_fa
+
+from . import common
+
+
+class JsonToDataset:
+    """Reading the FA.json and building the xarray.Dataset."""
+
+    params = [common.GRID_SIZES]
+    param_names = common.GRID_NAMES
+    timeout = 300
+
+    def setup(self, grid):
+        nx, ny, nlev = grid
+        self.tmpdir = tempfile.mkdtemp()
+        self.jsonfile = common.write_payload(common.synthetic_payload(nx, ny, nlev),
+                                             self.tmpdir)
+
+    def teardown(self, grid):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def time_json_to_full_dataset(self, grid):
+        reading_fa.json_to_full_dataset(self.jsonfile)
+
+    def peakmem_json_to_full_dataset(self, grid):
+        reading_fa.json_to_full_dataset(self.jsonfile)
+
+
+class CleanDataset:
+    """Formatting a freshly read dataset (time dimensions, pseudo 3D, layout)."""
+
+    params = [common.GRID_SIZES]
+    param_names = common.GRID_NAMES
+    timeout = 300
+
+    def setup(self, grid):
+        nx, ny, nlev = grid
+        self.ds = common.payload_to_raw_dataset(common.synthetic_payload(nx, ny, nlev))
+        self.cleaned_ds = common.payload_to_fadataset(common.synthetic_payload(nx, ny, nlev)).ds
+
+    def time_clean(self, grid):
+        common.fresh_fadataset(self.ds)._clean()
+
+    def time_clean_already_clean(self, grid):
+        common.fresh_fadataset(self.cleaned_ds)._clean()
+
+    def time_format_pseudo_3d_fields(self, grid):
+        common.fresh_fadataset(self.ds)._format_pseudo_3d_fields()
+
+
+class Reproject:
+    """Reprojecting a dataset to latlon."""
+
+    params = [common.GRID_SIZES]
+    param_names = common.GRID_NAMES
+    timeout = 300
+
+    def setup(self, grid):
+        nx, ny, nlev = grid
+        self.ds = common.payload_to_fadataset(common.synthetic_payload(nx, ny, nlev)).ds
+
+    def time_reproject(self, grid):
+        common.fresh_fadataset(self.ds).reproject(target_epsg='EPSG:4326')
+
+    def peakmem_reproject(self, grid):
+        common.fresh_fadataset(self.ds).reproject(target_epsg='EPSG:4326')
+
+
+class SaveNc:
+    """Writing a dataset to netCDF."""
+
+    params = [common.GRID_SIZES]
+    param_names = common.GRID_NAMES
+    timeout = 300
+
+    def setup(self, grid):
+        nx, ny, nlev = grid
+        self.tmpdir = tempfile.mkdtemp()
+        self.dataset = common.payload_to_fadataset(common.synthetic_payload(nx, ny, nlev))
+
+    def teardown(self, grid):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def time_save_nc(self, grid):
+        self.dataset.save_nc(outputfolder=self.tmpdir, filename='bench',
+                             overwrite=True)
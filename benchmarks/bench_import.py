@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the startup time (imports) of the package and the CLI modes.
+
+The timeraw_ benchmarks run in a fresh python process, so nothing is imported
+yet. The track_ benchmarks count the heavy modules that are imported by a mode
+and should stay at zero.
+
+@author: thoverga
+"""
+
+import sys
+import subprocess
+
+
+# Modules that are only needed for plotting (or for decoding/converting)
+PLOTTING_MODULES = ['matplotlib', 'cartopy']
+DECODING_MODULES = ['xarray', 'rioxarray']
+
+_DESCRIBE_CODE = """
+import pyfa_tool
+fafile = pyfa_tool.FaFile('PFARSYNTH+0001', backend='synthetic')
+"""
+
+_CONVERT_CODE = """
+import os, tempfile
+import pyfa_tool
+dataset = pyfa_tool.FaDataset('PFARSYNTH+0001', backend='synthetic')
+dataset.import_fa(whitelist=['SYNTH2D.000'])
+with tempfile.TemporaryDirectory() as tmpdir:
+    dataset.save_nc(outputfolder=tmpdir, filename='synth.nc')
+"""
+
+
+def _count_imported(code, modules):
+    """Run code in a new python process and count the imported modules."""
+    check = (code +
+             f"\nimport sys\nprint(sum(m in sys.modules for m in {modules!r}))\n")
+    output = subprocess.run([sys.executable, '-c', check], capture_output=True,
+                            text=True, check=True).stdout
+    return int(output.strip().splitlines()[-1])
+
+
+def timeraw_import_pyfa():
+    return "import pyfa_tool"
+
+
+def timeraw_import_describe():
+    return _DESCRIBE_CODE
+
+
+def timeraw_import_dataset():
+    return "from pyfa_tool import FaDataset"
+
+
+def track_plotting_modules_on_describe():
+    return _count_imported(_DESCRIBE_CODE, PLOTTING_MODULES)
+
+
+track_plotting_modules_on_describe.unit = 'modules'
+
+
+def track_decoding_modules_on_describe():
+    return _count_imported(_DESCRIBE_CODE, DECODING_MODULES)
+
+
+track_decoding_modules_on_describe.unit = 'modules'
+
+
+def track_plotting_modules_on_convert():
+    return _count_imported(_CONVERT_CODE, PLOTTING_MODULES)
+
+
+track_plotting_modules_on_convert.unit = 'modules'
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the spectral to grid-point transform (no R needed).
+
+@author: thoverga
+"""
+
+import numpy as np
+
+import pyfa_tool.modules.spectral as spectral
+import pyfa_tool.modules.synthetic as synthetic
+import pyfa_tool.modules.reading_fa as reading_fa
+
+from . import common
+
+
+class SpectralTransform:
+    """Transforming the levels of a 3D spectral field to grid-point values."""
+
+    params = [common.GRID_SIZES]
+    param_names = common.GRID_NAMES
+    timeout = 300
+
+    def setup(self, grid):
+        nx, ny, nlev = grid
+        self.payload = synthetic.synthetic_fa_payload(nx=nx, ny=ny, nlev=nlev,
+                                                      as_lists=False,
+                                                      spectral=True)
+        # the transform is on the extended (C+I+E) grid of the payload
+        metadata = self.payload['pyfa_metadata']
+        (self.ny, self.nx), _zone = reading_fa._spectral_geometry(metadata)
+        field = np.random.default_rng(0).normal(size=(nlev, self.ny, self.nx))
+        self.coeffs = spectral.gridpoint_to_spectral(field, nsmax=metadata['nsmax'][0],
+                                                     nmsmax=metadata['nmsmax'][0])
+
+    def time_transform_batched(self, grid):
+        spectral.spectral_to_gridpoint(self.coeffs, ny=self.ny, nx=self.nx)
+
+    def time_transform_per_level(self, grid):
+        for coeffs in self.coeffs:
+            spectral.spectral_to_gridpoint(coeffs, ny=self.ny, nx=self.nx)
+
+    def time_transform_preview(self, grid):
+        spectral.spectral_to_gridpoint(self.coeffs, ny=self.ny, nx=self.nx,
+                                       truncation=0.25)
+
+    def time_payload_to_dataset(self, grid):
+        reading_fa.payload_to_dataset(self.payload)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the benchmarks.
+
+@author: thoverga
+"""
+
+import os
+import json
+import tempfile
+
+import pyfa_tool.modules.reading_fa as reading_fa
+import pyfa_tool.modules.synthetic as synthetic
+from pyfa_tool.dataset import FaDataset
+
+
+# (nx, ny, nlev) of the benchmarked grids, one parameter of the benchmarks
+# (params = [GRID_SIZES], a bare list of tuples is read as several parameters)
+GRID_SIZES = [(50, 40, 10), (200, 200, 46)]
+GRID_NAMES = ['nx, ny, nlev']
+
+
+def write_payload(payload, folder):
+    """Write a FA.json-like payload to folder and return the path."""
+    jsonfile = os.path.join(folder, 'FA.json')
+    with open(jsonfile, 'w') as f:
+        json.dump(payload, f)
+    return jsonfile
+
+
+def payload_to_raw_dataset(payload, folder=None):
+    """Convert a payload to a (not yet cleaned) xarray.Dataset."""
+    if folder is None:
+        # the json is only needed while it is read
+        with tempfile.TemporaryDirectory() as tmpdir:
+            return payload_to_raw_dataset(payload, folder=tmpdir)
+    jsonfile = write_payload(payload, folder)
+    return reading_fa.json_to_full_dataset(jsonfile)
+
+
+def payload_to_fadataset(payload, folder=None):
+    """Convert a payload to a (cleaned) FaDataset."""
+    dataset = FaDataset()
+    dataset.ds = payload_to_raw_dataset(payload, folder)
+    dataset._clean()
+    return dataset
+
+
+def fresh_fadataset(ds):
+    """Wrap a shallow copy of a xarray.Dataset in a new FaDataset."""
+    dataset = FaDataset()
+    dataset.ds = ds.copy(deep=False)
+    return dataset
+
+
+def synthetic_payload(nx, ny, nlev, **kwargs):
+    return synthetic.synthetic_fa_payload(nx=nx, ny=ny, nlev=nlev, **kwargs)
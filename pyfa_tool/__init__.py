@@ -26,10 +26,46 @@ demo_fa_nwp_2 = os.path.join(str(Path(package_path).parent.resolve()),
 
 
 
-#User accesable classes
-from pyfa_tool.file import FaFile
-from pyfa_tool.dataset import FaDataset
-from pyfa_tool.collection import FaCollection
+#User accesable classes and functions (name: module). These are imported on
+#first use, so 'import pyfa_tool' does not load xarray, rioxarray, matplotlib,
+#cartopy, ... when they are not needed (e.g. for describing a FA file).
+_lazy_attributes = {
+    'FaFile': 'pyfa_tool.file',
+    'FaDataset': 'pyfa_tool.dataset',
+    'FaCollection': 'pyfa_tool.collection',
+    'FaEnsemble': 'pyfa_tool.ensemble',
+    'FaClient': 'pyfa_tool.client',
+
+    #Decode backends
+    'FaBackend': 'pyfa_tool.modules.backends',
+    'RscriptBackend': 'pyfa_tool.modules.backends',
+    'RworkerBackend': 'pyfa_tool.modules.backends',
+    'SyntheticBackend': 'pyfa_tool.modules.backends',
+    'set_default_backend': 'pyfa_tool.modules.backends',
+    'register_backend': 'pyfa_tool.modules.backends',
+
+    #Field statistics index
+    'set_fieldstats': 'pyfa_tool.modules.fieldstats',
+    }
+
+__all__ = list(_lazy_attributes.keys()) + ['setup_shell_command']
+
+
+def __getattr__(name):
+    """Import the user accesable classes and functions on first use."""
+    if name in _lazy_attributes:
+        import importlib
+        value = getattr(importlib.import_module(_lazy_attributes[name]), name)
+        globals()[name] = value # only import once
+        return value
+    if name == 'modules':
+        import importlib
+        return importlib.import_module('pyfa_tool.modules')
+    raise AttributeError(f"module 'pyfa_tool' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_lazy_attributes.keys()))
 
 
 
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module that holds the FaClient class (the client of pyfa serve)
+
+@author: thoverga
+"""
+
+import sys
+import json
+import socket
+import http.client
+from urllib.parse import urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pyfa_tool.dataset import FaDataset
+import pyfa_tool.modules.serve as serve
+import pyfa_tool.modules.profiling as profiling
+import pyfa_tool.modules.fieldstats as fieldstats
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class FaClient(FaDataset):
+    """
+    A FaDataset whose fields are requested from a FA field server (pyfa serve).
+
+    Only the requested slices (field, levels, bbox/window and stride) are
+    transferred, the decoding (and caching) is done by the server. The data is
+    stored in the .ds attribute like for a FaDataset, so the getters,
+    plotting, reprojecting, saving, ... methods of FaDataset can be used.
+    """
+
+    def __init__(self, fafile=None, address=f'http://{serve.DEFAULT_HOST}:{serve.DEFAULT_PORT}',
+                 nodata=-999, timeout=None):
+        """
+        Initiate a FaClient.
+
+        Parameters
+        ----------
+        fafile : str, optional
+            The path of the FA file, as seen by the server. The default is
+            None.
+        address : str, optional
+            The address of the server: 'http://host:port', or the path of its
+            Unix socket. The default is 'http://127.0.0.1:8765'.
+        nodata : int, optional
+            The Nodata value to be used by (rio)xarray. The default is -999.
+        timeout : float, optional
+            The timeout (in seconds) of the requests. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        # no FaDataset.__init__(), the file is opened (and decoded) by the server
+        self.backend = None
+        self.fafile = fafile
+        self.address = address
+        self.timeout = timeout
+        self.ds = None # xarray.Dataset
+        self.fieldstats = pd.DataFrame(columns=fieldstats.FIELDSTATS_COLUMNS)
+        self.nodata = nodata
+        self.profiler = profiling.StageProfiler()
+
+    def __repr__(self):
+        if self.ds is None:
+            return f'FaClient of {self.fafile} at {self.address} (nothing imported)'
+        return str(self.ds)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def set_fafile(self, fafile):
+        """
+        Update the path to the FA-file (as seen by the server).
+
+        Parameters
+        ----------
+        fafile : str
+            Path to the FA-file.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.fafile = fafile
+
+    # =========================================================================
+    # Requests
+    # =========================================================================
+
+    def _request(self, path, params):
+        """Send a GET request to the server and return the body."""
+        url = urlparse(self.address)
+        if url.scheme in ['http', '']:
+            if url.scheme == 'http':
+                conn = http.client.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+            else:
+                conn = _UnixHTTPConnection(self.address, timeout=self.timeout)
+        elif url.scheme == 'unix':
+            conn = _UnixHTTPConnection(url.path, timeout=self.timeout)
+        else:
+            sys.exit(f'{self.address} is not a http:// address or a Unix socket.')
+
+        try:
+            conn.request('GET', f'{path}?{urlencode(params)}')
+            response = conn.getresponse()
+            body = response.read()
+        except OSError as e:
+            sys.exit(f'The FA server at {self.address} is not reachable: {e}')
+        finally:
+            conn.close()
+        if response.status == 500:
+            sys.exit(f'The FA server failed on the request: {body.decode(errors="replace")}')
+        if response.status != 200:
+            sys.exit(f'The FA server refused the request: {body.decode(errors="replace")}')
+        return body
+
+    def get_available_fields(self):
+        """
+        Get the fields of the FA file (as known by the server).
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per field (2D fieldnames, 3D and pseudo 3D basenames),
+            with the kind, levels, nbits and statistics.
+
+        """
+        assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
+        description = json.loads(self._request('/fields', {'file': self.fafile}))
+        return pd.DataFrame(description['fields'])
+
+    def get_slice(self, fieldname, levels=None, bbox=None, window=None, stride=1):
+        """
+        Request a slice of a field.
+
+        Parameters
+        ----------
+        fieldname : str
+            The 2D fieldname or 3D (pseudo 3D) basename.
+        levels : list of int, optional
+            The levels (3D fields). If None, all levels. The default is None.
+        bbox : tuple of float, optional
+            (xmin, ymin, xmax, ymax) in the native coordinates. The default is
+            None.
+        window : tuple of int, optional
+            (x_start, x_stop, y_start, y_stop) gridpoint indices. The default
+            is None.
+        stride : int, optional
+            Take every stride-th point in x and y. The default is 1.
+
+        Returns
+        -------
+        xarray.DataArray
+            The slice. The attributes, dates and CRS of the dataset are in
+            .encoding['pyfa_server'].
+
+        """
+        assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
+        params = {'file': self.fafile, 'field': fieldname, 'stride': int(stride)}
+        if isinstance(levels, int):
+            levels = [levels]
+        if levels is not None:
+            params['level'] = ','.join([str(int(lev)) for lev in levels])
+        if bbox is not None:
+            params['bbox'] = ','.join([str(float(val)) for val in bbox])
+        if window is not None:
+            params['window'] = ','.join([str(int(val)) for val in window])
+
+        header, arrays = serve.unpack_arrays(bytearray(self._request('/slice', params)))
+        coords = {'x': arrays['x'], 'y': arrays['y']}
+        if 'level' in arrays:
+            coords['level'] = arrays['level']
+        da = xr.DataArray(arrays['values'], dims=header['dims'], coords=coords,
+                          name=fieldname, attrs=header['field_attrs'])
+        da.encoding['pyfa_server'] = {key: header[key] for key in
+                                      ['attrs', 'validate', 'basedate', 'crs']}
+        return da
+
+    # =========================================================================
+    # Importing data
+    # =========================================================================
+
+    def import_fa(self, whitelist=None, levels=None, bbox=None, window=None,
+                  stride=1, reproj=False, target_epsg='EPSG:4326'):
+        """
+        Request fields from the server and make a xarray.Dataset of them.
+
+        Parameters
+        ----------
+        whitelist : list or (fieldname)str, optional
+            The fields (2D fieldnames, 3D and pseudo 3D basenames). If None,
+            all fields of the FA file are requested. The default is None.
+        levels : list of int, optional
+            Only these levels of the 3D fields are requested. The default is
+            None.
+        bbox : tuple of float, optional
+            (xmin, ymin, xmax, ymax) in the native coordinates. The default is
+            None.
+        window : tuple of int, optional
+            (x_start, x_stop, y_start, y_stop) gridpoint indices. The default
+            is None.
+        stride : int, optional
+            Take every stride-th point in x and y. The default is 1.
+        reproj : bool, optional
+            If True, the data will be reproject to the CRS specified by the
+            target_epsg. The default is False.
+        target_epsg : str, optional
+            EPSG code to reproject the data to. The default is 'EPSG:4326'.
+
+        Returns
+        -------
+        None.
+
+        """
+        available = self.get_available_fields()
+        if whitelist is None:
+            whitelist = list(available['field'])
+        if isinstance(whitelist, str):
+            whitelist = [whitelist]
+        # the levels only apply to the fields with levels
+        with_levels = list(available.loc[available['kind'].isin(['3d', 'pseudo_3d']), 'field'])
+
+        fields = {}
+        for fieldname in whitelist:
+            fields[fieldname] = self.get_slice(fieldname,
+                                               levels=levels if fieldname in with_levels else None,
+                                               bbox=bbox, window=window, stride=stride)
+        info = fields[whitelist[0]].encoding['pyfa_server']
+
+        ds = xr.Dataset({name: da.variable for name, da in fields.items()},
+                        coords={name: coord for da in fields.values()
+                                for name, coord in da.coords.items()})
+        ds.attrs.update({key: np.asarray(val) if isinstance(val, list) else val
+                         for key, val in info['attrs'].items()})
+        ds.attrs['validate'] = pd.Timestamp(info['validate'])
+        ds.attrs['basedate'] = pd.Timestamp(info['basedate'])
+        if info['crs'] is not None:
+            ds = ds.rio.write_crs(info['crs'])
+
+        self.ds = ds
+        self._clean()
+        if reproj:
+            self.reproject(target_epsg=target_epsg)
+
+    def import_2d_field(self, fieldname, bbox=None, window=None, stride=1,
+                        reproj=False, target_epsg='EPSG:4326'):
+        """
+        Request a 2D field from the server (see import_fa()).
+
+        Parameters
+        ----------
+        fieldname : str
+            The fieldname of a 2D field in the FA file.
+        bbox, window, stride, reproj, target_epsg :
+            See import_fa().
+
+        Returns
+        -------
+        None.
+
+        """
+        self.import_fa(whitelist=[fieldname], bbox=bbox, window=window,
+                       stride=stride, reproj=reproj, target_epsg=target_epsg)
+
+    def import_3d_field(self, fieldname, levels=None, bbox=None, window=None,
+                        stride=1, reproj=False, target_epsg='EPSG:4326'):
+        """
+        Request a 3D field from the server (see import_fa()).
+
+        Parameters
+        ----------
+        fieldname : str
+            The basename of a 3D (or pseudo 3D) field in the FA file.
+        levels, bbox, window, stride, reproj, target_epsg :
+            See import_fa().
+
+        Returns
+        -------
+        None.
+
+        """
+        self.import_fa(whitelist=[fieldname], levels=levels, bbox=bbox,
+                       window=window, stride=stride, reproj=reproj,
+                       target_epsg=target_epsg)
@@ -6,11 +6,24 @@ Module that holds the FaCollection class
 @author: thoverga
 """
 
+import os
 import sys
+import shutil
+import asyncio
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
 import xarray as xr
 import numpy as np
 from pyfa_tool.dataset import FaDataset as FaDatasetClass
 import pyfa_tool.modules.IO as IO
+import pyfa_tool.modules.archive as archive
+import pyfa_tool.modules.aio as aio
+import pyfa_tool.modules.geospatial_functions as geospatial_func
+import pyfa_tool.modules.reading_fa as reading_fa
+import pyfa_tool.modules.profiling as profiling
+import pyfa_tool.modules.store as collection_store
+import pyfa_tool.modules.scratch as scratch
 
 
 class FaCollection():
@@ -34,7 +47,11 @@ class FaCollection():
 
         """
         self.ds = None
+        self.fafiles = [] # FA files that are imported when iterated (lazy)
+        self._lazy_import = {'backend': None, 'import_kwargs': {}}
         self._combine_on_validate = combine_by_validate
+        self._decode_per = 'field' # decode tasks of lazy FaDatasets
+        self.profiler = profiling.StageProfiler() # timing of the stages
         if bool(FaDatasets):
             #Sets the FaDatasets attribute + apply some checks + combine data if combinemethod is provided!
             self.set_fadatasets(FaDatasets)
@@ -50,6 +67,8 @@ class FaCollection():
             return f'FaCollection with a combined Dataset: \n {self.ds}'
         if bool(self.FaDatasets):
             return f'FaCollection that holds {len(self.FaDatasets)} FaDatasets, not yet been combined.'
+        if bool(self.fafiles):
+            return f'FaCollection of {len(self.fafiles)} FA files, not yet imported.'
         return 'empty instance of a FaCollection.'
 
     def __str__(self):
@@ -58,6 +77,8 @@ class FaCollection():
             return f'FaCollection with a combined Dataset: \n {self.ds}'
         if bool(self.FaDatasets):
             return f'FaCollection that holds {len(self.FaDatasets)} FaDatasets, not yet been combined.'
+        if bool(self.fafiles):
+            return f'FaCollection of {len(self.fafiles)} FA files, not yet imported.'
         return 'empty instance of a FaCollection.'
 
     # =============================================================================
@@ -97,7 +118,9 @@ class FaCollection():
         if self._combine_on_validate:
             self.combine_by_validate()
 
-    def set_fadatasets_by_file_regex(self, searchdir, filename_regex='*', **kwargs):
+    def set_fadatasets_by_file_regex(self, searchdir, filename_regex='*',
+                                     backend=None, lazy=False,
+                                     decode_per='field', **kwargs):
         """
         Update the FaDatasets of this collection by using regex expression of filenames.
 
@@ -109,11 +132,25 @@ class FaCollection():
         searchdir : str
             Path to the directory where the regex search query is executed.
             This is most often the direcotry where the FA files are stored.
+            It can be a tar archive, then the members are matched (and read
+            without extracting the archive).
         filename_regex : str, optional
             Regex expression to match filenames. The default is '*'.
+        backend : str or FaBackend, optional
+            The backend used to decode the FA files. If None, the default
+            backend is used. The default is None.
+        lazy : bool, optional
+            If True, the FA files are imported as dask arrays (see
+            FaDataset.lazy_import_fa()), so the combined dataset is chunked
+            and only decoded when it is computed or saved (see the max_memory
+            argument of save_nc() and save_zarr()). Requires dask. The default
+            is False.
+        decode_per : 'field' or 'file', optional
+            For lazy imports: one decode task per field, or per file. The
+            default is 'field'.
         **kwargs :
-            kwargs passed to the FaDataset.import_fa() method to specify which
-            fields are imported.
+            kwargs passed to the FaDataset.import_fa() (or lazy_import_fa())
+            method to specify which fields are imported.
 
         Returns
         -------
@@ -126,9 +163,13 @@ class FaCollection():
         # Read the FaFiles
         fadatasets = []
         for file in filepaths:
-            Dataset = FaDatasetClass(fafile=file)
-            Dataset.import_fa(**kwargs)
+            Dataset = FaDatasetClass(fafile=file, backend=backend)
+            if lazy:
+                Dataset.lazy_import_fa(decode_per=decode_per, **kwargs)
+            else:
+                Dataset.import_fa(**kwargs)
             fadatasets.append(Dataset)
+        self._decode_per = decode_per
 
         # Add them as attribute
         self.set_fadatasets(FaDatasets=fadatasets)
@@ -137,6 +178,189 @@ class FaCollection():
         if self._combine_on_validate:
             self.combine_by_validate()
 
+    def set_fadatasets_by_catalogue(self, catalogue, whitelist=None, start=None,
+                                    end=None, backend=None, **kwargs):
+        """
+        Update the FaDatasets of this collection by selecting files in a catalogue.
+
+        Only the FA files that contain fields of the whitelist (and that are
+        in the time range) are imported, and only the fields of the whitelist
+        that are in a file are requested.
+
+        Parameters
+        ----------
+        catalogue : pandas.DataFrame or str
+            A catalogue (see modules.catalogue.build_catalogue()), or the path
+            of a catalogue file (.parquet or .csv).
+        whitelist : list, optional
+            The fields (2D fieldnames or 3D basenames) to import. If None, all
+            fields are imported. The default is None.
+        start : datetime-like, optional
+            Only files with a validate at or after start are imported. The
+            default is None.
+        end : datetime-like, optional
+            Only files with a validate at or before end are imported. The
+            default is None.
+        backend : str or FaBackend, optional
+            The backend used to decode the FA files. If None, the default
+            backend is used. The default is None.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method (except the
+            whitelist).
+
+        Returns
+        -------
+        None.
+
+        """
+        import pyfa_tool.modules.catalogue as catalogue_module
+
+        plan = catalogue_module.plan_imports(catalogue=catalogue,
+                                             whitelist=whitelist,
+                                             start=start,
+                                             end=end)
+        fadatasets = []
+        for file, fields in plan.items():
+            Dataset = FaDatasetClass(fafile=file, backend=backend)
+            Dataset.import_fa(whitelist=fields, **kwargs)
+            fadatasets.append(Dataset)
+
+        # Add them as attribute (and combine if specified)
+        self.set_fadatasets(FaDatasets=fadatasets)
+
+    def set_fafiles(self, fafiles, backend=None, **kwargs):
+        """
+        Set the FA files of this collection, without importing them (lazy).
+
+        The FA files are imported one by one (in validate order) when the
+        collection is iterated (see iter_fadatasets()), so collections that
+        are too large for memory can be processed.
+
+        Parameters
+        ----------
+        fafiles : list of str
+            Paths of the FA files. Members of tar archives are given as
+            'archive.tar::member', wildcards in the member
+            ('archive.tar::PFAR*+000*') select all matching members.
+        backend : str or FaBackend, optional
+            The backend used to decode the FA files. If None, the default
+            backend is used. The default is None.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method to specify which
+            fields are imported.
+
+        Returns
+        -------
+        None.
+
+        """
+        if isinstance(fafiles, str):
+            fafiles = [fafiles]
+        fafiles = archive.expand_paths(fafiles)
+        if len(fafiles) == 0:
+            sys.exit('No FA files are provided.')
+        self.fafiles = list(fafiles)
+        self._lazy_import = {'backend': backend, 'import_kwargs': kwargs}
+
+    @aio.exits_as_errors
+    async def aload(self, fafiles, backend=None, max_concurrent=None, **kwargs):
+        """
+        Import FA files concurrently, without blocking the event loop (coroutine).
+
+        All FA files are imported with FaDataset.aimport_fa() at the same
+        time (limited by the decode limit, see
+        modules.aio.set_max_concurrency()), and set as the FaDatasets of this
+        collection. If one import fails, or aload is cancelled, the other
+        imports are cancelled (and their R processes killed). Errors are
+        raised as RuntimeError (see modules.aio.exits_as_errors()).
+
+        Parameters
+        ----------
+        fafiles : list of str
+            Paths of the FA files ('archive.tar::member' paths are accepted,
+            see set_fafiles()).
+        backend : str or FaBackend, optional
+            The backend used to decode the FA files. If None, the default
+            backend is used. The default is None.
+        max_concurrent : int, optional
+            The maximum number of files of this collection that are imported
+            at the same time (on top of the decode limit). If None, only the
+            decode limit is used. The default is None.
+        **kwargs :
+            kwargs passed to the FaDataset.aimport_fa() method to specify which
+            fields are imported.
+
+        Returns
+        -------
+        None.
+
+        """
+        if isinstance(fafiles, str):
+            fafiles = [fafiles]
+        fafiles = await asyncio.to_thread(archive.expand_paths, fafiles)
+        if len(fafiles) == 0:
+            sys.exit('No FA files are provided.')
+
+        semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent is not None else None
+
+        async def _load(fafile):
+            dataset = FaDatasetClass(fafile=fafile, backend=backend)
+            if semaphore is None:
+                await dataset.aimport_fa(**kwargs)
+            else:
+                async with semaphore:
+                    await dataset.aimport_fa(**kwargs)
+            return dataset
+
+        fadatasets = await aio.gather([_load(fafile) for fafile in fafiles])
+
+        # Add them as attribute (and combine if specified)
+        await asyncio.to_thread(self.set_fadatasets, FaDatasets=fadatasets)
+
+    def iter_fadatasets(self, **kwargs):
+        """
+        Iterate over the FaDatasets of this collection in validate order.
+
+        If FA files are set (see set_fafiles()), they are imported one at a
+        time, so only one file is in memory. Else the FaDatasets of the
+        collection are used.
+
+        Parameters
+        ----------
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method, they update the
+            kwargs given to set_fafiles().
+
+        Yields
+        ------
+        FaDataset
+            The (imported) FaDatasets, sorted by validate.
+
+        """
+        if bool(self.FaDatasets):
+            for dataset in sorted(self.FaDatasets, key=lambda x: x.get_validate()):
+                yield dataset
+            return
+        if not bool(self.fafiles):
+            sys.exit('No FaDatasets or FA files are set in this collection.')
+
+        from pyfa_tool.file import FaFile
+        from pyfa_tool.modules.describe_module import _str_to_dt
+
+        # Sort the files on the validate (from the metadata only). The opened
+        # FaFiles are passed to the imports, so the metadata is read once.
+        backend = self._lazy_import['backend']
+        opened = sorted([FaFile(fafile, backend=backend) for fafile in self.fafiles],
+                        key=lambda FA: _str_to_dt(FA.metadata['validate'][0]))
+        import_kwargs = {**self._lazy_import['import_kwargs'], **kwargs}
+        opened.reverse()
+        while bool(opened):
+            FA = opened.pop()
+            dataset = FaDatasetClass(fafile=FA.fafile, backend=backend)
+            dataset._FA = FA
+            dataset.import_fa(**import_kwargs)
+            yield dataset
+
     # =============================================================================
     # Merge Dataset methods
     # =============================================================================
@@ -166,6 +390,12 @@ class FaCollection():
         unique. So a combine on multiple dimensions is prefered for some of these
         applications.
         """
+        with self.profiler.stage('combine_by_validate',
+                                 n_datasets=len(self.FaDatasets)):
+            self._combine_by_validate()
+
+    def _combine_by_validate(self):
+        """Combine all datasets by validate (see combine_by_validate())."""
         FaDatasets = self.FaDatasets
 
         if len(FaDatasets) == 0:
@@ -219,11 +449,517 @@ class FaCollection():
         self._clean()
         self.ds.attrs.update(specific_comb_attributes)
 
+    # =========================================================================
+    # Temporal methods
+    # =========================================================================
+
+    def decumulate(self, fields, period=None):
+        """
+        Convert accumulated fields to amounts over intervals (in place).
+
+        Accumulated fields (precipitation, fluxes, ...) hold the amount since
+        the basedate. They are converted to the amount over the interval
+        that ends at each validate, by differencing along the validate
+        dimension of the combined dataset. The differencing is done in place.
+
+        Parameters
+        ----------
+        fields : list or str
+            The accumulated fields (2D fieldnames or 3D basenames).
+        period : str or pandas.Timedelta, optional
+            The length of the intervals (e.g. '1h'), it must be a multiple of
+            the model timestep. If a validate has no validate one period
+            earlier (missing leadtime), its amount is NaN (the amount at the
+            basedate, +0000, is zero). If None, the intervals are between
+            consecutive validates (the first one starts at the basedate). The
+            default is None.
+
+        Returns
+        -------
+        None.
+
+        Note
+        ------
+        For collections that do not fit in memory (and lazy collections), use
+        iter_decumulated().
+
+        """
+        import pyfa_tool.modules.decumulation as decumulation
+
+        assert not (self.ds is None), 'No collection xarray.Dataset, combine the collection by validate first.'
+        if isinstance(fields, str):
+            fields = [fields]
+        for field in fields:
+            if field not in self.ds.data_vars:
+                sys.exit(f'{field} is not found in the collection.')
+            if 'validate' not in self.ds[field].dims:
+                sys.exit(f'{field} has no validate dimension, combine the collection by validate first.')
+            if self.ds[field].chunks is not None:
+                # the differencing is done in place, not on a computed copy
+                sys.exit(f'{field} is a lazy (dask) field and can not be decumulated in place, use iter_decumulated() or load the collection first.')
+        if self.ds['basedate'].shape[0] != 1:
+            sys.exit('Decumulating is only possible for collections with one basedate.')
+
+        period = decumulation._to_period(period, timestep=self.ds.attrs.get('timestep'))
+        sources = decumulation.interval_sources(validates=self.ds['validate'].values,
+                                                basedate=self.ds['basedate'].values[0],
+                                                period=period)
+
+        missing = []
+        with self.profiler.stage('decumulate', n_fields=len(fields)):
+            for field in fields:
+                xarr = self.ds[field]
+                xarr.variable.load() # in memory (e.g. fields of an opened store), so .values is not a copy
+                missing = decumulation.decumulate_inplace(xarr.values,
+                                                          sources=sources,
+                                                          axis=xarr.dims.index('validate'))
+                xarr.attrs['accumulation_period'] = 'previous validate' if period is None else str(period)
+
+        if bool(missing):
+            missing_validates = [str(pd.Timestamp(t)) for t in self.ds['validate'].values[missing]]
+            print(f'WARNING: the start of the interval is missing for {missing_validates}, these amounts are NaN.')
+
+    def iter_decumulated(self, fields, period=None, **kwargs):
+        """
+        Iterate over the FaDatasets, with the accumulated fields decumulated.
+
+        The FaDatasets are processed one by one in validate order (see
+        iter_fadatasets()). Only the accumulations of the validates that are
+        still needed are kept, so memory is bounded by one file and the
+        accumulations within one period.
+
+        Parameters
+        ----------
+        fields : list or str
+            The accumulated fields (2D fieldnames or 3D basenames).
+        period : str or pandas.Timedelta, optional
+            The length of the intervals (see decumulate()). The default is
+            None.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method (see
+            iter_fadatasets()).
+
+        Yields
+        ------
+        FaDataset
+            The FaDatasets with the decumulated fields (in place).
+
+        """
+        import pyfa_tool.modules.decumulation as decumulation
+
+        if isinstance(fields, str):
+            fields = [fields]
+        decumulator = None
+        for dataset in self.iter_fadatasets(**kwargs):
+            if decumulator is None:
+                decumulator = decumulation.StreamingDecumulator(period=period,
+                                                                timestep=dataset.ds.attrs.get('timestep'))
+            missing_fields = [field for field in fields if not dataset.field_exist(field)]
+            if bool(missing_fields):
+                sys.exit(f'{missing_fields} are not found in {dataset.fafile}.')
+
+            found = decumulator.update(validate=dataset.get_validate(),
+                                       basedate=dataset.get_basedate(),
+                                       fields={field: dataset.ds[field].values for field in fields})
+            if not found:
+                print(f'WARNING: the start of the interval is missing for {dataset.get_validate()}, these amounts are NaN.')
+            for field in fields:
+                dataset.ds[field].attrs['accumulation_period'] = 'previous validate' if decumulator.period is None else str(decumulator.period)
+            yield dataset
+
+    def iter_aggregated(self, freq='1D', stats=['mean'], fields=None, **kwargs):
+        """
+        Iterate over the temporal aggregates (bins) of the collection.
+
+        The FaDatasets are processed one by one in validate order (see
+        iter_fadatasets()), and per-bin running statistics are updated. Each
+        bin is yielded as soon as it is complete (when the first validate of
+        the next bin is found), so memory is bounded by one file and the
+        accumulators of one bin.
+
+        Parameters
+        ----------
+        freq : str, optional
+            The length of the bins, a fixed frequency (e.g. '1D', '6h') or the
+            start of a calendar period ('MS', 'QS', 'YS'). A bin holds the
+            validates in [start, next start). The default is '1D'.
+        stats : list, optional
+            The statistics to compute ('mean', 'sum', 'min', 'max', 'std',
+            'var', 'count'). The default is ['mean'].
+        fields : list, optional
+            The fields (2D fieldnames or 3D basenames) to aggregate. If None,
+            all fields of the first FaDataset are aggregated. The default is
+            None.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method (see
+            iter_fadatasets()).
+
+        Yields
+        ------
+        xarray.Dataset
+            The aggregate of one bin, with a '{field}_{stat}' variable for
+            each field and statistic, and the start of the bin as validate.
+
+        """
+        import pyfa_tool.modules.streaming_stats as streaming_stats
+
+        if isinstance(stats, str):
+            stats = [stats]
+        if isinstance(fields, str):
+            fields = [fields]
+        streaming_stats.check_stats(stats)
+        offset = streaming_stats.to_bin_offset(freq)
+
+        current = None # the bin that is being accumulated
+        for dataset in self.iter_fadatasets(**kwargs):
+            start = streaming_stats.bin_start(dataset.get_validate(), offset)
+            if (current is not None) and (start != current['start']):
+                if start < current['start']:
+                    sys.exit(f'The validates must be increasing, {dataset.get_validate()} comes after the bin of {current["start"]}.')
+                yield _finish_bin(current, freq=freq)
+                current = None
+
+            if current is None:
+                if fields is None:
+                    fields = dataset.get_fieldnames()
+                # only the (small) coordinates and attributes are kept, not the data
+                current = {'start': start,
+                           'dims': {field: dataset.ds[field].dims for field in fields},
+                           'field_attrs': {field: dict(dataset.ds[field].attrs) for field in fields},
+                           'coords': {name: coord.copy(deep=True) for name, coord in dataset.ds.coords.items()
+                                      if name not in ['validate', 'basedate']},
+                           'attrs': dict(dataset.ds.attrs),
+                           'accumulators': {field: streaming_stats.RunningStats(shape=dataset.ds[field].shape,
+                                                                                stats=stats)
+                                            for field in fields},
+                           'filepaths': []}
+
+            missing_fields = [field for field in fields if not dataset.field_exist(field)]
+            if bool(missing_fields):
+                sys.exit(f'{missing_fields} are not found in {dataset.fafile}.')
+            with self.profiler.stage('aggregate_update', file=str(dataset.fafile)):
+                for field in fields:
+                    current['accumulators'][field].update(dataset.ds[field].values)
+            current['filepaths'].append(str(dataset.fafile))
+
+        if current is not None:
+            yield _finish_bin(current, freq=freq)
+
+    def aggregate(self, freq='1D', stats=['mean'], fields=None,
+                  outputfolder=None, overwrite=False, **kwargs):
+        """
+        Compute temporal aggregates (means, sums, extremes, ...) of the collection.
+
+        The files are processed in a streaming way (see iter_aggregated()).
+        If an outputfolder is given, each bin is written to its own netCDF
+        file as soon as it is complete.
+
+        Parameters
+        ----------
+        freq : str, optional
+            The length of the bins, a fixed frequency (e.g. '1D', '6h') or the
+            start of a calendar period ('MS', 'QS', 'YS'). The default is
+            '1D'.
+        stats : list, optional
+            The statistics to compute ('mean', 'sum', 'min', 'max', 'std',
+            'var', 'count'). The default is ['mean'].
+        fields : list, optional
+            The fields (2D fieldnames or 3D basenames) to aggregate. If None,
+            all fields are aggregated. The default is None.
+        outputfolder : str, optional
+            If not None, each bin is saved as '{freq}_{start}.nc' in this
+            folder. The default is None.
+        overwrite : bool, optional
+            Overwrite existing netCDF files in the outputfolder. The default
+            is False.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method (see
+            iter_fadatasets()).
+
+        Returns
+        -------
+        xarray.Dataset or list
+            The aggregates of all bins (combined on validate), or the paths of
+            the netCDF files if an outputfolder is given.
+
+        """
+        bins = []
+        with self.profiler.stage('aggregate', freq=str(freq)):
+            for aggregate in self.iter_aggregated(freq=freq, stats=stats,
+                                                  fields=fields, **kwargs):
+                if outputfolder is None:
+                    bins.append(aggregate)
+                    continue
+                start = pd.Timestamp(aggregate['validate'].values[0])
+                filename = f'{freq}_{start:%Y%m%d%H%M}.nc'
+                IO.save_as_nc(xrdata=aggregate,
+                              outputfolder=outputfolder,
+                              filename=filename,
+                              overwrite=overwrite)
+                bins.append(os.path.join(outputfolder, filename))
+
+        if outputfolder is not None:
+            return bins
+        if len(bins) == 1:
+            return bins[0]
+        return reading_fa._to_canonical_layout(xr.concat(bins, dim='validate',
+                                                         data_vars='all',
+                                                         coords='minimal',
+                                                         compat='override',
+                                                         combine_attrs='drop_conflicts'))
+
+    def get_lat(self, disk_cache=True):
+        """
+        Get the latitude of all grid points.
+
+        The coordinates are computed from the projection and the x/y
+        coordinates, and are cached per geometry (in memory and on disk).
+
+        Parameters
+        ----------
+        disk_cache : bool, optional
+            If True, the disk cache is used. The default is True.
+
+        Returns
+        -------
+        xarray.DataArray
+            The latitudes with (y, x) dimensions.
+
+        """
+        assert not (self.ds is None), 'No collection xarray.Dataset'
+        return geospatial_func.get_latlon_coords(self.ds, disk_cache=disk_cache)['lat']
+
+    def get_lon(self, disk_cache=True):
+        """
+        Get the longitude of all grid points.
+
+        The coordinates are computed from the projection and the x/y
+        coordinates, and are cached per geometry (in memory and on disk).
+
+        Parameters
+        ----------
+        disk_cache : bool, optional
+            If True, the disk cache is used. The default is True.
+
+        Returns
+        -------
+        xarray.DataArray
+            The longitudes with (y, x) dimensions.
+
+        """
+        assert not (self.ds is None), 'No collection xarray.Dataset'
+        return geospatial_func.get_latlon_coords(self.ds, disk_cache=disk_cache)['lon']
+
+    def add_latlon_coords(self, disk_cache=True):
+        """
+        Add the 2D 'lat' and 'lon' coordinates (y, x) to the combined dataset.
+
+        Parameters
+        ----------
+        disk_cache : bool, optional
+            If True, the disk cache is used. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        assert not (self.ds is None), 'No collection xarray.Dataset'
+        self.ds = self.ds.assign_coords(geospatial_func.get_latlon_coords(self.ds,
+                                                                          disk_cache=disk_cache))
+
+    def get_transposed_view(self, *dims):
+        """
+        Get the combined dataset with another dimension order.
+
+        The data is stored in the canonical layout ('basedate', 'validate',
+        'level', 'y', 'x'). If another order is needed, this method returns a
+        view on the same memory, so no data is copied.
+
+        Parameters
+        ----------
+        *dims : str
+            The dimensions in the desired order. Missing dimensions are
+            appended in the canonical order.
+
+        Returns
+        -------
+        xarray.Dataset
+            A transposed view of the combined dataset.
+
+        """
+        assert not (self.ds is None), 'No collection xarray.Dataset'
+        return self.ds.transpose(*dims, ...)
+
+    # =========================================================================
+    # Plotting
+    # =========================================================================
+
+    def render_frames(self, variable, out_dir, level=None, fmt='png', fps=4,
+                      n_jobs=1, vmin=None, vmax=None, cmap=None, grid=False,
+                      land=None, coastline=None, dpi=100, figsize=None,
+                      prefix=None):
+        """
+        Render a 2D plot of a field for each validate (animation frames).
+
+        The figure, the map features and the colorbar are created once, and
+        only the data and the title are updated for each frame. The colorscale
+        is the same for all frames.
+
+        Parameters
+        ----------
+        variable : str
+            A 2D fieldname or a 3D basisfieldname (level is required) to plot.
+        out_dir : str
+            The directory to write the frames (or the MP4 file) to.
+        level : int, optional
+            The level to plot if a 3D basisfieldname is provided. The default
+            is None.
+        fmt : 'png' or 'mp4', optional
+            Write a PNG file for each frame, or combine the frames to an MP4
+            file (ffmpeg is needed). The default is 'png'.
+        fps : int, optional
+            Frames per second of the MP4 file. The default is 4.
+        n_jobs : int, optional
+            Number of processes that render the frames. The default is 1.
+        vmin : float, optional
+            Lower limit of the colorscale. If None, the minimum over all frames
+            is used. The default is None.
+        vmax : float, optional
+            Upper limit of the colorscale. If None, the maximum over all frames
+            is used. The default is None.
+        cmap : str, optional
+            The colormap. The default is None.
+        grid : bool, optional
+            Add gridlines to the plot. The default is False.
+        land : bool, optional
+            If True, and if the dataset is in a latlon projection (EPSG:4326)
+            or in the native projection of the FA files, then land boarders
+            are drawn. If None, it will be set to True if the projection is
+            latlon or native, else False. The default is None.
+        coastline : bool, optional
+            If True, and if the dataset is in a latlon projection (EPSG:4326)
+            or in the native projection of the FA files, then coastlines are
+            drawn. If None, it will be set to True if the projection is latlon
+            or native, else False. The default is None.
+        dpi : int, optional
+            Resolution of the frames. The default is 100.
+        figsize : tuple, optional
+            Size of the figure in inches. The default is None.
+        prefix : str, optional
+            Prefix of the filenames. If None, the variable (and level) is used.
+            The default is None.
+
+        Returns
+        -------
+        list
+            The paths of the frames (or a list with the path of the MP4 file).
+
+        """
+        import pyfa_tool.modules.plotting as plotting
+
+        assert not (self.ds is None), 'No collection xarray.Dataset'
+        if fmt not in ['png', 'mp4']:
+            sys.exit(f'{fmt} is not a valid format for the frames, use png or mp4.')
+        if variable not in self.ds.data_vars:
+            sys.exit(f'{variable} is not found in the collection.')
+        if not IO.check_folder_exist(out_dir):
+            sys.exit(f'{out_dir} directory not found.')
+        if (fmt == 'mp4') & (shutil.which('ffmpeg') is None):
+            sys.exit('ffmpeg is not found, it is needed to write MP4 files.')
+
+        xarr = self.ds[variable]
+        if 'level' in xarr.dims:
+            assert not (level is None), f'{variable} is a 3D field. Specify a level.'
+            xarr = xarr.sel(level=level)
+        if 'validate' not in xarr.dims:
+            sys.exit(f'{variable} has no validate dimension, combine the collection by validate first.')
+        if 'basedate' in xarr.dims:
+            xarr = xarr.isel(basedate=0)
+        xarr = xarr.transpose('validate', 'y', 'x')
+
+        # setup default values for coastline and land features
+        islatlon = str(self.ds.rio.crs) == 'EPSG:4326'
+        native_crs = None
+        if (not islatlon) and geospatial_func.in_native_projection(self.ds):
+            native_crs = plotting.crs_from_proj4(self.ds.attrs['projection'])
+        ismap = islatlon | (native_crs is not None)
+        if land is None:
+            land = ismap
+        if coastline is None:
+            coastline = ismap
+        if ((land) | (coastline)) & (not ismap):
+            sys.exit('Adding land and coastline features is only available in latlon coordinates or in the native projection')
+
+        # One colorscale for all frames
+        values = xarr.values
+        if vmin is None:
+            vmin = float(np.nanmin(values))
+        if vmax is None:
+            vmax = float(np.nanmax(values))
+
+        if prefix is None:
+            prefix = variable if level is None else f'{variable}_level{level}'
+        with contextlib.ExitStack() as stack:
+            if fmt == 'mp4':
+                # the frames are only needed to encode the video (the size
+                # of uncompressed RGBA frames is an upper bound)
+                width, height = figsize if figsize is not None else (6.4, 4.8)
+                frame_size = int(width * height * dpi**2 * 4)
+                frame_dir = stack.enter_context(scratch.scratch_dir(name='frames',
+                                                                    expected_size=xarr.sizes['validate'] * frame_size))
+            else:
+                frame_dir = out_dir
+
+            basedate = pd.Timestamp(self.ds['basedate'].values[0])
+            frames = []
+            for idx, validate in enumerate(xarr['validate'].values):
+                validate = pd.Timestamp(validate)
+                title = f'{variable} at {validate} (UTC, LT={validate - basedate})'
+                frames.append((values[idx], title,
+                               os.path.join(frame_dir, f'{prefix}_{idx:04d}.png')))
+
+            renderer_kwargs = {'latlon': islatlon, 'grid': grid, 'land': land,
+                               'coastline': coastline, 'vmin': vmin, 'vmax': vmax,
+                               'cmap': cmap, 'dpi': dpi, 'figsize': figsize,
+                               'label': xarr.attrs.get('units', variable),
+                               'crs': native_crs}
+            x = xarr['x'].values
+            y = xarr['y'].values
+
+            with self.profiler.stage('render_frames', field=variable,
+                                     n_frames=len(frames)):
+                if (n_jobs is None) or (n_jobs <= 1) or (len(frames) <= 1):
+                    paths = plotting.render_frames(x, y, frames, renderer_kwargs)
+                else:
+                    # each process renders a block of frames with its own figure
+                    chunks = [chunk for chunk in np.array_split(np.arange(len(frames)), int(n_jobs))
+                              if len(chunk) > 0]
+                    paths = []
+                    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+                        futures = [executor.submit(plotting.render_frames, x, y,
+                                                   [frames[i] for i in chunk],
+                                                   renderer_kwargs)
+                                   for chunk in chunks]
+                        for future in futures:
+                            paths.extend(future.result())
+
+                if fmt == 'mp4':
+                    target = os.path.join(out_dir, f'{prefix}.mp4')
+                    plotting.frames_to_mp4(frame_pattern=os.path.join(frame_dir, f'{prefix}_%04d.png'),
+                                           target=target,
+                                           fps=fps)
+                    return [target]
+
+        print(f'{len(paths)} frames saved to {out_dir}')
+        return paths
+
     # =========================================================================
     # IO
     # =========================================================================
 
-    def save_nc(self, outputfolder, filename, overwrite=False, **kwargs):
+    def save_nc(self, outputfolder, filename, overwrite=False, dtype=None,
+                max_memory=None, appendable=False, **kwargs):
         """
         Save the xarray.Dataset as a netCDF file.
 
@@ -237,6 +973,19 @@ class FaCollection():
             If the path of the target netCDF file exist, an error will be
             thrown unles overwrite is True. Then the file will be overwritten.
             The default is False.
+        dtype : str or None, optional
+            If not None, the fields are encoded with this floating point dtype
+            (e.g. 'float32') in the netCDF file. If None, the dtype of the
+            fields is kept. The default is None.
+        max_memory : int or str, optional
+            For lazy collections: the memory limit (bytes, or e.g. '4G') of
+            the chunks that are decoded and written at the same time. If
+            None, the dask settings are used. The default is None.
+        appendable : bool, optional
+            If True, the file is written with an unlimited validate dimension
+            (and the validates in seconds), so new validates can be appended
+            in place with append_to(). Else append_to() rewrites the file.
+            The default is False.
         **kwargs : kwargs
             Kwargs will be passed to the xarray.to_netcdf() method.
 
@@ -246,15 +995,139 @@ class FaCollection():
 
         """
         assert not (self.ds is None), 'No collection xarray.Dataset'
+        import pyfa_tool.modules.lazy as lazy
 
         self._clean()
         saveds = self.ds
+        if appendable:
+            # an unlimited validate dimension, so new validates can be appended (see append_to())
+            kwargs.setdefault('unlimited_dims', ['validate'])
+            collection_store.add_validate_encoding(kwargs)
+
+        with self.profiler.stage('save_nc'):
+            with lazy.memory_limit(saveds, max_memory=max_memory,
+                                   decode_per=self._decode_per):
+                IO.save_as_nc(xrdata=saveds,
+                              outputfolder=outputfolder,
+                              filename=filename,
+                              overwrite=overwrite,
+                              dtype=dtype,
+                              **kwargs)
 
-        IO.save_as_nc(xrdata=saveds,
-                      outputfolder=outputfolder,
-                      filename=filename,
-                      overwrite=overwrite,
-                      **kwargs)
+    def save_zarr(self, store, overwrite=False, dtype=None, max_memory=None,
+                  **kwargs):
+        """
+        Save the xarray.Dataset as a zarr store (requires zarr).
+
+        Parameters
+        ----------
+        store : str
+            Path of the zarr store.
+        overwrite : bool, optional
+            If the store exist, an error will be thrown unles overwrite is
+            True. The default is False.
+        dtype : str or None, optional
+            See save_nc(). The default is None.
+        max_memory : int or str, optional
+            See save_nc(). The default is None.
+        **kwargs : kwargs
+            Kwargs will be passed to the xarray.to_zarr() method.
+
+        Returns
+        -------
+        None.
+
+        """
+        assert not (self.ds is None), 'No collection xarray.Dataset'
+        import pyfa_tool.modules.lazy as lazy
+
+        self._clean()
+        saveds = self.ds
+
+        collection_store.add_validate_encoding(kwargs)
+
+        with self.profiler.stage('save_zarr'):
+            with lazy.memory_limit(saveds, max_memory=max_memory,
+                                   decode_per=self._decode_per):
+                IO.save_as_zarr(xrdata=saveds,
+                                store=store,
+                                overwrite=overwrite,
+                                dtype=dtype,
+                                **kwargs)
+
+    def append_to(self, store, new_files=None, backend=None, **kwargs):
+        """
+        Append FA files to an existing combined store (netCDF or zarr).
+
+        The store is a collection that is combined by validate and saved with
+        save_nc() or save_zarr(). The geometry and the vertical level
+        definitions (A and B lists) of the new files must be the same as in
+        the store. Only the new validate slices are written, and the
+        'origins' and 'filepaths' attributes are updated, so the time of an
+        append does not depend on the size of the store. If that is not
+        possible (e.g. a validate is replaced, or the fields differ), the
+        store is rewritten (see modules.store).
+
+        Parameters
+        ----------
+        store : str
+            Path of the netCDF file, or zarr store (.zarr). If it does not
+            exist, it is created.
+        new_files : list of str, optional
+            Paths of the new FA files ('archive.tar::member' paths are
+            accepted). If None, the FaDatasets of this collection are
+            appended. The default is None.
+        backend : str or FaBackend, optional
+            The backend used to decode the FA files. If None, the default
+            backend is used. The default is None.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method to specify which
+            fields are imported.
+
+        Returns
+        -------
+        None.
+
+        """
+        if new_files is None:
+            if not bool(self.FaDatasets):
+                sys.exit('No FaDatasets or new FA files are given to append.')
+            fadatasets = self.FaDatasets
+        else:
+            if isinstance(new_files, str):
+                new_files = [new_files]
+            new_files = archive.expand_paths(new_files)
+            if len(new_files) == 0:
+                sys.exit('No FA files are provided.')
+            fadatasets = []
+            for file in new_files:
+                Dataset = FaDatasetClass(fafile=file, backend=backend)
+                Dataset.import_fa(**kwargs)
+                fadatasets.append(Dataset)
+
+        with self.profiler.stage('append_to', n_datasets=len(fadatasets)):
+            collection_store.append_datasets(store, fadatasets)
+
+    def get_profile_report(self):
+        """
+        Get the timing and memory use of the stages of this collection.
+
+        The stages of the import of each FaDataset are included (with the path
+        of the FA file in the 'file' column).
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per stage (and per field for the per-field stages).
+
+        """
+        reports = []
+        for dataset in self.FaDatasets:
+            report = dataset.get_profile_report()
+            report['file'] = str(dataset.fafile)
+            reports.append(report)
+        reports.append(self.profiler.get_report())
+        return pd.concat(reports, ignore_index=True)
 
     # =========================================================================
     #     Helpers
@@ -262,8 +1135,30 @@ class FaCollection():
 
     def _clean(self):
         """Force a specific data format."""
-        # store the y and x coordiantes as last, so GIS programs project them correct
-        self.ds = self.ds.transpose('basedate', 'validate', 'level', 'y', 'x')
+        # store the y and x coordiantes as last, so GIS programs project them
+        # correct (only transposed if not yet in the canonical layout)
+        self.ds = reading_fa._to_canonical_layout(self.ds)
+
+
+def _finish_bin(current, freq):
+    """Create the xarray.Dataset of a complete bin (see FaCollection.iter_aggregated())."""
+    data_vars = {}
+    for field, accumulator in current['accumulators'].items():
+        for stat in accumulator.stats:
+            data_vars[f'{field}_{stat}'] = (current['dims'][field],
+                                            accumulator.result(stat),
+                                            {**current['field_attrs'][field],
+                                             'cell_methods': f'validate: {stat}'})
+
+    ds = xr.Dataset(data_vars=data_vars, coords=current['coords'])
+    ds = ds.expand_dims(validate=[current['start']])
+
+    ds.attrs.update({key: val for key, val in current['attrs'].items()
+                     if key not in ['origin', 'filepath']})
+    ds.attrs['aggregation_freq'] = str(freq)
+    ds.attrs['n_files'] = len(current['filepaths'])
+    ds.attrs['filepaths'] = current['filepaths']
+    return reading_fa._to_canonical_layout(ds)
 
 
 def _check_lists_are_equal(list_a, list_b):
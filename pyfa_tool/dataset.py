@@ -6,10 +6,9 @@ Created on Mon Jan  8 13:50:41 2024
 @author: thoverga
 """
 
-import os
 import sys
+import asyncio
 from collections.abc import Iterable
-import subprocess
 import pandas as pd
 import xarray as xr
 import rioxarray #Do not remove this import!
@@ -18,9 +17,12 @@ import rioxarray #Do not remove this import!
 import pyfa_tool.modules.IO as IO
 import pyfa_tool.modules.geospatial_functions as geospatial_func
 import pyfa_tool.modules.reading_fa as reading_fa
-import pyfa_tool.modules.plotting as plotting
+import pyfa_tool.modules.backends as backends
+import pyfa_tool.modules.aio as aio
+import pyfa_tool.modules.profiling as profiling
+import pyfa_tool.modules.fieldstats as fieldstats
+import pyfa_tool.modules.archive as archive
 
-from pyfa_tool import package_path
 from pyfa_tool.file import FaFile
 
 
@@ -30,16 +32,22 @@ from pyfa_tool.file import FaFile
 class FaDataset():
     """A Class that holds data, and methods, of an FA file."""
 
-    def __init__(self, fafile=None, nodata=-999):
+    def __init__(self, fafile=None, nodata=-999, backend=None):
         """
         Initiate of an FaDataset object.
 
         Parameters
         ----------
         fafile : str, optional
-            Path of the target FA-file. The default is None.
+            Path of the target FA-file, or of a member of a tar archive
+            ('archive.tar::member', a wildcard must match one member). The
+            archive is not extracted. The default is None.
         nodata : int, optional
             The Nodata value to be used by (rio)xarray. The default is -999.
+        backend : str or FaBackend, optional
+            The backend used to decode the FA file ('rscript', 'synthetic' or
+            an instance of a FaBackend). If None, the default backend is used.
+            The default is None.
 
         Returns
         -------
@@ -51,14 +59,20 @@ class FaDataset():
         integer-casting of the nodata value exists.
 
         """
+        self.backend = backends.get_backend(backend)
+
         # test if file exist
         if not fafile is None:
-            if not IO.check_file_exist(fafile):
+            fafile = archive.resolve_single(fafile)
+            if not self.backend.exists(fafile):
                 sys.exit(f'{fafile} is not a file.')
 
         self.fafile = fafile
         self.ds = None # xarray.Dataset
+        self.fieldstats = pd.DataFrame(columns=fieldstats.FIELDSTATS_COLUMNS) # stats of the decoded fields
         self.nodata = nodata
+        self.profiler = profiling.StageProfiler() # timing of the stages
+        self._FA = None # an opened FaFile of fafile, used by the next import
 
 
     # =========================================================================
@@ -81,14 +95,16 @@ class FaDataset():
         Parameters
         ----------
         fafile : str
-            Path to the FA-file.
+            Path to the FA-file, or of a member of a tar archive
+            ('archive.tar::member').
 
         Returns
         -------
         None.
 
         """
-        if not IO.check_file_exist(fafile):
+        fafile = archive.resolve_single(fafile)
+        if not self.backend.exists(fafile):
             sys.exit(f'{fafile} is not a file.')
         self.fafile = fafile
 
@@ -151,6 +167,18 @@ class FaDataset():
         """
         return pd.Timedelta(int(self.ds.attrs['timestep']), unit='seconds')
 
+    def get_profile_report(self):
+        """
+        Get the timing and memory use of the import (and processing) stages.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per stage (and per field for the per-field stages).
+
+        """
+        return self.profiler.get_report()
+
     def get_leadtime(self):
         """
         Get the model leadtime at the current data.
@@ -163,6 +191,66 @@ class FaDataset():
         """
         return self.get_validate() - self.get_basedate()
 
+    def get_lat(self, disk_cache=True):
+        """
+        Get the latitude of all grid points.
+
+        The coordinates are computed from the projection and the x/y
+        coordinates, and are cached per geometry (in memory and on disk).
+
+        Parameters
+        ----------
+        disk_cache : bool, optional
+            If True, the disk cache is used. The default is True.
+
+        Returns
+        -------
+        xarray.DataArray
+            The latitudes with (y, x) dimensions.
+
+        """
+        assert not (self.ds is None), 'Empty instance of FaDataset.'
+        return geospatial_func.get_latlon_coords(self.ds, disk_cache=disk_cache)['lat']
+
+    def get_lon(self, disk_cache=True):
+        """
+        Get the longitude of all grid points.
+
+        The coordinates are computed from the projection and the x/y
+        coordinates, and are cached per geometry (in memory and on disk).
+
+        Parameters
+        ----------
+        disk_cache : bool, optional
+            If True, the disk cache is used. The default is True.
+
+        Returns
+        -------
+        xarray.DataArray
+            The longitudes with (y, x) dimensions.
+
+        """
+        assert not (self.ds is None), 'Empty instance of FaDataset.'
+        return geospatial_func.get_latlon_coords(self.ds, disk_cache=disk_cache)['lon']
+
+    def add_latlon_coords(self, disk_cache=True):
+        """
+        Add the 2D 'lat' and 'lon' coordinates (y, x) to the dataset.
+
+        Parameters
+        ----------
+        disk_cache : bool, optional
+            If True, the disk cache is used. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        assert not (self.ds is None), 'Empty instance of FaDataset.'
+        self.ds = self.ds.assign_coords(geospatial_func.get_latlon_coords(self.ds,
+                                                                          disk_cache=disk_cache))
+
 
 
 
@@ -174,7 +262,7 @@ class FaDataset():
     # =========================================================================
     def import_fa(self, whitelist=None, blacklist=None,
                   rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326',
-                  ):
+                  dtype=None, levels=None, window=None, profiler=None):
         """
         Import a FA file and make a xarray.Dataset of it.
 
@@ -183,8 +271,8 @@ class FaDataset():
             * Reading all fieldnames of the FA file.
             * Constructing a whitelist (fieldnames to be read by RFa)
             * Construct a blacklist (fieldnames to be skipped by RFa)
-            * Use RFa to read all desired fields, and write them to json
-            * Read the jsons and feed the data to a xarray.Dataset.
+            * Use the backend (RFa by default) to decode all desired fields
+            * Feed the decoded data to a xarray.Dataset.
             * Add metadata to the xarray.Dataset
             * Reproject (if needed) the xarray.Dataset
 
@@ -205,6 +293,22 @@ class FaDataset():
             target_epsg. The default is False.
         target_epsg : str, optional
             EPSG code to reproject the data to. The default is 'EPSG:4326'.
+        dtype : str or None, optional
+            The floating point dtype to store the fields in ('float32' or
+            'float64'). If None (or 'auto'), float32 is used for all fields
+            that are packed with at most 24 bits (nbits), and float64 for the
+            others. The default is None.
+        levels : list of int, optional
+            Only these levels of the 3D fields are read. If None, all levels
+            are read. The default is None.
+        window : tuple of int, optional
+            (x_start, x_stop, y_start, y_stop) gridpoint indices (python slice
+            convention) of a spatial window to read. If None, the full domain
+            is read. The default is None.
+        profiler : StageProfiler, optional
+            The profiler to record the timing and memory use of the import
+            stages in. If None, the profiler of this FaDataset is used. The
+            default is None.
 
 
         Returns
@@ -219,10 +323,120 @@ class FaDataset():
 
         """
 
+        if profiler is not None:
+            self.profiler = profiler
+
+        with profiling.activate(self.profiler):
+            with self.profiler.stage('import_fa', file=str(self.fafile)):
+                self._import_fa(whitelist=whitelist,
+                                blacklist=blacklist,
+                                rm_tmpdir=rm_tmpdir,
+                                reproj=reproj,
+                                target_epsg=target_epsg,
+                                dtype=dtype,
+                                levels=levels,
+                                window=window)
+
+
+    @aio.exits_as_errors
+    async def aimport_fa(self, whitelist=None, blacklist=None,
+                         rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326',
+                         dtype=None, levels=None, window=None, profiler=None):
+        """
+        Import a FA file without blocking the event loop (coroutine).
+
+        The same as import_fa(), but the decoder is awaited (for the R
+        backends the R process is awaited, and killed when the coroutine is
+        cancelled) and the json parsing and the creation of the dataset run
+        in a thread. The number of decodes that run at the same time is
+        limited (see modules.aio.set_max_concurrency()). Errors are raised as
+        RuntimeError (see modules.aio.exits_as_errors()).
+
+        Parameters
+        ----------
+        See import_fa().
+
+        Returns
+        -------
+        None.
+
+        """
+        if profiler is not None:
+            self.profiler = profiler
+
+        with profiling.activate(self.profiler):
+            with self.profiler.stage('import_fa', file=str(self.fafile)):
+                await self._aimport_fa(whitelist=whitelist,
+                                       blacklist=blacklist,
+                                       rm_tmpdir=rm_tmpdir,
+                                       reproj=reproj,
+                                       target_epsg=target_epsg,
+                                       dtype=dtype,
+                                       levels=levels,
+                                       window=window)
+
+    async def _aimport_fa(self, whitelist=None, blacklist=None,
+                          rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326',
+                          dtype=None, levels=None, window=None):
+        """Coroutine version of _import_fa()."""
+        assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
+
+        with profiling.stage('read_metadata'):
+            FA = self._take_opened_fafile()
+            if FA is None:
+                FA = await FaFile.aopen(self.fafile, backend=self.backend)
+        fields, field_nbits, digits = self._select_fields(FA, whitelist=whitelist,
+                                                          blacklist=blacklist,
+                                                          dtype=dtype)
+
+        with profiling.stage('decode'):
+            payload = await self.backend.aread_fields(FA.fafile,
+                                                      fields=fields,
+                                                      levels=levels,
+                                                      window=window,
+                                                      digits=digits,
+                                                      rm_tmpdir=rm_tmpdir)
+
+        await asyncio.to_thread(self._set_payload, FA, payload, dtype=dtype,
+                                field_nbits=field_nbits, window=window,
+                                reproj=reproj, target_epsg=target_epsg)
+
+    def _import_fa(self, whitelist=None, blacklist=None,
+                   rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326',
+                   dtype=None, levels=None, window=None):
+        """Import a FA file (see import_fa()), without activating the profiler."""
         assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
 
         # Get all available fields
-        FA = FaFile(self.fafile)
+        with profiling.stage('read_metadata'):
+            FA = self._take_opened_fafile()
+            if FA is None:
+                FA = FaFile(self.fafile, backend=self.backend)
+        fields, field_nbits, digits = self._select_fields(FA, whitelist=whitelist,
+                                                          blacklist=blacklist,
+                                                          dtype=dtype)
+
+        # Decode the fields with the backend
+        with profiling.stage('decode'):
+            payload = self.backend.read_fields(FA.fafile,
+                                               fields=fields,
+                                               levels=levels,
+                                               window=window,
+                                               digits=digits,
+                                               rm_tmpdir=rm_tmpdir)
+
+        self._set_payload(FA, payload, dtype=dtype, field_nbits=field_nbits,
+                          window=window, reproj=reproj, target_epsg=target_epsg)
+
+    def _take_opened_fafile(self):
+        """Get (and forget) the FaFile that is opened already for the next import, or None."""
+        FA, self._FA = self._FA, None
+        if (FA is None) or (FA.fafile != self.fafile):
+            return None
+        return FA
+
+    def _select_fields(self, FA, whitelist=None, blacklist=None, dtype=None):
+        """Get the fields to decode, their nbits and the json digits (see import_fa())."""
         subset_fields = {'2d_white': [],
                          '3d_white': [],
                          '2d_black': [],
@@ -278,7 +492,7 @@ class FaDataset():
 
             # Get all available fields (if not yet made in the whitelist part)
             if FA is None:
-                FA = FaFile(self.fafile)
+                FA = FaFile(self.fafile, backend=self.backend)
 
 
             # Find the 2d-blacklist fields
@@ -300,49 +514,88 @@ class FaDataset():
                 print(f'WARNING: None of these fields are found in the FA file: {blacklist}')
 
 
-        # create at tmpdir if not provided
-        tmpdir = IO.create_tmpdir(location=os.getcwd())
-
-
-        # There is no clean way i found to parse multiple lists as arguments
-        #for an R script. So write them to json, and read them in the Rscript.
+        # The blacklist surpasses the whitelist
+        fields = {'2d': [field for field in subset_fields['2d_white'] if field not in subset_fields['2d_black']],
+                  '3d': [field for field in subset_fields['3d_white'] if field not in subset_fields['3d_black']]}
+
+        # Resolve the dtype of all the fields that will be read, so the
+        # transport is done with the precision that is needed.
+        field_nbits = FA._get_nbits_per_fieldname()
+        digits = reading_fa._json_digits_for_dtype(
+            [reading_fa._resolve_dtype(dtype=dtype, nbits=field_nbits.get(field))
+             for field in fields['2d'] + fields['3d']])
+        return fields, field_nbits, digits
+
+    def _set_payload(self, FA, payload, dtype=None, field_nbits=None, window=None,
+                     reproj=False, target_epsg='EPSG:4326'):
+        """Make the xarray.Dataset of a decoded payload (see import_fa())."""
+        # Convert to a xarray dataset (and compute the field statistics)
+        stats = [] if fieldstats.is_enabled() else None
+        with profiling.stage('build_dataset'):
+            ds = reading_fa.payload_to_dataset(payload,
+                                               dtype=dtype,
+                                               field_nbits=field_nbits,
+                                               fieldstats=stats)
+        self.fieldstats = pd.DataFrame(stats if stats is not None else [],
+                                       columns=fieldstats.FIELDSTATS_COLUMNS)
+        if (stats is not None) & (window is None):
+            # only statistics of the full fields are stored in the index
+            fieldstats.update_fieldstats(FA.fafile, self.fieldstats)
 
-        Rfa_attr_json=os.path.join(tmpdir, 'Rfa_extra_attrs.json')
-        IO.write_json(datadict=subset_fields,
-                      jsonpath=Rfa_attr_json,
-                      force=True)
-
-        # Run Rscript to generete json files with data and meta info
-        r_script = os.path.join(package_path, 'modules',
-                                'rfa_scripts', 'get_all_fields.R')
+        # Update attribute
+        self.ds = ds
+        with profiling.stage('clean'):
+            self._clean()
 
-        convert_fa = subprocess.Popen([os.path.join(IO._get_rbin(), 'Rscript'),
-                                       r_script,
-                                       FA.fafile,
-                                       tmpdir,
-                                       Rfa_attr_json])
+        if reproj:
+            self.reproject(target_epsg=target_epsg)
 
-        _ = convert_fa.wait()  # wait until finished before continuing
+    def lazy_import_fa(self, whitelist=None, blacklist=None, dtype=None,
+                       levels=None, window=None, decode_per='field'):
+        """
+        Import a FA file as dask arrays, that are decoded when computed.
 
-        # read in the json file
-        jsonfile = os.path.join(tmpdir, "FA.json")
+        Only the catalogue and one 2D field (for the coordinates) are read,
+        the dask graph has one decode task per field, or per file. The .ds
+        attribute has the same layout as after import_fa(). Requires dask.
 
-        # Convert to a xarray dataset
-        ds = reading_fa.json_to_full_dataset(jsonfile)
+        Parameters
+        ----------
+        whitelist : list or (fieldname)str, optional
+            The fields (2D fieldnames, 3D and pseudo 3D basenames). If None,
+            all fields are imported. The default is None.
+        blacklist : list or (fieldname)str, optional
+            The fields to skip. The blacklist surpasses the whitelist. The
+            default is None.
+        dtype, levels, window :
+            See import_fa().
+        decode_per : 'field' or 'file', optional
+            One decode task per field, or one per file (all fields are
+            decoded at once). The default is 'field'.
 
-        if rm_tmpdir:
-            IO.remove_tempdir(tmpdir)
+        Returns
+        -------
+        None.
 
-        # Update attribute
-        self.ds = ds
-        self._clean()
+        """
+        assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
+        import pyfa_tool.modules.lazy as lazy
 
-        if reproj:
-            self.reproject(target_epsg=target_epsg)
+        with profiling.activate(self.profiler):
+            with self.profiler.stage('lazy_import_fa', file=str(self.fafile)):
+                self.ds = lazy.open_lazy_dataset(self.fafile,
+                                                 backend=self.backend,
+                                                 whitelist=whitelist,
+                                                 blacklist=blacklist,
+                                                 dtype=dtype,
+                                                 levels=levels,
+                                                 window=window,
+                                                 decode_per=decode_per)
 
 
     def import_2d_field(self, fieldname,
-                        rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326'):
+                        rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326',
+                        dtype=None):
         """
         Import a 2D field of a FA file into an xarray.Dataset.
 
@@ -360,6 +613,10 @@ class FaDataset():
             target_epsg. The default is False.
         target_epsg : str, optional
             EPSG code to reproject the data to. The default is 'EPSG:4326'.
+        dtype : str or None, optional
+            The floating point dtype to store the field in. If None, it is
+            derived from the packing (nbits) of the field. See import_fa().
+            The default is None.
 
         Returns
         -------
@@ -371,7 +628,7 @@ class FaDataset():
         assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
 
         # Get all available fields
-        FA = FaFile(self.fafile)
+        FA = FaFile(self.fafile, backend=self.backend)
 
         # Check if fieldname is a 2d field
         if fieldname not in FA._list_all_2d_fieldnames_as_2d_fields():
@@ -380,11 +637,14 @@ class FaDataset():
         self.import_fa(whitelist=fieldname,
                        blacklist=None,
                        rm_tmpdir=rm_tmpdir,
-                       reproj=reproj)
+                       reproj=reproj,
+                       target_epsg=target_epsg,
+                       dtype=dtype)
 
 
     def import_3d_field(self, fieldname,
-                        rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326'):
+                        rm_tmpdir=True, reproj=False, target_epsg='EPSG:4326',
+                        dtype=None):
         """
         Import a 3D field of a FA file into an xarray.Dataset.
 
@@ -404,6 +664,10 @@ class FaDataset():
             target_epsg. The default is False.
         target_epsg : str, optional
             EPSG code to reproject the data to. The default is 'EPSG:4326'.
+        dtype : str or None, optional
+            The floating point dtype to store the field in. If None, it is
+            derived from the packing (nbits) of the field. See import_fa().
+            The default is None.
 
         Returns
         -------
@@ -414,7 +678,7 @@ class FaDataset():
         assert not self.fafile is None, 'First set a FAfile path, using the set_fafile() method.'
 
         # Get all available fields
-        FA = FaFile(self.fafile)
+        FA = FaFile(self.fafile, backend=self.backend)
 
         # Check if fieldname is a 2d field
         if fieldname not in FA._list_all_3d_fieldnames_as_basenames():
@@ -424,10 +688,12 @@ class FaDataset():
                        blacklist=None,
                        rm_tmpdir=rm_tmpdir,
                        reproj=reproj,
-                       target_epsg=target_epsg)
+                       target_epsg=target_epsg,
+                       dtype=dtype)
 
 
-    def save_nc(self, outputfolder, filename, overwrite=False, **kwargs):
+    def save_nc(self, outputfolder, filename, overwrite=False, dtype=None,
+                **kwargs):
         """
         Save the xarray.Dataset as a netCDF file.
 
@@ -442,6 +708,10 @@ class FaDataset():
             If the path of the target netCDF file exist, an error will be
             thrown unles overwrite is True. Then the file will be overwritten.
             The default is False.
+        dtype : str or None, optional
+            If not None, the fields are encoded with this floating point dtype
+            (e.g. 'float32') in the netCDF file. If None, the dtype of the
+            fields is kept. The default is None.
         **kwargs : kwargs
             Kwargs will be passed to the xarray.to_netcdf() method.
 
@@ -455,11 +725,13 @@ class FaDataset():
         self._clean()
         saveds = self.ds
 
-        IO.save_as_nc(xrdata=saveds,
-                   outputfolder=outputfolder,
-                   filename=filename,
-                   overwrite=overwrite,
-                   **kwargs)
+        with self.profiler.stage('save_nc'):
+            IO.save_as_nc(xrdata=saveds,
+                          outputfolder=outputfolder,
+                          filename=filename,
+                          overwrite=overwrite,
+                          dtype=dtype,
+                          **kwargs)
 
 
     def read_nc(self, file, **kwargs):
@@ -514,9 +786,10 @@ class FaDataset():
         """
         assert not (self.ds is None), 'Empty instance of FaDataset.'
 
-        ds = geospatial_func.reproject(dataset=self.ds,
-                                       target_epsg=target_epsg,
-                                       nodata=self.nodata)
+        with self.profiler.stage('reproject', target_epsg=str(target_epsg)):
+            ds = geospatial_func.reproject(dataset=self.ds,
+                                           target_epsg=target_epsg,
+                                           nodata=self.nodata)
 
         if 'level' in self.ds.coords:
             ds = ds.assign_coords({"level": self.ds.coords['level'].data})
@@ -557,13 +830,15 @@ class FaDataset():
         grid : bool, optional
             Add gridlines to plot. The default is False.
         land : bool, optional
-            If True, and if the dataset is in a latlon projection (EPSG:4326),
-            then land boarders are drawn. If None, it will be set to True if
-            the projection is latlon, else False. The default is None.
+            If True, and if the dataset is in a latlon projection (EPSG:4326)
+            or in the native projection of the FA file, then land boarders are
+            drawn. If None, it will be set to True if the projection is latlon
+            or native, else False. The default is None.
         coastline : bool, optional
-            If True, and if the dataset is in a latlon projection (EPSG:4326),
-            then coastlines are drawn. If None, it will be set to True if
-            the projection is latlon, else False. The default is None.
+            If True, and if the dataset is in a latlon projection (EPSG:4326)
+            or in the native projection of the FA file, then coastlines are
+            drawn. If None, it will be set to True if the projection is latlon
+            or native, else False. The default is None.
         contour : bool, optional
             If True, the contourf() method is used as a plotting backend, else
             the default xarray.Dataset.plot(). The default is False.
@@ -581,6 +856,9 @@ class FaDataset():
 
 
 
+        # the plotting stack (matplotlib, cartopy) is only loaded when plotting
+        import pyfa_tool.modules.plotting as plotting
+
         assert not (self.ds is None), 'Empty instance of FaDataset.'
 
         if self._is_3d_field(variable):
@@ -593,24 +871,30 @@ class FaDataset():
 
         # setup default values for coastline and land features
         islatlon = self. _in_latlon()
+        # Data on the native grid is drawn in the projection of the FA file
+        # (no reprojection of the data needed for a map)
+        native_crs = self._get_native_crs()
+        ismap = islatlon | (native_crs is not None)
         if land is None:
-            if islatlon:
+            if ismap:
                 land=True
             else:
                 land=False
 
         if coastline is None:
-             if islatlon:
+             if ismap:
                  coastline=True
              else:
                  coastline=False
 
         if (land) | (coastline):
-            if not islatlon:
-                sys.exit('Adding land and coastline features is only available in latlon coordinates')
+            if not ismap:
+                sys.exit('Adding land and coastline features is only available in latlon coordinates or in the native projection')
 
         if islatlon:
             fig, ax = plotting.make_platcarree_fig()
+        elif native_crs is not None:
+            fig, ax = plotting.make_native_fig(crs=native_crs)
         else:
             fig, ax = plotting.make_regular_fig()
 
@@ -627,6 +911,7 @@ class FaDataset():
                         coastline=coastline,
                         contour=contour,
                         levels=contour_levels,
+                        transform=native_crs,
                         **kwargs)
 
         return ax
@@ -637,6 +922,29 @@ class FaDataset():
     def describe(self):
         pass
 
+    def get_transposed_view(self, *dims):
+        """
+        Get the dataset with another dimension order.
+
+        The data is stored in the canonical layout ('basedate', 'validate',
+        'level', 'y', 'x'). If another order is needed, this method returns a
+        view on the same memory, so no data is copied.
+
+        Parameters
+        ----------
+        *dims : str
+            The dimensions in the desired order. Missing dimensions are
+            appended in the canonical order.
+
+        Returns
+        -------
+        xarray.Dataset
+            A transposed view of the dataset.
+
+        """
+        assert not (self.ds is None), 'Empty instance of FaDataset.'
+        return self.ds.transpose(*dims, ...)
+
     # =============================================================================
     # Helpers
     # =============================================================================
@@ -725,8 +1033,8 @@ class FaDataset():
         self._set_time_dimensions()
         # Convert pseudo 3d fields to 3d fields
         self._format_pseudo_3d_fields()
-        # Fix dimension order
-        self.ds = self.ds.transpose('y', 'x', 'level', 'validate', 'basedate')
+        # Check the dimension order (only transposed if not canonical)
+        self.ds = reading_fa._to_canonical_layout(self.ds)
 
 
     def field_exist(self, fieldname):
@@ -767,6 +1075,15 @@ class FaDataset():
         else:
             return False
 
+    def _get_native_crs(self):
+        """ Get the cartopy projection if the data is on the native grid (else None)."""
+        if (self.ds is None) or self._in_latlon():
+            return None
+        if not geospatial_func.in_native_projection(self.ds):
+            return None
+        import pyfa_tool.modules.plotting as plotting
+        return plotting.crs_from_proj4(self.ds.attrs['projection'])
+
     def _get_physical_variables(self):
         blacklist=['spatial_ref']
         dims = list(self.ds.dims)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module that holds the FaEnsemble class
+
+@author: thoverga
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pyfa_tool.dataset import FaDataset as FaDatasetClass
+import pyfa_tool.modules.reading_fa as reading_fa
+import pyfa_tool.modules.profiling as profiling
+import pyfa_tool.modules.streaming_stats as streaming_stats
+
+
+class FaEnsemble():
+    """This class computes statistics over the members of an ensemble, one member at a time."""
+
+    def __init__(self, members=[], backend=None, **kwargs):
+        """
+        Initialize a FaEnsemble.
+
+        Parameters
+        ----------
+        members : list, optional
+            The members, as (imported) FaDatasets or as paths of FA files. FA
+            files are imported one at a time when the statistics are
+            computed. A member can have another validate than the others, the
+            statistics are computed per validate. The default is [].
+        backend : str or FaBackend, optional
+            The backend used to decode the FA files. If None, the default
+            backend is used. The default is None.
+        **kwargs :
+            kwargs passed to the FaDataset.import_fa() method to specify which
+            fields of the FA files are imported.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.members = []
+        self.backend = backend
+        self.import_kwargs = kwargs
+        self.profiler = profiling.StageProfiler() # timing of the stages
+        if bool(members):
+            self.set_members(members)
+
+    # =========================================================================
+    # Specials
+    # =========================================================================
+
+    def __repr__(self):
+        """String representation."""
+        return f'FaEnsemble with {len(self.members)} members.'
+
+    def __str__(self):
+        """String typecaste representation."""
+        return f'FaEnsemble with {len(self.members)} members.'
+
+    # =============================================================================
+    # Getters/setters
+    # =============================================================================
+
+    def set_members(self, members):
+        """
+        Update the members of this ensemble.
+
+        Parameters
+        ----------
+        members : list
+            The members, as (imported) FaDatasets or as paths of FA files.
+
+        Returns
+        -------
+        None.
+
+        """
+        if len(members) == 0:
+            sys.exit('No members are provided.')
+        for member in members:
+            if not isinstance(member, (FaDatasetClass, str)):
+                sys.exit(f'{member} is not an instance of FaDataset or a path of a FA file.')
+        self.members = list(members)
+
+    def iter_members(self):
+        """
+        Iterate over the (imported) members.
+
+        Members that are FA files are imported when they are needed, so only
+        one of them is in memory.
+
+        Yields
+        ------
+        FaDataset
+            The members.
+
+        """
+        for member in self.members:
+            if isinstance(member, FaDatasetClass):
+                yield member
+                continue
+            dataset = FaDatasetClass(fafile=member, backend=self.backend)
+            dataset.import_fa(**self.import_kwargs)
+            yield dataset
+
+    # =========================================================================
+    # Statistics
+    # =========================================================================
+
+    def compute_statistics(self, stats=['mean', 'std'], fields=None,
+                           thresholds=None, percentiles=None,
+                           percentile_bins=100, percentile_range=None):
+        """
+        Compute statistics over the members, in one pass.
+
+        The members are processed one at a time and running accumulators are
+        updated (Welford mean and variance, counts of threshold exceedances
+        and histograms for percentiles), so the memory does not depend on the
+        number of members. The percentiles are exact as long as the fields of
+        the members use less memory than the histograms (percentile_bins / 2
+        float32 members), for larger ensembles they are estimated by
+        histograms with a range per gridpoint.
+
+        Parameters
+        ----------
+        stats : list, optional
+            The statistics to compute ('mean', 'sum', 'min', 'max', 'std',
+            'var', 'count'). The default is ['mean', 'std'].
+        fields : list, optional
+            The fields (2D fieldnames or 3D basenames). If None, all fields of
+            the first member are used. The default is None.
+        thresholds : dict, optional
+            Fieldname: list of thresholds. For each threshold the fraction of
+            the members with a value above it (exceedance probability) is
+            computed. The default is None.
+        percentiles : list, optional
+            The percentiles (0 to 100) to estimate. The default is None.
+        percentile_bins : int, optional
+            The number of histogram bins used to estimate the percentiles.
+            The default is 100.
+        percentile_range : dict, optional
+            Fieldname: (lower, upper) range of the percentile histograms (for
+            all gridpoints). If a field is missing, the range of each
+            gridpoint over the first members, widened by half of it on both
+            sides, is used. The default is None.
+
+        Returns
+        -------
+        xarray.Dataset
+            For each field, a '{field}_{stat}' variable per statistic, a
+            '{field}_exceedance' variable (with a '{field}_threshold'
+            dimension) and a '{field}_percentile' variable (with a
+            'percentile' dimension). All have a validate dimension, and the
+            number of members per validate is in 'n_members'.
+
+        """
+        if isinstance(stats, str):
+            stats = [stats]
+        if isinstance(fields, str):
+            fields = [fields]
+        if thresholds is None:
+            thresholds = {}
+        if percentile_range is None:
+            percentile_range = {}
+        streaming_stats.check_stats(stats)
+        if not bool(self.members):
+            sys.exit('No members are set in this ensemble.')
+
+        accumulators = {} # validate: accumulators of that validate
+        with profiling.activate(self.profiler):
+            with self.profiler.stage('ensemble_statistics', n_members=len(self.members)):
+                for member in self.iter_members():
+                    if fields is None:
+                        fields = member.get_fieldnames()
+                    missing_fields = [field for field in fields if not member.field_exist(field)]
+                    if bool(missing_fields):
+                        sys.exit(f'{missing_fields} are not found in member {member.fafile}.')
+
+                    validate = member.get_validate()
+                    if validate not in accumulators:
+                        accumulators[validate] = _init_accumulators(member, fields, stats,
+                                                                    thresholds, percentiles,
+                                                                    percentile_bins,
+                                                                    percentile_range)
+                    with profiling.stage('update_members', file=str(member.fafile)):
+                        _update_accumulators(accumulators[validate], member)
+
+        results = [_finish_accumulators(accumulators[validate], validate, percentiles)
+                   for validate in sorted(accumulators)]
+        if len(results) == 1:
+            return results[0]
+        return reading_fa._to_canonical_layout(xr.concat(results, dim='validate',
+                                                         data_vars='all',
+                                                         coords='minimal',
+                                                         compat='override',
+                                                         combine_attrs='drop_conflicts'))
+
+    def get_profile_report(self):
+        """
+        Get the timing and memory use of the stages of this ensemble.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per stage.
+
+        """
+        return self.profiler.get_report()
+
+
+# =========================================================================
+#     Helpers
+# =============================================================================
+
+def _init_accumulators(member, fields, stats, thresholds, percentiles,
+                       percentile_bins, percentile_range):
+    """Create the accumulators of one validate (only the coordinates and attributes of the member are kept)."""
+    acc = {'n_members': 0,
+           'dims': {field: member.ds[field].dims for field in fields},
+           'field_attrs': {field: dict(member.ds[field].attrs) for field in fields},
+           'coords': {name: coord.copy(deep=True) for name, coord in member.ds.coords.items()
+                      if name not in ['validate']},
+           'attrs': {key: val for key, val in member.ds.attrs.items()
+                     if key not in ['origin', 'filepath']},
+           'stats': {}, 'thresholds': {}, 'exceedances': {}, 'histograms': {}}
+
+    for field in fields:
+        values = member.ds[field].values
+        acc['stats'][field] = streaming_stats.RunningStats(shape=values.shape, stats=stats)
+        if field in thresholds:
+            acc['thresholds'][field] = np.atleast_1d(np.asarray(thresholds[field], dtype=np.float64))
+            acc['exceedances'][field] = np.zeros((acc['thresholds'][field].shape[0],) + values.shape,
+                                                 dtype=np.int64)
+        if percentiles is not None:
+            lower, upper = percentile_range.get(field, (None, None))
+            acc['histograms'][field] = streaming_stats.RunningPercentiles(shape=values.shape,
+                                                                          nbins=percentile_bins,
+                                                                          lower=lower,
+                                                                          upper=upper)
+    return acc
+
+
+def _update_accumulators(acc, member):
+    """Add one member to the accumulators of its validate."""
+    acc['n_members'] += 1
+    for field, running in acc['stats'].items():
+        values = member.ds[field].values
+        running.update(values)
+        if field in acc['exceedances']:
+            for idx, threshold in enumerate(acc['thresholds'][field]):
+                acc['exceedances'][field][idx] += values > threshold
+        if field in acc['histograms']:
+            acc['histograms'][field].update(values)
+
+
+def _finish_accumulators(acc, validate, percentiles):
+    """Create the xarray.Dataset with the statistics of one validate."""
+    data_vars = {}
+    for field, running in acc['stats'].items():
+        dims = acc['dims'][field]
+        attrs = acc['field_attrs'][field]
+        for stat in running.stats:
+            data_vars[f'{field}_{stat}'] = (dims, running.result(stat),
+                                            {**attrs, 'cell_methods': f'member: {stat}'})
+        if field in acc['exceedances']:
+            data_vars[f'{field}_exceedance'] = ((f'{field}_threshold',) + dims,
+                                                acc['exceedances'][field] / acc['n_members'],
+                                                {'long_name': f'fraction of the members with {field} above the threshold'})
+        if field in acc['histograms']:
+            histogram = acc['histograms'][field]
+            if histogram.n_outside > 0:
+                print(f'WARNING: {histogram.n_outside} values of {field} are outside the range of the percentile histograms, the outer percentiles are clipped.')
+            data_vars[f'{field}_percentile'] = (('percentile',) + dims,
+                                                histogram.percentiles(percentiles),
+                                                {**attrs, 'cell_methods': 'member: percentile'})
+
+    coords = dict(acc['coords'])
+    if bool(acc['histograms']):
+        coords['percentile'] = np.asarray(percentiles, dtype=np.float64)
+    for field, values in acc['thresholds'].items():
+        coords[f'{field}_threshold'] = values
+    ds = xr.Dataset(data_vars=data_vars, coords=coords)
+    ds['n_members'] = acc['n_members']
+    ds = ds.expand_dims(validate=[pd.Timestamp(validate)])
+    ds.attrs.update(acc['attrs'])
+    return reading_fa._to_canonical_layout(ds)
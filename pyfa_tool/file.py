@@ -7,19 +7,19 @@ Created on Fri Jan 19 10:16:36 2024
 """
 
 
-import os
 import sys
-import subprocess
+import asyncio
 
 
-import pyfa_tool.modules.IO as IO
 import pyfa_tool.modules.describe_module as describe_module
-from pyfa_tool import package_path
+import pyfa_tool.modules.backends as backends
+import pyfa_tool.modules.aio as aio
+import pyfa_tool.modules.fieldstats as fieldstats
 
 
 class FaFile():
     """A Class that holds metadata and fieldnames of a FA file."""
-    def __init__(self, fafile):
+    def __init__(self, fafile, backend=None):
         """
         Initiate a FAFile object.
 
@@ -29,14 +29,20 @@ class FaFile():
         ----------
         fafile : str
             The path of the FA file.
+        backend : str or FaBackend, optional
+            The backend used to read the FA file ('rscript', 'synthetic' or an
+            instance of a FaBackend). If None, the default backend is used. The
+            default is None.
 
         Returns
         -------
         None.
 
         """
+        self.backend = backends.get_backend(backend)
+
         # test if file exist
-        if not IO.check_file_exist(fafile):
+        if not self.backend.exists(fafile):
             sys.exit(f'{fafile} is not a file.')
 
         self.fafile = fafile
@@ -48,6 +54,44 @@ class FaFile():
         self._filter_fieldname_types(fieldsdf=self.fielddf,
                                      nlev = self.metadata['nlev'][0])
 
+    @classmethod
+    @aio.exits_as_errors
+    async def aopen(cls, fafile, backend=None):
+        """
+        Initiate a FaFile without blocking the event loop (coroutine).
+
+        The metadata and fieldnames are read by awaiting the backend (for the
+        R backends the R process is awaited, and killed when the coroutine is
+        cancelled). Errors are raised as RuntimeError (see
+        modules.aio.exits_as_errors()).
+
+        Parameters
+        ----------
+        fafile : str
+            The path of the FA file.
+        backend : str or FaBackend, optional
+            The backend used to read the FA file. If None, the default backend
+            is used. The default is None.
+
+        Returns
+        -------
+        FaFile
+            The FaFile, with the metadata and fieldnames read.
+
+        """
+        FA = cls.__new__(cls)
+        FA.backend = backends.get_backend(backend)
+        if not await asyncio.to_thread(FA.backend.exists, fafile):
+            sys.exit(f'{fafile} is not a file.')
+        FA.fafile = fafile
+
+        metadata = await FA.backend.aread_metadata(fafile)
+        fielddata = await FA.backend.alist_fields(fafile)
+        await asyncio.to_thread(FA._set_metadata, metadata, fielddata)
+        FA._filter_fieldname_types(fieldsdf=FA.fielddf,
+                                   nlev=FA.metadata['nlev'][0])
+        return FA
+
     # =========================================================================
     #     Special functions ------------
     # =========================================================================
@@ -73,6 +117,23 @@ class FaFile():
         """
         return self.fielddf
 
+    def get_fieldstats(self):
+        """
+        Get the statistics of the fields (computed when they were decoded).
+
+        The statistics are stored (in the on-disk index) each time fields of
+        this FA file are imported, so no fields are decoded here.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The name, min, max, mean and number of NaNs of each field (level)
+            that was decoded before.
+
+        """
+        return self.fielddf.loc[self.fielddf['n_points'].notna(),
+                                fieldstats.FIELDSTATS_COLUMNS].reset_index(drop=True)
+
     def get_metadata(self):
         """
         Get general metadata (applicable to all fields).
@@ -105,6 +166,63 @@ class FaFile():
                                               pseudod3fieldnames=self._pure_pseudo_3d_fieldnames)
 
 
+    def compare(self, other, fields=None, verbose=True, backend=None):
+        """
+        Compare the fields of this FA file with another FA file.
+
+        The fields are matched by name (2D fieldnames, 3D basenames and the
+        levels of pseudo 3D fields), and each pair of fields is decoded and
+        compared before the next pair is read. Fields with bit-identical
+        records are not decoded.
+
+        Parameters
+        ----------
+        other : FaFile or str
+            The other FA file (the path is read with the backend of this
+            FaFile).
+        fields : list, optional
+            Only compare these fields (2D fieldnames or 3D basenames). If
+            None, all fields are compared. The default is None.
+        verbose : bool, optional
+            If True, an overview of the comparison is printed. The default is
+            True.
+        backend : str or FaBackend, optional
+            The backend that decodes the fields (and reads the other file). If
+            None, the backend of this FaFile is used, except for the rscript
+            backend: the rworker backend is used instead (as for the diff
+            command), so R is not started for each field. The default is None.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per field (and per level for 3D fields) with the status
+            ('identical', 'different', 'only_in_a', 'only_in_b'), the maximum
+            absolute difference, the RMSE, the mean difference (this file
+            minus other) and the number of points. The metadata that differs
+            (see modules.compare.compare_metadata()) is in
+            report.attrs['metadata_diff'].
+
+        """
+        import pyfa_tool.modules.compare as compare
+
+        if backend is None:
+            # one R process for all fields instead of one per field
+            if type(self.backend) is backends.RscriptBackend:
+                backend = 'rworker'
+            else:
+                backend = self.backend
+        backend = backends.get_backend(backend)
+
+        if not isinstance(other, FaFile):
+            other = FaFile(other, backend=backend)
+        report, metadata_diff = compare.compare_fafiles(self, other, fields=fields,
+                                                        backend=backend)
+        report.attrs['metadata_diff'] = metadata_diff
+        if verbose:
+            compare.print_comparison(report, metadata_diff,
+                                     fafile_a=self.fafile, fafile_b=other.fafile)
+        return report
+
     # =========================================================================
     #     Helpers --------------------
     # =========================================================================
@@ -228,6 +346,34 @@ class FaFile():
         """
 
         return list(set(self.fielddf['name'].to_list()))
+
+    def _get_nbits_per_fieldname(self):
+        """
+        Get the number of packing bits for all fields and 3D basenames.
+
+        For 3D (and pseudo 3D) basenames, the maximum over all levels is used.
+
+        Returns
+        -------
+        dict
+            fieldname (and basename) : nbits
+
+        """
+        if 'nbits' not in self.fielddf.columns:
+            return {}
+
+        nbits = {}
+        for name, bits in zip(self.fielddf['name'], self.fielddf['nbits']):
+            try:
+                bits = int(bits)
+            except (TypeError, ValueError):
+                continue
+            nbits[name] = max(bits, nbits.get(name, 0))
+            if name in self._pure_3d_fieldnames or name in self._pure_pseudo_3d_fieldnames:
+                basename = name[4:].strip()
+                nbits[basename] = max(bits, nbits.get(basename, 0))
+        return nbits
+
     def _list_all_3d_fieldnames_as_basenames(self):
         """
         Create a list of all basisfieldnames which occures at multiple levels.
@@ -251,9 +397,8 @@ class FaFile():
         """
         Extract the fieldnames and metadata from an fa_filepath.
 
-        This function will execute get_all_metadata.R, that will write all the
-        fielnames and the metadata to json files. These files are read and
-        formatted.
+        The backend is used to read all the fieldnames and the metadata (for
+        the default backend this will execute get_all_metadata.R).
 
         The .metadata and .fielddf attributes are set.
 
@@ -262,29 +407,19 @@ class FaFile():
         None
 
         """
-        # create at tmpdir if not provided
-        tmpdir = IO.create_tmpdir(location=os.getcwd())
-        # Run Rscript to generete a json file with all info
-        r_script = os.path.join(package_path, 'modules', 'rfa_scripts',
-                                'get_all_metadata.R')
-        subprocess.call([os.path.join(IO._get_rbin(), 'Rscript'), r_script,
-                         self.fafile, tmpdir])
-
-
-        fields_jsonpath = os.path.join(tmpdir, 'fields.json')
-        metadata_jsonpath = os.path.join(tmpdir, 'metadata.json')
-
-        # Read the json files
-        fielddata = IO.read_json(jsonpath=fields_jsonpath,
-                                 to_dataframe=True)
-        metadata = IO.read_json(jsonpath=metadata_jsonpath,
-                                 to_dataframe=False)
+        metadata = self.backend.read_metadata(self.fafile)
+        fielddata = self.backend.list_fields(self.fafile)
+        self._set_metadata(metadata, fielddata)
 
+    def _set_metadata(self, metadata, fielddata):
+        """Set the .metadata and .fielddf attributes from the backend output."""
         # Remove trailing and leading whitespace from fieldnames
         fielddata['name'] = [fieldname.strip() for fieldname in fielddata['name']]
 
+        # Add the statistics of the fields that are decoded before (if any)
+        fielddata = fieldstats.merge_into_fielddf(fielddata,
+                                                  fieldstats.read_fieldstats(self.fafile))
+
         # update attributes
         self.metadata = metadata
         self.fielddf = fielddata
-
-        IO.remove_tempdir(tmpdir)
\ No newline at end of file
@@ -17,9 +17,176 @@ main_path = Path(__file__).parents[1].resolve()
 sys.path.append(str(main_path))
 
 
+# =============================================================================
+# Subcommands
+# =============================================================================
+
+def _run_convert_batch(argv):
+    """Convert multiple FA files to netCDF (one netCDF file per FA file)."""
+    parser = argparse.ArgumentParser(prog='PyFA-tool convert-batch',
+                                     description='Convert FA files to netCDF, one netCDF file per FA file, in parallel.')
+    parser.add_argument('inputs', nargs='+',
+                        help='FA files and/or directories containing FA files.')
+    parser.add_argument('--pattern', default='*',
+                        help='Regex expression (unix wildcards) on the filenames in the directories.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files that are converted in parallel.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Template of the netCDF paths. Available fields: {dir}, {parent}, {name} and {stem} of the FA file. (default: {dir}/{stem}.nc)')
+    parser.add_argument('--whitelist', default='',
+                        help='list of fieldnames to read (seperated by ,). If emtpy, all fields are read.')
+    parser.add_argument('--proj', default='',
+                        help='Reproject to this crs (ex: EPSG:4326)')
+    parser.add_argument('--dtype', default='auto', choices=['auto', 'float32', 'float64'],
+                        help='Floating point dtype to store the fields in.')
+    parser.add_argument('--force', default=False, action='store_true',
+                        help='Also convert FA files with an up-to-date netCDF file.')
+    args = parser.parse_args(argv)
+
+    from pyfa_tool.modules import batch
+
+    whitelist = []
+    if args.whitelist != '':
+        whitelist = str(args.whitelist).replace(' ', '').split(',')
+
+    filepaths = batch.collect_fa_paths(args.inputs, filename_regex=args.pattern)
+    if not bool(filepaths):
+        sys.exit(f'No FA files found in {args.inputs}.')
+
+    summary = batch.convert_batch(filepaths,
+                                  output_template=(args.output if args.output is not None
+                                                   else batch.DEFAULT_OUTPUT_TEMPLATE),
+                                  n_jobs=args.jobs,
+                                  skip_up_to_date=not args.force,
+                                  whitelist=whitelist,
+                                  reproj=(args.proj != ''),
+                                  target_epsg=args.proj,
+                                  dtype=args.dtype)
+    batch.print_summary(summary)
+    return int((summary['status'] == 'failed').any())
+
+
+def _run_watch(argv):
+    """Watch a directory and convert new FA files as they are written."""
+    parser = argparse.ArgumentParser(prog='PyFA-tool watch',
+                                     description='Watch a directory and append new (complete) FA files to a netCDF collection store as they are written.')
+    parser.add_argument('dir', help='The directory to watch.')
+    parser.add_argument('pattern', nargs='?', default='*',
+                        help='Regex expression (unix wildcards) on the FA filenames. (quote it in the shell)')
+    parser.add_argument('--store', default='collection.nc',
+                        help='Path of the netCDF collection store the files are appended to.')
+    parser.add_argument('--whitelist', default='',
+                        help='list of fieldnames to read (seperated by ,). If emtpy, all fields are read.')
+    parser.add_argument('--proj', default='',
+                        help='Reproject to this crs (ex: EPSG:4326)')
+    parser.add_argument('--dtype', default='auto', choices=['auto', 'float32', 'float64'],
+                        help='Floating point dtype to store the fields in.')
+    parser.add_argument('--interval', type=float, default=5.,
+                        help='Seconds between two polls of the directory.')
+    parser.add_argument('--settle', type=float, default=10.,
+                        help='A file is complete if its size did not change for this number of seconds.')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Stop if no new file arrived for this number of seconds.')
+    parser.add_argument('--max-files', type=int, default=None,
+                        help='Stop after this number of files are converted.')
+    parser.add_argument('--skip-existing', default=False, action='store_true',
+                        help='Do not convert the files that are already in the directory.')
+    parser.add_argument('--backend', default='rworker',
+                        help='The decode backend. The default (rworker) keeps R running between files.')
+    args = parser.parse_args(argv)
+
+    from pyfa_tool.modules import watch
+
+    whitelist = []
+    if args.whitelist != '':
+        whitelist = str(args.whitelist).replace(' ', '').split(',')
+
+    watch.watch_and_convert(searchdir=args.dir,
+                            filename_regex=args.pattern,
+                            store=args.store,
+                            backend=args.backend,
+                            interval=args.interval,
+                            settle_time=args.settle,
+                            idle_timeout=args.idle_timeout,
+                            max_files=args.max_files,
+                            skip_existing=args.skip_existing,
+                            whitelist=whitelist,
+                            reproj=(args.proj != ''),
+                            target_epsg=args.proj,
+                            dtype=args.dtype)
+    return 0
+
+
+def _run_diff(argv):
+    """Compare two FA files field by field."""
+    parser = argparse.ArgumentParser(prog='PyFA-tool diff',
+                                     description='Compare two FA files field by field (max abs difference, RMSE, bit-identical). Exits with 1 if the fields or the metadata differ.')
+    parser.add_argument('file_a', help='The reference FA file.')
+    parser.add_argument('file_b', help='The FA file to compare with.')
+    parser.add_argument('--whitelist', default='',
+                        help='list of fields to compare (seperated by ,). If emtpy, all fields are compared.')
+    parser.add_argument('--output', default=None,
+                        help='Write the report (one row per field and level) to this .csv file.')
+    parser.add_argument('--backend', default='rworker',
+                        help='The decode backend. The default (rworker) keeps R running between the fields.')
+    args = parser.parse_args(argv)
+
+    from pyfa_tool.file import FaFile
+
+    fields = None
+    if args.whitelist != '':
+        fields = str(args.whitelist).replace(' ', '').split(',')
+
+    FA = FaFile(args.file_a, backend=args.backend)
+    report = FA.compare(args.file_b, fields=fields, verbose=True)
+    if args.output is not None:
+        report.to_csv(args.output, index=False)
+        print(f'Report saved to {args.output}')
+    differs = (report['status'] != 'identical').any() or bool(report.attrs.get('metadata_diff'))
+    return int(differs)
+
+
+def _run_serve(argv):
+    """Serve slices of FA fields to local clients."""
+    parser = argparse.ArgumentParser(prog='PyFA-tool serve',
+                                     description='Serve slices (field, level, bbox, stride) of FA files on localhost or a Unix socket, with a cache of decoded fields. Use pyfa_tool.FaClient to request them.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='The host to listen on (default 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='The port to listen on (default 8765).')
+    parser.add_argument('--socket', default=None,
+                        help='Listen on this Unix socket instead of host:port.')
+    parser.add_argument('--root', default='.',
+                        help='Only serve FA files in this directory (relative paths are relative to it). The default is the current directory. The server has no authentication: use --root=/ only if every local user may read all your files through it.')
+    parser.add_argument('--cache', default='1G',
+                        help='The maximum size of the cache of decoded fields (e.g. 500M, 2G). The default is 1G.')
+    parser.add_argument('-j', '--workers', type=int, default=2,
+                        help='The number of decodes that run at the same time (warm R workers).')
+    parser.add_argument('--backend', default='rworker',
+                        help='The decode backend. The default (rworker) keeps R running between the requests.')
+    args = parser.parse_args(argv)
+
+    from pyfa_tool.modules import serve, scratch
+
+    server = serve.FaServer(backend=args.backend,
+                            n_workers=args.workers,
+                            max_cache_bytes=scratch._parse_size(args.cache),
+                            root=args.root)
+    server.serve(host=args.host, port=args.port, socket_path=args.socket)
+    return 0
+
+
+_SUBCOMMANDS = {'convert-batch': _run_convert_batch,
+                'watch': _run_watch,
+                'diff': _run_diff,
+                'serve': _run_serve}
+
 
 if __name__ == "__main__":
 
+    if (len(sys.argv) > 1) and (sys.argv[1] in _SUBCOMMANDS):
+        sys.exit(_SUBCOMMANDS[sys.argv[1]](sys.argv[2:]))
+
     parser = argparse.ArgumentParser(prog='PyFA-tool',
                                      formatter_class=argparse.RawDescriptionHelpFormatter,
                                      description="""
@@ -28,8 +195,12 @@ PyFA: a tool for scientist working with ACCORD-FA files.
 
 The following functionality is available:
     * -p, --plot (make as spatial plot of an 2D field.)
-    * -d, --describe (print out information of a FA file.)
-    * -c, -- convert (convert a FA file to netCDF)""",
+    * -d, --describe (print out information of a FA file, or a catalogue of multiple FA files.)
+    * -c, -- convert (convert a FA file to netCDF)
+    * convert-batch (convert FA files to netCDF in parallel, see: convert-batch -h)
+    * watch (convert FA files as they are written by the model, see: watch -h)
+    * diff (compare two FA files field by field, see: diff -h)
+    * serve (serve slices of FA fields to local clients, see: serve -h)""",
 
                                      epilog='''
                                                 Add kwargs as you like as arguments. The position of these arguments is not of importance.
@@ -56,6 +227,14 @@ The following functionality is available:
     default_2dfieldname = 'SFX.T2M'
     parser.add_argument("--field", help="fieldname", default=default_2dfieldname)
     parser.add_argument("--proj", help="Reproject to this crs (ex: EPSG:4326)", default='') #default no reproj
+    parser.add_argument("--profile", help="Print the timing and memory use of all the stages (R, decoding, building, reprojecting, writing, ...).",
+                        default=False, action="store_true")
+    parser.add_argument("--dtype", help="Floating point dtype to store the fields in. With auto, float32 is used for all fields packed with at most 24 bits.",
+                        default='auto', choices=['auto', 'float32', 'float64'])
+    parser.add_argument("--catalogue", help="When describing multiple FA files, write the catalogue (one row per file and field) to this .parquet or .csv file.",
+                        default='')
+    parser.add_argument("-j", "--jobs", help="Number of FA files that are described in parallel.",
+                        default=1, type=int)
 
     parser.add_argument('kwargs', help='Extra arguments passed to the plot function. (must follow directly the file argurment, and as last arg)', nargs='*')
 
@@ -79,9 +258,8 @@ The following functionality is available:
     # =============================================================================
     # Import required modules (so they are not loaded with --help)
     # =============================================================================
-    import pyfa_tool as pyfa
-    # from pyfa_tool.modules import plotting
-    import matplotlib.pyplot as plt
+    import pyfa_tool as pyfa # the classes are imported on first use
+    import pyfa_tool.modules.IO
     import numpy as np
     from pathlib import Path
 
@@ -184,6 +362,22 @@ The following functionality is available:
     if np.array(['whitelist' in faP for faP in matching_paths]).any():
         print("WARNING: could it be that you added a whitelist without the '--' prefix?")
 
+    def new_profiler():
+        """Profiler for one import (None if not profiling)."""
+        if args.profile:
+            from pyfa_tool.modules.profiling import StageProfiler
+            return StageProfiler(trace_memory=True)
+        return None
+
+    def print_profile_report(report):
+        if args.profile:
+            import pandas as pd
+            with pd.option_context('display.max_rows', None,
+                                   'display.max_columns', None,
+                                   'display.width', 200):
+                print('\n########## Profile ######### \n')
+                print(report)
+
 
     # =============================================================================
     # Describe mode
@@ -194,7 +388,13 @@ The following functionality is available:
             FA = pyfa.FaFile(fa_file)
             FA.describe()
         else:
-            sys.exit('Describe is not implemented for multiple FA-files.')
+            # Describe all files in one catalogue table
+            from pyfa_tool.modules import catalogue
+            cat = catalogue.build_catalogue(filepaths=matching_paths,
+                                            n_jobs=args.jobs)
+            catalogue.print_catalogue_summary(cat)
+            if args.catalogue != '':
+                catalogue.write_catalogue(cat, args.catalogue)
 
 
     # =============================================================================
@@ -220,9 +420,12 @@ The following functionality is available:
                                rm_tmpdir=True,
                                reproj=reproj_bool,
                                target_epsg=args.proj,
+                               dtype=args.dtype,
                                )
             print(ds)
-            # plot the 2d field
+            print_profile_report(ds.get_profile_report())
+            # plot the 2d field (matplotlib is only imported in plot mode)
+            import matplotlib.pyplot as plt
             ds.plot(variable=d2fieldname,
                     **kwargs)
             plt.show()
@@ -256,16 +459,21 @@ The following functionality is available:
             ds.import_fa(whitelist=whitelist,
                          blacklist=blacklist,
                          reproj=reproj_bool,
-                         target_epsg=trg_epsg)
+                         target_epsg=trg_epsg,
+                         dtype=args.dtype,
+                         profiler=new_profiler())
 
             # save to nc
             ds.save_nc(outputfolder=target_dir,
                        filename=target_file,
                        )
+            print_profile_report(ds.get_profile_report())
         else:
             if args.combine_by_validate:
 
                 col = pyfa.FaCollection() # 1. init colleciton
+                if args.profile:
+                    col.profiler = new_profiler()
                 # 2: set Fadatasets
                 datasets = []
                 for fafilepath in matching_paths:
@@ -274,7 +482,9 @@ The following functionality is available:
                     ds.import_fa(whitelist=whitelist,
                                  blacklist=blacklist,
                                  reproj=reproj_bool,
-                                 target_epsg=trg_epsg)
+                                 target_epsg=trg_epsg,
+                                 dtype=args.dtype,
+                                 profiler=new_profiler())
                     datasets.append(ds)
 
                 col.set_fadatasets(FaDatasets=datasets)
@@ -287,6 +497,7 @@ The following functionality is available:
                 col.save_nc(outputfolder=os.getcwd(),
                            filename=target_file,
                            )
+                print_profile_report(col.get_profile_report())
 
             else:
                 sys.exit('In the CLI only the "combine by validate" combinatin technique is implented for a colleciton of FA-files.')
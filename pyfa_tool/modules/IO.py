@@ -15,7 +15,7 @@ import pandas as pd
 import subprocess
 import shutil
 import fnmatch
-import xarray as xr
+import functools
 
 
 
@@ -56,16 +56,14 @@ def create_tmpdir(location, tmpdir_name='tmp_fajson'):
 
     """
     tmpdir_path = os.path.join(location, tmpdir_name)
-    tmpdir_available = False
-    while tmpdir_available == False:
-        if os.path.exists(tmpdir_path):  # Do not overwrite if this dir exists already
+    while True:
+        try:
+            # creating is the check, so parallel processes can not get the same directory
+            os.makedirs(tmpdir_path)
+            return tmpdir_path
+        except FileExistsError:
             # add some random characters if the directory exists
             tmpdir_path += ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(4))
-        else:
-            tmpdir_available = True
-
-    os.makedirs(tmpdir_path)
-    return tmpdir_path
 
 def remove_tempdir(tmpdirpath):
     """
@@ -91,18 +89,24 @@ def get_paths_using_regex(searchdir, filename_regex='*'):
     Parameters
     ----------
     searchdir : str
-        The path of the directory to scan all files of.
+        The path of the directory to scan all files of, or the path of a tar
+        archive to scan all members of.
     filename_regex : str, optional
         Regex expression for matching filenames. The default is '*'.
 
     Returns
     -------
     matching_paths : list
-        A list of the matching file paths.
+        A list of the matching file paths (archive.tar::member for the
+        members of an archive).
 
     """
+    import pyfa_tool.modules.archive as archive
+    if archive.is_archive(searchdir):
+        return archive.list_members(searchdir, pattern=filename_regex)
+
     if not os.path.isdir(searchdir):
-        sys.exit(f'{searchdir} is not a directory.')
+        sys.exit(f'{searchdir} is not a directory (or tar archive).')
 
     #Get all filenames
     files = os.listdir(searchdir)
@@ -189,23 +193,12 @@ def write_json(datadict, jsonpath, force=False):
 # =============================================================================
 # OS R related
 # =============================================================================
+@functools.lru_cache(maxsize=None)
 def _get_rbin():
-    """Funtion to extract the Rbin of your environment"""
-    # Write very simple R script in curdir
-    r_miniscript = os.path.join(os.getcwd(), 'mini_R_script.R')
-    with open(r_miniscript, 'w') as f:
-        f.write('R.home("bin")')
-
-    # Execure script and extract the rbin
-    result = subprocess.run(['Rscript', r_miniscript], capture_output=True, text=True)
+    """Funtion to extract the Rbin of your environment (looked up once)"""
+    # Evaluate R.home("bin") directly (no script file is written)
+    result = subprocess.run(['Rscript', '-e', 'R.home("bin")'], capture_output=True, text=True)
     rbin = result.stdout.split('"')[1]
-
-    # Delete basic r script
-    try:
-        os.remove(r_miniscript)
-    except OSError:
-        pass
-
     return rbin
 
 
@@ -214,7 +207,8 @@ def _get_rbin():
 # =============================================================================
 
 
-def save_as_nc(xrdata, outputfolder, filename, overwrite=False, **kwargs):
+def save_as_nc(xrdata, outputfolder, filename, overwrite=False, dtype=None,
+               **kwargs):
     """
     Save an Xarray object to a NetCDF file.
 
@@ -229,6 +223,10 @@ def save_as_nc(xrdata, outputfolder, filename, overwrite=False, **kwargs):
     overwrite : bool, optional
         If False, the xarray object is not saved if the netCDF file already
         exists. The default is False.
+    dtype : str or None, optional
+        If not None, all floating point data variables are encoded with this
+        dtype in the netCDF file. If None, the dtype of the data is kept. The
+        default is None.
     **kwargs : optional
         kwargs are passed to the .to_netcdf() method of the xarray object.
 
@@ -254,6 +252,13 @@ def save_as_nc(xrdata, outputfolder, filename, overwrite=False, **kwargs):
     if (check_file_exist(target_file) & (overwrite)):
         os.remove(target_file)
 
+    # set the dtype of the floating point variables in the encoding
+    if dtype is not None:
+        encoding = kwargs.pop('encoding', {})
+        kwargs['encoding'] = _float_dtype_encoding(xrdata=xrdata,
+                                                   dtype=dtype,
+                                                   encoding=encoding)
+
     # convert to nc
     xrdata.to_netcdf(path=target_file,
                       engine='netcdf4',
@@ -263,6 +268,61 @@ def save_as_nc(xrdata, outputfolder, filename, overwrite=False, **kwargs):
     return None
 
 
+def save_as_zarr(xrdata, store, overwrite=False, dtype=None, **kwargs):
+    """
+    Save an Xarray object to a zarr store.
+
+    Dask-backed data is written chunk by chunk.
+
+    Parameters
+    ----------
+    xrdata : xarray.DataArray or xarray.DataSet
+        The Xarray data object to save.
+    store : str
+        Path of the zarr store (a directory).
+    overwrite : bool, optional
+        If False, the xarray object is not saved if the store already exists.
+        The default is False.
+    dtype : str or None, optional
+        If not None, all floating point data variables are encoded with this
+        dtype in the store. If None, the dtype of the data is kept. The
+        default is None.
+    **kwargs : optional
+        kwargs are passed to the .to_zarr() method of the xarray object.
+
+    Returns
+    -------
+    None.
+
+    """
+    if (os.path.exists(store)) & (not overwrite):
+        sys.exit(f'{store} already exists.')
+
+    # set the dtype of the floating point variables in the encoding
+    if dtype is not None:
+        encoding = kwargs.pop('encoding', {})
+        kwargs['encoding'] = _float_dtype_encoding(xrdata=xrdata,
+                                                   dtype=dtype,
+                                                   encoding=encoding)
+
+    try:
+        xrdata.to_zarr(store, mode='w', **kwargs)
+    except ImportError:
+        sys.exit('Writing zarr stores requires zarr (pip install zarr).')
+    print(f'Data saved to {store}')
+    return None
+
+
+def _float_dtype_encoding(xrdata, dtype, encoding={}):
+    """Add the dtype to the netCDF encoding of all floating point variables."""
+    encoding = {key: dict(val) for key, val in encoding.items()}
+    for varname, var in xrdata.data_vars.items():
+        if var.dtype.kind == 'f':
+            encoding.setdefault(varname, {})
+            encoding[varname].setdefault('dtype', str(dtype))
+    return encoding
+
+
 def read_netCDF(file, **kwargs):
     """
     Import a netCDF file into a xarray Dataset.
@@ -284,6 +344,8 @@ def read_netCDF(file, **kwargs):
     if not check_file_exist(file):
         sys.exit(f'{file} does not exist.')
 
+    import xarray as xr # not needed for the other IO functions, so import here
+
     ds = xr.open_dataset(file, **kwargs)
 
     return ds
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helpers for the asyncio API (FaFile.aopen, FaDataset.aimport_fa and
+FaCollection.aload).
+
+The decoders run as child processes (R) that are awaited without blocking the
+event loop. The number of decodes that run at the same time is limited (per
+event loop) by a semaphore, and a child process is killed when the coroutine
+that waits for it is cancelled.
+
+The limit is PYFA_MAX_CONCURRENT_DECODES (environment variable) or the number
+of CPUs, and can be changed with set_max_concurrency().
+
+PyFa stops on errors with sys.exit(), but a SystemExit that is raised in a
+task stops the whole event loop (it can not be caught by the awaiting
+coroutine). The coroutines of PyFa therefore raise these errors as
+RuntimeError (see exits_as_errors()).
+
+@author: thoverga
+"""
+
+import os
+import sys
+import asyncio
+import weakref
+import functools
+import contextlib
+
+
+_settings = {'max_concurrency': None} # None: PYFA_MAX_CONCURRENT_DECODES or the number of CPUs
+_limiters = weakref.WeakKeyDictionary() # event loop: (limit, semaphore)
+
+
+# =============================================================================
+# Concurrency limit
+# =============================================================================
+
+def get_max_concurrency():
+    """Get the maximum number of decodes that run at the same time."""
+    if _settings['max_concurrency'] is not None:
+        return _settings['max_concurrency']
+    env_limit = os.environ.get('PYFA_MAX_CONCURRENT_DECODES')
+    if bool(env_limit):
+        return int(env_limit)
+    return os.cpu_count() or 1
+
+
+def set_max_concurrency(max_concurrency):
+    """
+    Set the maximum number of decodes that run at the same time.
+
+    Parameters
+    ----------
+    max_concurrency : int or None
+        The maximum number of decodes (per event loop). If None, the
+        PYFA_MAX_CONCURRENT_DECODES environment variable, or the number of
+        CPUs, is used.
+
+    Returns
+    -------
+    None.
+
+    """
+    if (max_concurrency is not None) and (int(max_concurrency) < 1):
+        sys.exit(f'The maximum concurrency must be at least 1, not {max_concurrency}.')
+    _settings['max_concurrency'] = None if max_concurrency is None else int(max_concurrency)
+
+
+@contextlib.asynccontextmanager
+async def limit():
+    """Async context that holds one of the decode slots of the running event loop."""
+    loop = asyncio.get_running_loop()
+    max_concurrency = get_max_concurrency()
+    if (loop not in _limiters) or (_limiters[loop][0] != max_concurrency):
+        # a new limit is used by the next decodes (running ones keep their slot)
+        _limiters[loop] = (max_concurrency, asyncio.Semaphore(max_concurrency))
+    async with _limiters[loop][1]:
+        yield
+
+
+# =============================================================================
+# Errors
+# =============================================================================
+
+def _exit_to_error(e):
+    """Convert a SystemExit (of sys.exit(message)) to a RuntimeError."""
+    message = e.code if isinstance(e.code, str) else f'PyFa exited with code {e.code}.'
+    return RuntimeError(message)
+
+
+def exits_as_errors(coroutine_function):
+    """
+    Decorate a coroutine function, so that a sys.exit() in it raises a RuntimeError.
+
+    Parameters
+    ----------
+    coroutine_function : coroutine function
+        The coroutine function (that calls synchronous PyFa code).
+
+    Returns
+    -------
+    coroutine function
+        The decorated coroutine function.
+
+    """
+    @functools.wraps(coroutine_function)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await coroutine_function(*args, **kwargs)
+        except SystemExit as e:
+            raise _exit_to_error(e) from e
+    return wrapper
+
+
+# =============================================================================
+# Running
+# =============================================================================
+
+async def run_subprocess(*cmd):
+    """
+    Run a child process (within the concurrency limit) and wait for it.
+
+    The output of the child is not captured. If the waiting coroutine is
+    cancelled, the child is killed before the cancellation is propagated.
+
+    Parameters
+    ----------
+    *cmd : str
+        The program and its arguments.
+
+    Returns
+    -------
+    int
+        The return code of the child process.
+
+    """
+    async with limit():
+        process = await asyncio.create_subprocess_exec(*cmd)
+        try:
+            return await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run a blocking function in a thread (within the concurrency limit)."""
+    async with limit():
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def in_thread(context):
+    """
+    Async context that enters and exits a blocking context manager in a thread.
+
+    E.g. to create a scratch directory, or to copy a member of an archive,
+    without blocking the event loop. If the coroutine is cancelled while the
+    context is entered, the context is exited when the thread is done.
+
+    Parameters
+    ----------
+    context : context manager
+        The (blocking) context manager.
+
+    Yields
+    ------
+    The value of the context manager.
+
+    """
+    entering = asyncio.ensure_future(asyncio.to_thread(context.__enter__))
+    try:
+        value = await asyncio.shield(entering)
+    except asyncio.CancelledError:
+        # the thread enters the context anyway, so exit it when it is done
+        await entering
+        await asyncio.to_thread(context.__exit__, *sys.exc_info())
+        raise
+
+    try:
+        yield value
+    except BaseException:
+        if not await asyncio.to_thread(context.__exit__, *sys.exc_info()):
+            raise
+    else:
+        await asyncio.to_thread(context.__exit__, None, None, None)
+
+
+async def gather(coros):
+    """
+    Run coroutines concurrently and get their results (in order).
+
+    If one of them fails (or the gather is cancelled), the others are
+    cancelled too, so no decodes are left running. A sys.exit() in one of
+    them is raised as a RuntimeError (see exits_as_errors()).
+
+    Parameters
+    ----------
+    coros : list
+        The coroutines.
+
+    Returns
+    -------
+    list
+        The results.
+
+    """
+    tasks = [asyncio.ensure_future(_await_as_error(coro)) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _await_as_error(coro):
+    """Await a coroutine, a sys.exit() in it is raised as a RuntimeError."""
+    try:
+        return await coro
+    except SystemExit as e:
+        raise _exit_to_error(e) from e
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read FA files that are members of tar archives, without extracting the archive.
+
+A member of an archive is given as 'archive.tar::member', and the member part
+can be a unix wildcard (e.g. 'run.tar::PFAR*+000*') to select several
+members. The members of an archive are indexed once (name, offset and size of
+the data), and only the members that are decoded are copied, by offset, to a
+scratch file for the decoder.
+
+@author: thoverga
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import fnmatch
+import tarfile
+import tempfile
+import contextlib
+from collections import namedtuple
+
+import pyfa_tool.modules.profiling as profiling
+import pyfa_tool.modules.scratch as scratch
+
+
+ARCHIVE_SEPARATOR = '::'
+
+# The location and size of the data of a member in the archive
+TarMember = namedtuple('TarMember', ['name', 'offset', 'size'])
+
+_COPY_CHUNK = 16 * 1024 * 1024 # bytes per read, if copy_file_range is not available
+
+_index_cache = {} # (abspath, size, mtime_ns) of an archive: its index
+
+
+# =============================================================================
+# Paths
+# =============================================================================
+
+def split_archive_path(path):
+    """
+    Split a path in the archive and the member.
+
+    Parameters
+    ----------
+    path : str
+        A path ('archive.tar::member', or a plain path).
+
+    Returns
+    -------
+    archive : str or None
+        The path of the archive (None for a plain path).
+    member : str
+        The member (or member pattern), or the plain path.
+
+    """
+    path = str(path)
+    if ARCHIVE_SEPARATOR not in path:
+        return None, path
+    archive, member = path.split(ARCHIVE_SEPARATOR, 1)
+    return archive, member
+
+
+def is_archive_path(path):
+    """Check if a path points to a member of an archive ('archive.tar::member')."""
+    return split_archive_path(path)[0] is not None
+
+
+def is_archive(path):
+    """Check if a path is a tar archive on disk."""
+    return os.path.isfile(str(path)) and tarfile.is_tarfile(str(path))
+
+
+def file_signature(path):
+    """
+    Get a key that changes when a (member) file changes.
+
+    Parameters
+    ----------
+    path : str
+        A plain path or a member of an archive.
+
+    Returns
+    -------
+    str or None
+        'absolute path|size|mtime_ns', for members with the size and mtime of
+        the archive and the offset of the member. None if the file does not
+        exist.
+
+    """
+    archive, member = split_archive_path(path)
+    if archive is None:
+        if not os.path.isfile(member):
+            return None
+        stat = os.stat(member)
+        return f'{os.path.abspath(member)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+    found = get_tar_index(archive).get(member)
+    if found is None:
+        return None
+    stat = os.stat(archive)
+    return f'{os.path.abspath(archive)}{ARCHIVE_SEPARATOR}{member}|{stat.st_size}@{found.offset}|{stat.st_mtime_ns}'
+
+
+def file_size(path):
+    """Get the size in bytes of a plain file, or a member of an archive (0 if not found)."""
+    archive, member = split_archive_path(path)
+    if archive is None:
+        return os.path.getsize(member) if os.path.isfile(member) else 0
+    found = get_tar_index(archive).get(member) if is_archive(archive) else None
+    return 0 if found is None else found.size
+
+
+def exists(path):
+    """Check if a plain file, or a member of an archive, exists."""
+    archive, member = split_archive_path(path)
+    if archive is None:
+        return os.path.isfile(member)
+    if not is_archive(archive):
+        return False
+    return member in get_tar_index(archive)
+
+
+def checksum_range(path, offset, length):
+    """
+    Get the checksum of a byte range of a plain file, or a member of an archive.
+
+    Parameters
+    ----------
+    path : str
+        A plain path or a member of an archive ('archive.tar::member').
+    offset : int
+        The offset (bytes) of the range in the (member) file.
+    length : int
+        The length (bytes) of the range.
+
+    Returns
+    -------
+    str or None
+        The (blake2b) checksum of the range. None if the range can not be
+        read by offset (a member of a compressed archive, or a range beyond
+        the end of the file).
+
+    """
+    archive, member = split_archive_path(path)
+    if archive is None:
+        filepath, start = member, int(offset)
+    else:
+        found = get_tar_index(archive).get(member)
+        if (found is None) or (found.offset is None) or (int(offset) + int(length) > found.size):
+            return None
+        filepath, start = archive, found.offset + int(offset)
+
+    checksum = hashlib.blake2b(digest_size=16)
+    remaining = int(length)
+    with open(filepath, 'rb') as source:
+        source.seek(start)
+        while remaining > 0:
+            chunk = source.read(min(_COPY_CHUNK, remaining))
+            if not chunk:
+                return None
+            checksum.update(chunk)
+            remaining -= len(chunk)
+    return checksum.hexdigest()
+
+
+# =============================================================================
+# Indexing
+# =============================================================================
+
+def get_tar_index(archive):
+    """
+    Get the index of the members of a tar archive.
+
+    The headers of the archive are read once per version of the archive (the
+    data of the members is skipped for uncompressed archives).
+
+    Parameters
+    ----------
+    archive : str
+        The path of the tar archive.
+
+    Returns
+    -------
+    dict
+        Member name: TarMember, for all regular files in the archive. The
+        offset is None for compressed archives.
+
+    """
+    if not is_archive(archive):
+        sys.exit(f'{archive} is not a tar archive.')
+    stat = os.stat(archive)
+    key = (os.path.abspath(archive), stat.st_size, stat.st_mtime_ns)
+    if key in _index_cache:
+        return _index_cache[key]
+
+    with profiling.stage('index_archive', file=str(archive)):
+        try:
+            tar = tarfile.open(archive, mode='r:')
+            by_offset = True
+        except tarfile.ReadError:
+            # Data of compressed archives can not be read by offset
+            tar = tarfile.open(archive, mode='r:*')
+            by_offset = False
+        with tar:
+            index = {info.name: TarMember(name=info.name,
+                                          offset=info.offset_data if (by_offset and not info.issparse()) else None,
+                                          size=info.size)
+                     for info in tar if info.isreg()}
+
+    # only keep the index of the last few archives
+    if len(_index_cache) >= 8:
+        _index_cache.pop(next(iter(_index_cache)))
+    _index_cache[key] = index
+    return index
+
+
+def list_members(archive, pattern='*'):
+    """
+    Get the members of an archive that match a pattern.
+
+    Parameters
+    ----------
+    archive : str
+        The path of the tar archive.
+    pattern : str, optional
+        Unix wildcard, matched on the member name and on its filename (without
+        the directories in the archive). The default is '*'.
+
+    Returns
+    -------
+    list
+        The sorted member paths ('archive.tar::member').
+
+    """
+    names = [name for name in get_tar_index(archive)
+             if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(os.path.basename(name), pattern)]
+    return [f'{archive}{ARCHIVE_SEPARATOR}{name}' for name in sorted(names)]
+
+
+def expand_paths(paths):
+    """
+    Expand the wildcards of archive paths ('archive.tar::PFAR*') to members.
+
+    Parameters
+    ----------
+    paths : list of str
+        Plain paths and archive paths. Plain paths are not changed.
+
+    Returns
+    -------
+    list
+        The paths, with archive patterns replaced by the matching members.
+
+    """
+    expanded = []
+    for path in paths:
+        archive, member = split_archive_path(path)
+        if archive is None:
+            expanded.append(path)
+            continue
+        matches = list_members(archive, member)
+        if not bool(matches):
+            print(f'WARNING: no members of {archive} match {member}.')
+        expanded.extend(matches)
+    return expanded
+
+
+def resolve_single(path):
+    """
+    Resolve an archive pattern that should match one member.
+
+    Parameters
+    ----------
+    path : str
+        A plain path or an archive path (with or without wildcards).
+
+    Returns
+    -------
+    str
+        The path (of the only matching member for archive patterns).
+
+    """
+    archive, member = split_archive_path(path)
+    if (archive is None) or (not any(char in member for char in '*?[')):
+        return path
+    matches = list_members(archive, member)
+    if len(matches) != 1:
+        sys.exit(f'{member} matches {len(matches)} members of {archive}, a FaDataset needs exactly one.')
+    return matches[0]
+
+
+# =============================================================================
+# Reading members
+# =============================================================================
+
+@contextlib.contextmanager
+def local_file(path, scratchdir=None):
+    """
+    Get a plain file for a path, to open with a decoder that needs a file.
+
+    A plain path is used as is. For a member of an archive only the data of
+    that member is copied (by offset) to a scratch file, that is removed when
+    the context is closed.
+
+    Parameters
+    ----------
+    path : str
+        A plain path or a member of an archive ('archive.tar::member').
+    scratchdir : str, optional
+        The directory of the scratch file. If None, a new scratch directory
+        is used (see modules.scratch). The default is None.
+
+    Yields
+    ------
+    str
+        The path of a plain file with the content of the (member) file.
+
+    """
+    archive, member = split_archive_path(path)
+    if archive is None:
+        yield member
+        return
+
+    found = get_tar_index(archive).get(member)
+    if found is None:
+        sys.exit(f'{member} is not found in {archive}.')
+
+    with contextlib.ExitStack() as stack:
+        if scratchdir is None:
+            scratchdir = stack.enter_context(scratch.scratch_dir(name='member',
+                                                                 expected_size=found.size))
+        fd, scratchfile = tempfile.mkstemp(prefix='pyfa_', suffix=f'_{os.path.basename(member)}',
+                                           dir=scratchdir)
+        try:
+            with profiling.stage('archive_member_copy', file=str(path), size=found.size):
+                with os.fdopen(fd, 'wb') as target:
+                    _copy_member(archive, found, target)
+            yield scratchfile
+        finally:
+            try:
+                os.remove(scratchfile)
+            except OSError:
+                pass
+
+
+def _copy_member(archive, found, target):
+    """Copy the data of a member to an opened (binary) file."""
+    if found.offset is None:
+        # compressed archive: stream the member through tarfile
+        with tarfile.open(archive, mode='r:*') as tar:
+            shutil.copyfileobj(tar.extractfile(found.name), target, _COPY_CHUNK)
+        return
+
+    with open(archive, 'rb') as source:
+        remaining = found.size
+        offset = found.offset
+        target.flush()
+        # copy in the kernel when possible
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(source.fileno(), target.fileno(),
+                                                remaining, offset_src=offset)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                    offset += copied
+            except OSError:
+                pass # e.g. not supported by the filesystem, copy in python
+        source.seek(offset)
+        while remaining > 0:
+            chunk = source.read(min(_COPY_CHUNK, remaining))
+            if not chunk:
+                break
+            target.write(chunk)
+            remaining -= len(chunk)
+    if remaining > 0:
+        sys.exit(f'{archive} is truncated, {found.name} is incomplete.')
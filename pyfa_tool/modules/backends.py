@@ -0,0 +1,733 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decode backends for FA files.
+
+A backend knows how to list the fields of a FA file, how to read its metadata
+and how to decode (a subset of) the fields. FaFile and FaDataset only talk to
+a backend, so the decoder can be swapped without changing these classes.
+
+Available backends:
+    * 'rscript': decode with RFa by calling the R scripts (default).
+    * 'rworker': decode with RFa in a warm R process, that runs the same R
+      scripts for many files.
+    * 'synthetic': in-process synthetic FA-like data (no R needed), for
+      testing, profiling and load-testing the python side.
+
+@author: thoverga
+"""
+
+import os
+import re
+import sys
+import atexit
+import asyncio
+import weakref
+import threading
+import collections
+import subprocess
+from datetime import datetime
+
+import pandas as pd
+
+import pyfa_tool.modules.IO as IO
+import pyfa_tool.modules.aio as aio
+import pyfa_tool.modules.archive as archive
+import pyfa_tool.modules.scratch as scratch
+import pyfa_tool.modules.synthetic as synthetic
+import pyfa_tool.modules.profiling as profiling
+from pyfa_tool import package_path
+
+
+_RFA_SCRIPTS_DIR = os.path.join(package_path, 'modules', 'rfa_scripts')
+_WORKER_DONE_MARKER = 'PYFA_WORKER_DONE'
+_JSON_SIZE_FACTOR = 8 # size of the FA.json of all fields, relative to the FA file
+_META_CACHE_SIZE = 64 # number of files of which the metadata is cached (per backend)
+
+# =============================================================================
+# Backend protocol
+# =============================================================================
+
+class FaBackend():
+    """Base class that defines the interface of a FA decode backend."""
+
+    name = None
+
+    def exists(self, fafile):
+        """
+        Check if the backend can open the FA file.
+
+        Parameters
+        ----------
+        fafile : str
+            Path of the FA file, or of a member of a tar archive
+            ('archive.tar::member').
+
+        Returns
+        -------
+        bool
+            True if the file can be read by this backend.
+
+        """
+        return archive.exists(fafile)
+
+    def list_fields(self, fafile):
+        """
+        List all the fields in the FA file.
+
+        Parameters
+        ----------
+        fafile : str
+            Path of the FA file.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per field (the structure of fields.json), with at least a
+            'name' column.
+
+        """
+        raise NotImplementedError
+
+    def read_metadata(self, fafile):
+        """
+        Read the general metadata of the FA file.
+
+        Parameters
+        ----------
+        fafile : str
+            Path of the FA file.
+
+        Returns
+        -------
+        dict
+            The metadata (the structure of metadata.json, all values are lists).
+
+        """
+        raise NotImplementedError
+
+    def read_fields(self, fafile, fields, levels=None, window=None,
+                    digits=None, rm_tmpdir=True):
+        """
+        Decode fields of the FA file.
+
+        Parameters
+        ----------
+        fafile : str
+            Path of the FA file.
+        fields : dict
+            The fields to decode, with a '2d' key (list of 2D fieldnames,
+            including pseudo 3D fieldnames and specific levels of 3D fields)
+            and a '3d' key (list of 3D basenames).
+        levels : list of int, optional
+            The levels to decode for the 3D fields. If None, all levels are
+            decoded. The default is None.
+        window : tuple of int, optional
+            (x_start, x_stop, y_start, y_stop) gridpoint indices of the window
+            to decode. If None, the full domain is decoded. The default is None.
+        digits : int, optional
+            Number of significant digits needed for the values (-1 for maximum
+            precision). Only used by backends that serialize the data. The
+            default is None.
+        rm_tmpdir : bool, optional
+            If True, temporary files of the backend are removed. The default
+            is True.
+
+        Returns
+        -------
+        dict
+            The decoded payload (the structure of the FA.json file), the data
+            can be (nested) lists or numpy arrays.
+
+        """
+        raise NotImplementedError
+
+    def record_checksums(self, fafile, fieldnames):
+        """
+        Get checksums of the (packed) records of fields, without decoding them.
+
+        Fields with the same checksum are bit-identical after decoding (e.g.
+        to skip identical fields when comparing files).
+
+        Parameters
+        ----------
+        fafile : str
+            The path of the FA file.
+        fieldnames : list
+            The fieldnames (of the records, e.g. S001TEMPERATURE for a level
+            of a 3D field).
+
+        Returns
+        -------
+        dict
+            Fieldname: checksum, for the records that could be read. Empty if
+            the backend can not read records.
+
+        """
+        return {}
+
+    # =========================================================================
+    # Coroutine versions (the methods above in a thread, backends that run
+    # child processes await them instead)
+    # =========================================================================
+
+    async def alist_fields(self, fafile):
+        """Coroutine version of list_fields()."""
+        return await aio.run_in_thread(self.list_fields, fafile)
+
+    async def aread_metadata(self, fafile):
+        """Coroutine version of read_metadata()."""
+        return await aio.run_in_thread(self.read_metadata, fafile)
+
+    async def aread_fields(self, fafile, fields, levels=None, window=None,
+                           digits=None, rm_tmpdir=True):
+        """Coroutine version of read_fields()."""
+        return await aio.run_in_thread(self.read_fields, fafile, fields,
+                                       levels=levels, window=window,
+                                       digits=digits, rm_tmpdir=rm_tmpdir)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+
+# =============================================================================
+# Rscript (RFa) backend
+# =============================================================================
+
+class RscriptBackend(FaBackend):
+    """Decode FA files with RFa, by running the R scripts in a subprocess."""
+
+    name = 'rscript'
+
+    # Compare the (packed) records of the fields before decoding them, with
+    # the offset and length (in bytes) of the field list of RFa. Only turn
+    # this on when these units are verified for the RFa version in use.
+    checksum_records = False
+
+    def __init__(self):
+        # The metadata and the fields are written by the same R script, so
+        # cache them to avoid running it twice for the same file (and copying
+        # a member of an archive again). Several files are kept, since the
+        # files of a collection are opened before they are decoded.
+        self._meta_cache = collections.OrderedDict() # signature: (metadata, fielddata)
+        self._meta_lock = threading.Lock()
+
+    def list_fields(self, fafile):
+        return self._read_metadata_and_fields(fafile)[1].copy()
+
+    def read_metadata(self, fafile):
+        return dict(self._read_metadata_and_fields(fafile)[0])
+
+    def read_fields(self, fafile, fields, levels=None, window=None,
+                    digits=None, rm_tmpdir=True):
+        with scratch.scratch_dir(name='fajson', expected_size=_fields_scratch_size(fafile),
+                                 keep=not rm_tmpdir) as tmpdir:
+            Rfa_attr_json = _write_rfa_attrs(tmpdir, fields=fields, digits=digits)
+
+            # Run Rscript to generete json files with data and meta info
+            with archive.local_file(fafile, scratchdir=tmpdir) as localfile:
+                with profiling.stage('rscript_get_all_fields'):
+                    self._run_r_script('get_all_fields.R', localfile, tmpdir, Rfa_attr_json)
+
+            payload = _read_fields_json(fafile, tmpdir)
+
+        # RFa decodes the full fields, so subset afterwards
+        return _subset_payload(payload, levels=levels, window=window)
+
+    async def aread_fields(self, fafile, fields, levels=None, window=None,
+                           digits=None, rm_tmpdir=True):
+        # the scratch directory, the json files and the copy of a member are
+        # handled in threads, so the event loop is not blocked
+        expected_size = await asyncio.to_thread(_fields_scratch_size, fafile)
+        async with aio.in_thread(scratch.scratch_dir(name='fajson', expected_size=expected_size,
+                                                     keep=not rm_tmpdir)) as tmpdir:
+            Rfa_attr_json = await asyncio.to_thread(_write_rfa_attrs, tmpdir,
+                                                    fields=fields, digits=digits)
+
+            async with aio.in_thread(archive.local_file(fafile, scratchdir=tmpdir)) as localfile:
+                with profiling.stage('rscript_get_all_fields'):
+                    await self._arun_r_script('get_all_fields.R', localfile, tmpdir, Rfa_attr_json)
+
+            # parsing the json is heavy, so do not block the event loop
+            payload = await asyncio.to_thread(_read_fields_json, fafile, tmpdir)
+
+        return await asyncio.to_thread(_subset_payload, payload, levels=levels, window=window)
+
+    async def alist_fields(self, fafile):
+        return (await self._aread_metadata_and_fields(fafile))[1].copy()
+
+    async def aread_metadata(self, fafile):
+        return dict((await self._aread_metadata_and_fields(fafile))[0])
+
+    def record_checksums(self, fafile, fieldnames):
+        # The units of the offset and length of the field list of RFa (bytes,
+        # or LFI words) are not verified, so the fields are decoded unless
+        # checksum_records is turned on (hashing part of a record could
+        # report different fields as identical).
+        if not self.checksum_records:
+            return {}
+        fielddata = self.list_fields(fafile)
+        if not set(['name', 'offset', 'length']).issubset(fielddata.columns):
+            return {}
+        if not _records_fit_in_file(fielddata['offset'], fielddata['length'],
+                                    archive.file_size(fafile)):
+            return {}
+        records = {str(name).strip(): (offset, length) for name, offset, length
+                   in zip(fielddata['name'], fielddata['offset'], fielddata['length'])}
+        checksums = {}
+        for fieldname in fieldnames:
+            if str(fieldname).strip() not in records:
+                continue
+            offset, length = records[str(fieldname).strip()]
+            checksum = archive.checksum_range(fafile, offset=int(offset), length=int(length))
+            if checksum is not None:
+                checksums[fieldname] = checksum
+        return checksums
+
+    def _read_metadata_and_fields(self, fafile):
+        """Run get_all_metadata.R (once per file version) and read the jsons."""
+        key = archive.file_signature(fafile)
+        cached = self._get_cached_metadata(key)
+        if cached is not None:
+            return cached
+
+        with scratch.scratch_dir(name='fameta',
+                                 expected_size=archive.file_size(fafile)) as tmpdir:
+            # Run Rscript to generete a json file with all info
+            with archive.local_file(fafile, scratchdir=tmpdir) as localfile:
+                with profiling.stage('rscript_get_all_metadata'):
+                    self._run_r_script('get_all_metadata.R', localfile, tmpdir)
+            metadata, fielddata = _read_metadata_json(fafile, tmpdir)
+
+        self._cache_metadata(key, metadata, fielddata)
+        return metadata, fielddata
+
+    async def _aread_metadata_and_fields(self, fafile):
+        """Coroutine version of _read_metadata_and_fields()."""
+        key = await asyncio.to_thread(archive.file_signature, fafile)
+        cached = self._get_cached_metadata(key)
+        if cached is not None:
+            return cached
+
+        expected_size = await asyncio.to_thread(archive.file_size, fafile)
+        async with aio.in_thread(scratch.scratch_dir(name='fameta',
+                                                     expected_size=expected_size)) as tmpdir:
+            async with aio.in_thread(archive.local_file(fafile, scratchdir=tmpdir)) as localfile:
+                with profiling.stage('rscript_get_all_metadata'):
+                    await self._arun_r_script('get_all_metadata.R', localfile, tmpdir)
+            metadata, fielddata = await asyncio.to_thread(_read_metadata_json, fafile, tmpdir)
+
+        self._cache_metadata(key, metadata, fielddata)
+        return metadata, fielddata
+
+    def _get_cached_metadata(self, key):
+        """The cached (metadata, fielddata) of a file signature (None if not cached)."""
+        with self._meta_lock:
+            if key not in self._meta_cache:
+                return None
+            self._meta_cache.move_to_end(key)
+            return self._meta_cache[key]
+
+    def _cache_metadata(self, key, metadata, fielddata):
+        """Cache the metadata of a file signature (the least recently used are dropped)."""
+        if key is None:
+            return
+        with self._meta_lock:
+            self._meta_cache[key] = (metadata, fielddata)
+            self._meta_cache.move_to_end(key)
+            while len(self._meta_cache) > _META_CACHE_SIZE:
+                self._meta_cache.popitem(last=False)
+
+    def _run_r_script(self, script, *args):
+        """Run one of the R scripts in a new R process (and wait for it)."""
+        r_script = os.path.join(_RFA_SCRIPTS_DIR, script)
+        subprocess.call([os.path.join(IO._get_rbin(), 'Rscript'), r_script,
+                         *[str(arg) for arg in args]])
+
+    async def _arun_r_script(self, script, *args):
+        """Run one of the R scripts in a new R process (killed when cancelled)."""
+        r_script = os.path.join(_RFA_SCRIPTS_DIR, script)
+        await aio.run_subprocess(os.path.join(IO._get_rbin(), 'Rscript'), r_script,
+                                 *[str(arg) for arg in args])
+
+
+# =============================================================================
+# Warm R worker backend
+# =============================================================================
+
+class RworkerBackend(RscriptBackend):
+    """
+    Decode FA files with RFa, in one R process that is kept alive.
+
+    The R process (fa_worker.R) loads R and the libraries once and runs the
+    same R scripts as the 'rscript' backend for each request, so the startup
+    time of R is not paid for every file. Useful when many files are decoded
+    one after the other (e.g. when watching a directory).
+    """
+
+    name = 'rworker'
+
+    def __init__(self):
+        super().__init__()
+        self._process = None
+        self._lock = threading.Lock() # one request at a time (e.g. dask threads)
+        self._async_locks = weakref.WeakKeyDictionary() # event loop: lock of the worker
+        atexit.register(self.close) # do not leave the R process behind
+
+    def __repr__(self):
+        running = (self._process is not None) and (self._process.poll() is None)
+        return f'RworkerBackend(running={running})'
+
+    def close(self):
+        """Stop the R worker process (it is restarted when needed)."""
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            try:
+                self._process.stdin.write('quit\n')
+                self._process.stdin.flush()
+                self._process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self._process.kill()
+                self._process.wait()
+        self._process = None
+
+    def _kill(self):
+        """Kill the R worker process (e.g. when a request is cancelled)."""
+        process = self._process
+        if (process is not None) and (process.poll() is None):
+            process.kill()
+            process.wait()
+        self._process = None
+
+    def _start_worker(self):
+        """Start the R worker process if it is not running."""
+        if (self._process is not None) and (self._process.poll() is None):
+            return self._process
+        with profiling.stage('rworker_start'):
+            self._process = subprocess.Popen([os.path.join(IO._get_rbin(), 'Rscript'),
+                                              os.path.join(_RFA_SCRIPTS_DIR, 'fa_worker.R')],
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE,
+                                             text=True,
+                                             bufsize=1)
+        return self._process
+
+    def _run_r_script(self, script, *args):
+        """Run one of the R scripts in the warm R worker (and wait for it)."""
+        with self._lock:
+            process = self._start_worker()
+            process.stdin.write('\t'.join([script] + [str(arg) for arg in args]) + '\n')
+            process.stdin.flush()
+
+            # forward the output of the script, until the worker is done
+            for line in process.stdout:
+                if line.startswith(_WORKER_DONE_MARKER):
+                    if line.split()[-1] != 'ok':
+                        print(f'WARNING: the R worker failed on {script} {args[0]}.')
+                    return
+                print(line, end='')
+
+            # The worker has stopped (crashed), it will be restarted on the next request
+            print(f'WARNING: the R worker stopped while running {script} {args[0]}.')
+            if self._process is process:
+                self._process = None
+
+    async def _arun_r_script(self, script, *args):
+        """Run one of the R scripts in the warm R worker (one request at a time, the worker is killed when cancelled)."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_locks:
+            self._async_locks[loop] = asyncio.Lock()
+        async with self._async_locks[loop]:
+            async with aio.limit():
+                try:
+                    await asyncio.to_thread(self._run_r_script, script, *args)
+                except asyncio.CancelledError:
+                    self._kill() # the running script can not be interrupted otherwise
+                    raise
+
+
+def _records_fit_in_file(offsets, lengths, file_size):
+    """Check that the records (offset and length in bytes) do not overlap and end in the file."""
+    if not file_size:
+        return False
+    end = 0
+    for offset, length in sorted(zip(offsets, lengths)):
+        if (int(offset) < end) or (int(length) <= 0):
+            return False
+        end = int(offset) + int(length)
+    return end <= file_size
+
+
+def _fields_scratch_size(fafile):
+    """The expected size of the scratch files to decode a FA file with RFa."""
+    # The json text of the decoded fields is much larger than the packed FA
+    # file (and a member of an archive is copied to the scratch too)
+    return (_JSON_SIZE_FACTOR + 1) * archive.file_size(fafile)
+
+
+def _write_rfa_attrs(tmpdir, fields, digits=None):
+    """Write the fields to decode (and the json precision) for the R script."""
+    # There is no clean way i found to parse multiple lists as arguments
+    #for an R script. So write them to json, and read them in the Rscript.
+    Rfa_attrs = {'2d_white': list(fields.get('2d', [])),
+                 '3d_white': list(fields.get('3d', [])),
+                 '2d_black': [],
+                 '3d_black': []}
+    if digits is not None:
+        Rfa_attrs['json_digits'] = int(digits)
+
+    Rfa_attr_json=os.path.join(tmpdir, 'Rfa_extra_attrs.json')
+    IO.write_json(datadict=Rfa_attrs,
+                  jsonpath=Rfa_attr_json,
+                  force=True)
+    return Rfa_attr_json
+
+
+def _read_fields_json(fafile, tmpdir):
+    """Read the FA.json file that is written by get_all_fields.R."""
+    jsonfile = os.path.join(tmpdir, "FA.json")
+    if not IO.check_file_exist(jsonfile):
+        sys.exit(f'RFa could not decode {fafile}.')
+    print('Reading json data')
+    with profiling.stage('json_load'):
+        payload = IO.read_json(jsonfile)
+    payload['pyfa_metadata']['filepath'] = [str(fafile)] # not the scratch file of a member
+
+    _add_r_timing(os.path.join(tmpdir, 'timing.json'))
+    return payload
+
+
+def _read_metadata_json(fafile, tmpdir):
+    """Read the metadata.json and fields.json files that are written by get_all_metadata.R."""
+    fields_jsonpath = os.path.join(tmpdir, 'fields.json')
+    metadata_jsonpath = os.path.join(tmpdir, 'metadata.json')
+
+    # Read the json files
+    fielddata = IO.read_json(jsonpath=fields_jsonpath,
+                             to_dataframe=True)
+    metadata = IO.read_json(jsonpath=metadata_jsonpath,
+                            to_dataframe=False)
+    metadata['filepath'] = [str(fafile)] # not the scratch file of a member
+    return metadata, fielddata
+
+
+def _subset_payload(payload, levels=None, window=None):
+    """Subset a decoded payload (reading_fa, and xarray, are only imported when decoding)."""
+    import pyfa_tool.modules.reading_fa as reading_fa
+    return reading_fa.subset_payload(payload, levels=levels, window=window)
+
+
+def _add_r_timing(timing_json):
+    """Add the timings measured in R to the active profiler."""
+    if (profiling.get_active_profiler() is None) | (not IO.check_file_exist(timing_json)):
+        return
+    timing = IO.read_json(timing_json)
+    profiling.add_record('r_startup', wall_time=timing.get('r_startup'),
+                         source='R')
+    # no decoded fields: an empty (unnamed) R list is written as []
+    fadec = timing.get('fadec') or {}
+    if isinstance(fadec, list):
+        fadec = {}
+    for fieldname, seconds in fadec.items():
+        profiling.add_record('fadec', field=fieldname, wall_time=seconds,
+                             source='R')
+    profiling.add_record('r_tojson', wall_time=timing.get('r_tojson'),
+                         source='R')
+    profiling.add_record('r_write_json', wall_time=timing.get('r_write_json'),
+                         source='R')
+
+
+# =============================================================================
+# Synthetic backend
+# =============================================================================
+
+class SyntheticBackend(FaBackend):
+    """
+    Create synthetic FA-like data in-process (no R and no FA files needed).
+
+    Every path is accepted as a FA file. The leadtime (in hours) is taken from
+    the '+NNNN' suffix of the filename (e.g. PFAR07csm07+0002), if present.
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, nx=50, ny=40, nlev=10, n2d=4, n3d=2, npseudo=1,
+                 pseudo_nlev=3, nbits=16, basedate=datetime(2024, 1, 1),
+                 timestep=60, spectral=False):
+        """
+        Initiate a synthetic backend.
+
+        Parameters
+        ----------
+        nx : int, optional
+            Number of points in X. The default is 50.
+        ny : int, optional
+            Number of points in Y. The default is 40.
+        nlev : int, optional
+            Number of model levels. The default is 10.
+        n2d : int, optional
+            The number of 2D fields. The default is 4.
+        n3d : int, optional
+            The number of 3D fields. The default is 2.
+        npseudo : int, optional
+            The number of pseudo 3D fields. The default is 1.
+        pseudo_nlev : int, optional
+            The number of levels of the pseudo 3D fields. The default is 3.
+        nbits : int, optional
+            The packing of all fields. The default is 16.
+        basedate : datetime.datetime, optional
+            The basedate of all files. The default is datetime(2024, 1, 1).
+        timestep : int, optional
+            The model timestep in seconds. The default is 60.
+        spectral : bool, optional
+            If True, the 3D fields are spectral, and returned as spectral
+            coefficients (transformed by PyFa). The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.settings = {'nx': nx, 'ny': ny, 'nlev': nlev, 'n2d': n2d,
+                         'n3d': n3d, 'npseudo': npseudo,
+                         'pseudo_nlev': pseudo_nlev, 'spectral': spectral}
+        self.nbits = nbits
+        self.basedate = basedate
+        self.timestep = timestep
+
+    def __repr__(self):
+        return f'SyntheticBackend({self.settings})'
+
+    def exists(self, fafile):
+        return True
+
+    def list_fields(self, fafile):
+        return pd.DataFrame(synthetic.synthetic_fields_list(nbits=self.nbits,
+                                                            **self.settings))
+
+    def read_metadata(self, fafile):
+        return synthetic.synthetic_metadata(nx=self.settings['nx'],
+                                            ny=self.settings['ny'],
+                                            nlev=self.settings['nlev'],
+                                            basedate=self.basedate,
+                                            leadtime=self._leadtime(fafile),
+                                            timestep=self.timestep,
+                                            filepath=fafile,
+                                            nfields=self.list_fields(fafile).shape[0],
+                                            with_coords=False)
+
+    def read_fields(self, fafile, fields, levels=None, window=None,
+                    digits=None, rm_tmpdir=True):
+        fieldnames = list(fields.get('2d', [])) + list(fields.get('3d', []))
+        with profiling.stage('synthetic_decode'):
+            payload = synthetic.synthetic_fa_payload(basedate=self.basedate,
+                                                     leadtime=self._leadtime(fafile),
+                                                     timestep=self.timestep,
+                                                     filepath=fafile,
+                                                     as_lists=False,
+                                                     seed=_seed_from_path(fafile),
+                                                     fieldnames=fieldnames,
+                                                     **self.settings)
+        return _subset_payload(payload, levels=levels, window=window)
+
+    def record_checksums(self, fafile, fieldnames):
+        # The data only depends on the settings, the seed of the path and the
+        # fieldname (the leadtime is only in the metadata)
+        seed = _seed_from_path(fafile)
+        return {fieldname: f'{sorted(self.settings.items())}|{self.nbits}|{seed}|{fieldname}'
+                for fieldname in fieldnames}
+
+    @staticmethod
+    def _leadtime(fafile):
+        match = re.search(r'\+(\d+)$', os.path.basename(str(fafile)))
+        if match is None:
+            return 0
+        return int(match.group(1))
+
+
+def _seed_from_path(fafile):
+    """Deterministic seed for a path (same file, same data)."""
+    return sum(ord(char) for char in str(fafile)) % (2**16)
+
+
+# =============================================================================
+# Backend registry
+# =============================================================================
+
+_BACKENDS = {RscriptBackend.name: RscriptBackend,
+             RworkerBackend.name: RworkerBackend,
+             SyntheticBackend.name: SyntheticBackend}
+
+_default_backend = {'backend': None}
+_instances = {} # one (shared) instance per backend name
+
+
+def register_backend(name, backend_class):
+    """
+    Make a backend available by name.
+
+    Parameters
+    ----------
+    name : str
+        The name of the backend.
+    backend_class : class
+        A subclass of FaBackend (initiated without arguments).
+
+    Returns
+    -------
+    None.
+
+    """
+    if not issubclass(backend_class, FaBackend):
+        sys.exit(f'{backend_class} is not a subclass of FaBackend.')
+    _BACKENDS[name] = backend_class
+
+
+def set_default_backend(backend):
+    """
+    Set the backend that is used when no backend is specified.
+
+    Parameters
+    ----------
+    backend : str or FaBackend
+        The name of a registered backend, or an instance of a FaBackend.
+
+    Returns
+    -------
+    None.
+
+    """
+    _default_backend['backend'] = get_backend(backend)
+
+
+def get_backend(backend=None):
+    """
+    Get a backend instance.
+
+    Parameters
+    ----------
+    backend : str, FaBackend or None, optional
+        The name of a registered backend, an instance of a FaBackend, or None
+        for the default backend ('rscript' unless changed with
+        set_default_backend()). The default is None.
+
+    Returns
+    -------
+    FaBackend
+        The backend instance.
+
+    """
+    if backend is None:
+        if _default_backend['backend'] is None:
+            _default_backend['backend'] = get_backend(RscriptBackend.name)
+        return _default_backend['backend']
+    if isinstance(backend, FaBackend):
+        return backend
+    if isinstance(backend, str):
+        if backend not in _BACKENDS:
+            sys.exit(f'{backend} is not a known backend. Choose from {list(_BACKENDS.keys())}.')
+        if backend not in _instances:
+            _instances[backend] = _BACKENDS[backend]()
+        return _instances[backend]
+    sys.exit(f'{backend} is not a FaBackend (or name of a backend).')
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch conversion of FA files to netCDF (one netCDF file per FA file).
+
+@author: thoverga
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import pyfa_tool.modules.IO as IO
+import pyfa_tool.modules.backends as backends
+
+
+DEFAULT_OUTPUT_TEMPLATE = os.path.join('{dir}', '{stem}.nc')
+
+
+# =============================================================================
+# Paths
+# =============================================================================
+
+def collect_fa_paths(inputs, filename_regex='*'):
+    """
+    Get all FA file paths from a list of files and/or directories.
+
+    Parameters
+    ----------
+    inputs : list of str
+        Paths to FA files or to directories containing FA files.
+    filename_regex : str, optional
+        Regex expression (unix wildcards) to match the filenames in the
+        directories. The default is '*'.
+
+    Returns
+    -------
+    list
+        Sorted list of (unique) FA file paths.
+
+    """
+    filepaths = []
+    for path in inputs:
+        if IO.check_folder_exist(path):
+            filepaths.extend([f for f in IO.get_paths_using_regex(searchdir=path,
+                                                                  filename_regex=filename_regex)
+                              if IO.check_file_exist(f)])
+        elif IO.check_file_exist(path):
+            filepaths.append(path)
+        else:
+            print(f'WARNING: {path} is not a file or directory, and is skipped.')
+    return sorted(set(os.path.abspath(f) for f in filepaths))
+
+
+def format_target_path(fafile, output_template=DEFAULT_OUTPUT_TEMPLATE):
+    """
+    Construct the path of the netCDF file for a FA file.
+
+    Parameters
+    ----------
+    fafile : str
+        Path of the FA file.
+    output_template : str, optional
+        Template of the netCDF path. Available fields are {dir} (directory of
+        the FA file), {parent} (name of that directory), {name} (filename of
+        the FA file) and {stem} (filename without suffix). The '.nc'
+        extension is added if not present. The default is '{dir}/{stem}.nc'.
+
+    Returns
+    -------
+    str
+        Path of the netCDF file.
+
+    """
+    fapath = Path(fafile).resolve()
+    target = str(output_template).format(dir=str(fapath.parent),
+                                         parent=fapath.parent.name,
+                                         name=fapath.name,
+                                         stem=fapath.stem)
+    if not target.endswith('.nc'):
+        target = target + '.nc'
+    return os.path.abspath(target)
+
+
+def is_up_to_date(fafile, target):
+    """Check if the netCDF target exists and is newer than the FA file."""
+    if not IO.check_file_exist(target):
+        return False
+    return os.path.getmtime(target) >= os.path.getmtime(fafile)
+
+
+# =============================================================================
+# Conversion
+# =============================================================================
+
+def _convert_one(fafile, target, backend=None, import_kwargs={}, save_kwargs={}):
+    """Convert one FA file to netCDF and return the outcome (never raises)."""
+    from pyfa_tool.dataset import FaDataset
+
+    start = time.perf_counter()
+    outcome = {'file': fafile, 'output': target, 'status': 'converted',
+               'duration': None, 'error': ''}
+    try:
+        dataset = FaDataset(fafile, backend=backend)
+        dataset.import_fa(**import_kwargs)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        dataset.save_nc(outputfolder=os.path.dirname(target),
+                        filename=os.path.basename(target),
+                        overwrite=True,
+                        **save_kwargs)
+    except (Exception, SystemExit) as e:
+        # PyFa uses sys.exit() for errors, so catch SystemExit as well
+        outcome['status'] = 'failed'
+        outcome['error'] = f'{type(e).__name__}: {e}'
+    outcome['duration'] = time.perf_counter() - start
+    return outcome
+
+
+def convert_batch(filepaths, output_template=DEFAULT_OUTPUT_TEMPLATE, n_jobs=1,
+                  skip_up_to_date=True, backend=None, save_kwargs={},
+                  **import_kwargs):
+    """
+    Convert FA files to netCDF, one netCDF file per FA file, in parallel.
+
+    Parameters
+    ----------
+    filepaths : list of str
+        Paths of the FA files.
+    output_template : str, optional
+        Template of the netCDF paths (see format_target_path()). The default
+        is '{dir}/{stem}.nc'.
+    n_jobs : int, optional
+        Number of files that are converted in parallel (processes). The
+        default is 1.
+    skip_up_to_date : bool, optional
+        If True, FA files with a netCDF file that is newer than the FA file
+        are skipped. The default is True.
+    backend : str or FaBackend, optional
+        The backend used to decode the FA files. If None, the default backend
+        is used. The default is None.
+    save_kwargs : dict, optional
+        Kwargs passed to the FaDataset.save_nc() method. The default is {}.
+    **import_kwargs :
+        Kwargs passed to the FaDataset.import_fa() method (whitelist,
+        reproj, target_epsg, dtype, ...).
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        One row per FA file with the output path, the status ('converted',
+        'skipped' or 'failed'), the duration (in seconds, NaN if the worker
+        process died) and the error.
+
+    """
+    targets = {fafile: format_target_path(fafile, output_template) for fafile in filepaths}
+
+    # Multiple FA files writing to the same target is a template error
+    if len(set(targets.values())) < len(targets):
+        sys.exit(f'The output template {output_template} gives the same netCDF path for multiple FA files.')
+
+    outcomes = []
+    todo = []
+    for fafile, target in targets.items():
+        if skip_up_to_date and is_up_to_date(fafile, target):
+            outcomes.append({'file': fafile, 'output': target, 'status': 'skipped',
+                             'duration': 0., 'error': ''})
+        else:
+            todo.append(fafile)
+
+    if bool(todo) and isinstance(backends.get_backend(backend), backends.RscriptBackend):
+        # Look up the R installation once, before starting the workers
+        IO._get_rbin()
+
+    if (n_jobs is None) or (n_jobs <= 1) or (len(todo) <= 1):
+        for fafile in todo:
+            outcome = _convert_one(fafile, targets[fafile], backend=backend,
+                                   import_kwargs=import_kwargs,
+                                   save_kwargs=save_kwargs)
+            _print_outcome(outcome)
+            outcomes.append(outcome)
+    else:
+        with ProcessPoolExecutor(max_workers=int(n_jobs)) as executor:
+            futures = {executor.submit(_convert_one, fafile, targets[fafile],
+                                       backend, import_kwargs, save_kwargs): fafile
+                       for fafile in todo}
+            for future in as_completed(futures):
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    # The worker died (e.g. killed when out of memory, this
+                    # breaks the pool and fails all unfinished files) or the
+                    # outcome could not be sent back.
+                    fafile = futures[future]
+                    outcome = {'file': fafile, 'output': targets[fafile],
+                               'status': 'failed', 'duration': float('nan'),
+                               'error': f'{type(e).__name__}: {e}'}
+                _print_outcome(outcome)
+                outcomes.append(outcome)
+
+    summary = pd.DataFrame(outcomes, columns=['file', 'output', 'status',
+                                              'duration', 'error'])
+    return summary.sort_values('file').reset_index(drop=True)
+
+
+def _print_outcome(outcome):
+    print(f"{outcome['status'].upper()}: {outcome['file']} ({outcome['duration']:.1f}s)")
+
+
+def print_summary(summary):
+    """
+    Print out the summary table of a batch conversion.
+
+    Parameters
+    ----------
+    summary : pandas.DataFrame
+        The summary returned by convert_batch().
+
+    Returns
+    -------
+    None.
+
+    """
+    table = summary.copy()
+    table['file'] = [os.path.basename(f) for f in table['file']]
+    table['duration'] = table['duration'].map(lambda x: f'{x:.1f}s')
+
+    print('\n########## Batch conversion ######### \n')
+    with pd.option_context('display.max_rows', None,
+                           'display.max_colwidth', 80,
+                           'display.width', 200):
+        print(table[['file', 'status', 'duration', 'output', 'error']].to_string(index=False))
+
+    counts = summary['status'].value_counts()
+    print(f"\n{counts.get('converted', 0)} converted, {counts.get('skipped', 0)} skipped (up to date), {counts.get('failed', 0)} failed.")
+    print(f"Total conversion time: {summary['duration'].sum():.1f}s")
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catalogue (inventory) of the content of many FA files.
+
+A catalogue is a table with one row per file and field (2D fieldname, or
+basename for 3D and pseudo 3D fields). It holds the time information, the
+geometry, the packing and the levels of each field, so imports can be planned
+without reading the FA files again.
+
+@author: thoverga
+"""
+
+import os
+import sys
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import pyfa_tool.modules.describe_module as describe_module
+
+
+# The columns of a catalogue (in this order)
+CATALOGUE_COLUMNS = ['file', 'field', 'kind', 'full_name', 'validate',
+                     'basedate', 'leadtime', 'timestep', 'geometry', 'nx',
+                     'ny', 'nbits', 'spectral', 'nlevels', 'levels', 'origin',
+                     'min', 'max', 'mean', 'n_nan']
+
+# The statistics of fields that were not decoded before
+_NO_STATS = {'min': float('nan'), 'max': float('nan'), 'mean': float('nan'),
+             'n_nan': float('nan')}
+
+# The metadata that defines the horizontal geometry of a FA file
+_GEOMETRY_KEYS = ['projection', 'lon_0', 'lat_1', 'lat_2', 'proj_R', 'nx',
+                  'ny', 'dx', 'dy', 'ex', 'ey', 'center_lon', 'center_lat']
+
+
+# =============================================================================
+# Describing files
+# =============================================================================
+
+def metadata_geometry_hash(metadata):
+    """
+    Create a hash that identifies the horizontal geometry of a FA file.
+
+    Parameters
+    ----------
+    metadata : dict
+        The metadata of a FA file (FaFile.metadata).
+
+    Returns
+    -------
+    str
+        The hash of the geometry.
+
+    """
+    geometry = '|'.join([f'{key}={metadata[key][0]}' for key in _GEOMETRY_KEYS
+                         if key in metadata])
+    return hashlib.sha1(geometry.encode()).hexdigest()[:12]
+
+
+def describe_file(fafile, backend=None):
+    """
+    Describe the content of one FA file as catalogue rows.
+
+    Parameters
+    ----------
+    fafile : str
+        Path of the FA file.
+    backend : str or FaBackend, optional
+        The backend used to read the FA file. If None, the default backend is
+        used. The default is None.
+
+    Returns
+    -------
+    list
+        A list of dictionaries, one for each field (see CATALOGUE_COLUMNS).
+
+    """
+    from pyfa_tool.file import FaFile
+
+    return _describe_fafile(FaFile(fafile, backend=backend))
+
+
+def _describe_fafile(FA):
+    """Describe the content of a FaFile as catalogue rows (see describe_file())."""
+    fafile = FA.fafile
+    metadata = FA.metadata
+
+    validate = describe_module._str_to_dt(metadata['validate'][0])
+    basedate = describe_module._str_to_dt(metadata['basedate'][0])
+    file_info = {'file': os.path.abspath(str(fafile)) if os.path.exists(str(fafile)) else str(fafile),
+                 'validate': validate,
+                 'basedate': basedate,
+                 'leadtime': (validate - basedate).total_seconds() / 3600.,
+                 'timestep': int(metadata['timestep'][0]) if str(metadata['timestep'][0]) != '' else 0,
+                 'geometry': metadata_geometry_hash(metadata),
+                 'nx': int(metadata['nx'][0]),
+                 'ny': int(metadata['ny'][0]),
+                 'origin': str(metadata['origin'][0])}
+
+    multi_lvl_fields, single_lvl_fields, pseudo_lvl_fields = describe_module._split_fields(
+        fieldslist=FA.fielddf.to_dict('records'),
+        d2_list=FA._pure_2d_fieldnames,
+        d3_list=FA._pure_3d_fieldnames,
+        pseudo_list=FA._pure_pseudo_3d_fieldnames)
+
+    # The packing and spectral flag of the 3D fields is taken over all levels
+    nbits = FA._get_nbits_per_fieldname()
+    spectral = _get_spectral_per_fieldname(FA)
+    # The statistics of the fields (if they were decoded before)
+    stats = _get_stats_per_fieldname(FA)
+
+    rows = []
+    for field in single_lvl_fields:
+        name = field['name'].strip()
+        rows.append({**file_info, 'field': name, 'kind': '2d', 'full_name': name,
+                     'nbits': nbits.get(name), 'spectral': spectral.get(name),
+                     'nlevels': 1, 'levels': '', **stats.get(name, _NO_STATS)})
+    for kind, fields in [('3d', multi_lvl_fields), ('pseudo_3d', pseudo_lvl_fields)]:
+        for basename, field in fields.items():
+            basename = basename.strip()
+            levels = sorted(field['levels'])
+            rows.append({**file_info, 'field': basename, 'kind': kind,
+                         'full_name': field['full_name'],
+                         'nbits': nbits.get(basename),
+                         'spectral': spectral.get(basename),
+                         'nlevels': len(levels),
+                         'levels': ','.join([str(lev) for lev in levels]),
+                         **stats.get(basename, _NO_STATS)})
+    return rows
+
+
+def _get_spectral_per_fieldname(FA):
+    """Get the spectral flag of all fields and 3D basenames (True if any level is spectral)."""
+    if 'spectral' not in FA.fielddf.columns:
+        return {}
+    spectral = {}
+    for name, is_spectral in zip(FA.fielddf['name'], FA.fielddf['spectral']):
+        is_spectral = bool(is_spectral)
+        spectral[name] = spectral.get(name, False) | is_spectral
+        if (name in FA._pure_3d_fieldnames) or (name in FA._pure_pseudo_3d_fieldnames):
+            basename = name[4:].strip()
+            spectral[basename] = spectral.get(basename, False) | is_spectral
+    return spectral
+
+
+def _get_stats_per_fieldname(FA):
+    """Get the stored statistics of all fields and 3D basenames (over all levels)."""
+    if 'n_points' not in FA.fielddf.columns:
+        return {}
+    known = FA.fielddf[FA.fielddf['n_points'].notna()].copy()
+    if known.empty:
+        return {}
+
+    multilevel = known['name'].isin(FA._pure_3d_fieldnames + FA._pure_pseudo_3d_fieldnames)
+    known['field'] = [name[4:].strip() if is_multi else name
+                      for name, is_multi in zip(known['name'], multilevel)]
+    known['weighted_sum'] = known['mean'] * (known['n_points'] - known['n_nan'])
+    known['n_valid'] = known['n_points'] - known['n_nan']
+    per_field = known.groupby('field').agg(min=('min', 'min'),
+                                           max=('max', 'max'),
+                                           weighted_sum=('weighted_sum', 'sum'),
+                                           n_valid=('n_valid', 'sum'),
+                                           n_nan=('n_nan', 'sum'),
+                                           nlevels=('name', 'size'))
+    # only use the statistics if all levels are known
+    nlevels = FA.fielddf.assign(field=[name[4:].strip() if name in set(FA._pure_3d_fieldnames + FA._pure_pseudo_3d_fieldnames)
+                                       else name for name in FA.fielddf['name']]).groupby('field').size()
+    stats = {}
+    for field, row in per_field.iterrows():
+        if row['nlevels'] != nlevels.get(field):
+            continue
+        stats[field] = {'min': row['min'], 'max': row['max'],
+                        'mean': row['weighted_sum'] / row['n_valid'] if row['n_valid'] > 0 else float('nan'),
+                        'n_nan': int(row['n_nan'])}
+    return stats
+
+
+def _describe_file_or_warn(fafile, backend=None):
+    """Describe a file, or return an empty list (and the error) if it fails."""
+    try:
+        return describe_file(fafile, backend=backend), ''
+    except (Exception, SystemExit) as e:
+        # PyFa uses sys.exit() for errors, so catch SystemExit as well
+        return [], f'{type(e).__name__}: {e}'
+
+
+def _future_result_or_error(future):
+    """Get the result of a _describe_file_or_warn() future, also if the worker died."""
+    try:
+        return future.result()
+    except Exception as e:
+        # e.g. BrokenProcessPool, when a worker is killed (out of memory)
+        return [], f'{type(e).__name__}: {e}'
+
+
+# =============================================================================
+# Building catalogues
+# =============================================================================
+
+def build_catalogue(filepaths, n_jobs=1, backend=None):
+    """
+    Describe many FA files (in parallel) into one catalogue table.
+
+    Parameters
+    ----------
+    filepaths : list of str
+        Paths of the FA files.
+    n_jobs : int, optional
+        Number of files that are described in parallel (processes). The
+        default is 1.
+    backend : str or FaBackend, optional
+        The backend used to read the FA files. If None, the default backend is
+        used. The default is None.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The catalogue, one row per file and field (see CATALOGUE_COLUMNS),
+        sorted by validate, file and field.
+
+    """
+    rows = []
+    if (n_jobs is None) or (n_jobs <= 1) or (len(filepaths) <= 1):
+        results = [(fafile, _describe_file_or_warn(fafile, backend)) for fafile in filepaths]
+    else:
+        with ProcessPoolExecutor(max_workers=int(n_jobs)) as executor:
+            futures = [executor.submit(_describe_file_or_warn, fafile, backend)
+                       for fafile in filepaths]
+            results = [(fafile, _future_result_or_error(future))
+                       for fafile, future in zip(filepaths, futures)]
+
+    for fafile, (filerows, error) in results:
+        if error != '':
+            print(f'WARNING: {fafile} is not added to the catalogue: {error}')
+        rows.extend(filerows)
+
+    catalogue = pd.DataFrame(rows, columns=CATALOGUE_COLUMNS)
+    return catalogue.sort_values(['validate', 'file', 'field']).reset_index(drop=True)
+
+
+def write_catalogue(catalogue, path):
+    """
+    Write a catalogue to a Parquet (.parquet) or CSV (.csv) file.
+
+    Parameters
+    ----------
+    catalogue : pandas.DataFrame
+        The catalogue.
+    path : str
+        The target file, the format is derived from the extension.
+
+    Returns
+    -------
+    None.
+
+    """
+    if str(path).endswith('.parquet'):
+        try:
+            catalogue.to_parquet(path, index=False)
+        except ImportError:
+            sys.exit('Writing Parquet files requires pyarrow (or fastparquet), or use a .csv file.')
+    elif str(path).endswith('.csv'):
+        catalogue.to_csv(path, index=False)
+    else:
+        sys.exit(f'{path} is not a .parquet or .csv file.')
+    print(f'Catalogue saved to {path}')
+
+
+def read_catalogue(path):
+    """
+    Read a catalogue from a Parquet (.parquet) or CSV (.csv) file.
+
+    Parameters
+    ----------
+    path : str
+        The catalogue file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The catalogue.
+
+    """
+    if not os.path.isfile(path):
+        sys.exit(f'{path} does not exist.')
+    if str(path).endswith('.parquet'):
+        try:
+            catalogue = pd.read_parquet(path)
+        except ImportError:
+            sys.exit('Reading Parquet files requires pyarrow (or fastparquet).')
+    elif str(path).endswith('.csv'):
+        catalogue = pd.read_csv(path, parse_dates=['validate', 'basedate'],
+                                dtype={'levels': str, 'geometry': str},
+                                keep_default_na=False,
+                                na_values={col: [''] for col in ['nbits', 'min', 'max', 'mean', 'n_nan']})
+    else:
+        sys.exit(f'{path} is not a .parquet or .csv file.')
+    return catalogue
+
+
+# =============================================================================
+# Planning imports
+# =============================================================================
+
+def plan_imports(catalogue, whitelist=None, start=None, end=None):
+    """
+    Select the FA files (and fields) to import from a catalogue.
+
+    Parameters
+    ----------
+    catalogue : pandas.DataFrame or str
+        The catalogue, or the path of a catalogue file.
+    whitelist : list, optional
+        The fields (2D fieldnames or 3D basenames) to import. If None, all
+        fields are imported. The default is None.
+    start : datetime-like, optional
+        Only files with a validate at or after start are selected. The default
+        is None.
+    end : datetime-like, optional
+        Only files with a validate at or before end are selected. The default
+        is None.
+
+    Returns
+    -------
+    dict
+        The paths of the FA files (ordered by validate) as keys and the
+        whitelist to import as values (None for all fields).
+
+    """
+    if isinstance(catalogue, str):
+        catalogue = read_catalogue(catalogue)
+
+    selection = catalogue
+    if start is not None:
+        selection = selection[selection['validate'] >= pd.Timestamp(start)]
+    if end is not None:
+        selection = selection[selection['validate'] <= pd.Timestamp(end)]
+    if whitelist is not None:
+        if isinstance(whitelist, str):
+            whitelist = [whitelist]
+        selection = selection[selection['field'].isin(whitelist)]
+    if selection.empty:
+        sys.exit('No FA files in the catalogue match the selection.')
+
+    # Combining is only possible on one geometry
+    if selection['geometry'].nunique() > 1:
+        sys.exit(f'The selected FA files have different geometries: {list(selection["geometry"].unique())}')
+
+    plan = {}
+    for fafile, filerows in selection.sort_values(['validate', 'file']).groupby('file', sort=False):
+        if whitelist is None:
+            plan[fafile] = None
+            continue
+        missing = set(whitelist) - set(filerows['field'])
+        if bool(missing):
+            print(f'WARNING: {sorted(missing)} not found in {fafile}.')
+
+        fields = []
+        for _idx, row in filerows.iterrows():
+            if row['kind'] == 'pseudo_3d':
+                # pseudo 3D fields are imported level by level
+                fields.extend([f'S{int(lev):03d}{row["field"]}' for lev in str(row['levels']).split(',')])
+            else:
+                fields.append(row['field'])
+        plan[fafile] = fields
+    return plan
+
+
+def print_catalogue_summary(catalogue):
+    """
+    Print out an overview (one line per file) of a catalogue.
+
+    Parameters
+    ----------
+    catalogue : pandas.DataFrame
+        The catalogue.
+
+    Returns
+    -------
+    None.
+
+    """
+    summary = catalogue.groupby('file', sort=False).agg(
+        validate=('validate', 'first'),
+        leadtime=('leadtime', 'first'),
+        geometry=('geometry', 'first'),
+        n2d=('kind', lambda kind: int((kind == '2d').sum())),
+        n3d=('kind', lambda kind: int((kind == '3d').sum())),
+        npseudo3d=('kind', lambda kind: int((kind == 'pseudo_3d').sum())))
+    summary.index = [os.path.basename(f) for f in summary.index]
+
+    print('\n########## Catalogue ######### \n')
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summary)
+    print(f"\n{summary.shape[0]} files, {catalogue['field'].nunique()} distinct fields, {catalogue['geometry'].nunique()} geometries.")
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Field-by-field comparison of two FA files (e.g. for cycle regression checks).
+
+The fields of both files are matched with their catalogue rows, and each pair
+of fields is decoded and compared before the next pair is read, so only one
+field of each file is in memory. The (packed) records are checked first: when
+the backend can read them, fields with bit-identical records are not decoded.
+Decoded fields that are bit-identical are detected before the statistics are
+computed.
+
+@author: thoverga
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+import pyfa_tool.modules.catalogue as catalogue
+import pyfa_tool.modules.profiling as profiling
+
+
+# The columns of a comparison report (in this order). n_points is the number
+# of points that are valid (not NaN) in both files for decoded fields, and the
+# number of grid points for fields with identical records (not decoded).
+COMPARE_COLUMNS = ['field', 'kind', 'level', 'status', 'max_abs_diff', 'rmse',
+                   'mean_diff', 'n_points']
+
+# Metadata that is expected to differ between two files
+_IGNORED_METADATA = ['filepath', 'xcoords', 'ycoords']
+
+
+# =============================================================================
+# Matching
+# =============================================================================
+
+def match_fields(rows_a, rows_b, fields=None):
+    """
+    Match the fields of two FA files by their catalogue rows.
+
+    Parameters
+    ----------
+    rows_a : list
+        The catalogue rows of the first file (see catalogue.describe_file()).
+    rows_b : list
+        The catalogue rows of the second file.
+    fields : list, optional
+        Only match these fields (2D fieldnames or 3D basenames). If None, all
+        fields are matched. The default is None.
+
+    Returns
+    -------
+    matched : list
+        (name, kind, names to decode) of the fields in both files. The names
+        to decode are the fieldname for 2D fields, the basename for 3D fields
+        and the levels (S00xNAME) of the pseudo 3D fields that are in both
+        files.
+    only_a : list
+        The fields only in the first file.
+    only_b : list
+        The fields only in the second file.
+
+    """
+    by_name_a = {row['field']: row for row in rows_a}
+    by_name_b = {row['field']: row for row in rows_b}
+    if fields is not None:
+        by_name_a = {name: row for name, row in by_name_a.items() if name in fields}
+        by_name_b = {name: row for name, row in by_name_b.items() if name in fields}
+
+    matched = []
+    only_a = sorted(set(by_name_a) - set(by_name_b))
+    only_b = sorted(set(by_name_b) - set(by_name_a))
+    for name in sorted(set(by_name_a) & set(by_name_b)):
+        row_a, row_b = by_name_a[name], by_name_b[name]
+        if row_a['kind'] != row_b['kind']:
+            # e.g. a 3D field in one file and a pseudo 3D field in the other
+            only_a.append(name)
+            only_b.append(name)
+            continue
+        if row_a['kind'] == 'pseudo_3d':
+            levels_a = set(str(row_a['levels']).split(','))
+            levels_b = set(str(row_b['levels']).split(','))
+            for lev in sorted(levels_a ^ levels_b, key=int):
+                (only_a if lev in levels_a else only_b).append(f'S{int(lev):03d}{name}')
+            names = [f'S{int(lev):03d}{name}' for lev in sorted(levels_a & levels_b, key=int)]
+        else:
+            names = [name]
+        matched.append((name, row_a['kind'], names))
+    return matched, sorted(only_a), sorted(only_b)
+
+
+def compare_metadata(metadata_a, metadata_b):
+    """
+    Find the metadata that differs between two FA files.
+
+    Parameters
+    ----------
+    metadata_a : dict
+        The metadata of the first file (FaFile.metadata).
+    metadata_b : dict
+        The metadata of the second file.
+
+    Returns
+    -------
+    dict
+        key: (value in a, value in b) for all keys that differ.
+
+    """
+    differences = {}
+    for key in sorted(set(metadata_a) | set(metadata_b)):
+        if key in _IGNORED_METADATA:
+            continue
+        val_a = metadata_a.get(key)
+        val_b = metadata_b.get(key)
+        if list(np.atleast_1d(val_a)) != list(np.atleast_1d(val_b)):
+            differences[key] = (val_a, val_b)
+    return differences
+
+
+# =============================================================================
+# Comparing fields
+# =============================================================================
+
+def compare_arrays(values_a, values_b):
+    """
+    Compare two arrays per level (all axes but the last two are kept).
+
+    Parameters
+    ----------
+    values_a : numpy.array
+        The values of the first file, (level,) y, x. This array is
+        overwritten with the difference.
+    values_b : numpy.array
+        The values of the second file (same shape).
+
+    Returns
+    -------
+    dict
+        'identical' (bool per level), 'max_abs_diff', 'rmse', 'mean_diff'
+        and 'n_points' (per level).
+
+    """
+    if values_a.shape != values_b.shape:
+        sys.exit(f'The fields have other shapes: {values_a.shape} and {values_b.shape}.')
+    spatial = (-2, -1)
+    nlevels = values_a.shape[:-2]
+
+    # Bit-identical (NaN at the same places) is checked first
+    if values_a.dtype == values_b.dtype and np.array_equal(values_a, values_b, equal_nan=True):
+        n_points = np.count_nonzero(~np.isnan(values_a), axis=spatial)
+        return {'identical': np.ones(nlevels, dtype=bool),
+                'max_abs_diff': np.zeros(nlevels),
+                'rmse': np.zeros(nlevels),
+                'mean_diff': np.zeros(nlevels),
+                'n_points': n_points}
+
+    identical = np.all((values_a == values_b) | (np.isnan(values_a) & np.isnan(values_b)),
+                       axis=spatial)
+    # the difference is computed in place
+    diff = np.subtract(values_a, values_b, out=values_a, casting='unsafe')
+    valid = ~np.isnan(diff)
+    n_points = np.count_nonzero(valid, axis=spatial)
+    diff[~valid] = 0.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = {'identical': identical,
+                  'max_abs_diff': np.max(np.abs(diff), axis=spatial, initial=0.),
+                  'rmse': np.sqrt(np.sum(diff * diff, axis=spatial) / n_points),
+                  'mean_diff': np.sum(diff, axis=spatial) / n_points,
+                  'n_points': n_points}
+    return result
+
+
+def _record_names(FA, name, kind):
+    """The fieldnames of the records of a field (the levels for a 3D field)."""
+    if kind == '3d':
+        return sorted([fieldname for fieldname in FA._pure_3d_fieldnames
+                       if fieldname[4:].strip() == name])
+    return [name]
+
+
+def _identical_records(FA_a, FA_b, name, kind):
+    """
+    Check if the records of a field are bit-identical in both files (without decoding).
+
+    Returns the levels (None for 2D fields) if all records are identical, and
+    False if they are not (or if the records can not be read).
+    """
+    names_a = _record_names(FA_a, name, kind)
+    if (not bool(names_a)) or (names_a != _record_names(FA_b, name, kind)):
+        return False
+    checksums_a = FA_a.backend.record_checksums(FA_a.fafile, names_a)
+    if len(checksums_a) != len(names_a):
+        return False
+    checksums_b = FA_b.backend.record_checksums(FA_b.fafile, names_a)
+    if checksums_a != checksums_b:
+        return False
+    if kind == '3d':
+        return [int(fieldname[1:4]) for fieldname in names_a]
+    return None
+
+
+def _identical_result(FA, levels):
+    """The comparison of bit-identical records (the points are all points of the grid)."""
+    nlevels = () if levels is None else (len(levels),)
+    n_points = int(FA.metadata['nx'][0]) * int(FA.metadata['ny'][0])
+    return {'identical': np.ones(nlevels, dtype=bool),
+            'max_abs_diff': np.zeros(nlevels),
+            'rmse': np.zeros(nlevels),
+            'mean_diff': np.zeros(nlevels),
+            'n_points': np.full(nlevels, n_points)}
+
+
+def _decode_field(FA, name, kind, backend=None):
+    """Decode one field (or the levels of a 3D field) of a FaFile to (levels, values)."""
+    import pyfa_tool.modules.reading_fa as reading_fa
+
+    fields = {'2d': [], '3d': []}
+    fields['3d' if kind == '3d' else '2d'].append(name)
+    backend = FA.backend if backend is None else backend
+    payload = backend.read_fields(FA.fafile, fields=fields)
+    payload = reading_fa.spectral_payload_to_gridpoint(payload)
+
+    metadata = payload['pyfa_metadata']
+    key = [key for key in payload.keys() if key != 'pyfa_metadata'][0]
+    if payload[key]['type'] == ['3d']:
+        levels = reading_fa._get_levels(metadata, int(metadata['nlev'][0]))
+        return levels, reading_fa._fmt_3d_field_to_matrix(payload[key]['data'],
+                                                          dtype=np.float64)
+    return None, reading_fa._fmt_2d_field_to_matrix(payload[key]['data'],
+                                                    xcoords=np.asarray(metadata['xcoords']),
+                                                    dtype=np.float64)
+
+
+def compare_fafiles(FA_a, FA_b, fields=None, backend=None):
+    """
+    Compare the fields of two FA files, one pair of fields at a time.
+
+    The records of a field are compared first (see
+    FaBackend.record_checksums()), fields with bit-identical records are not
+    decoded. Their number of points is the size of the grid (NaN points are
+    not counted for the decoded fields).
+
+    Parameters
+    ----------
+    FA_a : FaFile
+        The first (reference) FA file.
+    FA_b : FaFile
+        The second FA file.
+    fields : list, optional
+        Only compare these fields (2D fieldnames or 3D basenames). If None,
+        all fields are compared. The default is None.
+    backend : FaBackend, optional
+        The backend that decodes the fields. If None, the backends of the
+        FaFiles are used. The default is None.
+
+    Returns
+    -------
+    report : pandas.DataFrame
+        One row per field (and per level for 3D fields), see COMPARE_COLUMNS.
+        The status is 'identical', 'different', 'only_in_a' or 'only_in_b'.
+    metadata_diff : dict
+        The metadata that differs (see compare_metadata()).
+
+    """
+    if isinstance(fields, str):
+        fields = [fields]
+    rows_a = catalogue._describe_fafile(FA_a)
+    rows_b = catalogue._describe_fafile(FA_b)
+    if rows_a and rows_b and (rows_a[0]['geometry'] != rows_b[0]['geometry']):
+        sys.exit(f'{FA_a.fafile} and {FA_b.fafile} have other geometries, they can not be compared field by field.')
+
+    matched, only_a, only_b = match_fields(rows_a, rows_b, fields=fields)
+    if fields is not None:
+        not_found = set(fields) - set([row['field'] for row in rows_a + rows_b])
+        if bool(not_found):
+            print(f'WARNING: {sorted(not_found)} not found in {FA_a.fafile} nor in {FA_b.fafile}.')
+
+    report = []
+    for name, kind, names in matched:
+        for fieldname in names:
+            with profiling.stage('compare_field', field=fieldname):
+                levels = _identical_records(FA_a, FA_b, fieldname, kind)
+                if levels is not False:
+                    result = _identical_result(FA_a, levels)
+                else:
+                    levels, values_a = _decode_field(FA_a, fieldname, kind, backend=backend)
+                    _levels_b, values_b = _decode_field(FA_b, fieldname, kind, backend=backend)
+                    result = compare_arrays(values_a, values_b)
+                    del values_a, values_b # only one pair in memory
+
+            report_name = name if kind == '3d' else fieldname
+            if levels is None:
+                levels = [None]
+                result = {key: np.atleast_1d(val) for key, val in result.items()}
+            for idx, level in enumerate(levels):
+                report.append({'field': report_name, 'kind': kind, 'level': level,
+                               'status': 'identical' if result['identical'][idx] else 'different',
+                               'max_abs_diff': float(result['max_abs_diff'][idx]),
+                               'rmse': float(result['rmse'][idx]),
+                               'mean_diff': float(result['mean_diff'][idx]),
+                               'n_points': int(result['n_points'][idx])})
+
+    for name in only_a:
+        report.append({'field': name, 'status': 'only_in_a'})
+    for name in only_b:
+        report.append({'field': name, 'status': 'only_in_b'})
+
+    report = pd.DataFrame(report, columns=COMPARE_COLUMNS)
+    return report, compare_metadata(FA_a.metadata, FA_b.metadata)
+
+
+def print_comparison(report, metadata_diff=None, fafile_a='a', fafile_b='b'):
+    """
+    Print out an overview of a comparison.
+
+    Parameters
+    ----------
+    report : pandas.DataFrame
+        The comparison report (see compare_fafiles()).
+    metadata_diff : dict, optional
+        The metadata that differs. The default is None.
+    fafile_a : str, optional
+        Name of the first file. The default is 'a'.
+    fafile_b : str, optional
+        Name of the second file. The default is 'b'.
+
+    Returns
+    -------
+    None.
+
+    """
+    print(f'\n########## Comparison ######### \n\n a: {fafile_a}\n b: {fafile_b}\n')
+    if bool(metadata_diff):
+        print('Metadata that differs:')
+        for key, (val_a, val_b) in metadata_diff.items():
+            print(f'  {key}: {val_a} --> {val_b}')
+        print('')
+
+    # one line per field (the maximum over the levels)
+    per_field = report.groupby(['field', 'status'], sort=False, dropna=False).agg(
+        nlevels=('status', 'size'),
+        max_abs_diff=('max_abs_diff', 'max'),
+        rmse=('rmse', 'max')).reset_index()
+    not_identical = per_field[per_field['status'] != 'identical']
+    if not not_identical.empty:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(not_identical.to_string(index=False))
+        print('')
+
+    counts = report.drop_duplicates(['field', 'status'])['status'].value_counts()
+    print(', '.join([f'{counts.get(status, 0)} {status}' for status in
+                     ['identical', 'different', 'only_in_a', 'only_in_b']]) + ' fields.')
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decumulation of accumulated fields (precipitation, fluxes, ...).
+
+Accumulated fields in FA files hold the amount since the basedate. The amount
+over an interval (start, validate] is the difference of the accumulations at
+the validate and at the start, where the accumulation at the basedate is zero.
+
+The differencing is done in place (on the memory of the fields), so no full
+size temporaries are created.
+
+@author: thoverga
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+# Special values of the interval sources
+FROM_BASEDATE = -1 # the interval starts at the basedate (the accumulation is zero)
+MISSING = -2 # the start of the interval is not available
+
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+def _to_period(period, timestep=None):
+    """Convert a period to a pandas.Timedelta and check it against the model timestep."""
+    if period is None:
+        return None
+    period = pd.Timedelta(period)
+    if period <= pd.Timedelta(0):
+        sys.exit(f'The decumulation period must be positive, not {period}.')
+    if (timestep is not None) and (int(timestep) > 0):
+        if period.total_seconds() % int(timestep) != 0:
+            sys.exit(f'The decumulation period ({period}) is not a multiple of the model timestep ({int(timestep)}s).')
+    return period
+
+
+def interval_sources(validates, basedate, period=None):
+    """
+    Find the start of the decumulation interval of each validate.
+
+    Parameters
+    ----------
+    validates : array of datetimes
+        The (increasing) validates of the accumulated fields.
+    basedate : datetime
+        The basedate, the start of the accumulation.
+    period : str or pandas.Timedelta, optional
+        The length of the intervals. If None, each interval starts at the
+        previous validate (or the basedate for the first one). The default is
+        None.
+
+    Returns
+    -------
+    numpy.array
+        For each validate, the index of the validate where the interval
+        starts, FROM_BASEDATE if it starts at the basedate, or MISSING if the
+        start is not available (missing leadtime). The validate at the
+        basedate (+0000) is FROM_BASEDATE (its accumulation, and amount, is
+        zero).
+
+    """
+    validates = pd.DatetimeIndex(validates)
+    basedate = pd.Timestamp(basedate)
+    if not validates.is_monotonic_increasing:
+        sys.exit('The validates must be sorted (increasing) to decumulate.')
+    if (validates < basedate).any():
+        sys.exit(f'Validates before the basedate ({basedate}) can not be decumulated.')
+
+    if period is None:
+        starts = pd.DatetimeIndex([basedate]).append(validates[:-1])
+    else:
+        starts = validates - pd.Timedelta(period)
+
+    sources = validates.get_indexer(starts)
+    sources[sources < 0] = MISSING
+    sources[starts == basedate] = FROM_BASEDATE
+    # nothing is accumulated yet at the basedate
+    sources[validates == basedate] = FROM_BASEDATE
+    return sources
+
+
+def decumulate_inplace(values, sources, axis=0):
+    """
+    Convert accumulations to interval amounts, in place.
+
+    Parameters
+    ----------
+    values : numpy.array
+        The accumulated values (float dtype), overwritten with the interval
+        amounts.
+    sources : numpy.array
+        The start of the interval of each time index (see interval_sources()).
+    axis : int, optional
+        The time axis of values. The default is 0.
+
+    Returns
+    -------
+    list
+        The time indices of the intervals with a missing start (set to NaN).
+
+    """
+    assert np.issubdtype(values.dtype, np.floating), 'Only float fields can be decumulated.'
+    view = np.moveaxis(values, axis, 0) # no copy
+
+    missing = []
+    # From the last to the first, so the start of an interval is not yet
+    # converted when it is subtracted.
+    for idx in range(view.shape[0] - 1, -1, -1):
+        source = sources[idx]
+        if source == FROM_BASEDATE:
+            continue
+        if source == MISSING:
+            view[idx] = np.nan
+            missing.append(idx)
+            continue
+        assert source < idx, 'The start of an interval must be before its end.'
+        view[idx] -= view[source]
+    return sorted(missing)
+
+
+# =============================================================================
+# Streaming
+# =============================================================================
+
+class StreamingDecumulator():
+    """Decumulate fields file by file (in validate order), keeping only the needed history."""
+
+    def __init__(self, period=None, timestep=None):
+        """
+        Initiate a StreamingDecumulator.
+
+        Parameters
+        ----------
+        period : str or pandas.Timedelta, optional
+            The length of the intervals. If None, each interval starts at the
+            previous validate. The default is None.
+        timestep : int, optional
+            The model timestep in seconds, the period must be a multiple of
+            it. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.period = _to_period(period, timestep)
+        self._basedate = None
+        self._history = {} # validate: {fieldname: accumulated values}
+
+    def update(self, validate, basedate, fields):
+        """
+        Decumulate the fields of one validate (in place).
+
+        Parameters
+        ----------
+        validate : datetime
+            The validate of the fields (must be after the validate of the
+            previous update).
+        basedate : datetime
+            The basedate of the fields. If it changes, the history is reset.
+        fields : dict
+            Fieldname: numpy.array (float) with the accumulated values. The
+            arrays are overwritten with the interval amounts.
+
+        Returns
+        -------
+        bool
+            False if the start of the interval is missing (the fields are set
+            to NaN), else True.
+
+        """
+        validate = pd.Timestamp(validate)
+        basedate = pd.Timestamp(basedate)
+        if basedate != self._basedate:
+            self._basedate = basedate
+            self._history = {}
+        if bool(self._history) and (validate <= max(self._history)):
+            sys.exit(f'The validates must be increasing, {validate} comes after {max(self._history)}.')
+
+        if self.period is None:
+            start = max(self._history) if bool(self._history) else basedate
+        elif validate == basedate:
+            start = basedate # nothing is accumulated yet at the basedate
+        else:
+            start = validate - self.period
+
+        # keep a copy of the accumulations for the following intervals
+        accumulations = {name: np.array(values, copy=True) for name, values in fields.items()}
+
+        found = True
+        if start != basedate:
+            previous = self._history.get(start)
+            for name, values in fields.items():
+                assert np.issubdtype(values.dtype, np.floating), 'Only float fields can be decumulated.'
+                if (previous is None) or (name not in previous):
+                    values[...] = np.nan
+                    found = False
+                else:
+                    values -= previous[name]
+
+        self._history[validate] = accumulations
+        self._drop_history(validate)
+        return found
+
+    def _drop_history(self, validate):
+        """Drop the accumulations that are not needed anymore."""
+        if self.period is None:
+            keep = [validate]
+        else:
+            keep = [t for t in self._history if t > validate - self.period]
+        self._history = {t: self._history[t] for t in keep}
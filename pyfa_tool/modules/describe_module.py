@@ -32,6 +32,7 @@ def _split_fields(fieldslist, d2_list, d3_list, pseudo_list):
             else:
                 # just add level to known levels
                 multi_lvl_fields[basis_fieldname]['levels'].append(int(fieldname[1:4]))
+                _merge_level_stats(multi_lvl_fields[basis_fieldname], field)
         elif fieldname in pseudo_list:
             basis_fieldname = fieldname[4:]
             if not basis_fieldname in pseudo_lvl_fields.keys():
@@ -43,31 +44,55 @@ def _split_fields(fieldslist, d2_list, d3_list, pseudo_list):
             else:
                 # just add level to known levels
                 pseudo_lvl_fields[basis_fieldname]['levels'].append(int(fieldname[1:4]))
+                _merge_level_stats(pseudo_lvl_fields[basis_fieldname], field)
 
 
     return multi_lvl_fields, single_lvl_fields, pseudo_lvl_fields
 
 
+def _merge_level_stats(fielddict, levelfield):
+    """Combine the statistics of a level with the statistics of the other levels (3D fields)."""
+    if 'n_nan' not in fielddict:
+        return
+    if not (_has_stats(fielddict) and _has_stats(levelfield)):
+        # only known if the statistics of all levels are known
+        fielddict['n_nan'] = float('nan')
+        return
+    fielddict['min'] = min(fielddict['min'], levelfield['min'])
+    fielddict['max'] = max(fielddict['max'], levelfield['max'])
+    fielddict['n_nan'] = fielddict['n_nan'] + levelfield['n_nan']
+
+
+def _has_stats(fielddict):
+    """Check if the statistics of a field are known (the field was decoded before)."""
+    return ('n_nan' in fielddict) and (fielddict['n_nan'] == fielddict['n_nan']) # NaN if unknown
+
+
 def _print_fields_table(fields_2d, fields_3d, fields_pseudo):
     """ Print out the fields information."""
+    # The statistics are only shown if they are known for some fields
+    with_stats = any([_has_stats(field) for field in
+                      list(fields_2d) + list(fields_3d.values()) + list(fields_pseudo.values())])
+    stats_header = 'min / max / NaNs' if with_stats else ''
+
     # First 2d fields
     print('########## 2D ######### \n')
-    print(f'{"name".ljust(19)}{"index".ljust(8)}{"spectral".ljust(10)}{"nbits".ljust(6)}')
+    print(f'{"name".ljust(19)}{"index".ljust(8)}{"spectral".ljust(10)}{"nbits".ljust(6)}{stats_header}')
     print('------------------------------------------')
     for field in fields_2d:
-        print(_format_2d_field(field))
+        print(_format_2d_field(field) + (_format_stats(field) if with_stats else ''))
 
     print('\n########## 3D ######### \n')
-    print(f'{"Base-name".ljust(19)}{"Full-name example".ljust(19)}{"spectral".ljust(10)}{"nbits".ljust(6)}levels')
+    print(f'{"Base-name".ljust(19)}{"Full-name example".ljust(19)}{"spectral".ljust(10)}{"nbits".ljust(6)}{"levels".ljust(10)}{stats_header}')
     print('-------------------------------------------------------------')
     for field in fields_3d.values():
-        print(_format_3d_field(field))
+        print(_format_3d_field(field) + (_format_stats(field) if with_stats else ''))
 
     print('\n########## Pseudo 3D ######### \n')
-    print(f'{"Base-name".ljust(19)}{"Full-name example".ljust(19)}{"spectral".ljust(10)}{"nbits".ljust(6)}levels')
+    print(f'{"Base-name".ljust(19)}{"Full-name example".ljust(19)}{"spectral".ljust(10)}{"nbits".ljust(6)}{"levels".ljust(10)}{stats_header}')
     print('-------------------------------------------------------------')
     for field in fields_pseudo.values():
-        print(_format_3d_field(field))
+        print(_format_3d_field(field) + (_format_stats(field) if with_stats else ''))
 
 
 def describe_fa_from_json(metadata, fieldslist,
@@ -245,4 +270,11 @@ def _format_3d_field(fielddict):
     except KeyError:
         nbit = 'Unknown'.ljust(4)
 
-    return f"{basename}{fullname}{spctr}{nbit}{levels}"
+    return f"{basename}{fullname}{spctr}{nbit}{str(levels).ljust(10)}"
+
+
+def _format_stats(fielddict):
+    """Text representation of the statistics of a field (over all levels)."""
+    if not _has_stats(fielddict):
+        return '-'
+    return f"{fielddict['min']:.6g} / {fielddict['max']:.6g} / {int(fielddict['n_nan'])}"
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Statistics (min, max, mean and number of NaNs) of the fields of FA files.
+
+The statistics are computed while the decoded fields are in memory anyway (one
+row per FA fieldname, so per level for 3D fields), and are stored in an
+on-disk index per FA file (a csv file in FIELDSTATS_CACHE_DIR, by default
+~/.cache/pyfa/fieldstats, or $PYFA_CACHE_DIR/fieldstats). The index is used
+by FaFile (fielddf), describe and the catalogue, without decoding the fields
+again.
+
+The index is configured with environment variables:
+    * PYFA_FIELDSTATS: set to 0 (or false, no, off) to not compute and store
+      the statistics (see also set_fieldstats()).
+    * PYFA_FIELDSTATS_MAX_FILES: the maximum number of indexes that are kept
+      (the least recently written are removed). The default is 1000.
+
+@author: thoverga
+"""
+
+import os
+import sys
+import tempfile
+import hashlib
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import pyfa_tool.modules.archive as archive
+
+
+FIELDSTATS_CACHE_DIR = os.path.join(os.environ.get('PYFA_CACHE_DIR',
+                                                   os.path.join(os.path.expanduser('~'), '.cache', 'pyfa')),
+                                    'fieldstats')
+
+# The columns of a fieldstats table (in this order)
+FIELDSTATS_COLUMNS = ['name', 'min', 'max', 'mean', 'n_nan', 'n_points']
+
+# The maximum number of indexes (if PYFA_FIELDSTATS_MAX_FILES is not set)
+_DEFAULT_MAX_FILES = 1000
+
+_settings = {'enabled': None} # None: PYFA_FIELDSTATS
+
+
+# =============================================================================
+# Settings
+# =============================================================================
+
+def is_enabled():
+    """Check if the statistics are computed and stored."""
+    if _settings['enabled'] is not None:
+        return _settings['enabled']
+    return os.environ.get('PYFA_FIELDSTATS', '1').strip().lower() not in ['0', 'false', 'no', 'off']
+
+
+def set_fieldstats(enabled):
+    """
+    Turn the computing and storing of the field statistics on or off.
+
+    Parameters
+    ----------
+    enabled : bool or None
+        If False, no statistics are computed nor stored (the stored
+        statistics are still read). If None, the PYFA_FIELDSTATS environment
+        variable is used (on by default).
+
+    Returns
+    -------
+    None.
+
+    """
+    _settings['enabled'] = None if enabled is None else bool(enabled)
+
+
+def get_max_files():
+    """Get the maximum number of indexes that are kept (PYFA_FIELDSTATS_MAX_FILES)."""
+    max_files = os.environ.get('PYFA_FIELDSTATS_MAX_FILES')
+    if not bool(max_files):
+        return _DEFAULT_MAX_FILES
+    if (not max_files.isnumeric()) or (int(max_files) < 1):
+        sys.exit(f'PYFA_FIELDSTATS_MAX_FILES must be a positive number, not {max_files}.')
+    return int(max_files)
+
+
+# =============================================================================
+# Computing
+# =============================================================================
+
+def compute_fieldstats(name, values, levels=None):
+    """
+    Compute the statistics of a decoded field.
+
+    Parameters
+    ----------
+    name : str
+        The fieldname (or the basename of a 3D field).
+    values : numpy.array
+        The values, (y, x) or (level, y, x) if levels is given.
+    levels : list of int, optional
+        The levels of a 3D field, one row per level is created with the FA
+        fieldname (S00xNAME). The default is None.
+
+    Returns
+    -------
+    list
+        A list of dictionaries (see FIELDSTATS_COLUMNS).
+
+    """
+    values = np.asarray(values)
+    flat = values.reshape(values.shape[:-2] + (-1,))
+    n_points = flat.shape[-1]
+
+    n_nan = np.count_nonzero(np.isnan(flat), axis=-1)
+    # fmin/fmax skip NaN, and give NaN (without a warning) if all are NaN
+    mins = np.fmin.reduce(flat, axis=-1)
+    maxs = np.fmax.reduce(flat, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(flat, axis=-1, dtype=np.float64) / (n_points - n_nan)
+
+    if levels is None:
+        names = [name]
+    else:
+        names = [f'S{int(lev):03d}{name}' for lev in levels]
+    mins, maxs, means, n_nan = [np.atleast_1d(arr) for arr in [mins, maxs, means, n_nan]]
+
+    return [{'name': fieldname,
+             'min': float(mins[idx]),
+             'max': float(maxs[idx]),
+             'mean': float(means[idx]),
+             'n_nan': int(n_nan[idx]),
+             'n_points': int(n_points)} for idx, fieldname in enumerate(names)]
+
+
+# =============================================================================
+# On-disk index
+# =============================================================================
+
+def _index_path(fafile):
+    """The path of the index of a FA file (None if it is not a file on disk or in an archive)."""
+    # the size and modification time are part of the key, so a rewritten
+    # FA file gets a new index
+    key = archive.file_signature(fafile)
+    if key is None:
+        return None
+    return os.path.join(FIELDSTATS_CACHE_DIR,
+                        f'{hashlib.sha1(key.encode()).hexdigest()}.csv')
+
+
+def read_fieldstats(fafile):
+    """
+    Read the stored statistics of a FA file.
+
+    Parameters
+    ----------
+    fafile : str
+        The path of the FA file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The statistics (see FIELDSTATS_COLUMNS), empty if nothing is stored.
+
+    """
+    path = _index_path(fafile)
+    if (path is None) or (not os.path.isfile(path)):
+        return pd.DataFrame(columns=FIELDSTATS_COLUMNS)
+    try:
+        return pd.read_csv(path)[FIELDSTATS_COLUMNS]
+    except (OSError, ValueError, KeyError, pd.errors.ParserError):
+        print(f'WARNING: the field statistics index {path} is not readable, it is ignored.')
+        return pd.DataFrame(columns=FIELDSTATS_COLUMNS)
+
+
+def update_fieldstats(fafile, stats):
+    """
+    Add statistics to the stored statistics of a FA file.
+
+    Parameters
+    ----------
+    fafile : str
+        The path of the FA file.
+    stats : pandas.DataFrame
+        The statistics (see FIELDSTATS_COLUMNS), they replace the stored
+        statistics of the same fields.
+
+    Returns
+    -------
+    None.
+
+    """
+    if not is_enabled():
+        return
+    path = _index_path(fafile)
+    if (path is None) or stats.empty:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # other processes do not update the same index in between
+        with _locked(os.path.dirname(path)):
+            stored = read_fieldstats(fafile)
+            stored = stored[~stored['name'].isin(stats['name'])]
+            combined = pd.concat([df for df in [stored, stats[FIELDSTATS_COLUMNS]] if not df.empty],
+                                 ignore_index=True)
+            _write_atomic(combined.sort_values('name'), path)
+            _remove_oldest(os.path.dirname(path), max_files=get_max_files())
+    except OSError as e:
+        print(f'WARNING: the field statistics could not be stored in {path}: {e}')
+
+
+@contextlib.contextmanager
+def _locked(folder):
+    """Context that holds the (advisory) lock of the indexes in folder (no lock without fcntl)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(os.path.join(folder, '.lock'), 'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def _write_atomic(stats, path):
+    """Write a table to a temporary file and replace the index (readers never see a partial index)."""
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            stats.to_csv(f, index=False)
+        os.replace(tmpfile, path)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+
+
+def _remove_oldest(folder, max_files):
+    """Remove the least recently written indexes when there are more than max_files."""
+    indexes = []
+    for entry in os.scandir(folder):
+        if entry.name.endswith('.csv'):
+            try:
+                indexes.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue # removed by another process
+    for _mtime, path in sorted(indexes)[:max(len(indexes) - max_files, 0)]:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+
+def merge_into_fielddf(fielddf, stats):
+    """
+    Add the statistics as columns (min, max, mean, n_nan) to a fielddf.
+
+    Parameters
+    ----------
+    fielddf : pandas.DataFrame
+        The fields of a FA file (FaFile.fielddf).
+    stats : pandas.DataFrame
+        The statistics (see FIELDSTATS_COLUMNS).
+
+    Returns
+    -------
+    pandas.DataFrame
+        The fielddf with the statistics (NaN for fields without statistics).
+
+    """
+    fielddf = fielddf.drop(columns=[col for col in FIELDSTATS_COLUMNS[1:]
+                                    if col in fielddf.columns])
+    stats = stats.drop_duplicates('name', keep='last').set_index('name')
+    for col in FIELDSTATS_COLUMNS[1:]:
+        fielddf[col] = fielddf['name'].map(stats[col]) if not stats.empty else np.nan
+    return fielddf
@@ -6,6 +6,23 @@ Created on Wed Jan 10 09:07:27 2024
 @author: thoverga
 """
 
+import os
+import sys
+import hashlib
+import tempfile
+
+import numpy as np
+
+import pyfa_tool.modules.reading_fa as reading_fa
+
+
+# Location of the disk cache of the lat/lon arrays (one file per geometry)
+LATLON_CACHE_DIR = os.path.join(os.environ.get('PYFA_CACHE_DIR',
+                                               os.path.join(os.path.expanduser('~'), '.cache', 'pyfa')),
+                                'latlon')
+
+_latlon_cache = {} # geometry hash: (lat, lon), shared by all datasets on that grid
+
 
 def reproject(dataset, target_epsg='EPSG:4326', nodata=-999):
     """
@@ -41,7 +58,9 @@ def reproject(dataset, target_epsg='EPSG:4326', nodata=-999):
     # I am not a fan of -999 as nodata, but it must be a value that
     # can be typecast to integer (rasterio thing?)
 
-    ds = dataset.transpose('level', 'validate', 'basedate', 'y', 'x')
+    # The spatial dimensions are already the last ones (canonical layout), so
+    # no transposing is needed.
+    ds = reading_fa._to_canonical_layout(dataset)
 
     for fieldname in list(ds.variables):
         if fieldname not in ds.dims:
@@ -54,3 +73,155 @@ def reproject(dataset, target_epsg='EPSG:4326', nodata=-999):
     # remove no data
     ds = ds.where(ds != nodata)
     return ds
+
+
+def in_native_projection(dataset):
+    """
+    Check if a Dataset is on the native grid (the projection of the FA file).
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        A Dataset with a rio.crs attribute and the proj4 string of the FA file
+        in the 'projection' attribute.
+
+    Returns
+    -------
+    bool
+        True if the Dataset is not reprojected.
+
+    """
+    if ('projection' not in dataset.attrs) or (dataset.rio.crs is None):
+        return False
+    from pyproj import CRS
+    return CRS.from_user_input(dataset.rio.crs.to_wkt()) == CRS.from_proj4(dataset.attrs['projection'])
+
+
+# =============================================================================
+# Latitude and longitude of the grid points
+# =============================================================================
+
+def geometry_hash(dataset):
+    """
+    Create a hash that identifies the geometry (crs and x/y coordinates) of a Dataset.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        A Dataset with x and y coordinates and a rio.crs attribute.
+
+    Returns
+    -------
+    str
+        The hash of the geometry.
+
+    """
+    if dataset.rio.crs is None:
+        sys.exit('The Dataset has no CRS (rio.crs), so its grid points can not be located.')
+    sha = hashlib.sha1()
+    sha.update(str(dataset.rio.crs.to_wkt()).encode())
+    sha.update(np.ascontiguousarray(dataset['x'].values, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(dataset['y'].values, dtype=np.float64).tobytes())
+    return sha.hexdigest()[:20]
+
+
+def get_latlon(dataset, disk_cache=True):
+    """
+    Get the latitude and longitude of all grid points of a Dataset.
+
+    The coordinates are computed with one (vectorized) transformation of the
+    x and y coordinates, and cached per geometry in memory and on disk (in
+    LATLON_CACHE_DIR), so they are computed once for all Datasets on the same
+    grid.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        A Dataset with x and y coordinates and a rio.crs attribute.
+    disk_cache : bool, optional
+        If True, the coordinates are read from (and written to) the disk
+        cache. The default is True.
+
+    Returns
+    -------
+    lat : numpy.array
+        The latitudes (y, x) of the grid points (read-only).
+    lon : numpy.array
+        The longitudes (y, x) of the grid points (read-only).
+
+    """
+    key = geometry_hash(dataset)
+    if key in _latlon_cache:
+        return _latlon_cache[key]
+
+    cachefile = os.path.join(LATLON_CACHE_DIR, f'{key}.npz')
+    latlon = None
+    if disk_cache and os.path.isfile(cachefile):
+        try:
+            with np.load(cachefile) as cached:
+                latlon = (cached['lat'], cached['lon'])
+        except (OSError, ValueError, KeyError):
+            print(f'WARNING: the lat/lon cache file {cachefile} is not readable, so it is recomputed.')
+
+    if latlon is None:
+        latlon = _compute_latlon(dataset)
+        if disk_cache:
+            _write_latlon_cache(cachefile, *latlon)
+
+    for arr in latlon:
+        arr.flags.writeable = False # shared between datasets
+    _latlon_cache[key] = latlon
+    return latlon
+
+
+def get_latlon_coords(dataset, disk_cache=True):
+    """
+    Get the latitude and longitude of all grid points as 2D coordinates.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        A Dataset with x and y coordinates and a rio.crs attribute.
+    disk_cache : bool, optional
+        If True, the disk cache is used (see get_latlon()). The default is
+        True.
+
+    Returns
+    -------
+    dict
+        The 'lat' and 'lon' xarray.DataArrays with (y, x) dimensions.
+
+    """
+    import xarray as xr
+
+    lat, lon = get_latlon(dataset, disk_cache=disk_cache)
+    coords = {'y': dataset['y'].values, 'x': dataset['x'].values}
+    return {'lat': xr.DataArray(lat, dims=('y', 'x'), coords=coords, name='lat',
+                                attrs={'units': 'degrees_north',
+                                       'standard_name': 'latitude'}),
+            'lon': xr.DataArray(lon, dims=('y', 'x'), coords=coords, name='lon',
+                                attrs={'units': 'degrees_east',
+                                       'standard_name': 'longitude'})}
+
+
+def _compute_latlon(dataset):
+    """Transform the x/y coordinates to lat/lon (all grid points at once)."""
+    from pyproj import Transformer
+
+    xx, yy = np.meshgrid(dataset['x'].values, dataset['y'].values)
+    transformer = Transformer.from_crs(dataset.rio.crs.to_wkt(), 'EPSG:4326',
+                                       always_xy=True)
+    lon, lat = transformer.transform(xx, yy)
+    return np.asarray(lat), np.asarray(lon)
+
+
+def _write_latlon_cache(cachefile, lat, lon):
+    """Write the lat/lon arrays to the disk cache (atomic, failures are ignored)."""
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cachefile), suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, lat=lat, lon=lon)
+        os.replace(tmpfile, cachefile)
+    except OSError as e:
+        print(f'WARNING: the lat/lon coordinates could not be cached in {cachefile}: {e}')
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dask-backed (out-of-core) FaDatasets and collections.
+
+A lazy FaDataset holds dask arrays instead of decoded fields: the dask graph
+has one decode task per field (decode_per='field'), or one per FA file that
+decodes all fields at once (decode_per='file'). Combining lazy FaDatasets
+gives a chunked Dataset that is only computed when it is written (or
+computed), chunk by chunk, so collections that do not fit in memory can be
+combined and saved.
+
+The number of chunks that are decoded at the same time is derived from a
+memory limit (see memory_limit()).
+
+Dask is an optional dependency (pip install dask).
+
+@author: thoverga
+"""
+
+import os
+import sys
+import contextlib
+
+import numpy as np
+
+import pyfa_tool.modules.scratch as scratch
+
+
+DECODE_PER = ['field', 'file']
+
+# Peak memory of decoding a chunk, relative to the size of the chunk (the
+# decoded payload and the dataset are in memory at the same time)
+_DECODE_MEMORY_FACTOR = 4
+
+
+def require_dask():
+    """Import dask (exit with a message if it is not installed)."""
+    try:
+        import dask
+        import dask.array
+    except ImportError:
+        sys.exit('Lazy (out-of-core) FaDatasets and collections require dask (pip install dask).')
+    return dask
+
+
+def is_lazy(ds):
+    """Check if any variable of a Dataset is a dask array."""
+    return any(var.chunks is not None for var in ds.variables.values())
+
+
+# =============================================================================
+# Opening
+# =============================================================================
+
+def open_lazy_dataset(fafile, backend=None, whitelist=None, blacklist=None,
+                      dtype=None, levels=None, window=None, decode_per='field'):
+    """
+    Open a FA file as a dask-backed xarray.Dataset (FaDataset layout).
+
+    Parameters
+    ----------
+    fafile : str
+        The path of the FA file (or a member of a tar archive).
+    backend : str or FaBackend, optional
+        The decode backend. If None, the default backend is used. The default
+        is None.
+    whitelist : list or str, optional
+        The fields (2D fieldnames, 3D and pseudo 3D basenames) to open. The
+        levels of pseudo 3D fields (S00x prefix) select their basename. If
+        None, all fields are opened. The default is None.
+    blacklist : list or str, optional
+        The fields to skip. The blacklist surpasses the whitelist. The
+        default is None.
+    dtype, levels, window :
+        See FaDataset.import_fa().
+    decode_per : 'field' or 'file', optional
+        One decode task per field, or one per file (that decodes all fields
+        at once, fewer decoder runs but more memory per task). The default
+        is 'field'.
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        The dataset, with one dask chunk per field.
+
+    """
+    if decode_per not in DECODE_PER:
+        sys.exit(f'{decode_per} is not a valid decode_per, choose from {DECODE_PER}.')
+    require_dask()
+    ds = _open_selection(fafile, backend=backend, whitelist=whitelist,
+                         blacklist=blacklist, dtype=dtype, levels=levels,
+                         window=window)
+    if decode_per == 'field':
+        # one chunk per field, the decoders read full fields
+        return ds.chunk({dim: -1 for dim in ds.dims})
+    return _chunk_per_file(ds, fafile, backend=backend, dtype=dtype,
+                           levels=levels, window=window)
+
+
+def _open_selection(fafile, backend=None, whitelist=None, blacklist=None,
+                    dtype=None, levels=None, window=None):
+    """Open a FA file lazily (see modules.xarray_backend) and select the fields, levels and window."""
+    import pyfa_tool.modules.xarray_backend as xarray_backend
+
+    ds = xarray_backend.open_fa_dataset(fafile, backend=backend, dtype=dtype,
+                                        time_dims=False)
+    fields = list(ds.data_vars)
+    if whitelist is not None:
+        whitelist = [_to_variable(name, fields) for name in _as_list(whitelist)]
+        fields = [field for field in fields if field in whitelist]
+        if not bool(fields):
+            sys.exit(f'None of these fields are found in the FA file: {whitelist}')
+    if blacklist is not None:
+        blacklist = [_to_variable(name, fields) for name in _as_list(blacklist)]
+        fields = [field for field in fields if field not in blacklist]
+    ds = ds.drop_vars([field for field in ds.data_vars if field not in fields])
+
+    if levels is not None:
+        ds = ds.sel(level=[lev for lev in ds['level'].values if lev in set(levels)])
+    if window is not None:
+        x_start, x_stop, y_start, y_stop = window
+        ds = ds.isel(x=slice(x_start, x_stop), y=slice(y_start, y_stop))
+    return ds
+
+
+def _as_list(names):
+    if isinstance(names, str):
+        return [names]
+    return list(names)
+
+
+def _to_variable(name, fields):
+    """Map a fieldname on the variable of the lazy dataset (S00xNAME -> NAME)."""
+    if (name not in fields) and name.startswith('S') and name[1:4].isnumeric():
+        return name[4:].strip()
+    return name
+
+
+def _chunk_per_file(ds, fafile, backend=None, dtype=None, levels=None,
+                    window=None):
+    """Replace the lazy fields by dask arrays that share one decode task (of all fields)."""
+    dask = require_dask()
+
+    decoded = dask.delayed(_import_fields, pure=True)(fafile, backend=backend,
+                                                      fields=list(ds.data_vars),
+                                                      dtype=dtype, levels=levels,
+                                                      window=window)
+    data_vars = {}
+    for name, var in ds.data_vars.items():
+        values = dask.delayed(_field_values, pure=True)(decoded, name,
+                                                        level=ds['level'].values if 'level' in var.dims else None)
+        data_vars[name] = (var.dims,
+                           dask.array.from_delayed(values, shape=var.shape, dtype=var.dtype),
+                           var.attrs)
+    return ds.assign(data_vars)
+
+
+def _import_fields(fafile, backend, fields, dtype=None, levels=None,
+                   window=None):
+    """Import the fields of a FA file (one decode), and get the dataset."""
+    from pyfa_tool.dataset import FaDataset
+    from pyfa_tool.file import FaFile
+
+    whitelist = []
+    Dataset = FaDataset(fafile=fafile, backend=backend)
+    FA = FaFile(Dataset.fafile, backend=Dataset.backend)
+    pseudo_fieldnames = FA._list_all_pseudo_3d_fieldnames_as_2d_fields()
+    for field in fields:
+        # pseudo 3D fields are imported by their (S00x) fieldnames
+        levelnames = [name for name in pseudo_fieldnames if name[4:].strip() == field]
+        whitelist.extend(levelnames if bool(levelnames) else [field])
+    Dataset.import_fa(whitelist=whitelist, dtype=dtype, levels=levels,
+                      window=window)
+    return Dataset.ds
+
+
+def _field_values(ds, name, level=None):
+    """Get the values of a field of a decoded dataset (on the levels of the lazy dataset)."""
+    field = ds[name]
+    if level is not None:
+        field = field.reindex(level=level)
+    return np.asarray(field.values)
+
+
+# =============================================================================
+# Computing
+# =============================================================================
+
+def get_num_workers(ds, max_memory, decode_per='field'):
+    """
+    Get the number of chunks that can be decoded at the same time.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The lazy dataset.
+    max_memory : int or str
+        The memory limit (bytes, or e.g. '4G').
+    decode_per : 'field' or 'file', optional
+        The decode tasks of the dataset (see open_lazy_dataset()). The
+        default is 'field'.
+
+    Returns
+    -------
+    int
+        The number of workers (at least 1, at most the number of CPUs).
+
+    """
+    max_memory = scratch._parse_size(max_memory)
+    if decode_per == 'file':
+        # a task holds all fields of a file
+        task_size = sum(var.nbytes / var.sizes.get('validate', 1)
+                        for var in ds.data_vars.values())
+    else:
+        task_size = max([_max_chunk_nbytes(var) for var in ds.data_vars.values()],
+                        default=0)
+    if task_size == 0:
+        return os.cpu_count() or 1
+    num_workers = int(max_memory // (_DECODE_MEMORY_FACTOR * task_size))
+    if num_workers < 1:
+        print(f'WARNING: a decode task needs about {int(_DECODE_MEMORY_FACTOR * task_size)} bytes, more than the memory limit ({max_memory} bytes).')
+    return min(max(num_workers, 1), os.cpu_count() or 1)
+
+
+def _max_chunk_nbytes(var):
+    """The size in bytes of the largest chunk of a variable."""
+    if var.chunks is None:
+        return var.nbytes
+    return int(np.prod([max(chunks) for chunks in var.chunks])) * var.dtype.itemsize
+
+
+@contextlib.contextmanager
+def memory_limit(ds, max_memory=None, decode_per='field'):
+    """
+    Context in which the dask computations of a lazy dataset stay under a memory limit.
+
+    The threaded scheduler is used, with as many workers as chunks fit in
+    the memory limit (see get_num_workers()).
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The dataset that is computed (or written).
+    max_memory : int or str, optional
+        The memory limit (bytes, or e.g. '4G'). If None, or if the dataset
+        is not lazy, the dask settings are not changed. The default is None.
+    decode_per : 'field' or 'file', optional
+        The decode tasks of the dataset. The default is 'field'.
+
+    Yields
+    ------
+    None.
+
+    """
+    if (max_memory is None) or (not is_lazy(ds)):
+        yield
+        return
+    dask = require_dask()
+    num_workers = get_num_workers(ds, max_memory=max_memory, decode_per=decode_per)
+    with dask.config.set(scheduler='threads', num_workers=num_workers):
+        yield
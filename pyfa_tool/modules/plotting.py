@@ -6,6 +6,11 @@ Created on Mon Jan 23 09:15:09 2023
 @author: thoverga
 """
 
+import sys
+import shutil
+import subprocess
+
+import numpy as np
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 
@@ -43,13 +48,81 @@ def make_platcarree_fig():
     fig, ax = plt.subplots(subplot_kw={'projection':ccrs.PlateCarree()})
     return fig, ax
 
+def make_native_fig(crs):
+    """ Create figure and axes in the (native) projection of the data """
+    fig, ax = plt.subplots(subplot_kw={'projection':crs})
+    return fig, ax
+
+
+# =============================================================================
+# Projections
+# =============================================================================
+
+def _parse_proj4_str(proj4str):
+    """Convert a proj4 string to a dictionary (numeric values as floats)."""
+    params = {}
+    for item in str(proj4str).split():
+        key, _, value = item.lstrip('+').partition('=')
+        try:
+            params[key] = float(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def crs_from_proj4(proj4str):
+    """
+    Create a cartopy CRS from the proj4 string of a FA file.
+
+    Parameters
+    ----------
+    proj4str : str
+        The proj4 string (as stored in the 'projection' attribute).
+
+    Returns
+    -------
+    cartopy.crs.Projection
+        The projection of the FA grid.
+
+    """
+    params = _parse_proj4_str(proj4str)
+    # FA files use a sphere with radius R
+    radius = params.get('R', 6371229.)
+    globe = ccrs.Globe(ellipse=None, semimajor_axis=radius,
+                       semiminor_axis=radius)
+
+    if params.get('proj') == 'lcc':
+        return ccrs.LambertConformal(central_longitude=params.get('lon_0', 0.),
+                                     central_latitude=params.get('lat_0', 0.),
+                                     standard_parallels=(params.get('lat_1', 0.),
+                                                         params.get('lat_2', params.get('lat_1', 0.))),
+                                     false_easting=params.get('x_0', 0.),
+                                     false_northing=params.get('y_0', 0.),
+                                     globe=globe)
+    if params.get('proj') == 'merc':
+        return ccrs.Mercator(central_longitude=params.get('lon_0', 0.),
+                             latitude_true_scale=params.get('lat_ts', params.get('lat_1', 0.)),
+                             globe=globe)
+    if params.get('proj') == 'stere':
+        return ccrs.Stereographic(central_latitude=params.get('lat_0', 90.),
+                                  central_longitude=params.get('lon_0', 0.),
+                                  true_scale_latitude=params.get('lat_ts', params.get('lat_1', None)),
+                                  globe=globe)
+    sys.exit(f'Plotting in the {params.get("proj")} projection is not implemented.')
+
 
 # # =============================================================================
 # Plotting functions
 # =============================================================================
 
 
-def make_plot(dxr, ax,title=None, grid=False, land=True, coastline=True, contour=False, levels=10, **kwargs):
+def make_plot(dxr, ax,title=None, grid=False, land=True, coastline=True, contour=False, levels=10, transform=None, **kwargs):
+    if transform is not None:
+        # data in another crs than the axes (no warping of the data)
+        kwargs['transform'] = transform
+        ax.set_extent([float(dxr['x'].min()), float(dxr['x'].max()),
+                       float(dxr['y'].min()), float(dxr['y'].max())],
+                      crs=transform)
     if contour:
         dxr.plot.contourf(ax=ax, levels=levels,  **kwargs)
 
@@ -68,6 +141,174 @@ def make_plot(dxr, ax,title=None, grid=False, land=True, coastline=True, contour
 
 
 
+# =============================================================================
+# Frame rendering (animations)
+# =============================================================================
+
+class FrameRenderer():
+    """
+    Render frames of a 2D field with one figure.
+
+    The figure, the map features and the colorbar are created once, for each
+    frame only the data of the mesh and the title are updated.
+    """
+
+    def __init__(self, x, y, latlon=False, grid=False, land=False,
+                 coastline=False, vmin=None, vmax=None, cmap=None,
+                 figsize=None, dpi=100, label=None, crs=None):
+        """
+        Create the figure and the static layers.
+
+        Parameters
+        ----------
+        x : numpy.array
+            The x coordinates (1D).
+        y : numpy.array
+            The y coordinates (1D).
+        latlon : bool, optional
+            If True, the coordinates are longitudes and latitudes and a
+            PlateCarree map is made. The default is False.
+        grid : bool, optional
+            Add gridlines to the plot. The default is False.
+        land : bool, optional
+            Draw land boarders (latlon or crs only). The default is False.
+        coastline : bool, optional
+            Draw coastlines (latlon or crs only). The default is False.
+        vmin : float, optional
+            Lower limit of the colorscale (the same for all frames). The
+            default is None.
+        vmax : float, optional
+            Upper limit of the colorscale (the same for all frames). The
+            default is None.
+        cmap : str, optional
+            The colormap. The default is None.
+        figsize : tuple, optional
+            Size of the figure in inches. The default is None.
+        dpi : int, optional
+            Resolution of the frames. The default is 100.
+        label : str, optional
+            Label of the colorbar. The default is None.
+        crs : cartopy.crs.Projection, optional
+            The (native) projection of the x and y coordinates. If not None,
+            the map is made in this projection. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        # No pyplot: figures are not registered (no memory leak when
+        # rendering many frames, and no GUI backend needed in workers).
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        mesh_kwargs = {}
+        if latlon:
+            self.ax = self.fig.add_subplot(projection=ccrs.PlateCarree())
+        elif crs is not None:
+            self.ax = self.fig.add_subplot(projection=crs)
+            self.ax.set_extent([np.min(x), np.max(x), np.min(y), np.max(y)], crs=crs)
+            mesh_kwargs['transform'] = crs
+        else:
+            self.ax = self.fig.add_subplot()
+
+        self.mesh = self.ax.pcolormesh(x, y, np.full((len(y), len(x)), np.nan),
+                                       vmin=vmin, vmax=vmax, cmap=cmap,
+                                       shading='auto', **mesh_kwargs)
+        self.fig.colorbar(self.mesh, ax=self.ax, label=label)
+
+        if land:
+            self.ax.add_feature(cfeature.LAND)
+            self.ax.add_feature(cfeature.BORDERS)
+        if coastline:
+            self.ax.add_feature(cfeature.COASTLINE)
+        if grid:
+            self.ax.gridlines(draw_labels=True, dms=True, x_inline=False, y_inline=False)
+
+    def render(self, data, title, filepath):
+        """
+        Update the data and the title, and save the frame.
+
+        Parameters
+        ----------
+        data : numpy.array
+            The 2D (y, x) data of the frame.
+        title : str
+            The title of the frame.
+        filepath : str
+            The path of the image file.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.mesh.set_array(np.ma.masked_invalid(data).ravel())
+        self.ax.set_title(title)
+        self.fig.savefig(filepath)
+
+
+def render_frames(x, y, frames, renderer_kwargs={}):
+    """
+    Render frames with one FrameRenderer.
+
+    Parameters
+    ----------
+    x : numpy.array
+        The x coordinates (1D).
+    y : numpy.array
+        The y coordinates (1D).
+    frames : list
+        A list of (data, title, filepath) tuples.
+    renderer_kwargs : dict, optional
+        Kwargs passed to the FrameRenderer. The default is {}.
+
+    Returns
+    -------
+    list
+        The paths of the rendered frames.
+
+    """
+    renderer = FrameRenderer(x=x, y=y, **renderer_kwargs)
+    for data, title, filepath in frames:
+        renderer.render(data=data, title=title, filepath=filepath)
+    return [frame[2] for frame in frames]
+
+
+def frames_to_mp4(frame_pattern, target, fps=4):
+    """
+    Combine frames (image files) to an MP4 video with ffmpeg.
+
+    Parameters
+    ----------
+    frame_pattern : str
+        The ffmpeg input pattern of the frames (e.g. 'frame_%04d.png').
+    target : str
+        Path of the MP4 file.
+    fps : int, optional
+        Frames per second. The default is 4.
+
+    Returns
+    -------
+    None.
+
+    """
+    if shutil.which('ffmpeg') is None:
+        sys.exit('ffmpeg is not found, it is needed to write MP4 files.')
+
+    result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error',
+                             '-framerate', str(fps),
+                             '-i', frame_pattern,
+                             # h264 needs even dimensions
+                             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                             '-pix_fmt', 'yuv420p',
+                             target],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f'ffmpeg could not write {target}: {result.stderr}')
+    print(f'Animation saved to {target}')
+
+
 # =============================================================================
 # Saving functions
 # =============================================================================
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the import/combine/save stages.
+
+A StageProfiler records the wall time, CPU time (including child processes,
+like R) and memory use of each stage. The records are available as a
+pandas.DataFrame, are passed to an (optional) callback and are logged to the
+'pyfa_tool.profiling' logger at DEBUG level.
+
+Code that does not know which profiler to use (like the decode backends) can
+use the module-level stage() context manager. It records to the profiler that
+is activated by the caller, and does nothing if there is none.
+
+The memory columns of a record are:
+
+    * rss_delta_mb: the change of the resident memory of this process over
+      the stage (from /proc/self/statm, None where that is not available).
+    * peak_traced_mb: the peak python memory of the stage (tracemalloc, only
+      with trace_memory=True).
+    * process_peak_rss_mb and process_peak_rss_children_mb: the peak
+      resident memory of this process, and of its largest child process (like
+      R), since the start of the process (getrusage). These are cumulative:
+      they are the peak of all stages so far, not of the stage itself.
+
+The stack of open stages is kept per thread and per asyncio task (in a
+contextvars.ContextVar), so one profiler can record stages of concurrent
+imports. tracemalloc is process-wide however: with trace_memory=True, the
+peaks of stages that run at the same time include each other's memory.
+
+@author: thoverga
+"""
+
+import os
+import time
+import logging
+import resource
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+logger = logging.getLogger('pyfa_tool.profiling')
+
+_active_profiler = contextvars.ContextVar('pyfa_active_profiler', default=None)
+
+
+def _cpu_time():
+    """CPU time of this process and its (finished) child processes."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _current_rss_mb():
+    """Resident memory (in MB) of this process now, or None if unknown (no /proc)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * resource.getpagesize() / (1024. * 1024.)
+
+
+def _peak_rss_mb():
+    """Peak resident memory (in MB) of this process and of its largest child, since their start."""
+    to_mb = 1024. if os.uname().sysname != 'Darwin' else 1024. * 1024.
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / to_mb
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / to_mb
+    return self_rss, children_rss
+
+
+class StageProfiler():
+    """Records timing and memory information of processing stages."""
+
+    def __init__(self, callback=None, trace_memory=False):
+        """
+        Initiate a StageProfiler.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            A function that is called with the record (a dict) of each finished
+            stage. The default is None.
+        trace_memory : bool, optional
+            If True, the peak python memory of each stage is traced with
+            tracemalloc. This slows down the stages. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.records = []
+        # the open stages (a tuple of frames), per thread and asyncio task
+        self._stack = contextvars.ContextVar(f'pyfa_profiler_stack_{id(self)}',
+                                             default=())
+
+    def __repr__(self):
+        return f'StageProfiler with {len(self.records)} records'
+
+    def __str__(self):
+        return f'StageProfiler with {len(self.records)} records'
+
+    # =========================================================================
+    # Recording
+    # =========================================================================
+
+    @contextmanager
+    def stage(self, name, field=None, **info):
+        """
+        Context manager that records a stage.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        field : str, optional
+            The fieldname, for per-field stages. The default is None.
+        **info :
+            Extra information to store in the record.
+
+        Yields
+        ------
+        None.
+
+        """
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            # remember the peak of the parent stage, before resetting it
+            parents = self._stack.get()
+            if bool(parents):
+                parents[-1]['peak'] = max(parents[-1]['peak'],
+                                          tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        frame = {'peak': 0}
+        token = self._stack.set(self._stack.get() + (frame,))
+        rss_start = _current_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = _cpu_time() - cpu_start
+            rss_end = _current_rss_mb()
+            self._stack.reset(token)
+
+            peak_traced = None
+            if self.trace_memory:
+                peak_bytes = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                peak_traced = peak_bytes / (1024. * 1024.)
+                parents = self._stack.get()
+                if bool(parents):
+                    parents[-1]['peak'] = max(parents[-1]['peak'], peak_bytes)
+                if started_tracing:
+                    tracemalloc.stop()
+
+            rss_delta = None
+            if (rss_start is not None) & (rss_end is not None):
+                rss_delta = rss_end - rss_start
+            self.add_record(name=name, field=field, wall_time=wall,
+                            cpu_time=cpu, peak_traced_mb=peak_traced,
+                            rss_delta_mb=rss_delta, **info)
+
+    def add_record(self, name, field=None, wall_time=None, cpu_time=None,
+                   peak_traced_mb=None, rss_delta_mb=None, source='python',
+                   **info):
+        """
+        Add a record of a stage that is measured elsewhere (e.g. in R).
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        field : str, optional
+            The fieldname, for per-field stages. The default is None.
+        wall_time : float, optional
+            Wall time in seconds. The default is None.
+        cpu_time : float, optional
+            CPU time in seconds. The default is None.
+        peak_traced_mb : float, optional
+            Peak traced python memory in MB. The default is None.
+        rss_delta_mb : float, optional
+            Change of the resident memory of this process over the stage, in
+            MB. The default is None.
+        source : str, optional
+            Where the stage was measured. The default is 'python'.
+        **info :
+            Extra information to store in the record.
+
+        Returns
+        -------
+        None.
+
+        """
+        peak_rss, peak_rss_children = _peak_rss_mb()
+        record = {'stage': name,
+                  'field': field,
+                  'source': source,
+                  'wall_time': wall_time,
+                  'cpu_time': cpu_time,
+                  'peak_traced_mb': peak_traced_mb,
+                  'rss_delta_mb': rss_delta_mb,
+                  'process_peak_rss_mb': peak_rss,
+                  'process_peak_rss_children_mb': peak_rss_children}
+        record.update(info)
+        self.records.append(record)
+
+        logger.debug('%s%s: wall %.3fs, cpu %s', name,
+                     f' ({field})' if field is not None else '',
+                     wall_time if wall_time is not None else float('nan'),
+                     f'{cpu_time:.3f}s' if cpu_time is not None else 'unknown')
+        if self.callback is not None:
+            self.callback(record)
+
+    # =========================================================================
+    # Reporting
+    # =========================================================================
+
+    def get_report(self):
+        """
+        Get all the records as a table.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per (finished) stage.
+
+        """
+        if not bool(self.records):
+            return pd.DataFrame(columns=['stage', 'field', 'source', 'wall_time', 'cpu_time',
+                                         'peak_traced_mb', 'rss_delta_mb', 'process_peak_rss_mb',
+                                         'process_peak_rss_children_mb'])
+        # the records do not all have the same keys (e.g. the R timings)
+        return pd.DataFrame(self.records)
+
+    def get_summary(self):
+        """
+        Get the total wall and CPU time per stage (all fields together).
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per stage.
+
+        """
+        report = self.get_report()
+        return report.groupby('stage', sort=False).agg(
+            n=('wall_time', 'size'),
+            wall_time=('wall_time', 'sum'),
+            cpu_time=('cpu_time', 'sum'),
+            peak_traced_mb=('peak_traced_mb', 'max'),
+            rss_delta_mb=('rss_delta_mb', 'max'),
+            process_peak_rss_mb=('process_peak_rss_mb', 'max'))
+
+
+# =============================================================================
+# Active profiler
+# =============================================================================
+
+@contextmanager
+def activate(profiler):
+    """
+    Make a profiler the active one (for the module-level stage()).
+
+    Parameters
+    ----------
+    profiler : StageProfiler or None
+        The profiler to activate. If None, nothing is recorded.
+
+    Yields
+    ------
+    profiler : StageProfiler or None
+        The activated profiler.
+
+    """
+    token = _active_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _active_profiler.reset(token)
+
+
+def get_active_profiler():
+    """Get the active profiler (or None)."""
+    return _active_profiler.get()
+
+
+@contextmanager
+def stage(name, field=None, **info):
+    """
+    Record a stage in the active profiler (no-op if there is none).
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    field : str, optional
+        The fieldname, for per-field stages. The default is None.
+    **info :
+        Extra information to store in the record.
+
+    Yields
+    ------
+    None.
+
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name, field=field, **info):
+            yield
+
+
+def add_record(name, **kwargs):
+    """Add a record to the active profiler (no-op if there is none)."""
+    profiler = _active_profiler.get()
+    if profiler is not None:
+        profiler.add_record(name, **kwargs)
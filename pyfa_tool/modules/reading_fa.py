@@ -14,7 +14,24 @@ import numpy as np
 from datetime import timedelta
 
 import pyfa_tool.modules.IO as IO
+import pyfa_tool.modules.profiling as profiling
+import pyfa_tool.modules.spectral as spectral
+import pyfa_tool.modules.fieldstats as _fieldstats
 from pyfa_tool.modules.describe_module import _str_to_dt
+
+
+# The one memory layout used for all data in PyFa. Variables only carry the
+# dimensions they need (2D fields are ('y', 'x'), 3D fields are
+# ('level', 'y', 'x'), ...), but the relative order always follows this tuple
+# with the spatial dimensions last (rioxarray likes the spatial coordinates as
+# last).
+CANONICAL_DIMS = ('basedate', 'validate', 'level', 'y', 'x')
+
+# Fields packed with at most this number of bits lose no information in
+# float32: the rounding error of float32 (24-bit mantissa) is below the
+# packing quantum (the range of the field divided by 2**nbits).
+FLOAT32_MAX_NBITS = 24
+
 # =============================================================================
 # Formatters
 # =============================================================================
@@ -41,37 +58,147 @@ def _fmt_fieldname(string):
 
 
 
-def _fmt_2d_field_to_matrix(datalist, xcoords):
+def _fmt_2d_field_to_matrix(datalist, xcoords, dtype=None):
     xlen = xcoords.shape[0]
     # ylen = ycoords.shape[0]
 
     ncols=xlen #test 1
 
-    test = np.asarray(datalist)
+    test = np.asarray(datalist, dtype=dtype)
     test.shape = (test.size//ncols, ncols)
     return test
 
 
 
-def _fmt_3d_field_to_matrix(datalist):
-    # convert to matrix with these dimensions: (y, x, levels)
-    mat =np.asarray(datalist).transpose((1,0,2))
+def _fmt_3d_field_to_matrix(datalist, dtype=None):
+    # The data comes in as (x, y, levels), convert it (once) to a contiguous
+    # matrix with the canonical dimensions: (levels, y, x)
+    mat = np.ascontiguousarray(np.asarray(datalist, dtype=dtype).transpose((2, 1, 0)))
     return mat
 
 
+def _resolve_dtype(dtype=None, nbits=None):
+    """
+    Get the numpy dtype to store a decoded field in.
+
+    Parameters
+    ----------
+    dtype : str, numpy.dtype or None, optional
+        The requested dtype. If None or 'auto', float32 is used if the packing
+        of the field (nbits) fits in the float32 mantissa, else float64. The
+        default is None.
+    nbits : int, optional
+        The number of bits used to pack the field in the FA file. If unknown,
+        float64 is used in auto mode. The default is None.
+
+    Returns
+    -------
+    numpy.dtype
+        The dtype to use.
+
+    """
+    if (dtype is None) or (str(dtype) == 'auto'):
+        try:
+            nbits = int(nbits)
+        except (TypeError, ValueError):
+            return np.dtype('float64')
+        if 0 < nbits <= FLOAT32_MAX_NBITS:
+            return np.dtype('float32')
+        return np.dtype('float64')
+
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        sys.exit(f'{dtype} is not a floating point dtype.')
+    return dtype
+
+
+def _json_digits_for_dtype(dtypes):
+    """Number of significant digits needed to transport the dtypes as json."""
+    if any(np.dtype(dtype).itemsize > 4 for dtype in dtypes):
+        return -1  # max precision
+    return 9  # float32 round-trip
+
+
 def _make_level_dimension(nlev):
     return np.arange(1, nlev+1)
 
+def _get_levels(metadata, nlev):
+    # A subset of the levels is set in the metadata when only some levels are read
+    if 'levels' in metadata:
+        return np.asarray(metadata['levels'], dtype=int)
+    return _make_level_dimension(nlev)
+
 # =============================================================================
 #  Json to xarray
 # =============================================================================
 
 
 
-def json_to_full_dataset(jsonfile):
+def json_to_full_dataset(jsonfile, dtype=None, field_nbits=None):
+    """
+    Create a xarray.Dataset from the json file written by get_all_fields.R.
+
+    Parameters
+    ----------
+    jsonfile : str
+        Path to the json file.
+    dtype : str, numpy.dtype or None, optional
+        The dtype to store the fields in. If None or 'auto', float32 is used
+        for fields packed with at most 24 bits, else float64. The default is
+        None.
+    field_nbits : dict, optional
+        Fieldname (or 3D basename) to nbits mapping, used to resolve the dtype
+        in auto mode. The default is None.
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        The dataset of the FA file.
+
+    """
     print('Reading json data')
     data = IO.read_json(jsonfile)
 
+    return payload_to_dataset(data, dtype=dtype, field_nbits=field_nbits)
+
+
+def payload_to_dataset(data, dtype=None, field_nbits=None, fieldstats=None):
+    """
+    Create a xarray.Dataset from a decoded FA payload.
+
+    The payload is a dictionary with the structure of the FA.json file (as
+    returned by the read_fields() method of the decode backends). The data of
+    the fields can be (nested) lists or numpy arrays.
+
+    Parameters
+    ----------
+    data : dict
+        The FA payload.
+    dtype : str, numpy.dtype or None, optional
+        The dtype to store the fields in. If None or 'auto', float32 is used
+        for fields packed with at most 24 bits, else float64. The default is
+        None.
+    field_nbits : dict, optional
+        Fieldname (or 3D basename) to nbits mapping, used to resolve the dtype
+        in auto mode. The default is None.
+    fieldstats : list, optional
+        If a list is given, the statistics (min, max, mean, number of NaNs)
+        of each field and level are computed while the fields are in memory,
+        and appended to it (see modules.fieldstats). The default is None.
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        The dataset of the FA file.
+
+    """
+    if field_nbits is None:
+        field_nbits = {}
+
+    # Spectral fields are transformed to grid-point fields first (experimental,
+    # only payloads of the synthetic backend hold coefficients)
+    data = spectral_payload_to_gridpoint(data)
+
     metadict = {
         'basedate': _str_to_dt(data['pyfa_metadata']['basedate'][0]),
         'validate': _str_to_dt(data['pyfa_metadata']['validate'][0]),
@@ -97,7 +224,7 @@ def json_to_full_dataset(jsonfile):
         'nlev': int(data['pyfa_metadata']['nlev'][0]),
         'refpressure': float(data['pyfa_metadata']['refpressure'][0]),
         'A_list': np.array(data['pyfa_metadata']['A_list']),
-        'B_list': np.array(data['pyfa_metadata']['A_list']),
+        'B_list': np.array(data['pyfa_metadata']['B_list']),
         }
 
     xcoords=np.asarray(data['pyfa_metadata']['xcoords'])
@@ -106,28 +233,38 @@ def json_to_full_dataset(jsonfile):
 
     data_vars_2d = {}
     data_vars_3d = {}
+    levels = _get_levels(data['pyfa_metadata'], metadict['nlev'])
 
     for key, val in data.items():
         if isinstance(val, dict):
             if 'type' in val.keys():
-                if val['type'] == ['2d']:
-                    fieldname = _fmt_fieldname(key)
-                    dataarray = _fmt_2d_field_to_matrix(datalist=val['data'],
-                                                        xcoords = xcoords)
-                    data_vars_2d[fieldname] = (["y", "x"], dataarray)
-                elif val['type'] == ['3d']:
-                    fieldname = _fmt_fieldname(key)
-                    dataarray = _fmt_3d_field_to_matrix(datalist=val['data'])
-                    data_vars_3d[fieldname] = (["y", "x", 'level'], dataarray)
-                elif val['type'] == ['pseudo_3d']:
-                    fieldname = _fmt_fieldname(key)
-                    dataarray = _fmt_2d_field_to_matrix(datalist=val['data'],
-                                                        xcoords = xcoords)
-                    data_vars_2d[fieldname] = (["y", "x"], dataarray)
-
-
-                else:
-                    sys.exit(f'unknown type {val["type"]} for {key}')
+                fieldname = _fmt_fieldname(key)
+                field_dtype = _resolve_dtype(dtype=dtype,
+                                             nbits=field_nbits.get(fieldname))
+                with profiling.stage('build_field', field=fieldname):
+                    if val['type'] == ['2d']:
+                        dataarray = _fmt_2d_field_to_matrix(datalist=val['data'],
+                                                            xcoords = xcoords,
+                                                            dtype=field_dtype)
+                        data_vars_2d[fieldname] = (["y", "x"], dataarray)
+                    elif val['type'] == ['3d']:
+                        dataarray = _fmt_3d_field_to_matrix(datalist=val['data'],
+                                                            dtype=field_dtype)
+                        data_vars_3d[fieldname] = (['level', "y", "x"], dataarray)
+                    elif val['type'] == ['pseudo_3d']:
+                        dataarray = _fmt_2d_field_to_matrix(datalist=val['data'],
+                                                            xcoords = xcoords,
+                                                            dtype=field_dtype)
+                        data_vars_2d[fieldname] = (["y", "x"], dataarray)
+                    else:
+                        sys.exit(f'unknown type {val["type"]} for {key}')
+
+                if fieldstats is not None:
+                    with profiling.stage('fieldstats', field=fieldname):
+                        fieldstats.extend(_fieldstats.compute_fieldstats(
+                            name=fieldname,
+                            values=dataarray,
+                            levels=levels if val['type'] == ['3d'] else None))
 
     # Combine 2D and 3D fields
     data_vars_2d.update(data_vars_3d)
@@ -136,11 +273,9 @@ def json_to_full_dataset(jsonfile):
     ds = xr.Dataset(data_vars=data_vars_2d,
                     coords={'x': xcoords,
                             'y': ycoords,
-                            'level': _make_level_dimension(metadict['nlev'])
+                            'level': levels
                             },
                     )
-    # Set dimension order (this is a convention (rioxarray likes the spatial coordiantes as last))
-    ds = ds.transpose('level', 'y', 'x')
 
     # Metadata
     # meta_dict = {key: val[0] for key, val in data.items() if key in ['name', 'basedate', 'validate', 'leadtime', 'timestep', 'origin']}
@@ -151,3 +286,228 @@ def json_to_full_dataset(jsonfile):
     ds = ds.rio.set_spatial_dims('x', 'y', inplace=True)
 
     return ds
+
+
+def subset_payload(data, levels=None, window=None):
+    """
+    Select a subset of levels and a spatial window of a FA payload.
+
+    Parameters
+    ----------
+    data : dict
+        The FA payload (structure of the FA.json file).
+    levels : list of int, optional
+        The levels to keep for the 3D fields. If None, all levels are kept.
+        The default is None.
+    window : tuple of int, optional
+        (x_start, x_stop, y_start, y_stop) gridpoint indices (python slice
+        convention) of the window to keep. If None, the full domain is kept.
+        The default is None.
+
+    Returns
+    -------
+    data : dict
+        The payload with the subset of the data (the data is converted to
+        numpy arrays).
+
+    """
+    if (levels is None) & (window is None):
+        return data
+
+    metadata = dict(data['pyfa_metadata'])
+    nx = int(metadata['nx'][0])
+    nlev = int(metadata['nlev'][0])
+
+    xslice = slice(None)
+    yslice = slice(None)
+    if window is not None:
+        x_start, x_stop, y_start, y_stop = window
+        xslice = slice(x_start, x_stop)
+        yslice = slice(y_start, y_stop)
+        metadata['xcoords'] = list(np.asarray(metadata['xcoords'])[xslice])
+        metadata['ycoords'] = list(np.asarray(metadata['ycoords'])[yslice])
+        metadata['nx'] = [len(metadata['xcoords'])]
+        metadata['ny'] = [len(metadata['ycoords'])]
+
+    lev_idx = slice(None)
+    if levels is not None:
+        all_levels = _get_levels(data['pyfa_metadata'], nlev)
+        levels = [lev for lev in all_levels if lev in set(levels)]
+        lev_idx = [int(np.where(all_levels == lev)[0][0]) for lev in levels]
+        metadata['levels'] = levels
+
+    subset = {'pyfa_metadata': metadata}
+    for key, val in data.items():
+        if (not isinstance(val, dict)) or ('type' not in val.keys()) or (key == 'pyfa_metadata'):
+            continue
+        field = dict(val)
+        if _is_spectral_field(val):
+            # the window is applied after the transform (on the full grid)
+            if 'grid' not in field:
+                extended, zone = _spectral_geometry(data['pyfa_metadata'])
+                field['grid'] = list(extended)
+                field['zone'] = list(zone)
+            if window is not None:
+                field['window'] = list(window)
+            if (val['type'] == ['spectral_3d']) & (levels is not None):
+                field['data'] = {part: np.asarray(arr)[lev_idx]
+                                 for part, arr in val['data'].items()}
+        elif val['type'] == ['3d']:
+            # (x, y, level) layout
+            arr = np.asarray(val['data'])
+            field['data'] = arr[xslice, yslice][:, :, lev_idx]
+        else:
+            # flat (x varies fastest)
+            arr = np.asarray(val['data']).reshape((-1, nx))
+            field['data'] = arr[yslice, xslice].ravel()
+        subset[key] = field
+    return subset
+
+
+# =============================================================================
+# Spectral fields
+# =============================================================================
+
+def _is_spectral_field(val):
+    return str(val['type'][0]).startswith('spectral_')
+
+
+def _spectral_geometry(metadata):
+    """
+    Get the grid of the spectral transform and the zone that is kept.
+
+    The coefficients are transformed on the extended (C+I+E) grid of
+    (ndgux + ey, ndlux + ex) points, and the C+I zone (ndgux, ndlux) is kept.
+    Without these attributes the grid (ny, nx) of the metadata is used.
+
+    Returns
+    -------
+    tuple
+        The (ny, nx) of the extended grid and the (ny, nx) of the C+I zone.
+
+    """
+    ny, nx = int(metadata['ny'][0]), int(metadata['nx'][0])
+    if not all([key in metadata for key in ['ndlux', 'ndgux', 'ex', 'ey']]):
+        return (ny, nx), (ny, nx)
+    ndlux, ndgux = int(metadata['ndlux'][0]), int(metadata['ndgux'][0])
+    return (ndgux + int(metadata['ey'][0]), ndlux + int(metadata['ex'][0])), (ndgux, ndlux)
+
+
+def spectral_payload_to_gridpoint(data, truncation=1.):
+    """
+    Transform the spectral fields of a FA payload to grid-point fields.
+
+    Spectral fields have a 'spectral_2d', 'spectral_pseudo_3d' or
+    'spectral_3d' type, and the real and imaginary parts of the coefficients
+    as data ({'real': ..., 'imag': ...}) in the compact layout of
+    pyfa_tool.modules.spectral ((levels,) 2*nsmax + 1, nmsmax + 1). All
+    levels of a 3D field are transformed in one FFT call, on the extended
+    (C+I+E) grid, and the extension zone is cropped (see
+    _spectral_geometry()).
+
+    Note: the R scripts decode spectral fields to grid-point fields with RFa,
+    so only payloads of the synthetic backend hold coefficients.
+
+    Parameters
+    ----------
+    data : dict
+        The FA payload (structure of the FA.json file).
+    truncation : float, optional
+        Fraction (0, 1] of the truncation to keep. Smaller values drop the
+        small scales (fast, smooth previews). The default is 1.
+
+    Returns
+    -------
+    data : dict
+        The payload where all spectral fields are replaced by grid-point
+        fields ('2d', 'pseudo_3d' or '3d' type, same layout as FA.json). If
+        there are no spectral fields, the payload is returned as it is.
+
+    """
+    spectral_keys = [key for key, val in data.items()
+                     if isinstance(val, dict) and ('type' in val.keys())
+                     and (key != 'pyfa_metadata') and _is_spectral_field(val)]
+    if len(spectral_keys) == 0:
+        return data
+
+    metadata = data['pyfa_metadata']
+    nsmax = int(metadata['nsmax'][0]) if 'nsmax' in metadata else None
+
+    data = dict(data)
+    for key in spectral_keys:
+        val = data[key]
+        coeffs = np.asarray(val['data']['real']) + 1j * np.asarray(val['data']['imag'])
+        if (nsmax is not None) and (spectral.truncation_of_coeffs(coeffs)[0] != nsmax):
+            print(f'WARNING: the coefficients of {key} do not match the truncation (nsmax={nsmax}) of the file.')
+
+        if 'grid' in val:
+            (ny, nx), (zone_ny, zone_nx) = val['grid'], val['zone']
+        else:
+            (ny, nx), (zone_ny, zone_nx) = _spectral_geometry(metadata)
+        with profiling.stage('spectral_transform', field=_fmt_fieldname(key)):
+            grid = spectral.spectral_to_gridpoint(coeffs, ny=ny, nx=nx,
+                                                  truncation=truncation)
+        # drop the extension zone
+        grid = grid[..., :zone_ny, :zone_nx]
+
+        if 'window' in val:
+            x_start, x_stop, y_start, y_stop = val['window']
+            grid = grid[..., y_start:y_stop, x_start:x_stop]
+
+        gridtype = val['type'][0][len('spectral_'):]
+        if gridtype == '3d':
+            # (levels, y, x) -> (x, y, levels) layout of FA.json
+            data[key] = {'data': grid.transpose((2, 1, 0)), 'type': ['3d']}
+        else:
+            # flat (x varies fastest)
+            data[key] = {'data': grid.ravel(), 'type': [gridtype]}
+    return data
+
+
+# =============================================================================
+# Memory layout
+# =============================================================================
+
+def _canonical_dims(dims):
+    """Sort dimensions according to the canonical order (unknown dims first)."""
+    known = [dim for dim in CANONICAL_DIMS if dim in dims]
+    unknown = [dim for dim in dims if dim not in CANONICAL_DIMS]
+    return tuple(unknown + known)
+
+
+def _is_canonical_layout(ds):
+    """Check if all variables of a Dataset are in the canonical layout."""
+    for var in ds.variables.values():
+        if tuple(var.dims) != _canonical_dims(var.dims):
+            return False
+    return True
+
+
+def _to_canonical_layout(ds):
+    """
+    Make sure a Dataset is in the canonical layout.
+
+    If the Dataset is already in the canonical layout, it is returned as is
+    (no views or copies are made). Else the variables are transposed and
+    stored contiguous, so this happens only once (e.g. netCDF files written by
+    other tools).
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The dataset to check.
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        The dataset in the canonical layout.
+
+    """
+    if _is_canonical_layout(ds):
+        return ds
+
+    ds = ds.transpose(*_canonical_dims(ds.dims))
+    for varname, var in ds.data_vars.items():
+        if isinstance(var.data, np.ndarray):
+            ds[varname] = var.copy(data=np.ascontiguousarray(var.data))
+    return ds
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scratch directories for the temporary files of the decoders (json files of
+RFa, copies of archive members, ...).
+
+Each scratch directory is created atomically (tempfile.mkdtemp) with a unique
+name, so parallel imports in one directory, or on one node, do not race. The
+scratch root is configurable with environment variables:
+
+    * PYFA_SCRATCH_DIR: the root of the scratch directories. If not set,
+      /dev/shm (memory-backed) is used when the expected size fits in it, else
+      the default temporary directory of the system.
+    * PYFA_SCRATCH_QUOTA: the maximum size (e.g. '4G', '500M' or bytes) of all
+      pyfa scratch directories in the root together (of all processes). The
+      quota is advisory: the used size is checked when a scratch directory
+      is created, and the expected size is not reserved, so processes that
+      create their scratch directories at the same time can exceed it
+      together.
+
+Scratch directories are removed when the context is closed (also on errors),
+and the ones that are still present when python exits are removed as well.
+
+@author: thoverga
+"""
+
+import os
+import sys
+import shutil
+import atexit
+import tempfile
+import contextlib
+
+
+SHM_DIR = '/dev/shm'
+
+# Fraction of /dev/shm that is left free for other processes
+_SHM_RESERVE = 0.25
+
+_SCRATCH_PREFIX = 'pyfa_'
+
+_UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+_active_dirs = set() # scratch directories of this process that are not removed yet
+
+
+# =============================================================================
+# Settings
+# =============================================================================
+
+def _parse_size(size):
+    """Convert a size ('4G', '500M', '1024') to bytes."""
+    size = str(size).strip().upper().rstrip('B')
+    try:
+        if size[-1:] in _UNITS:
+            return int(float(size[:-1]) * _UNITS[size[-1]])
+        return int(float(size))
+    except ValueError:
+        sys.exit(f'{size} is not a valid scratch size (use bytes, or a K, M, G or T suffix).')
+
+
+def get_quota():
+    """Get the scratch quota in bytes (None if PYFA_SCRATCH_QUOTA is not set)."""
+    quota = os.environ.get('PYFA_SCRATCH_QUOTA')
+    if not bool(quota):
+        return None
+    return _parse_size(quota)
+
+
+def _shm_fits(expected_size):
+    """Check if /dev/shm is usable and has room for the expected size."""
+    if not (os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)):
+        return False
+    usage = shutil.disk_usage(SHM_DIR)
+    return usage.free - expected_size >= _SHM_RESERVE * usage.total
+
+
+def get_scratch_root(expected_size=0):
+    """
+    Get the directory where scratch directories are created.
+
+    Parameters
+    ----------
+    expected_size : int, optional
+        The expected size (in bytes) of the scratch files. It is used to
+        decide if /dev/shm can be used. The default is 0.
+
+    Returns
+    -------
+    str
+        PYFA_SCRATCH_DIR if set, else /dev/shm if the expected size fits, else
+        the default temporary directory.
+
+    """
+    root = os.environ.get('PYFA_SCRATCH_DIR')
+    if bool(root):
+        if not os.path.isdir(root):
+            sys.exit(f'The scratch directory {root} (PYFA_SCRATCH_DIR) does not exist.')
+        return root
+    if _shm_fits(expected_size):
+        quota = get_quota()
+        if (quota is None) or (get_used_size(SHM_DIR) + expected_size <= quota):
+            return SHM_DIR
+    return tempfile.gettempdir()
+
+
+def get_used_size(root):
+    """
+    Get the size of all pyfa scratch directories in a root (of all processes).
+
+    Parameters
+    ----------
+    root : str
+        The scratch root.
+
+    Returns
+    -------
+    int
+        The size in bytes.
+
+    """
+    used = 0
+    try:
+        entries = [entry for entry in os.scandir(root)
+                   if entry.name.startswith(_SCRATCH_PREFIX) and entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return 0
+    for entry in entries:
+        for dirpath, _dirnames, filenames in os.walk(entry.path):
+            for filename in filenames:
+                try:
+                    used += os.lstat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    pass # removed in the meantime
+    return used
+
+
+# =============================================================================
+# Scratch directories
+# =============================================================================
+
+def new_scratch_dir(name='tmp', expected_size=0):
+    """
+    Create a new (unique) scratch directory.
+
+    Parameters
+    ----------
+    name : str, optional
+        Part of the directory name. The default is 'tmp'.
+    expected_size : int, optional
+        The expected size (in bytes) of the scratch files, it is checked
+        against the (advisory) quota, but not reserved. The default is 0.
+
+    Returns
+    -------
+    str
+        The path of the directory. It is removed when python exits, or with
+        remove_scratch_dir().
+
+    """
+    root = get_scratch_root(expected_size=expected_size)
+    quota = get_quota()
+    if quota is not None:
+        used = get_used_size(root)
+        if used + expected_size > quota:
+            sys.exit(f'The scratch quota ({quota} bytes, PYFA_SCRATCH_QUOTA) is exceeded in {root}: {used} bytes are used and {expected_size} are needed.')
+
+    path = tempfile.mkdtemp(prefix=f'{_SCRATCH_PREFIX}{name}_', dir=root)
+    _active_dirs.add(path)
+    return path
+
+
+def remove_scratch_dir(path):
+    """Remove a scratch directory (and all its content)."""
+    shutil.rmtree(path, ignore_errors=True)
+    _active_dirs.discard(path)
+
+
+@contextlib.contextmanager
+def scratch_dir(name='tmp', expected_size=0, keep=False):
+    """
+    Context of a scratch directory, that is removed when the context closes.
+
+    Parameters
+    ----------
+    name : str, optional
+        Part of the directory name. The default is 'tmp'.
+    expected_size : int, optional
+        The expected size (in bytes) of the scratch files. The default is 0.
+    keep : bool, optional
+        If True, the directory is not removed (for debugging), and its path
+        is printed. The default is False.
+
+    Yields
+    ------
+    str
+        The path of the scratch directory.
+
+    """
+    path = new_scratch_dir(name=name, expected_size=expected_size)
+    try:
+        yield path
+    finally:
+        if keep:
+            _active_dirs.discard(path)
+            print(f'The scratch directory {path} is kept.')
+        else:
+            remove_scratch_dir(path)
+
+
+@atexit.register
+def _cleanup():
+    """Remove the scratch directories that are left behind (e.g. after an error)."""
+    for path in list(_active_dirs):
+        remove_scratch_dir(path)
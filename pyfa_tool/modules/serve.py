@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A local field-serving daemon (pyfa serve).
+
+The server listens on localhost (HTTP) or on a Unix socket, and answers
+requests for slices (file, field, level, bbox/window and stride) of FA
+files. Decoded fields are kept in a bounded in-memory (LRU) cache, so
+repeated requests for the same field are answered without decoding. The
+decodes are done by a pool of backend instances (by default warm R workers).
+
+Endpoints (GET):
+    * /fields?file=PATH : the metadata and the fields of a FA file (json).
+    * /slice?file=PATH&field=NAME[&level=1,2][&bbox=xmin,ymin,xmax,ymax]
+      [&window=x_start,x_stop,y_start,y_stop][&stride=N] : a slice of a
+      field, as a binary payload (see pack_arrays()).
+    * /stats : the cache statistics (json).
+
+The client is pyfa_tool.client.FaClient.
+
+The server has no authentication: every local user that can connect (to the
+port, or to the Unix socket) can make it decode every FA file that the server
+can read, unless the served files are limited to a directory (root). The
+serve command serves the current directory by default.
+
+@author: thoverga
+"""
+
+import os
+import sys
+import json
+import queue
+import socket
+import struct
+import threading
+import contextlib
+import socketserver
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+import pyfa_tool.modules.archive as archive
+import pyfa_tool.modules.backends as backends
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+_PAYLOAD_MAGIC = b'PYFA1'
+_HEADER_LENGTH = struct.Struct('<I') # length of the json header of a payload
+
+
+# =============================================================================
+# Binary payload
+# =============================================================================
+
+def pack_arrays(header, arrays):
+    """
+    Pack a json header and numpy arrays in a compact binary payload.
+
+    The payload is: the magic bytes, the length of the header (uint32), the
+    json header (with the name, dtype and shape of each array), and the raw
+    (little-endian, C-order) bytes of the arrays.
+
+    Parameters
+    ----------
+    header : dict
+        Json-serializable information.
+    arrays : dict
+        Name: numpy.array.
+
+    Returns
+    -------
+    bytes
+        The payload.
+
+    """
+    arrays = {name: np.ascontiguousarray(arr, dtype=np.asarray(arr).dtype.newbyteorder('<'))
+              for name, arr in arrays.items()}
+    header = dict(header)
+    header['arrays'] = [{'name': name, 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+                        for name, arr in arrays.items()]
+    header_bytes = json.dumps(header).encode()
+    return b''.join([_PAYLOAD_MAGIC, _HEADER_LENGTH.pack(len(header_bytes)), header_bytes]
+                    + [arr.tobytes() for arr in arrays.values()])
+
+
+def unpack_arrays(payload):
+    """
+    Unpack a payload of pack_arrays().
+
+    Parameters
+    ----------
+    payload : bytes or bytearray
+        The payload. The arrays are views on it (writable for a bytearray).
+
+    Returns
+    -------
+    header : dict
+        The json header.
+    arrays : dict
+        Name: numpy.array.
+
+    """
+    if bytes(payload[:len(_PAYLOAD_MAGIC)]) != _PAYLOAD_MAGIC:
+        sys.exit('The payload is not a PyFa payload.')
+    start = len(_PAYLOAD_MAGIC)
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload, start)
+    start += _HEADER_LENGTH.size
+    header = json.loads(bytes(payload[start:start + header_length]))
+    offset = start + header_length
+
+    arrays = {}
+    for spec in header['arrays']:
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        arrays[spec['name']] = np.frombuffer(payload, dtype=dtype, count=count,
+                                             offset=offset).reshape(spec['shape'])
+        offset += count * dtype.itemsize
+    return header, arrays
+
+
+def _to_json_value(value):
+    """Convert (numpy) attribute values to json-serializable values."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_json_value(val) for val in value]
+    return value
+
+
+# =============================================================================
+# Slicing
+# =============================================================================
+
+def slice_field(da, levels=None, bbox=None, window=None, stride=1):
+    """
+    Select a slice of a field.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        The field, (level,) y, x.
+    levels : list of int, optional
+        The levels to select (3D fields only). The default is None.
+    bbox : tuple of float, optional
+        (xmin, ymin, xmax, ymax) in the coordinates of the field (the native
+        projection). The default is None.
+    window : tuple of int, optional
+        (x_start, x_stop, y_start, y_stop) gridpoint indices (python slice
+        convention). The default is None.
+    stride : int, optional
+        Take every stride-th point in x and y. The default is 1.
+
+    Returns
+    -------
+    xarray.DataArray
+        The slice.
+
+    """
+    if levels is not None:
+        if 'level' not in da.dims:
+            sys.exit(f'{da.name} has no levels.')
+        missing = [lev for lev in levels if lev not in da['level'].values]
+        if bool(missing):
+            sys.exit(f'Levels {missing} are not found in {da.name}.')
+        da = da.sel(level=list(levels))
+    if window is not None:
+        x_start, x_stop, y_start, y_stop = window
+        da = da.isel(x=slice(x_start, x_stop), y=slice(y_start, y_stop))
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        xidx = np.flatnonzero((da['x'].values >= xmin) & (da['x'].values <= xmax))
+        yidx = np.flatnonzero((da['y'].values >= ymin) & (da['y'].values <= ymax))
+        if (xidx.size == 0) or (yidx.size == 0):
+            sys.exit(f'The bbox {bbox} does not overlap with the domain.')
+        da = da.isel(x=slice(xidx[0], xidx[-1] + 1), y=slice(yidx[0], yidx[-1] + 1))
+    if int(stride) < 1:
+        sys.exit(f'The stride must be at least 1, not {stride}.')
+    if int(stride) > 1:
+        da = da.isel(x=slice(None, None, int(stride)), y=slice(None, None, int(stride)))
+    return da
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+class FieldCache():
+    """A bounded (in bytes) LRU cache of decoded fields, safe to use from threads."""
+
+    def __init__(self, max_bytes=1024**3):
+        """
+        Initiate the cache.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The maximum size of the cached fields. The default is 1 GiB.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict() # key: (value, nbytes)
+        self._loading = {} # key: threading.Event of the loading thread
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'FieldCache with {len(self._entries)} fields ({self.nbytes} of {self.max_bytes} bytes)'
+
+    def __str__(self):
+        return self.__repr__()
+
+    def get(self, key, loader):
+        """
+        Get a value from the cache, or load (and cache) it.
+
+        If another thread is loading the same key, its result is waited for
+        (the value is loaded once).
+
+        Parameters
+        ----------
+        key : hashable
+            The key.
+        loader : callable
+            Called without arguments to load the value on a miss, returns
+            (value, nbytes).
+
+        Returns
+        -------
+        object
+            The value.
+
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                event = self._loading.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = threading.Event()
+                    self._loading[key] = event
+                    break
+            event.wait() # loaded by another thread (or failed), look again
+
+        try:
+            value, nbytes = loader()
+            with self._lock:
+                if nbytes <= self.max_bytes:
+                    self._entries[key] = (value, nbytes)
+                    self.nbytes += nbytes
+                    self._evict()
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            event.set()
+
+    def _evict(self):
+        """Drop the least recently used values until the cache fits (lock is held)."""
+        while self.nbytes > self.max_bytes:
+            _key, (_value, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def get_stats(self):
+        """The number of fields, bytes, hits and misses of the cache."""
+        with self._lock:
+            return {'fields': len(self._entries), 'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses}
+
+
+# =============================================================================
+# Server
+# =============================================================================
+
+class FaServer():
+    """Serve slices of the fields of FA files, with a cache of decoded fields."""
+
+    def __init__(self, backend='rworker', n_workers=2, max_cache_bytes=1024**3,
+                 root=None):
+        """
+        Initiate a FaServer.
+
+        Parameters
+        ----------
+        backend : str or FaBackend, optional
+            The backend used to decode the fields. For a name, n_workers
+            instances are made (for 'rworker', each with its own warm R
+            process). An instance is used by one request at a time. The
+            default is 'rworker'.
+        n_workers : int, optional
+            The number of decodes that run at the same time. The default is 2.
+        max_cache_bytes : int, optional
+            The maximum size of the cached fields. The default is 1 GiB.
+        root : str, optional
+            If given, only FA files in this directory (or archives in it) are
+            served, and relative paths are relative to it. If None, all files
+            that the server can read are served (to every local user that can
+            connect). The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.cache = FieldCache(max_bytes=max_cache_bytes)
+        self.root = None if root is None else os.path.abspath(root)
+
+        self._workers = queue.Queue()
+        if isinstance(backend, str):
+            if backend not in backends._BACKENDS:
+                sys.exit(f'{backend} is not a known backend. Choose from {list(backends._BACKENDS.keys())}.')
+            for _ in range(max(int(n_workers), 1)):
+                self._workers.put(backends._BACKENDS[backend]())
+        else:
+            self._workers.put(backends.get_backend(backend))
+        self._fafiles = collections.OrderedDict() # signature: FaFile (the last few)
+        self._fafiles_lock = threading.Lock()
+
+    def __repr__(self):
+        return f'FaServer ({self.cache})'
+
+    def __str__(self):
+        return self.__repr__()
+
+    @contextlib.contextmanager
+    def _worker(self):
+        """Context with a backend instance of the pool (waits for a free one)."""
+        backend = self._workers.get()
+        try:
+            yield backend
+        finally:
+            self._workers.put(backend)
+
+    def _resolve(self, fafile):
+        """Resolve a requested path (relative to the root) and check that it is allowed."""
+        if fafile is None:
+            sys.exit('No file is requested.')
+        if self.root is None:
+            return fafile
+        arch, member = archive.split_archive_path(fafile)
+        path = arch if arch is not None else member
+        path = os.path.abspath(os.path.join(self.root, path))
+        if os.path.commonpath([path, self.root]) != self.root:
+            sys.exit(f'{fafile} is not in the served directory.')
+        return path if arch is None else f'{path}{archive.ARCHIVE_SEPARATOR}{member}'
+
+    # =========================================================================
+    # Requests
+    # =========================================================================
+
+    def get_fafile(self, fafile):
+        """Get the (cached) FaFile of a FA file."""
+        from pyfa_tool.file import FaFile
+
+        signature = _cache_key(fafile)
+        with self._fafiles_lock:
+            if signature in self._fafiles:
+                self._fafiles.move_to_end(signature)
+                return self._fafiles[signature]
+        with self._worker() as backend:
+            FA = FaFile(fafile, backend=backend)
+        with self._fafiles_lock:
+            self._fafiles[signature] = FA
+            while len(self._fafiles) > 64:
+                self._fafiles.popitem(last=False)
+        return FA
+
+    def describe(self, fafile):
+        """
+        Get the metadata and the fields of a FA file.
+
+        Parameters
+        ----------
+        fafile : str
+            The path of the FA file.
+
+        Returns
+        -------
+        dict
+            'file', 'metadata' and 'fields' (the catalogue rows: field, kind,
+            levels, nbits, ...).
+
+        """
+        import pyfa_tool.modules.catalogue as catalogue
+
+        fafile = self._resolve(fafile)
+        FA = self.get_fafile(fafile)
+        rows = catalogue._describe_fafile(FA)
+        return {'file': fafile,
+                'metadata': {key: _to_json_value(val) for key, val in FA.metadata.items()},
+                'fields': [{key: _to_json_value(val) for key, val in row.items()
+                            if key in ['field', 'kind', 'levels', 'nbits', 'spectral',
+                                       'min', 'max', 'mean', 'n_nan']}
+                           for row in rows]}
+
+    def get_field(self, fafile, field):
+        """
+        Get a decoded field (from the cache, or decoded on a miss).
+
+        Parameters
+        ----------
+        fafile : str
+            The path of the FA file.
+        field : str
+            The 2D fieldname, 3D basename or pseudo 3D basename.
+
+        Returns
+        -------
+        da : xarray.DataArray
+            The field (all levels).
+        info : dict
+            'attrs' (of the dataset), 'validate', 'basedate' and 'crs'.
+
+        """
+        fafile = self._resolve(fafile)
+        return self.cache.get((_cache_key(fafile), field),
+                              lambda: self._decode_field(fafile, field))
+
+    def _decode_field(self, fafile, field):
+        """Decode one field of a FA file, returns ((da, info), nbytes)."""
+        from pyfa_tool.dataset import FaDataset
+
+        FA = self.get_fafile(fafile)
+        # the levels of a pseudo 3D field are decoded as 2D fields
+        whitelist = [name for name in FA._pure_pseudo_3d_fieldnames
+                     if name[4:].strip() == field]
+        if not bool(whitelist):
+            whitelist = [field]
+
+        with self._worker() as backend:
+            dataset = FaDataset(fafile=fafile, backend=backend)
+            dataset.import_fa(whitelist=whitelist)
+        if not dataset.field_exist(field):
+            sys.exit(f'{field} is not found in {fafile}.')
+
+        ds = dataset.ds
+        da = ds[field]
+        da = da.reset_coords(drop=True)
+        da.load()
+        info = {'attrs': {key: _to_json_value(val) for key, val in ds.attrs.items()},
+                'validate': str(ds['validate'].values[0]),
+                'basedate': str(ds['basedate'].values[0]),
+                'crs': None if ds.rio.crs is None else ds.rio.crs.to_wkt()}
+        nbytes = da.nbytes + sum(coord.nbytes for coord in da.coords.values())
+        return (da, info), nbytes
+
+    def get_slice(self, fafile, field, levels=None, bbox=None, window=None, stride=1):
+        """
+        Get a slice of a field as a binary payload (see pack_arrays()).
+
+        Parameters
+        ----------
+        fafile : str
+            The path of the FA file.
+        field : str
+            The 2D fieldname or 3D (pseudo 3D) basename.
+        levels, bbox, window, stride :
+            See slice_field().
+
+        Returns
+        -------
+        bytes
+            The payload, with the 'values', 'x', 'y' (and 'level') arrays.
+
+        """
+        da, info = self.get_field(fafile, field)
+        da = slice_field(da, levels=levels, bbox=bbox, window=window, stride=stride)
+
+        arrays = {'values': da.values, 'x': da['x'].values, 'y': da['y'].values}
+        if 'level' in da.dims:
+            arrays['level'] = da['level'].values
+        header = {'file': str(fafile), 'field': field, 'dims': list(da.dims),
+                  'field_attrs': {key: _to_json_value(val) for key, val in da.attrs.items()},
+                  **info}
+        return pack_arrays(header, arrays)
+
+    # =========================================================================
+    # Serving
+    # =========================================================================
+
+    def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+        """
+        Serve requests until interrupted (Ctrl-C).
+
+        Parameters
+        ----------
+        host : str, optional
+            The host to listen on (HTTP). The default is 127.0.0.1.
+        port : int, optional
+            The port to listen on (HTTP). The default is 8765.
+        socket_path : str, optional
+            If given, listen on this Unix socket instead of host:port. The
+            default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        httpd = self.make_server(host=host, port=port, socket_path=socket_path)
+        where = socket_path if socket_path is not None else f'http://{host}:{httpd.server_address[1]}'
+        print(f'Serving FA fields on {where} (Ctrl-C to stop)')
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print('Stopping the server.')
+        finally:
+            httpd.server_close()
+            if socket_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(socket_path)
+
+    def make_server(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+        """Make the (threading) socket server, without serving (see serve())."""
+        handler = type('_BoundHandler', (_RequestHandler,), {'faserver': self})
+        if socket_path is None:
+            return ThreadingHTTPServer((host, int(port)), handler)
+        if os.path.exists(socket_path):
+            # only replace a stale socket, not another file
+            if not _is_stale_socket(socket_path):
+                sys.exit(f'{socket_path} exists (and is not a stale socket).')
+            os.remove(socket_path)
+        return _ThreadingUnixHTTPServer(socket_path, handler)
+
+
+def _cache_key(fafile):
+    """The key of a FA file in the caches (a rewritten file gets a new key)."""
+    signature = archive.file_signature(fafile)
+    # paths that are not on disk (e.g. for the synthetic backend) are checked
+    # by the backend when the FA file is opened
+    return str(fafile) if signature is None else signature
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP on a Unix socket."""
+    daemon_threads = True
+
+
+def _is_stale_socket(socket_path):
+    """Check if a Unix socket file has no server listening on it."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            return False
+    return False
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Answer the requests of a FaServer (the faserver attribute is set on a subclass)."""
+
+    faserver = None
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # there is no address for Unix sockets
+        return str(self.client_address[0]) if bool(self.client_address) else 'unix'
+
+    def log_message(self, format, *args):
+        pass # keep the output of the server clean
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+        try:
+            if url.path == '/fields':
+                self._send(200, json.dumps(self.faserver.describe(query.get('file'))).encode(),
+                           'application/json')
+            elif url.path == '/slice':
+                if 'field' not in query:
+                    sys.exit('No field is requested.')
+                payload = self.faserver.get_slice(query.get('file'), query['field'],
+                                                  levels=_parse_list(query.get('level'), int),
+                                                  bbox=_parse_list(query.get('bbox'), float),
+                                                  window=_parse_list(query.get('window'), int),
+                                                  stride=int(query.get('stride', 1)))
+                self._send(200, payload, 'application/octet-stream')
+            elif url.path == '/stats':
+                self._send(200, json.dumps(self.faserver.cache.get_stats()).encode(),
+                           'application/json')
+            else:
+                self._send(404, f'Unknown request {url.path}.'.encode(), 'text/plain')
+        except SystemExit as e:
+            # the errors of PyFa (e.g. unknown field), the server keeps running
+            self._send(400, str(e.code).encode(), 'text/plain')
+        except ValueError as e:
+            self._send(400, str(e).encode(), 'text/plain')
+        except Exception as e:
+            # e.g. a failing decoder or a file that is removed, the client
+            # gets the error instead of a closed connection
+            self._send(500, f'{type(e).__name__}: {e}'.encode(), 'text/plain')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _parse_list(value, cast):
+    """Parse a comma separated query value (None if not given)."""
+    if (value is None) or (value == ''):
+        return None
+    return [cast(val) for val in str(value).split(',')]
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spectral to grid-point transform of LAM (bi-Fourier) fields in NumPy.
+
+EXPERIMENTAL: the R scripts (RFa) decode spectral fields to grid-point
+values with FAdec, so no payload of a real FA file holds coefficients. This
+transform is only applied to the payloads of backends that return the
+coefficients (currently only the synthetic backend), and it is not exposed
+through FaDataset.import_fa(). It has not been validated against FAdec.
+
+LAM models (ALADIN, AROME, ALARO) store spectral fields as bi-Fourier
+coefficients on the extended (C+I+E) grid, with an elliptic truncation:
+only the coefficients with (m/nmsmax)^2 + (n/nsmax)^2 <= 1 are kept, where
+m is the zonal (x) and n the meridional (y) wavenumber.
+
+In PyFa the coefficients of a field are stored in a compact complex array with
+shape (..., 2*nsmax + 1, nmsmax + 1): the rows are the meridional wavenumbers
+n = -nsmax, ..., nsmax and the columns the zonal wavenumbers m = 0, ..., nmsmax
+(the coefficients of negative m follow from the hermitian symmetry of a real
+field). Leading dimensions (e.g. levels) are transformed together.
+
+The index arrays and elliptic masks only depend on the geometry, so they are
+computed once per geometry and truncation (a SpectralPlan) and cached.
+
+The transform works on the extended grid, the caller crops the extension zone
+(the C+I zone is the first ndgux rows and ndlux columns, see
+reading_fa.spectral_payload_to_gridpoint()).
+
+@author: thoverga
+"""
+
+import sys
+import functools
+
+import numpy as np
+
+
+# =============================================================================
+# Transform plans
+# =============================================================================
+
+class SpectralPlan():
+    """The geometry dependent part of the spectral transform (cached)."""
+
+    def __init__(self, ny, nx, nsmax, nmsmax, truncation=1.):
+        """
+        Create a transform plan.
+
+        Parameters
+        ----------
+        ny : int
+            Number of grid points in Y (extended grid).
+        nx : int
+            Number of grid points in X (extended grid).
+        nsmax : int
+            The meridional truncation of the coefficients.
+        nmsmax : int
+            The zonal truncation of the coefficients.
+        truncation : float, optional
+            Fraction (0, 1] of the truncation to keep. Values smaller than 1
+            drop the small scales (e.g. for fast, smooth previews). The
+            default is 1.
+
+        Returns
+        -------
+        None.
+
+        """
+        if (2 * nsmax + 1 > ny) | (2 * nmsmax + 1 > nx):
+            sys.exit(f'The truncation (nsmax={nsmax}, nmsmax={nmsmax}) does not fit on a {nx}x{ny} grid.')
+        if not (0. < truncation <= 1.):
+            sys.exit(f'The truncation fraction must be in (0, 1], not {truncation}.')
+
+        self.ny = int(ny)
+        self.nx = int(nx)
+        self.nsmax = int(nsmax)
+        self.nmsmax = int(nmsmax)
+        self.truncation = float(truncation)
+
+        # elliptic truncation mask on the compact layout
+        self.mask = elliptic_mask(nsmax=self.nsmax, nmsmax=self.nmsmax,
+                                  truncation=self.truncation)
+
+        # position of the kept coefficients in the compact layout ...
+        self._src_rows, self._src_cols = np.nonzero(self.mask)
+        # ... and in the half spectrum of a (ny, nx) real FFT
+        self._dst_rows = (self._src_rows - self.nsmax) % self.ny
+        self._dst_cols = self._src_cols
+
+    def __repr__(self):
+        return f'SpectralPlan({self.nx}x{self.ny}, nsmax={self.nsmax}, nmsmax={self.nmsmax}, truncation={self.truncation})'
+
+    def __str__(self):
+        return self.__repr__()
+
+    def to_gridpoint(self, coeffs, dtype=np.float64):
+        """
+        Transform spectral coefficients to grid-point values.
+
+        Parameters
+        ----------
+        coeffs : numpy.array (complex)
+            The coefficients in the compact layout, with shape
+            (..., 2*nsmax + 1, nmsmax + 1).
+        dtype : numpy.dtype, optional
+            The dtype of the grid-point values. The default is float64.
+
+        Returns
+        -------
+        numpy.array
+            The grid-point values with shape (..., ny, nx).
+
+        """
+        coeffs = np.asarray(coeffs)
+        if coeffs.shape[-2:] != self.mask.shape:
+            sys.exit(f'The coefficients with shape {coeffs.shape} do not match the truncation of {self}.')
+
+        spectrum = np.zeros(coeffs.shape[:-2] + (self.ny, self.nx // 2 + 1),
+                            dtype=np.complex128)
+        spectrum[..., self._dst_rows, self._dst_cols] = coeffs[..., self._src_rows, self._src_cols]
+
+        # one FFT call for all leading dimensions (levels)
+        grid = np.fft.irfft2(spectrum, s=(self.ny, self.nx), axes=(-2, -1))
+        grid *= self.ny * self.nx
+        return grid.astype(dtype, copy=False)
+
+    def to_spectral(self, grid):
+        """
+        Transform grid-point values to (truncated) spectral coefficients.
+
+        Parameters
+        ----------
+        grid : numpy.array
+            The grid-point values with shape (..., ny, nx).
+
+        Returns
+        -------
+        numpy.array (complex)
+            The coefficients in the compact layout, with shape
+            (..., 2*nsmax + 1, nmsmax + 1).
+
+        """
+        grid = np.asarray(grid, dtype=np.float64)
+        spectrum = np.fft.rfft2(grid, axes=(-2, -1)) / (self.ny * self.nx)
+        coeffs = np.zeros(grid.shape[:-2] + self.mask.shape, dtype=np.complex128)
+        coeffs[..., self._src_rows, self._src_cols] = spectrum[..., self._dst_rows, self._dst_cols]
+        return coeffs
+
+
+def elliptic_mask(nsmax, nmsmax, truncation=1.):
+    """
+    Create the elliptic truncation mask on the compact coefficient layout.
+
+    Parameters
+    ----------
+    nsmax : int
+        The meridional truncation.
+    nmsmax : int
+        The zonal truncation.
+    truncation : float, optional
+        Fraction (0, 1] of the truncation to keep. The default is 1.
+
+    Returns
+    -------
+    numpy.array (bool)
+        The mask with shape (2*nsmax + 1, nmsmax + 1).
+
+    """
+    n = np.arange(-nsmax, nsmax + 1)[:, np.newaxis]
+    m = np.arange(0, nmsmax + 1)[np.newaxis, :]
+    ns_trunc = max(nsmax * truncation, 1e-12)
+    nms_trunc = max(nmsmax * truncation, 1e-12)
+    return (n / ns_trunc)**2 + (m / nms_trunc)**2 <= 1. + 1e-9
+
+
+@functools.lru_cache(maxsize=32)
+def get_spectral_plan(ny, nx, nsmax, nmsmax, truncation=1.):
+    """Get the (cached) SpectralPlan of a geometry (see SpectralPlan)."""
+    return SpectralPlan(ny=ny, nx=nx, nsmax=nsmax, nmsmax=nmsmax,
+                        truncation=truncation)
+
+
+# =============================================================================
+# Functions
+# =============================================================================
+
+def truncation_of_coeffs(coeffs):
+    """Get the (nsmax, nmsmax) truncation from the compact coefficient layout."""
+    shape = np.shape(coeffs)
+    return (shape[-2] - 1) // 2, shape[-1] - 1
+
+
+def spectral_to_gridpoint(coeffs, ny, nx, truncation=1., dtype=np.float64):
+    """
+    Transform spectral coefficients (compact layout) to grid-point values.
+
+    Parameters
+    ----------
+    coeffs : numpy.array (complex)
+        The coefficients in the compact layout, with shape
+        (..., 2*nsmax + 1, nmsmax + 1). All leading dimensions (e.g. levels)
+        are transformed in one FFT call.
+    ny : int
+        Number of grid points in Y (extended grid).
+    nx : int
+        Number of grid points in X (extended grid).
+    truncation : float, optional
+        Fraction (0, 1] of the truncation to keep. The default is 1.
+    dtype : numpy.dtype, optional
+        The dtype of the grid-point values. The default is float64.
+
+    Returns
+    -------
+    numpy.array
+        The grid-point values with shape (..., ny, nx).
+
+    """
+    nsmax, nmsmax = truncation_of_coeffs(coeffs)
+    plan = get_spectral_plan(ny=int(ny), nx=int(nx), nsmax=nsmax,
+                             nmsmax=nmsmax, truncation=float(truncation))
+    return plan.to_gridpoint(coeffs, dtype=dtype)
+
+
+def gridpoint_to_spectral(grid, nsmax, nmsmax):
+    """
+    Transform grid-point values to spectral coefficients (compact layout).
+
+    Parameters
+    ----------
+    grid : numpy.array
+        The grid-point values with shape (..., ny, nx).
+    nsmax : int
+        The meridional truncation.
+    nmsmax : int
+        The zonal truncation.
+
+    Returns
+    -------
+    numpy.array (complex)
+        The coefficients with shape (..., 2*nsmax + 1, nmsmax + 1).
+
+    """
+    ny, nx = np.shape(grid)[-2:]
+    plan = get_spectral_plan(ny=int(ny), nx=int(nx), nsmax=int(nsmax),
+                             nmsmax=int(nmsmax), truncation=1.)
+    return plan.to_spectral(grid)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append FaDatasets to a combined collection store (netCDF or zarr).
+
+A collection store has the structure of a FaCollection that is combined by
+validate (and saved with save_nc() or save_zarr()). New FaDatasets are
+appended on the validate dimension:
+
+    * If the new validates come after the stored ones, and the fields, levels
+      and dates match, only the new validate slices are written (and the
+      'origins' and 'filepaths' attributes are updated). For netCDF stores
+      the validate dimension must be unlimited (the stores written here, and
+      FaCollection.save_nc(appendable=True)), zarr stores are always
+      appendable. The time of an append does not depend on the size of the
+      store.
+    * Else (e.g. a validate is replaced or inserted, or a field is added)
+      the store is rewritten, to a temporary file that replaces the store,
+      with an unlimited validate dimension.
+
+The geometry (projection and grid) and the vertical level definitions (A and
+B lists) must be the same, else nothing is written. Stores that were written
+when the B list was filled with the A list get the B list of the new
+FaDatasets (with a warning).
+
+The 'filepaths' attribute is written last, so an append that is interrupted
+leaves more validates than filepaths. These incomplete validates are dropped
+(the store is rewritten) by the next append.
+
+@author: thoverga
+"""
+
+import os
+import sys
+import shutil
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import pyfa_tool.modules.IO as IO
+import pyfa_tool.modules.reading_fa as reading_fa
+
+
+# The validates are encoded in seconds, so every new validate can be appended
+VALIDATE_ENCODING = {'units': 'seconds since 1970-01-01 00:00:00', 'dtype': 'int64'}
+
+
+# =============================================================================
+# Stores
+# =============================================================================
+
+def is_zarr_store(store):
+    """Check if a store path is a zarr store (.zarr or a directory)."""
+    return str(store).rstrip('/').endswith('.zarr') or os.path.isdir(store)
+
+
+def store_exists(store):
+    """Check if a (netCDF or zarr) store exists."""
+    if is_zarr_store(store):
+        return os.path.isdir(store)
+    return IO.check_file_exist(store)
+
+
+def open_store(store):
+    """
+    Open a collection store lazily (only the coordinates are read).
+
+    Parameters
+    ----------
+    store : str
+        Path of the netCDF file or zarr store.
+
+    Returns
+    -------
+    xarray.Dataset
+        The stored collection.
+
+    """
+    if is_zarr_store(store):
+        try:
+            stored = xr.open_zarr(store)
+        except ImportError:
+            sys.exit('Reading zarr stores requires zarr (pip install zarr).')
+    else:
+        stored = xr.open_dataset(store, engine='netcdf4')
+    return stored
+
+
+def add_validate_encoding(kwargs):
+    """Add the encoding of the validate coordinate to the kwargs of a store writer (to_netcdf/to_zarr)."""
+    encoding = dict(kwargs.get('encoding', {}))
+    encoding['validate'] = {**VALIDATE_ENCODING, **encoding.get('validate', {})}
+    kwargs['encoding'] = encoding
+    return kwargs
+
+
+# =============================================================================
+# Checks
+# =============================================================================
+
+def check_compatible(reference, ds, name):
+    """
+    Check that a dataset has the geometry and level definitions of a reference.
+
+    Parameters
+    ----------
+    reference : xarray.Dataset
+        The stored collection (or the first new dataset).
+    ds : xarray.Dataset
+        The dataset that is appended.
+    name : str
+        Description of the dataset, used in the error message.
+
+    Returns
+    -------
+    None.
+
+    """
+    if str(reference.attrs.get('projection')) != str(ds.attrs.get('projection')):
+        sys.exit(f'Appending {name} is not possible since another projection is used.')
+    for dim in ['x', 'y']:
+        if ((reference.sizes.get(dim) != ds.sizes.get(dim)) or
+                (not np.allclose(reference[dim].values, ds[dim].values))):
+            sys.exit(f'Appending {name} is not possible since another grid is used ({dim} coordinates).')
+
+    # check if the vertical level defenitions is the same (A and B list)
+    for attr in ['A_list', 'B_list']:
+        if not np.array_equal(np.atleast_1d(reference.attrs.get(attr)),
+                              np.atleast_1d(ds.attrs.get(attr))):
+            sys.exit(f'Appending {name} is not possible since other defenition of levels is used ({attr})')
+
+
+def _migrate_b_list(stored, new, store):
+    """Replace the B list of a store that was written with the A list as B list (in memory)."""
+    a_list = np.atleast_1d(stored.attrs.get('A_list'))
+    b_list = np.atleast_1d(stored.attrs.get('B_list'))
+    new_b_list = np.atleast_1d(new.attrs.get('B_list'))
+    if (np.array_equal(b_list, a_list) and
+            np.array_equal(a_list, np.atleast_1d(new.attrs.get('A_list'))) and
+            (not np.array_equal(new_b_list, a_list))):
+        print(f'WARNING: the B_list of {store} is a copy of the A_list (written by an older version of PyFa), it is replaced by the B_list of the new FaDatasets.')
+        stored.attrs['B_list'] = new.attrs['B_list']
+
+
+def _count_complete_validates(stored, store):
+    """The number of validates of a store, without the validates of an interrupted append."""
+    nvalidates = stored.sizes['validate']
+    if 'filepaths' not in stored.attrs:
+        return nvalidates
+    nfilepaths = len(np.atleast_1d(stored.attrs['filepaths']))
+    if nfilepaths < nvalidates:
+        print(f'WARNING: the last {nvalidates - nfilepaths} validates of {store} are incomplete (an interrupted append), they are dropped.')
+        return nfilepaths
+    return nvalidates
+
+
+def _validate_fields(stored, new):
+    """The fields (with the validate dimension) of a store."""
+    return {name: var for name, var in stored.data_vars.items()
+            if ('validate' in var.dims) and (name not in new.coords)}
+
+
+def _match_validate_coords(stored, new):
+    """Give the coordinates that are stored per validate (e.g. spatial_ref) the validate dimension."""
+    names = [name for name, var in stored.variables.items()
+             if (name in new.coords) and (name != 'validate')
+             and ('validate' in var.dims) and ('validate' not in new[name].dims)]
+    for name in names:
+        new = new.assign_coords({name: xr.broadcast(new[name], new['validate'])[0]})
+    return new
+
+
+def _can_append(stored, new):
+    """Check if only the new validate slices can be written (else the store is rewritten)."""
+    if new['validate'].values.min() <= stored['validate'].values.max():
+        return False, 'the validates are not after the stored validates'
+    fields = _validate_fields(stored, new)
+    if set(fields) != set(new.data_vars):
+        return False, 'the fields are not the same'
+    for name, var in new.data_vars.items():
+        if set(var.dims) != set(fields[name].dims):
+            return False, f'the dimensions of {name} are not the same'
+    if ('level' in stored.dims) != ('level' in new.dims):
+        return False, 'the levels are not the same'
+    if ('level' in new.dims) and (not np.array_equal(stored['level'].values, new['level'].values)):
+        return False, 'the levels are not the same'
+    if ('basedate' in new.coords) and (not np.isin(new['basedate'].values,
+                                                   stored['basedate'].values).all()):
+        return False, 'the basedate is not in the store'
+    return True, ''
+
+
+# =============================================================================
+# Appending
+# =============================================================================
+
+def datasets_to_slices(datasets):
+    """
+    Combine FaDatasets to validate slices that can be appended to a store.
+
+    Parameters
+    ----------
+    datasets : list of FaDataset
+        The (imported) FaDatasets.
+
+    Returns
+    -------
+    new : xarray.Dataset
+        The datasets, combined on validate (all fields have the validate
+        dimension) and sorted.
+    origins : list
+        The origin of each validate.
+    filepaths : list
+        The FA file of each validate.
+
+    """
+    if len(datasets) == 0:
+        sys.exit('No FaDatasets are provided.')
+    slices, origins, filepaths = [], [], []
+    for dataset in sorted(datasets, key=lambda x: x.get_validate()):
+        ds = dataset.ds.copy()
+        origins.append(str(ds.attrs.pop('origin', '')))
+        filepaths.append(str(ds.attrs.pop('filepath', '')))
+        if bool(slices):
+            check_compatible(slices[0], ds, name=filepaths[-1])
+        slices.append(ds)
+
+    new = xr.concat(slices,
+                    dim='validate',
+                    data_vars='all',
+                    coords='minimal',
+                    compat='override',
+                    fill_value=np.nan,
+                    join='outer',
+                    combine_attrs='override')
+    if not new.indexes['validate'].is_unique:
+        sys.exit(f'Some FaDatasets have the same validate: {filepaths}')
+    return reading_fa._to_canonical_layout(new), origins, filepaths
+
+
+def append_datasets(store, datasets):
+    """
+    Append FaDatasets to a (netCDF or zarr) collection store, on validate.
+
+    If the store does not exist, it is created. Validates that are already
+    in the store are replaced.
+
+    Parameters
+    ----------
+    store : str
+        Path of the collection store (a .zarr path, or a directory, is a zarr
+        store, else netCDF).
+    datasets : list of FaDataset
+        The (imported) FaDatasets to append.
+
+    Returns
+    -------
+    None.
+
+    """
+    new, origins, filepaths = datasets_to_slices(datasets)
+
+    if not store_exists(store):
+        new.attrs['origins'] = origins
+        new.attrs['filepaths'] = filepaths
+        _write_store(new, store)
+        return
+
+    with open_store(store) as stored:
+        _migrate_b_list(stored, new, store)
+        check_compatible(stored, new, name=f'{filepaths} to {store}')
+        ncomplete = _count_complete_validates(stored, store)
+        origins = list(np.atleast_1d(stored.attrs.get('origins', [])))[:ncomplete] + origins
+        filepaths = list(np.atleast_1d(stored.attrs.get('filepaths', [])))[:ncomplete] + filepaths
+        attrs = dict(stored.attrs)
+        attrs['origins'] = [str(origin) for origin in origins]
+        attrs['filepaths'] = [str(filepath) for filepath in filepaths]
+        if ncomplete < stored.sizes['validate']:
+            can_append, reason = False, 'the last append is incomplete'
+        else:
+            can_append, reason = _can_append(stored, new)
+        appended = _match_validate_coords(stored, new)
+    # (the store is closed, so it can be written)
+
+    if can_append:
+        if is_zarr_store(store):
+            can_append = _append_zarr(appended, store, attrs)
+        else:
+            can_append, reason = _append_netcdf(appended, store, attrs)
+    if can_append:
+        return
+
+    print(f'The store {store} is rewritten ({reason}).')
+    with open_store(store) as stored:
+        stored = stored.isel(validate=slice(0, ncomplete)).load()
+    stored.attrs.update(attrs) # e.g. a replaced B_list
+    # coordinates without dimension (like spatial_ref) are read as variables
+    stored = stored.set_coords([name for name in new.coords if name in stored.data_vars])
+    combined = _merge(stored, new, origins, filepaths, store)
+    _write_store(combined, store)
+
+
+def _merge(stored, new, origins, filepaths, store):
+    """Merge the new validates in the stored collection (replacing validates)."""
+    # encode the store as a new file (e.g. the time units change with the first validate)
+    for var in stored.variables.values():
+        var.encoding = {}
+    nstored = stored.sizes['validate']
+
+    # Replace an earlier version of the same validate
+    is_replaced = np.append(stored['validate'].isin(new['validate'].values).values,
+                            np.zeros(new.sizes['validate'], dtype=bool))
+    if is_replaced.any():
+        print(f'WARNING: {stored["validate"].values[is_replaced[:nstored]]} is replaced in {store}.')
+        stored = stored.isel(validate=~is_replaced[:nstored])
+
+    combined = xr.concat([stored, new],
+                         dim='validate',
+                         data_vars='all',
+                         coords='minimal',
+                         compat='override',
+                         fill_value=np.nan,
+                         join='outer',
+                         combine_attrs='override')
+    keep = ~is_replaced
+    order = np.argsort(combined['validate'].values)
+    combined = combined.isel(validate=order)
+    combined.attrs['origins'] = list(np.array(origins)[keep][order])
+    combined.attrs['filepaths'] = list(np.array(filepaths)[keep][order])
+    return reading_fa._to_canonical_layout(combined)
+
+
+def _append_netcdf(new, store, attrs):
+    """Write the new validate slices at the end of a netCDF store (in place)."""
+    import netCDF4
+
+    with netCDF4.Dataset(store, mode='r') as nc:
+        if ('validate' not in nc.dimensions) or (not nc.dimensions['validate'].isunlimited()):
+            return False, 'the validate dimension is not unlimited'
+        timevar = nc['validate']
+        times = netCDF4.date2num(pd.to_datetime(new['validate'].values).to_pydatetime(),
+                                 timevar.units, getattr(timevar, 'calendar', 'standard'))
+        if (timevar.dtype.kind in 'iu') and (not np.allclose(times, np.round(times))):
+            return False, f'the validates can not be encoded in {timevar.units}'
+        # all variables with the validate dimension (fields and coordinates)
+        dimensions = {name: var.dimensions for name, var in nc.variables.items()
+                      if ('validate' in var.dimensions) and (name != 'validate')}
+        for name, dims in dimensions.items():
+            if (name not in new.variables) or (set(dims) != set(new[name].dims)):
+                return False, f'{name} is not in the new validates'
+
+    with netCDF4.Dataset(store, mode='a') as nc:
+        start = len(nc.dimensions['validate'])
+        stop = start + new.sizes['validate']
+        # the validates are written first, so the validate dimension never
+        # has slices without a validate
+        nc['validate'][start:stop] = np.round(times) if timevar.dtype.kind in 'iu' else times
+        for name, dims in dimensions.items():
+            index = tuple(slice(start, stop) if dim == 'validate' else slice(None)
+                          for dim in dims)
+            nc[name][index] = new[name].transpose(*dims).values
+        # the filepaths are written last, they mark the new slices as complete
+        # (see _count_complete_validates())
+        if 'B_list' in attrs:
+            nc.setncattr('B_list', attrs['B_list'])
+        nc.setncattr('origins', attrs['origins'])
+        nc.setncattr('filepaths', attrs['filepaths'])
+    print(f'{new.sizes["validate"]} validates appended to {store}')
+    return True, ''
+
+
+def _append_zarr(new, store, attrs):
+    """Write the new validate slices at the end of a zarr store (in place)."""
+    new = new.copy()
+    new.attrs = attrs
+    try:
+        new.to_zarr(store, append_dim='validate')
+    except ImportError:
+        sys.exit('Writing zarr stores requires zarr (pip install zarr).')
+    print(f'{new.sizes["validate"]} validates appended to {store}')
+    return True
+
+
+def _write_store(ds, store):
+    """(Re)write a store, to a temporary path that replaces the store."""
+    store_dir = os.path.dirname(os.path.abspath(store))
+    tmp_store = os.path.join(store_dir, f'.{os.path.basename(str(store).rstrip("/"))}.tmp')
+    if is_zarr_store(store):
+        IO.save_as_zarr(xrdata=ds, store=tmp_store, overwrite=True,
+                        **add_validate_encoding({}))
+        if os.path.isdir(store):
+            shutil.rmtree(store)
+        os.replace(tmp_store, store)
+        return
+
+    # an unlimited validate dimension, so the next validates can be appended
+    IO.save_as_nc(xrdata=ds,
+                  outputfolder=store_dir,
+                  filename=f'{os.path.basename(tmp_store)}.nc',
+                  overwrite=True,
+                  unlimited_dims=['validate'],
+                  **add_validate_encoding({}))
+    os.replace(f'{tmp_store}.nc', store)
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Running (streaming) statistics of fields, and the binning of validates.
+
+The statistics are updated one field at a time, so memory is bounded by the
+accumulators (count, sum, min, max, mean and M2 of the Welford algorithm, or
+fixed bin histograms for percentiles) instead of all the fields of a period
+or an ensemble. Percentiles are exact as long as keeping the fields uses less
+memory than the histograms.
+
+@author: thoverga
+"""
+
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+# The available statistics
+STATS = ['mean', 'sum', 'min', 'max', 'std', 'var', 'count']
+
+# The accumulators needed for each statistic
+_ACCUMULATORS = {'mean': ['count', 'mean'],
+                 'sum': ['count', 'sum'],
+                 'min': ['count', 'min'],
+                 'max': ['count', 'max'],
+                 'std': ['count', 'mean', 'm2'],
+                 'var': ['count', 'mean', 'm2'],
+                 'count': ['count']}
+
+
+# =============================================================================
+# Running statistics
+# =============================================================================
+
+class RunningStats():
+    """Elementwise running statistics of arrays with the same shape (NaN is skipped)."""
+
+    def __init__(self, shape, stats=['mean']):
+        """
+        Initiate the accumulators.
+
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the arrays.
+        stats : list, optional
+            The statistics to compute (see STATS). The default is ['mean'].
+
+        Returns
+        -------
+        None.
+
+        """
+        check_stats(stats)
+        self.shape = tuple(shape)
+        self.stats = list(stats)
+
+        needed = set([acc for stat in self.stats for acc in _ACCUMULATORS[stat]])
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.mean = np.zeros(self.shape) if 'mean' in needed else None
+        self.m2 = np.zeros(self.shape) if 'm2' in needed else None
+        self.sum = np.zeros(self.shape) if 'sum' in needed else None
+        self.min = np.full(self.shape, np.inf) if 'min' in needed else None
+        self.max = np.full(self.shape, -np.inf) if 'max' in needed else None
+
+    def __repr__(self):
+        return f'RunningStats({self.stats}) of {self.shape} arrays'
+
+    def __str__(self):
+        return self.__repr__()
+
+    def update(self, values):
+        """
+        Add an array to the statistics.
+
+        Parameters
+        ----------
+        values : numpy.array
+            The array (same shape as the accumulators). NaN values are
+            skipped.
+
+        Returns
+        -------
+        None.
+
+        """
+        values = np.asarray(values)
+        if values.shape != self.shape:
+            sys.exit(f'The shape of the values {values.shape} does not match the accumulators {self.shape}.')
+        valid = ~np.isnan(values)
+        self.count += valid
+
+        if self.mean is not None:
+            # Welford update (only where the values are valid)
+            delta = np.where(valid, values - self.mean, 0.)
+            self.mean += np.divide(delta, self.count, out=np.zeros(self.shape),
+                                   where=valid)
+            if self.m2 is not None:
+                self.m2 += delta * np.where(valid, values - self.mean, 0.)
+        if self.sum is not None:
+            self.sum += np.where(valid, values, 0.)
+        if self.min is not None:
+            np.fmin(self.min, values, out=self.min)
+        if self.max is not None:
+            np.fmax(self.max, values, out=self.max)
+
+    def result(self, stat, dtype=np.float64):
+        """
+        Get a statistic.
+
+        Parameters
+        ----------
+        stat : str
+            One of the computed statistics.
+        dtype : numpy.dtype, optional
+            The dtype of the result (not used for 'count'). The default is
+            float64.
+
+        Returns
+        -------
+        numpy.array
+            The statistic, NaN where there are no valid values (the standard
+            deviation and variance are the population ones, ddof=0).
+
+        """
+        if stat not in self.stats:
+            sys.exit(f'{stat} is not computed, only {self.stats}.')
+        if stat == 'count':
+            return self.count.copy()
+
+        empty = self.count == 0
+        if stat == 'mean':
+            result = self.mean.copy()
+        elif stat == 'sum':
+            result = self.sum.copy()
+        elif stat == 'min':
+            result = self.min.copy()
+        elif stat == 'max':
+            result = self.max.copy()
+        else:
+            result = np.divide(self.m2, self.count, out=np.zeros(self.shape),
+                               where=~empty)
+            if stat == 'std':
+                result = np.sqrt(result)
+        result[empty] = np.nan
+        return result.astype(dtype, copy=False)
+
+
+class RunningHistogram():
+    """Elementwise running histograms with fixed bins, to estimate percentiles (NaN is skipped)."""
+
+    def __init__(self, shape, lower, upper, nbins=100):
+        """
+        Initiate the histograms.
+
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the arrays.
+        lower : float or numpy.array
+            The lower edge of the first bin (one for all points, or one per
+            point). Smaller values are counted in the first bin.
+        upper : float or numpy.array
+            The upper edge of the last bin (one for all points, or one per
+            point). Larger values are counted in the last bin.
+        nbins : int, optional
+            The number of bins, the resolution of the percentiles is
+            (upper - lower) / nbins. The default is 100.
+
+        Returns
+        -------
+        None.
+
+        Note
+        -------
+        The memory of the histograms is nbins times the memory of one
+        (uint16) array, and independent of the number of updates (at most
+        65535).
+
+        """
+        self.shape = tuple(shape)
+        self.lower = np.array(np.broadcast_to(np.asarray(lower, dtype=np.float64), self.shape))
+        upper = np.broadcast_to(np.asarray(upper, dtype=np.float64), self.shape)
+        if not np.all(upper > self.lower):
+            sys.exit('The upper edges of the histograms must be larger than the lower edges.')
+        self.nbins = int(nbins)
+        self.width = (upper - self.lower) / self.nbins
+
+        self.counts = np.zeros((self.nbins,) + self.shape, dtype=np.uint16)
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.n_outside = 0 # number of values outside [lower, upper]
+        self._offsets = np.arange(int(np.prod(self.shape)))
+
+    @property
+    def upper(self):
+        """The upper edges of the last bins."""
+        return self.lower + self.nbins * self.width
+
+    def __repr__(self):
+        return f'RunningHistogram({self.nbins} bins) of {self.shape} arrays'
+
+    def __str__(self):
+        return self.__repr__()
+
+    def update(self, values):
+        """
+        Add an array to the histograms.
+
+        Parameters
+        ----------
+        values : numpy.array
+            The array (same shape as the histograms). NaN values are skipped.
+
+        Returns
+        -------
+        None.
+
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != self.shape:
+            sys.exit(f'The shape of the values {values.shape} does not match the histograms {self.shape}.')
+        if self.count.max(initial=0) >= np.iinfo(np.uint16).max:
+            sys.exit('The histograms are full (65535 values).')
+
+        values = values.ravel()
+        valid = ~np.isnan(values)
+        position = (values[valid] - self.lower.ravel()[valid]) / self.width.ravel()[valid]
+        self.n_outside += int(np.count_nonzero((position < 0) | (position > self.nbins)))
+        idx = np.clip(np.floor(position), 0, self.nbins - 1).astype(np.int64)
+
+        # Each point gets one count, so the flat indices are unique
+        flat_counts = self.counts.reshape((self.nbins, -1))
+        flat_counts[idx, self._offsets[valid]] += 1
+        self.count.ravel()[valid] += 1
+
+    def percentiles(self, qs, dtype=np.float64):
+        """
+        Estimate percentiles (linear interpolation within the bins).
+
+        The cumulative counts are computed once (bin by bin) for all
+        percentiles, no (nbins, ...) temporaries are created.
+
+        Parameters
+        ----------
+        qs : list of float
+            The percentiles (0 to 100).
+        dtype : numpy.dtype, optional
+            The dtype of the result. The default is float64.
+
+        Returns
+        -------
+        numpy.array
+            The percentiles (the first axis), NaN where there are no valid
+            values.
+
+        """
+        qs = check_percentiles(qs)
+        targets = qs.reshape((-1,) + (1,) * len(self.shape)) / 100. * self.count
+
+        idx = np.full(targets.shape, -1, dtype=np.int64) # the bin of each percentile
+        before = np.zeros(targets.shape, dtype=np.int64) # the counts before that bin
+        inbin = np.zeros(targets.shape, dtype=np.int64) # the counts in that bin
+        cumulative = np.zeros(self.shape, dtype=np.int64)
+        for b in range(self.nbins):
+            counts = self.counts[b].astype(np.int64)
+            upto = cumulative + counts
+            # the first (non empty) bin where the cumulative count reaches the target
+            reached = (idx < 0) & (upto >= targets) & (upto > 0)
+            idx[reached] = b
+            before[reached] = np.broadcast_to(cumulative, targets.shape)[reached]
+            inbin[reached] = np.broadcast_to(counts, targets.shape)[reached]
+            cumulative = upto
+
+        fraction = np.divide(targets - before, inbin, out=np.zeros(targets.shape),
+                             where=inbin > 0)
+        result = self.lower + (idx + fraction) * self.width
+        result[:, self.count == 0] = np.nan
+        return result.astype(dtype, copy=False)
+
+    def percentile(self, q, dtype=np.float64):
+        """Estimate one percentile (see percentiles())."""
+        return self.percentiles([q], dtype=dtype)[0]
+
+
+class RunningPercentiles():
+    """
+    Elementwise running percentiles, exact for few arrays and estimated by histograms for many.
+
+    The arrays are kept (exact percentiles, as numpy.nanpercentile) as long
+    as they use less memory than the histograms. Then the histograms are
+    created, with a range per point from the kept arrays (their range widened
+    by half of it on both sides, unless a fixed range is given), and the kept
+    arrays are dropped.
+    """
+
+    def __init__(self, shape, nbins=100, lower=None, upper=None, dtype=np.float32):
+        """
+        Initiate the running percentiles.
+
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the arrays.
+        nbins : int, optional
+            The number of bins of the histograms. The default is 100.
+        lower : float, optional
+            The lower edge of the histograms (for all points). If None, the
+            range of each point is derived from the kept arrays. The default
+            is None.
+        upper : float, optional
+            The upper edge of the histograms (for all points). The default is
+            None.
+        dtype : numpy.dtype, optional
+            The dtype of the kept arrays. The default is float32.
+
+        Returns
+        -------
+        None.
+
+        """
+        if (lower is None) != (upper is None):
+            sys.exit('Give both the lower and the upper edge of the histograms, or none.')
+        self.shape = tuple(shape)
+        self.nbins = int(nbins)
+        self.lower = lower
+        self.upper = upper
+        self.dtype = np.dtype(dtype)
+        # keep the arrays while they use less memory than the (uint16) histograms
+        self.max_kept = max(int(self.nbins * np.dtype(np.uint16).itemsize // self.dtype.itemsize), 1)
+
+        self._kept = []
+        self.histogram = None
+
+    def __repr__(self):
+        method = 'exact' if self.histogram is None else f'{self.nbins} bins'
+        return f'RunningPercentiles({method}) of {self.shape} arrays'
+
+    def __str__(self):
+        return self.__repr__()
+
+    @property
+    def is_exact(self):
+        """True if the percentiles are computed from the kept arrays."""
+        return self.histogram is None
+
+    @property
+    def n_outside(self):
+        """The number of values outside the range of the histograms."""
+        return 0 if self.histogram is None else self.histogram.n_outside
+
+    def update(self, values):
+        """
+        Add an array.
+
+        Parameters
+        ----------
+        values : numpy.array
+            The array (same shape as the accumulators). NaN values are
+            skipped.
+
+        Returns
+        -------
+        None.
+
+        """
+        values = np.asarray(values)
+        if values.shape != self.shape:
+            sys.exit(f'The shape of the values {values.shape} does not match the accumulators {self.shape}.')
+        if self.histogram is not None:
+            self.histogram.update(values)
+            return
+        self._kept.append(values.astype(self.dtype, copy=True))
+        if len(self._kept) >= self.max_kept:
+            self._to_histogram()
+
+    def _to_histogram(self):
+        """Create the histograms (with the range of the kept arrays) and drop the kept arrays."""
+        kept = np.stack(self._kept)
+        if self.lower is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning) # all-NaN points
+                lower = np.nanmin(kept, axis=0).astype(np.float64)
+                upper = np.nanmax(kept, axis=0).astype(np.float64)
+            lower[np.isnan(lower)] = 0.
+            upper[np.isnan(upper)] = 0.
+            margin = np.maximum(0.5 * (upper - lower),
+                                1e-6 * np.maximum(np.maximum(np.abs(lower), np.abs(upper)), 1.))
+            lower, upper = lower - margin, upper + margin
+        else:
+            lower, upper = self.lower, self.upper
+        self.histogram = RunningHistogram(shape=self.shape, lower=lower, upper=upper,
+                                          nbins=self.nbins)
+        for values in kept:
+            self.histogram.update(values)
+        self._kept = []
+
+    def percentiles(self, qs, dtype=np.float64):
+        """
+        Get percentiles.
+
+        Parameters
+        ----------
+        qs : list of float
+            The percentiles (0 to 100).
+        dtype : numpy.dtype, optional
+            The dtype of the result. The default is float64.
+
+        Returns
+        -------
+        numpy.array
+            The percentiles (the first axis), NaN where there are no valid
+            values.
+
+        """
+        qs = check_percentiles(qs)
+        if self.histogram is not None:
+            return self.histogram.percentiles(qs, dtype=dtype)
+        if not bool(self._kept):
+            return np.full((qs.shape[0],) + self.shape, np.nan, dtype=dtype)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning) # all-NaN points
+            result = np.nanpercentile(np.stack(self._kept), qs, axis=0)
+        return result.astype(dtype, copy=False)
+
+
+def check_percentiles(qs):
+    """Check if the percentiles are in [0, 100], and get them as array."""
+    qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+    if np.any((qs < 0.) | (qs > 100.)):
+        sys.exit(f'The percentiles must be in [0, 100], not {list(qs)}.')
+    return qs
+
+
+def check_stats(stats):
+    """Check if all statistics are available."""
+    unknown = [stat for stat in stats if stat not in STATS]
+    if bool(unknown):
+        sys.exit(f'{unknown} are not available statistics, use {STATS}.')
+
+
+# =============================================================================
+# Binning
+# =============================================================================
+
+# Offsets with a fixed length (Day is no Tick since pandas 3)
+_FIXED_OFFSETS = (pd.offsets.Tick, pd.offsets.Day)
+
+
+def to_bin_offset(freq):
+    """
+    Convert a frequency to a pandas offset that can be used for binning.
+
+    Parameters
+    ----------
+    freq : str or pandas offset
+        A fixed frequency (e.g. '1D', '6h') or the start of a calendar period
+        ('MS', 'QS', 'YS').
+
+    Returns
+    -------
+    pandas.DateOffset
+        The offset.
+
+    """
+    offset = pd.tseries.frequencies.to_offset(freq)
+    if not isinstance(offset, _FIXED_OFFSETS + (pd.offsets.MonthBegin,
+                                                pd.offsets.QuarterBegin,
+                                                pd.offsets.YearBegin)):
+        sys.exit(f'{freq} can not be used for binning, use a fixed frequency (e.g. 1D, 6h) or the start of a period (MS, QS, YS).')
+    return offset
+
+
+def bin_start(validate, offset):
+    """
+    Get the start of the bin of a validate (bins are [start, next start)).
+
+    Parameters
+    ----------
+    validate : datetime
+        The validate.
+    offset : pandas.DateOffset
+        The offset of the bins (see to_bin_offset()).
+
+    Returns
+    -------
+    pandas.Timestamp
+        The start of the bin.
+
+    """
+    validate = pd.Timestamp(validate)
+    if isinstance(offset, _FIXED_OFFSETS):
+        return validate.floor(offset)
+    return offset.rollback(validate.normalize())
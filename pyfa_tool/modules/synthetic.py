@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generators of synthetic FA-like data.
+
+The generated dictionaries have the same structure as the json files written by
+the R scripts (metadata.json, fields.json and FA.json), so the python side of
+PyFa can be tested, profiled and benchmarked without R or FA files.
+
+@author: thoverga
+"""
+
+from datetime import datetime, timedelta
+import numpy as np
+
+import pyfa_tool.modules.spectral as spectral
+
+
+# Format used by RFa to write datetimes (CY43)
+_DT_FMT = '%Y-%m-%d %H:%M:%S'
+
+# Default vertical geometry
+_REFPRESSURE = 101325.0
+
+# Width of the extension (E) zone
+_EZONE = 11
+
+
+# =============================================================================
+# Fieldnames
+# =============================================================================
+
+def synthetic_fieldnames(nlev, n2d=4, n3d=2, npseudo=1, pseudo_nlev=3):
+    """
+    Create fieldnames like they are found in a FA file.
+
+    Parameters
+    ----------
+    nlev : int
+        The number of model levels.
+    n2d : int, optional
+        The number of 2D fields. The default is 4.
+    n3d : int, optional
+        The number of 3D fields (defined on all levels). The default is 2.
+    npseudo : int, optional
+        The number of pseudo 3D fields (defined on some levels). The default
+        is 1.
+    pseudo_nlev : int, optional
+        The number of levels of the pseudo 3D fields (must be smaller than
+        nlev). The default is 3.
+
+    Returns
+    -------
+    dict
+        With '2d', '3d' and 'pseudo_3d' keys and lists of (base)names as
+        values.
+
+    """
+    pseudo_nlev = min(pseudo_nlev, nlev - 1)
+    if (npseudo > 0) & (pseudo_nlev < 1):
+        npseudo = 0
+    return {'2d': [f'SYNTH2D.{i:03d}' for i in range(n2d)],
+            '3d': [f'SYNTH3D.{i:03d}' for i in range(n3d)],
+            'pseudo_3d': [f'SYNTHPS.{i:03d}' for i in range(npseudo)],
+            'pseudo_nlev': pseudo_nlev}
+
+
+def _level_fieldname(basename, level):
+    return f'S{level:03d}{basename}'
+
+
+# =============================================================================
+# Metadata
+# =============================================================================
+
+def synthetic_metadata(nx=50, ny=40, nlev=10, basedate=datetime(2024, 1, 1),
+                       leadtime=1, timestep=60, filepath='PFARSYNTH+0001',
+                       nfields=None, with_coords=True):
+    """
+    Create a metadata dictionary like the one written by the R scripts.
+
+    Parameters
+    ----------
+    nx : int, optional
+        Number of points in X. The default is 50.
+    ny : int, optional
+        Number of points in Y. The default is 40.
+    nlev : int, optional
+        Number of model levels. The default is 10.
+    basedate : datetime.datetime, optional
+        The basedate. The default is datetime(2024, 1, 1).
+    leadtime : int or float, optional
+        The leadtime in hours. The default is 1.
+    timestep : int, optional
+        The model timestep in seconds. The default is 60.
+    filepath : str, optional
+        The (fake) path of the FA file. The default is 'PFARSYNTH+0001'.
+    nfields : int, optional
+        The number of fields in the file. The default is None.
+    with_coords : bool, optional
+        If True, the x and y coordinates are added (as in FA.json). The
+        default is True.
+
+    Returns
+    -------
+    dict
+        The metadata with all values stored as lists (json representation
+        of R vectors).
+
+    """
+    dx = dy = 1300
+    validate = basedate + timedelta(hours=leadtime)
+    metadata = {'basedate': [basedate.strftime(_DT_FMT)],
+                'validate': [validate.strftime(_DT_FMT)],
+                'leadtime': [str(leadtime)],
+                'timestep': [str(timestep)],
+                'origin': ['SYNTHETIC'],
+                'projection': ['lcc'],
+                'lon_0': [4.55],
+                'lat_1': [50.6],
+                'lat_2': [50.6],
+                'proj_R': [6371229],
+                'nx': [nx],
+                'ny': [ny],
+                'dx': [dx],
+                'dy': [dy],
+                'ex': [_EZONE],
+                'ey': [_EZONE],
+                'center_lon': [4.55],
+                'center_lat': [50.6],
+                'nfields': [nfields if nfields is not None else 0],
+                'filepath': [str(filepath)],
+                # the C+I zone is the grid, the spectral fields are defined
+                # on the C+I+E grid
+                'ndlux': [nx],
+                'ndgux': [ny],
+                'nsmax': [(ny + _EZONE - 1) // 2],
+                'nmsmax': [(nx + _EZONE - 1) // 2],
+                'nlev': [nlev],
+                'refpressure': [_REFPRESSURE],
+                'A_list': np.linspace(0., 20000., nlev + 1).tolist(),
+                'B_list': np.linspace(0., 1., nlev + 1).tolist(),
+                }
+    if with_coords:
+        metadata['xcoords'] = ((np.arange(nx) - nx / 2.) * dx).tolist()
+        metadata['ycoords'] = (5.6e6 + (np.arange(ny) - ny / 2.) * dy).tolist()
+    return metadata
+
+
+def synthetic_fields_list(nlev=10, n2d=4, n3d=2, npseudo=1, pseudo_nlev=3,
+                          nbits=16, nx=50, ny=40, spectral=False):
+    """
+    Create a list of field records like fields.json written by the R scripts.
+
+    Parameters
+    ----------
+    nlev : int, optional
+        Number of model levels. The default is 10.
+    n2d : int, optional
+        The number of 2D fields. The default is 4.
+    n3d : int, optional
+        The number of 3D fields. The default is 2.
+    npseudo : int, optional
+        The number of pseudo 3D fields. The default is 1.
+    pseudo_nlev : int, optional
+        The number of levels of the pseudo 3D fields. The default is 3.
+    nbits : int, optional
+        The packing of the fields. The default is 16.
+    nx : int, optional
+        Number of points in X. The default is 50.
+    ny : int, optional
+        Number of points in Y. The default is 40.
+    spectral : bool, optional
+        If True, the 3D fields are spectral fields. The default is False.
+
+    Returns
+    -------
+    list
+        A list of dictionaries (one for each field in the FA file).
+
+    """
+    names = synthetic_fieldnames(nlev=nlev, n2d=n2d, n3d=n3d, npseudo=npseudo,
+                                 pseudo_nlev=pseudo_nlev)
+    fieldnames = [(name, False) for name in names['2d']]
+    for basename in names['3d']:
+        fieldnames.extend([(_level_fieldname(basename, lev), spectral) for lev in range(1, nlev + 1)])
+    for basename in names['pseudo_3d']:
+        fieldnames.extend([(_level_fieldname(basename, lev), False) for lev in range(1, names['pseudo_nlev'] + 1)])
+
+    return [{'name': name,
+             'index': idx + 1,
+             'length': nx * ny,
+             'spectral': is_spectral,
+             'nbits': nbits} for idx, (name, is_spectral) in enumerate(fieldnames)]
+
+
+# =============================================================================
+# Data
+# =============================================================================
+
+def _synthetic_field(nx, ny, nlev=None, seed=0):
+    """Create a smooth field with some noise (levels, y, x) or (y, x)."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0., 2. * np.pi, nx)
+    y = np.linspace(0., np.pi, ny)
+    base = 280. + 10. * np.sin(x)[np.newaxis, :] * np.cos(y)[:, np.newaxis]
+    if nlev is None:
+        return base + rng.normal(0., 0.5, size=(ny, nx))
+    lapse = np.linspace(-60., 0., nlev)[:, np.newaxis, np.newaxis]
+    return base[np.newaxis, :, :] + lapse + rng.normal(0., 0.5, size=(nlev, ny, nx))
+
+
+def _extend_to_e_zone(data, ex, ey):
+    """Extend a (..., y, x) field on the C+I zone to a biperiodic field on the C+I+E grid."""
+    def _extend(arr, n, axis):
+        # linear blend from the last to the first row (or column)
+        first = np.take(arr, [0], axis=axis)
+        last = np.take(arr, [-1], axis=axis)
+        weights = np.arange(1, n + 1) / (n + 1.)
+        shape = [1] * arr.ndim
+        shape[axis] = n
+        weights = weights.reshape(shape)
+        return np.concatenate([arr, (1. - weights) * last + weights * first], axis=axis)
+    return _extend(_extend(data, ex, axis=-1), ey, axis=-2)
+
+
+def _to_spectral(data, metadata):
+    """Transform a (levels, y, x) field to (truncated) spectral coefficients on the C+I+E grid."""
+    extended = _extend_to_e_zone(data, ex=metadata['ex'][0], ey=metadata['ey'][0])
+    return spectral.gridpoint_to_spectral(extended, nsmax=metadata['nsmax'][0],
+                                          nmsmax=metadata['nmsmax'][0])
+
+
+def synthetic_fa_payload(nx=50, ny=40, nlev=10, n2d=4, n3d=2, npseudo=1,
+                         pseudo_nlev=3, basedate=datetime(2024, 1, 1),
+                         leadtime=1, timestep=60, filepath='PFARSYNTH+0001',
+                         as_lists=True, seed=0, fieldnames=None,
+                         spectral=False):
+    """
+    Create a dictionary with the same structure as the FA.json file.
+
+    The 2D fields are flat (x varies fastest), the 3D fields are nested
+    (x, y, level), exactly like the json written by get_all_fields.R. Spectral
+    3D fields hold the coefficients ({'real': ..., 'imag': ...}) in the
+    compact layout of pyfa_tool.modules.spectral.
+
+    Parameters
+    ----------
+    nx : int, optional
+        Number of points in X. The default is 50.
+    ny : int, optional
+        Number of points in Y. The default is 40.
+    nlev : int, optional
+        Number of model levels. The default is 10.
+    n2d : int, optional
+        The number of 2D fields. The default is 4.
+    n3d : int, optional
+        The number of 3D fields. The default is 2.
+    npseudo : int, optional
+        The number of pseudo 3D fields (stored as 2D fields per level). The
+        default is 1.
+    pseudo_nlev : int, optional
+        The number of levels of the pseudo 3D fields. The default is 3.
+    basedate : datetime.datetime, optional
+        The basedate. The default is datetime(2024, 1, 1).
+    leadtime : int or float, optional
+        The leadtime in hours. The default is 1.
+    timestep : int, optional
+        The model timestep in seconds. The default is 60.
+    filepath : str, optional
+        The (fake) path of the FA file. The default is 'PFARSYNTH+0001'.
+    as_lists : bool, optional
+        If True, the data is stored as (nested) lists like after json.load().
+        If False, numpy arrays with the same layout are used. The default is
+        True.
+    seed : int, optional
+        Seed for the random noise. The default is 0.
+    fieldnames : list, optional
+        If not None, only these fields are created (2D fieldnames, 3D
+        basenames or full names of pseudo 3D fields). The default is None.
+    spectral : bool, optional
+        If True, the 3D fields are stored as spectral coefficients (type
+        'spectral_3d'). The default is False.
+
+    Returns
+    -------
+    payload : dict
+        The FA.json-like dictionary.
+
+    """
+    names = synthetic_fieldnames(nlev=nlev, n2d=n2d, n3d=n3d, npseudo=npseudo,
+                                 pseudo_nlev=pseudo_nlev)
+    nfields = n2d + nlev * n3d + npseudo * names['pseudo_nlev']
+
+    payload = {'pyfa_metadata': synthetic_metadata(nx=nx, ny=ny, nlev=nlev,
+                                                   basedate=basedate,
+                                                   leadtime=leadtime,
+                                                   timestep=timestep,
+                                                   filepath=filepath,
+                                                   nfields=nfields,
+                                                   with_coords=True)}
+
+    def _fmt(arr):
+        return arr.tolist() if as_lists else arr
+
+    def _requested(fieldname):
+        return (fieldnames is None) or (fieldname in fieldnames)
+
+    counter = seed
+    for fieldname in names['2d']:
+        counter += 1
+        if _requested(fieldname):
+            data = _synthetic_field(nx, ny, seed=counter).ravel()
+            payload[fieldname] = {'data': _fmt(data), 'type': ['2d']}
+
+    for basename in names['pseudo_3d']:
+        for lev in range(1, names['pseudo_nlev'] + 1):
+            counter += 1
+            fieldname = _level_fieldname(basename, lev)
+            if _requested(fieldname):
+                data = _synthetic_field(nx, ny, seed=counter).ravel()
+                payload[fieldname] = {'data': _fmt(data), 'type': ['pseudo_3d']}
+
+    for basename in names['3d']:
+        counter += 1
+        if not _requested(basename):
+            continue
+        data = _synthetic_field(nx, ny, nlev=nlev, seed=counter)
+        if spectral:
+            coeffs = _to_spectral(data, payload['pyfa_metadata'])
+            payload[basename] = {'data': {'real': _fmt(coeffs.real),
+                                          'imag': _fmt(coeffs.imag)},
+                                 'type': ['spectral_3d']}
+        else:
+            payload[basename] = {'data': _fmt(data.transpose((2, 1, 0))), 'type': ['3d']}
+
+    return payload
+
+
+def synthetic_collection_payloads(nfiles=3, basedate=datetime(2024, 1, 1),
+                                  first_leadtime=1, **kwargs):
+    """
+    Create FA.json-like dictionaries for multiple files (hourly leadtimes).
+
+    Parameters
+    ----------
+    nfiles : int, optional
+        Number of files. The default is 3.
+    basedate : datetime.datetime, optional
+        The basedate of all files. The default is datetime(2024, 1, 1).
+    first_leadtime : int, optional
+        The leadtime (in hours) of the first file. The default is 1.
+    **kwargs :
+        Passed to synthetic_fa_payload().
+
+    Returns
+    -------
+    list
+        A list of FA.json-like dictionaries.
+
+    """
+    payloads = []
+    for i in range(nfiles):
+        leadtime = first_leadtime + i
+        payloads.append(synthetic_fa_payload(basedate=basedate,
+                                             leadtime=leadtime,
+                                             filepath=f'PFARSYNTH+{leadtime:04d}',
+                                             seed=i * 1000,
+                                             **kwargs))
+    return payloads
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch a directory for new FA files and convert them as they are written.
+
+A FA file is considered complete when its size and modification time did not
+change for a while (the settle time). Each complete file is imported and
+appended (on the validate dimension) to a netCDF collection store.
+
+Hidden files (like the temporary files of the store) and files with a
+temporary suffix (.tmp, .part, ...) are never picked up, neither is the
+store itself (if it is in the watched directory).
+
+@author: thoverga
+"""
+
+import os
+import sys
+import time
+
+import pyfa_tool.modules.IO as IO
+import pyfa_tool.modules.store as collection_store
+
+
+# Files with these suffixes are being written (downloads, editors, ...)
+_TEMP_SUFFIXES = ('.tmp', '.temp', '.part', '.partial', '.swp', '~')
+
+
+# =============================================================================
+# Detecting complete files
+# =============================================================================
+
+class DirectoryWatcher():
+    """Detect new and complete files in a directory by polling."""
+
+    def __init__(self, searchdir, filename_regex='*', settle_time=10.,
+                 skip_existing=False, exclude=None):
+        """
+        Initiate a DirectoryWatcher.
+
+        Parameters
+        ----------
+        searchdir : str
+            The directory to watch.
+        filename_regex : str, optional
+            Regex expression (unix wildcards) to match the filenames. The
+            default is '*'.
+        settle_time : float, optional
+            A file is complete if its size and modification time did not
+            change for this number of seconds. The default is 10.
+        skip_existing : bool, optional
+            If True, the files that are already in the directory are ignored.
+            The default is False.
+        exclude : list of str, optional
+            Paths that are never returned (e.g. the output store). Hidden and
+            temporary files are always excluded. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not IO.check_folder_exist(searchdir):
+            sys.exit(f'{searchdir} is not a directory.')
+        self.searchdir = searchdir
+        self.filename_regex = filename_regex
+        self.settle_time = float(settle_time)
+        self.exclude = set(os.path.abspath(path) for path in (exclude or []))
+
+        self._pending = {} # path: (signature, time the signature was first seen)
+        self._done = {} # path: signature when it was handled
+        if skip_existing:
+            for path in self._list_files():
+                self._done[path] = _signature(path)
+
+    def __repr__(self):
+        return f'DirectoryWatcher on {os.path.join(self.searchdir, self.filename_regex)}'
+
+    def __str__(self):
+        return f'DirectoryWatcher on {os.path.join(self.searchdir, self.filename_regex)}'
+
+    def poll(self):
+        """
+        Look for files that are complete and not yet handled.
+
+        Returns
+        -------
+        list
+            Sorted paths of the files that are complete since the last poll.
+
+        """
+        now = time.time()
+        ready = []
+        for path in self._list_files():
+            signature = _signature(path)
+            if (signature is None) or (signature[0] == 0):
+                continue # removed or still empty
+            if self._done.get(path) == signature:
+                continue # already handled (and not changed since)
+
+            if (path not in self._pending) or (self._pending[path][0] != signature):
+                # new file, or still being written
+                self._pending[path] = (signature, now)
+                if self.settle_time > 0:
+                    continue
+
+            if now - self._pending[path][1] >= self.settle_time:
+                ready.append(path)
+        return sorted(ready)
+
+    def mark_done(self, path):
+        """Mark a file as handled (it is only returned again if it changes)."""
+        self._pending.pop(path, None)
+        self._done[path] = _signature(path)
+
+    def _list_files(self):
+        paths = [os.path.abspath(path) for path in
+                 IO.get_paths_using_regex(searchdir=self.searchdir,
+                                          filename_regex=self.filename_regex)
+                 if IO.check_file_exist(path)]
+        return [path for path in paths
+                if (path not in self.exclude) and not _is_temporary(path)]
+
+
+def _is_temporary(path):
+    """Check if a file is hidden or has a temporary suffix."""
+    name = os.path.basename(path)
+    return name.startswith('.') or name.lower().endswith(_TEMP_SUFFIXES)
+
+
+def _signature(path):
+    """The size and modification time of a file (None if it is removed)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+# =============================================================================
+# Collection store
+# =============================================================================
+
+def append_to_store(dataset, store):
+    """
+    Append a FaDataset to a collection store (on validate).
+
+    The store has the same structure as the netCDF file (or zarr store) of a
+    FaCollection that is combined by validate. If the store does not exist,
+    it is created. If the validate of the dataset is already in the store,
+    it is replaced (see modules.store.append_datasets()).
+
+    Parameters
+    ----------
+    dataset : FaDataset
+        The (imported) FaDataset to append.
+    store : str
+        Path of the netCDF collection store (or a .zarr store).
+
+    Returns
+    -------
+    None.
+
+    """
+    collection_store.append_datasets(store, [dataset])
+
+
+# =============================================================================
+# Watch and convert
+# =============================================================================
+
+def watch_and_convert(searchdir, filename_regex='*', store='collection.nc',
+                      backend='rworker', interval=5., settle_time=10.,
+                      idle_timeout=None, max_files=None, skip_existing=False,
+                      **import_kwargs):
+    """
+    Watch a directory and convert new FA files as they are written.
+
+    Each complete FA file is imported, and appended to the netCDF collection
+    store. This runs until it is interrupted (Ctrl-C), or until a stop
+    condition (idle_timeout, max_files) is met.
+
+    Parameters
+    ----------
+    searchdir : str
+        The directory to watch.
+    filename_regex : str, optional
+        Regex expression (unix wildcards) to match the FA filenames. The
+        store, hidden and temporary files are never matched. The default is
+        '*'.
+    store : str, optional
+        Path of the netCDF collection store. The default is 'collection.nc'.
+    backend : str or FaBackend, optional
+        The backend used to decode the FA files. The default is 'rworker',
+        which keeps R running between files.
+    interval : float, optional
+        Seconds between two polls of the directory. The default is 5.
+    settle_time : float, optional
+        A file is complete if its size and modification time did not change
+        for this number of seconds. The default is 10.
+    idle_timeout : float, optional
+        Stop if no new file is converted for this number of seconds. If None,
+        the watcher does not stop on idle. The default is None.
+    max_files : int, optional
+        Stop after this number of files are converted. If None, there is no
+        limit. The default is None.
+    skip_existing : bool, optional
+        If True, the FA files that are already in the directory are not
+        converted. The default is False.
+    **import_kwargs :
+        Kwargs passed to the FaDataset.import_fa() method (whitelist,
+        reproj, target_epsg, dtype, ...).
+
+    Returns
+    -------
+    list
+        The paths of the converted FA files.
+
+    """
+    from pyfa_tool.dataset import FaDataset
+    import pyfa_tool.modules.backends as backends
+
+    backend = backends.get_backend(backend)
+    watcher = DirectoryWatcher(searchdir=searchdir,
+                               filename_regex=filename_regex,
+                               settle_time=settle_time,
+                               skip_existing=skip_existing,
+                               exclude=[store])
+    print(f'Watching {watcher.searchdir} for {filename_regex} files (Ctrl-C to stop).')
+
+    converted = []
+    last_activity = time.time()
+    try:
+        while True:
+            for fafile in watcher.poll():
+                start = time.perf_counter()
+                try:
+                    dataset = FaDataset(fafile, backend=backend)
+                    dataset.import_fa(**import_kwargs)
+                    append_to_store(dataset, store)
+                except (Exception, SystemExit) as e:
+                    # PyFa uses sys.exit() for errors. Retried if the file changes.
+                    print(f'WARNING: converting {fafile} failed: {type(e).__name__}: {e}')
+                else:
+                    converted.append(fafile)
+                    print(f'CONVERTED: {fafile} -> {store} ({time.perf_counter() - start:.1f}s)')
+                watcher.mark_done(fafile)
+                last_activity = time.time()
+
+                if (max_files is not None) and (len(converted) >= max_files):
+                    return converted
+
+            if (idle_timeout is not None) and (time.time() - last_activity >= idle_timeout):
+                print(f'No new files for {idle_timeout}s, stop watching.')
+                return converted
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print('Stop watching.')
+        return converted
+    finally:
+        if hasattr(backend, 'close'):
+            backend.close()
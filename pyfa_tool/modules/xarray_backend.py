@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The xarray backend of PyFa (engine='pyfa').
+
+With this backend, FA files can be opened with xarray directly:
+
+    ds = xr.open_dataset('PFAR07csm07+0002', engine='pyfa')
+    ds = xr.open_mfdataset('run/PFAR07csm07+*', engine='pyfa', parallel=True)
+
+The catalogue of the file (fields, levels, nbits and metadata) is read with
+FaFile, and one 2D field is decoded to get the grid coordinates and the
+attributes. All fields are lazy: a field is only decoded (with the decode
+backend) when its values are accessed. The dataset has the layout of a
+combined FaCollection (basedate, validate, level, y and x dimensions, pseudo
+3D fields on the level dimension and the CRS): all fields have the basedate
+and validate dimensions (of length 1), so the files of a run are concatenated
+on validate by open_mfdataset without data_vars='all'.
+
+Decoders read a full field at once, so the preferred chunks of a field are
+the full field (chunks={} gives one chunk per field).
+
+The backend is registered as an 'xarray.backends' entry point of the package.
+
+@author: thoverga
+"""
+
+import os
+import sys
+
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+
+
+# =============================================================================
+# Lazy fields
+# =============================================================================
+
+class FaBackendArray(BackendArray):
+    """
+    A (lazy) field of a FA file, that is decoded when it is indexed.
+
+    Only the levels and the spatial window that are indexed are kept (the
+    backend may decode more). Levels of the level coordinate that are not
+    present for the field (pseudo 3D fields) are NaN. The field can have
+    leading dimensions of length 1 (basedate and validate).
+    """
+
+    def __init__(self, fafile, backend, name, kind, fieldnames, levels, shape,
+                 dtype, n_time_dims=0):
+        """
+        Initiate a lazy field.
+
+        Parameters
+        ----------
+        fafile : str
+            The path of the FA file.
+        backend : FaBackend
+            The decode backend.
+        name : str
+            The fieldname (2D field) or basename (3D and pseudo 3D fields).
+        kind : str
+            '2d', '3d' or 'pseudo_3d'.
+        fieldnames : dict
+            Level: (2D) fieldname in the FA file, for pseudo 3D fields. Level:
+            basename for 3D fields.
+        levels : numpy.array
+            The level coordinate of the dataset.
+        shape : tuple
+            The shape of the field: (ny, nx), or (nlev, ny, nx).
+        dtype : numpy.dtype
+            The dtype of the field.
+        n_time_dims : int, optional
+            The number of leading dimensions of length 1 (e.g. 2 for basedate
+            and validate), before the dimensions of the field. The default is
+            0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.fafile = fafile
+        self.backend = backend
+        self.name = name
+        self.kind = kind
+        self.fieldnames = fieldnames
+        self.levels = np.asarray(levels)
+        self.field_shape = tuple(shape)
+        self.n_time_dims = int(n_time_dims)
+        self.shape = (1,) * self.n_time_dims + self.field_shape
+        self.dtype = np.dtype(dtype)
+        self._values = None # the full field, if it is decoded already
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # the shared backend of a process is passed by name, so the workers
+        # use their own (e.g. one warm R worker per process)
+        import pyfa_tool.modules.backends as backends
+        if backends._instances.get(self.backend.name) is self.backend:
+            state['backend'] = self.backend.name
+        return state
+
+    def __setstate__(self, state):
+        import pyfa_tool.modules.backends as backends
+        self.__dict__.update(state)
+        self.backend = backends.get_backend(self.backend)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape,
+                                                  indexing.IndexingSupport.BASIC,
+                                                  self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key):
+        """Decode the field for a tuple of integers and slices (one per dimension)."""
+        key = tuple(key)
+        time_key, field_key = key[:self.n_time_dims], key[self.n_time_dims:]
+        values = self._field_values(field_key)
+
+        # the dimensions of length 1 (an integer index drops the dimension)
+        time_sizes = [np.arange(1)[dimkey].size for dimkey in time_key
+                      if not isinstance(dimkey, (int, np.integer))]
+        values = values[(np.newaxis,) * len(time_sizes)]
+        return values[tuple(slice(0, size) for size in time_sizes)]
+
+    def _field_values(self, key):
+        """Decode the field for a tuple of integers and slices (one per dimension of the field)."""
+        if self._values is not None:
+            return self._values[key]
+
+        # (positional) indices per dimension, and the window that holds them
+        indices = [np.arange(size)[dimkey] for size, dimkey in zip(self.field_shape, key)]
+        y_idx, x_idx = indices[-2], indices[-1]
+        if (np.size(y_idx) == 0) or (np.size(x_idx) == 0) or (np.size(indices[0]) == 0):
+            return np.empty([np.size(idx) for idx in indices if np.ndim(idx) > 0],
+                            dtype=self.dtype)
+        window = (int(np.min(x_idx)), int(np.max(x_idx)) + 1,
+                  int(np.min(y_idx)), int(np.max(y_idx)) + 1)
+        if window == (0, self.shape[-1], 0, self.shape[-2]):
+            window = None
+
+        if self.kind == '2d':
+            values = self._decode({'2d': [self.name], '3d': []}, window=window)[self.name]
+        else:
+            lev_idx = np.atleast_1d(indices[0])
+            values = self._decode_levels(self.levels[lev_idx], window=window)
+            if np.ndim(indices[0]) == 0:
+                values = values[0]
+
+        # select the indices within the window
+        if window is not None:
+            values = np.take(values, y_idx - window[2], axis=-2)
+            values = np.take(values, x_idx - window[0], axis=-1)
+        return np.asarray(values, dtype=self.dtype)
+
+    def _decode_levels(self, levels, window=None):
+        """Decode levels of a 3D or pseudo 3D field (NaN for missing levels)."""
+        present = sorted(lev for lev in levels if lev in self.fieldnames)
+        if self.kind == '3d':
+            fields = {'2d': [], '3d': [self.name]}
+        else:
+            fields = {'2d': [self.fieldnames[lev] for lev in present], '3d': []}
+
+        decoded = {}
+        if bool(present):
+            decoded = self._decode(fields, levels=present if self.kind == '3d' else None,
+                                   window=window)
+        for values in decoded.values():
+            shape = values.shape[-2:]
+            break
+        else:
+            shape = (self.shape[-2] if window is None else window[3] - window[2],
+                     self.shape[-1] if window is None else window[1] - window[0])
+
+        result = np.full((len(levels),) + tuple(shape), np.nan, dtype=self.dtype)
+        for i, lev in enumerate(levels):
+            if lev not in self.fieldnames:
+                continue
+            if self.kind == '3d':
+                result[i] = decoded[self.name][present.index(lev)]
+            else:
+                result[i] = decoded[self.fieldnames[lev]]
+        return result
+
+    def _decode(self, fields, levels=None, window=None):
+        """Decode fields with the backend, and get their values (name: numpy array)."""
+        import pyfa_tool.modules.reading_fa as reading_fa
+        import pyfa_tool.modules.profiling as profiling
+
+        with profiling.stage('decode', file=str(self.fafile)):
+            payload = self.backend.read_fields(self.fafile,
+                                               fields=fields,
+                                               levels=levels,
+                                               window=window,
+                                               digits=reading_fa._json_digits_for_dtype([self.dtype]))
+        ds = reading_fa.payload_to_dataset(payload, dtype=self.dtype)
+        return {name: ds[name.strip()].values for name in fields['2d'] + fields['3d']}
+
+
+# =============================================================================
+# Opening FA files
+# =============================================================================
+
+def open_fa_dataset(fafile, backend=None, drop_variables=None, dtype=None,
+                    time_dims=True):
+    """
+    Open a FA file as a lazy xarray.Dataset.
+
+    Parameters
+    ----------
+    fafile : str
+        The path of the FA file (or a member of a tar archive).
+    backend : str or FaBackend, optional
+        The decode backend. If None, the default backend is used. The default
+        is None.
+    drop_variables : str or list, optional
+        Fields (2D fieldnames, 3D and pseudo 3D basenames) that are not
+        opened. The default is None.
+    dtype : str, numpy.dtype or None, optional
+        The dtype of the fields (see FaDataset.import_fa()). The default is
+        None.
+    time_dims : bool, optional
+        If True, the fields have the basedate and validate dimensions (the
+        layout of a combined FaCollection, files can be concatenated on
+        validate). If False, the fields have the layout of FaDataset.ds (the
+        basedate and validate are only coordinates). The default is True.
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        The dataset, with lazy fields.
+
+    """
+    import rioxarray #Do not remove this import!
+    import pyfa_tool.modules.archive as archive
+    import pyfa_tool.modules.reading_fa as reading_fa
+    import pyfa_tool.modules.profiling as profiling
+    from pyfa_tool.file import FaFile
+
+    fafile = archive.resolve_single(os.fspath(fafile))
+    with profiling.stage('read_metadata'):
+        FA = FaFile(fafile, backend=backend)
+    if drop_variables is None:
+        drop_variables = []
+    if isinstance(drop_variables, str):
+        drop_variables = [drop_variables]
+
+    # ---------- Catalogue -------------------
+    catalogue = {} # name: (kind, {level: fieldname})
+    for fieldname in sorted(FA._list_all_2d_fieldnames_as_2d_fields()):
+        catalogue[fieldname] = ('2d', {})
+    for basename in sorted(FA._list_all_3d_fieldnames_as_basenames()):
+        catalogue[basename] = ('3d', {})
+    for fieldname in sorted(FA._list_all_pseudo_3d_fieldnames_as_2d_fields()):
+        basename = fieldname[4:].strip()
+        if basename not in catalogue:
+            catalogue[basename] = ('pseudo_3d', {})
+        catalogue[basename][1][int(fieldname[1:4])] = fieldname
+    if not bool(catalogue):
+        sys.exit(f'There are no fields in {fafile}.')
+
+    # 3D fields are on all model levels
+    model_levels = reading_fa._make_level_dimension(int(FA.metadata['nlev'][0]))
+    for name, (kind, fieldnames) in catalogue.items():
+        if kind == '3d':
+            fieldnames.update({int(lev): name for lev in model_levels})
+
+    # ---------- Grid, coordinates and attributes -------------------
+    # The coordinates are not in the metadata, so decode one (2D) field
+    template_name = next(iter(catalogue))
+    kind, fieldnames = catalogue[template_name]
+    if kind == '2d':
+        template_fields = {'2d': [template_name], '3d': []}
+        template_levels = None
+    elif kind == '3d':
+        template_fields = {'2d': [], '3d': [template_name]}
+        template_levels = [1]
+    else:
+        template_fields = {'2d': [fieldnames[min(fieldnames)]], '3d': []}
+        template_levels = None
+    field_nbits = FA._get_nbits_per_fieldname()
+    with profiling.stage('decode', file=str(fafile)):
+        payload = FA.backend.read_fields(FA.fafile,
+                                         fields=template_fields,
+                                         levels=template_levels,
+                                         digits=reading_fa._json_digits_for_dtype(
+                                             [reading_fa._resolve_dtype(dtype=dtype,
+                                                                        nbits=field_nbits.get(template_name))]))
+    template = reading_fa.payload_to_dataset(payload, dtype=dtype,
+                                             field_nbits=field_nbits)
+
+    pseudo_levels = [lev for _kind, fieldnames in catalogue.values()
+                     if _kind == 'pseudo_3d' for lev in fieldnames]
+    levels = np.union1d(model_levels, np.asarray(pseudo_levels, dtype=int))
+    ny, nx = template.sizes['y'], template.sizes['x']
+
+    # ---------- Lazy fields -------------------
+    # (expand_dims would decode the fields, so the lazy arrays have the
+    # basedate and validate dimensions themselves)
+    time_dims = ('basedate', 'validate') if time_dims else ()
+    data_vars = {}
+    for name, (kind, fieldnames) in catalogue.items():
+        if name in drop_variables:
+            continue
+        field_dtype = reading_fa._resolve_dtype(dtype=dtype, nbits=field_nbits.get(name))
+        if kind == '2d':
+            dims, shape = ('y', 'x'), (ny, nx)
+        else:
+            dims, shape = ('level', 'y', 'x'), (levels.size, ny, nx)
+        array = FaBackendArray(fafile=FA.fafile, backend=FA.backend, name=name,
+                               kind=kind, fieldnames=fieldnames, levels=levels,
+                               shape=shape, dtype=field_dtype,
+                               n_time_dims=len(time_dims))
+        if (kind == '2d') and (name == template_name):
+            array._values = np.asarray(template[name].values, dtype=field_dtype)
+        var = xr.Variable(time_dims + dims, indexing.LazilyIndexedArray(array))
+        var.encoding['preferred_chunks'] = dict(zip(time_dims + dims, array.shape))
+        data_vars[name] = var
+
+    attrs = {key: val for key, val in template.attrs.items()
+             if key not in ['validate', 'basedate', 'leadtime']}
+    ds = xr.Dataset(data_vars=data_vars,
+                    coords={'validate': [template.attrs['validate']],
+                            'basedate': [template.attrs['basedate']],
+                            'level': levels,
+                            'y': template['y'].values,
+                            'x': template['x'].values},
+                    attrs=attrs)
+    ds = ds.rio.write_crs(attrs['projection'])
+    ds = ds.rio.set_spatial_dims('x', 'y', inplace=True)
+    return reading_fa._to_canonical_layout(ds)
+
+
+class PyfaBackendEntrypoint(BackendEntrypoint):
+    """xarray backend to open FA files (engine='pyfa')."""
+
+    description = 'Open FA files (lazily) with PyFa'
+    url = 'https://github.com/vergauwenthomas/PyFa-tool'
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables', 'backend',
+                               'dtype')
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, backend=None,
+                     dtype=None):
+        """
+        Open a FA file as a lazy xarray.Dataset (see open_fa_dataset()).
+
+        Parameters
+        ----------
+        filename_or_obj : str or os.PathLike
+            The path of the FA file (or 'archive.tar::member').
+        drop_variables : str or list, optional
+            Fields that are not opened. The default is None.
+        backend : str or FaBackend, optional
+            The decode backend. The default is None.
+        dtype : str, numpy.dtype or None, optional
+            The dtype of the fields. The default is None.
+
+        Returns
+        -------
+        xarray.Dataset
+            The dataset, with lazy fields.
+
+        """
+        return open_fa_dataset(filename_or_obj, backend=backend,
+                               drop_variables=drop_variables, dtype=dtype)
+
+    def guess_can_open(self, filename_or_obj):
+        # FA files have no extension, only the archive notation is recognised
+        try:
+            import pyfa_tool.modules.archive as archive
+            return archive.is_archive_path(os.fspath(filename_or_obj))
+        except TypeError:
+            return False
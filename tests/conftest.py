@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixtures of the pytest tests, on synthetic FA-like data (no R needed).
+
+@author: thoverga
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+rootfolder = Path(__file__).parents[1].resolve()
+sys.path.insert(0, str(rootfolder))
+
+from pyfa_tool.dataset import FaDataset
+from pyfa_tool.collection import FaCollection
+
+
+def import_synthetic(fafile, backend='synthetic', **kwargs):
+    """Import a (synthetic) FA file as FaDataset."""
+    Dataset = FaDataset(fafile=fafile, backend=backend)
+    Dataset.import_fa(**kwargs)
+    return Dataset
+
+
+def synthetic_fafiles(leadtimes, run='run/PFAR07csm07'):
+    """The (synthetic) FA file paths of leadtimes (hours)."""
+    return [f'{run}+{leadtime:04d}' for leadtime in leadtimes]
+
+
+@pytest.fixture
+def collection():
+    """A combined collection of the leadtimes +0000 up to +0003."""
+    Collection = FaCollection([import_synthetic(fafile) for fafile in synthetic_fafiles(range(4))])
+    Collection.combine_by_validate()
+    return Collection
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming temporal aggregation of collections.
+
+@author: thoverga
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import synthetic_fafiles
+from pyfa_tool.collection import FaCollection
+
+
+FIELDS = ['SYNTH2D.000', 'SYNTH3D.000']
+
+
+def _streaming_collection(leadtimes):
+    Collection = FaCollection()
+    Collection.set_fafiles(synthetic_fafiles(leadtimes), backend='synthetic')
+    return Collection
+
+
+def test_aggregate_matches_resample(collection):
+    Streaming = _streaming_collection(range(4))
+    aggregates = Streaming.aggregate(freq='2h', stats=['mean', 'max', 'std'], fields=FIELDS)
+
+    starts = pd.DatetimeIndex(aggregates['validate'].values)
+    assert list(starts) == [pd.Timestamp('2024-01-01 00:00'), pd.Timestamp('2024-01-01 02:00')]
+    resampled = collection.ds[FIELDS].resample(validate='2h')
+    for stat in ['mean', 'max', 'std']:
+        expected = getattr(resampled, stat)()
+        for field in FIELDS:
+            np.testing.assert_allclose(aggregates[f'{field}_{stat}'].values,
+                                       expected[field].values, rtol=1e-5, atol=1e-5)
+
+
+def test_iter_aggregated_yields_complete_bins():
+    Streaming = _streaming_collection(range(5))
+    aggregates = list(Streaming.iter_aggregated(freq='2h', stats=['count'], fields='SYNTH2D.000'))
+    assert len(aggregates) == 3
+    assert [int(aggregate['SYNTH2D.000_count'].max()) for aggregate in aggregates] == [2, 2, 1]
+
+
+def test_aggregate_to_files(tmp_path):
+    Streaming = _streaming_collection(range(4))
+    paths = Streaming.aggregate(freq='2h', stats=['mean'], fields='SYNTH2D.000',
+                                outputfolder=str(tmp_path))
+    assert [os.path.basename(path) for path in paths] == ['2h_202401010000.nc', '2h_202401010200.nc']
+    assert all(os.path.isfile(path) for path in paths)
+
+
+def test_aggregate_unknown_stat():
+    Streaming = _streaming_collection(range(2))
+    with pytest.raises(SystemExit):
+        Streaming.aggregate(freq='1h', stats=['median'])
+
+
+def test_iter_fadatasets_reads_the_metadata_once():
+    from pyfa_tool.modules.backends import SyntheticBackend
+
+    class CountingBackend(SyntheticBackend):
+        def __init__(self):
+            super().__init__()
+            self.metadata_reads = []
+
+        def read_metadata(self, fafile):
+            self.metadata_reads.append(fafile)
+            return super().read_metadata(fafile)
+
+    backend = CountingBackend()
+    fafiles = synthetic_fafiles([2, 0, 1])
+    Streaming = FaCollection()
+    Streaming.set_fafiles(fafiles, backend=backend)
+    validates = [dataset.get_validate() for dataset in Streaming.iter_fadatasets(whitelist='SYNTH2D.000')]
+    assert validates == sorted(validates)
+    assert sorted(backend.metadata_reads) == sorted(fafiles)
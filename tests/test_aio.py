@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the asyncio API.
+
+@author: thoverga
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import pyfa_tool.modules.aio as aio
+from conftest import import_synthetic, synthetic_fafiles
+from pyfa_tool.collection import FaCollection
+from pyfa_tool.dataset import FaDataset
+from pyfa_tool.file import FaFile
+
+
+def test_aopen():
+    FA = asyncio.run(FaFile.aopen('run/PFAR07csm07+0001', backend='synthetic'))
+    reference = FaFile('run/PFAR07csm07+0001', backend='synthetic')
+    assert FA.metadata == reference.metadata
+    assert FA.fielddf.equals(reference.fielddf)
+
+
+def test_aimport_fa_matches_import_fa():
+    Dataset = FaDataset(fafile='run/PFAR07csm07+0001', backend='synthetic')
+    asyncio.run(Dataset.aimport_fa(whitelist=['SYNTH2D.000', 'SYNTH3D.000'], levels=[2, 3]))
+    reference = import_synthetic('run/PFAR07csm07+0001', whitelist=['SYNTH2D.000', 'SYNTH3D.000'],
+                                 levels=[2, 3])
+    assert Dataset.ds.identical(reference.ds)
+
+
+def test_aload():
+    Collection = FaCollection()
+    asyncio.run(Collection.aload(synthetic_fafiles(range(3)), backend='synthetic',
+                                 whitelist=['SYNTH2D.000']))
+    Collection.combine_by_validate()
+    assert Collection.ds.sizes['validate'] == 3
+    reference = import_synthetic(synthetic_fafiles([2])[0], whitelist=['SYNTH2D.000'])
+    np.testing.assert_array_equal(Collection.ds['SYNTH2D.000'].isel(validate=2).values,
+                                  reference.ds['SYNTH2D.000'].values)
+
+
+def test_errors_do_not_stop_other_coroutines():
+    async def other():
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    async def failing():
+        with pytest.raises(RuntimeError, match='NOPE'):
+            await FaCollection().aload(synthetic_fafiles(range(2)), backend='synthetic',
+                                       whitelist=['NOPE'])
+        return 'caught'
+
+    async def main():
+        return await asyncio.gather(other(), failing())
+
+    assert asyncio.run(main()) == ['done', 'caught']
+
+
+def test_gather_raises_exit_as_error():
+    async def exits():
+        raise SystemExit('an error')
+
+    with pytest.raises(RuntimeError, match='an error'):
+        asyncio.run(aio.gather([exits(), asyncio.sleep(0.01)]))
+
+
+def test_max_concurrency(monkeypatch):
+    monkeypatch.setitem(aio._settings, 'max_concurrency', None)
+    monkeypatch.setenv('PYFA_MAX_CONCURRENT_DECODES', '3')
+    assert aio.get_max_concurrency() == 3
+    aio.set_max_concurrency(2)
+    assert aio.get_max_concurrency() == 2
+    with pytest.raises(SystemExit):
+        aio.set_max_concurrency(0)
+
+    running = {'now': 0, 'max': 0}
+
+    async def decode():
+        async with aio.limit():
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+            await asyncio.sleep(0.01)
+            running['now'] -= 1
+
+    asyncio.run(aio.gather([decode() for _ in range(6)]))
+    assert running['max'] == 2
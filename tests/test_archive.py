@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of reading FA files that are members of tar archives.
+
+@author: thoverga
+"""
+
+import io
+import os
+import tarfile
+
+import pytest
+
+import pyfa_tool.modules.archive as archive
+
+
+MEMBERS = {'run/PFAR07csm07+0000': b'FA file 0' * 1000,
+           'run/PFAR07csm07+0001': b'FA file 1' * 2000,
+           'run/PFAR07csm07+0002': b'FA file 2' * 10,
+           'run/ICMSHAR13+0001': b'other run'}
+
+
+def _write_tar(path, mode='w'):
+    with tarfile.open(path, mode=mode) as tar:
+        directory = tarfile.TarInfo('run')
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory) # a directory entry is not a member
+        for name, content in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return str(path)
+
+
+@pytest.fixture
+def tarpath(tmp_path):
+    return _write_tar(tmp_path / 'run.tar')
+
+
+@pytest.fixture
+def tgzpath(tmp_path):
+    return _write_tar(tmp_path / 'run.tar.gz', mode='w:gz')
+
+
+def test_list_members(tarpath):
+    assert archive.list_members(tarpath) == [f'{tarpath}::{name}' for name in sorted(MEMBERS)]
+    # the pattern matches the member name, or its filename
+    assert archive.list_members(tarpath, 'PFAR*+000[01]') == [f'{tarpath}::run/PFAR07csm07+0000',
+                                                             f'{tarpath}::run/PFAR07csm07+0001']
+    assert archive.list_members(tarpath, 'run/ICMSH*') == [f'{tarpath}::run/ICMSHAR13+0001']
+    assert archive.list_members(tarpath, 'nothing*') == []
+
+
+def test_expand_paths(tarpath, capsys):
+    paths = archive.expand_paths(['plain/PFAR07csm07+0000', f'{tarpath}::PFAR*',
+                                  f'{tarpath}::nothing*'])
+    assert paths == ['plain/PFAR07csm07+0000'] + [f'{tarpath}::run/PFAR07csm07+000{i}' for i in range(3)]
+    assert 'no members' in capsys.readouterr().out
+
+
+def test_resolve_single(tarpath):
+    assert archive.resolve_single('plain/PFAR*') == 'plain/PFAR*' # plain paths are not resolved
+    assert archive.resolve_single(f'{tarpath}::*+0002') == f'{tarpath}::run/PFAR07csm07+0002'
+    with pytest.raises(SystemExit):
+        archive.resolve_single(f'{tarpath}::nothing*')
+    with pytest.raises(SystemExit):
+        archive.resolve_single(f'{tarpath}::PFAR*')
+
+
+def test_index_and_size(tarpath, tgzpath):
+    index = archive.get_tar_index(tarpath)
+    assert set(index) == set(MEMBERS)
+    assert all(member.offset is not None for member in index.values())
+    assert all(member.offset is None for member in archive.get_tar_index(tgzpath).values())
+    assert archive.file_size(f'{tarpath}::run/PFAR07csm07+0001') == len(MEMBERS['run/PFAR07csm07+0001'])
+    assert archive.exists(f'{tarpath}::run/PFAR07csm07+0001')
+    assert not archive.exists(f'{tarpath}::run/PFAR07csm07+0009')
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_local_file(tarpath, tgzpath, tmp_path, compressed):
+    path = tgzpath if compressed else tarpath
+    name = 'run/PFAR07csm07+0001'
+    with archive.local_file(f'{path}::{name}', scratchdir=str(tmp_path)) as local:
+        with open(local, 'rb') as f:
+            assert f.read() == MEMBERS[name]
+    assert not os.path.exists(local) # the scratch file is removed
+
+
+def test_local_file_plain_and_missing(tarpath, tmp_path):
+    with archive.local_file(tarpath) as local:
+        assert local == tarpath
+    with pytest.raises(SystemExit):
+        with archive.local_file(f'{tarpath}::run/PFAR07csm07+0009', scratchdir=str(tmp_path)):
+            pass
+
+
+def test_truncated_archive(tarpath, tmp_path):
+    found = archive.get_tar_index(tarpath)['run/PFAR07csm07+0001']
+    # cut the archive in the data of the member
+    with open(tarpath, 'r+b') as f:
+        f.truncate(found.offset + found.size // 2)
+    with open(tmp_path / 'copy', 'wb') as target:
+        with pytest.raises(SystemExit, match='truncated'):
+            archive._copy_member(tarpath, found, target)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the selection of the decode backends.
+
+@author: thoverga
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import pyfa_tool.modules.backends as backends
+from pyfa_tool.file import FaFile
+
+
+@pytest.fixture
+def default_backend(monkeypatch):
+    """Restore the default backend after the test."""
+    monkeypatch.setitem(backends._default_backend, 'backend', None)
+
+
+def test_get_backend_by_name_is_shared():
+    backend = backends.get_backend('synthetic')
+    assert isinstance(backend, backends.SyntheticBackend)
+    assert backends.get_backend('synthetic') is backend
+
+
+def test_get_backend_instance():
+    backend = backends.SyntheticBackend(nx=20, ny=10)
+    assert backends.get_backend(backend) is backend
+
+
+def test_get_unknown_backend():
+    with pytest.raises(SystemExit):
+        backends.get_backend('nope')
+    with pytest.raises(SystemExit):
+        backends.get_backend(42)
+
+
+def test_default_backend(default_backend):
+    assert isinstance(backends.get_backend(), backends.RscriptBackend)
+    backends.set_default_backend('synthetic')
+    FA = FaFile('run/PFAR07csm07+0001')
+    assert isinstance(FA.backend, backends.SyntheticBackend)
+
+
+def test_register_backend(monkeypatch):
+    class SmallBackend(backends.SyntheticBackend):
+        name = 'small'
+
+        def __init__(self):
+            super().__init__(nx=12, ny=8, nlev=3)
+
+    monkeypatch.setitem(backends._BACKENDS, 'small', SmallBackend)
+    monkeypatch.delitem(backends._instances, 'small', raising=False)
+    backends.register_backend('small', SmallBackend)
+    FA = FaFile('run/PFAR07csm07+0001', backend='small')
+    assert FA.metadata['nx'][0] == 12
+    with pytest.raises(SystemExit):
+        backends.register_backend('nope', object)
+
+
+def test_synthetic_backend_subset():
+    backend = backends.SyntheticBackend(nx=20, ny=10, nlev=5)
+    full = backend.read_fields('run/PFAR07csm07+0001', fields={'2d': ['SYNTH2D.000'], '3d': ['SYNTH3D.000']})
+    subset = backend.read_fields('run/PFAR07csm07+0001', fields={'2d': ['SYNTH2D.000'], '3d': ['SYNTH3D.000']},
+                                 levels=[2, 4], window=(2, 8, 1, 5))
+    field_2d = np.asarray(full['SYNTH2D.000']['data']).reshape((10, 20))
+    np.testing.assert_array_equal(np.asarray(subset['SYNTH2D.000']['data']).reshape((4, 6)),
+                                  field_2d[1:5, 2:8])
+    # (x, y, level) layout
+    field_3d = np.asarray(full['SYNTH3D.000']['data'])
+    np.testing.assert_array_equal(np.asarray(subset['SYNTH3D.000']['data']),
+                                  field_3d[2:8, 1:5][:, :, [1, 3]])
+
+
+def test_synthetic_leadtime_from_filename():
+    FA = FaFile('run/PFAR07csm07+0006', backend='synthetic')
+    assert FA.metadata['leadtime'][0] == '6'
+
+
+@pytest.mark.parametrize('fadec', [[], {}, {'SURFTEMPERATURE': 0.25}])
+def test_add_r_timing(tmp_path, fadec):
+    import json
+    import pyfa_tool.modules.profiling as profiling
+
+    timing_json = tmp_path / 'timing.json'
+    timing_json.write_text(json.dumps({'r_startup': 1.5, 'fadec': fadec,
+                                       'r_tojson': 0.1, 'r_write_json': 0.2}))
+    with profiling.activate(profiling.StageProfiler()) as profiler:
+        backends._add_r_timing(str(timing_json))
+        # records with extra keys
+        profiling.add_record('read_json', nbytes=10)
+    report = profiler.get_report()
+    assert (report['stage'] == 'fadec').sum() == len(fadec)
+    assert report.loc[report['stage'] == 'read_json', 'nbytes'].iloc[0] == 10
+
+
+def test_rscript_metadata_cache(tmp_path, monkeypatch):
+    import json
+    import tarfile
+
+    fafiles = []
+    for leadtime in [1, 2]:
+        path = tmp_path / f'PFAR07csm07+000{leadtime}'
+        path.write_bytes(b'FA')
+        fafiles.append(str(path))
+    with tarfile.open(tmp_path / 'run.tar', 'w') as tar:
+        tar.add(fafiles[0], arcname='PFAR07csm07+0003')
+    fafiles.append(f'{tmp_path / "run.tar"}::PFAR07csm07+0003')
+
+    runs = []
+
+    def _run_r_script(self, script, localfile, tmpdir):
+        # what get_all_metadata.R writes
+        runs.append(localfile)
+        with open(os.path.join(tmpdir, 'metadata.json'), 'w') as f:
+            json.dump({'nx': [1]}, f)
+        with open(os.path.join(tmpdir, 'fields.json'), 'w') as f:
+            json.dump([{'name': 'SURFTEMPERATURE'}], f)
+
+    monkeypatch.setattr(backends.RscriptBackend, '_run_r_script', _run_r_script)
+    backend = backends.RscriptBackend()
+    # all files are opened before they are decoded (e.g. a collection)
+    for _repeat in range(2):
+        for fafile in fafiles:
+            assert backend.read_metadata(fafile)['filepath'] == [fafile]
+            assert list(backend.list_fields(fafile)['name']) == ['SURFTEMPERATURE']
+    assert len(runs) == len(fafiles)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the batch conversion of FA files to netCDF.
+
+@author: thoverga
+"""
+
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import pyfa_tool.modules.batch as batch
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+class _DyingBackend(SyntheticBackend):
+    """A synthetic backend that kills the (worker) process when decoding."""
+
+    def read_fields(self, fafile, **kwargs):
+        os._exit(1)
+
+
+def _touch(path, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('')
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+@pytest.fixture
+def fadir(tmp_path):
+    """A directory with (empty) FA files, the synthetic backend does not read them."""
+    for leadtime in range(3):
+        _touch(str(tmp_path / 'fa' / f'PFAR07csm07+000{leadtime}'))
+    _touch(str(tmp_path / 'fa' / 'notes.txt'))
+    return tmp_path / 'fa'
+
+
+def test_collect_fa_paths(fadir, capsys):
+    paths = batch.collect_fa_paths([str(fadir), str(fadir / 'PFAR07csm07+0001'),
+                                    str(fadir / 'missing')],
+                                   filename_regex='PFAR*')
+    assert [os.path.basename(path) for path in paths] == ['PFAR07csm07+0000',
+                                                          'PFAR07csm07+0001',
+                                                          'PFAR07csm07+0002']
+    assert all(os.path.isabs(path) for path in paths)
+    assert 'missing is not a file or directory' in capsys.readouterr().out
+
+
+def test_format_target_path(tmp_path):
+    fafile = str(tmp_path / 'run' / 'PFAR07csm07+0001')
+    assert batch.format_target_path(fafile) == str(tmp_path / 'run' / 'PFAR07csm07+0001.nc')
+    target = batch.format_target_path(fafile, os.path.join(str(tmp_path), 'nc', '{parent}_{name}'))
+    assert target == str(tmp_path / 'nc' / 'run_PFAR07csm07+0001.nc')
+
+
+def test_is_up_to_date(tmp_path):
+    fafile = _touch(str(tmp_path / 'PFAR07csm07+0001'), mtime=1000)
+    target = str(tmp_path / 'PFAR07csm07+0001.nc')
+    assert not batch.is_up_to_date(fafile, target)
+    _touch(target, mtime=500)
+    assert not batch.is_up_to_date(fafile, target)
+    os.utime(target, (2000, 2000))
+    assert batch.is_up_to_date(fafile, target)
+
+
+def test_convert_batch(fadir):
+    fafiles = batch.collect_fa_paths([str(fadir)], filename_regex='PFAR*')
+    summary = batch.convert_batch(fafiles, backend='synthetic', whitelist=['SYNTH2D.000'])
+    assert list(summary['status']) == ['converted'] * 3
+    with xr.open_dataset(summary['output'][1]) as ds:
+        assert 'SYNTH2D.000' in ds.data_vars
+        assert np.isfinite(ds['SYNTH2D.000'].values).all()
+
+    # the netCDF files are newer than the FA files now
+    summary = batch.convert_batch(fafiles, backend='synthetic', whitelist=['SYNTH2D.000'])
+    assert list(summary['status']) == ['skipped'] * 3
+
+
+def test_convert_batch_records_failures(fadir):
+    fafiles = batch.collect_fa_paths([str(fadir)], filename_regex='PFAR*')
+    summary = batch.convert_batch(fafiles, backend='synthetic', whitelist=['UNKNOWN'])
+    assert list(summary['status']) == ['failed'] * 3
+    assert summary['error'].str.startswith('SystemExit').all()
+
+
+def test_convert_batch_survives_dying_workers(fadir):
+    fafiles = batch.collect_fa_paths([str(fadir)], filename_regex='PFAR*')
+    summary = batch.convert_batch(fafiles, n_jobs=2, backend=_DyingBackend())
+    assert list(summary['status']) == ['failed'] * 3
+    assert summary['error'].str.startswith('BrokenProcessPool').all()
+
+
+def test_convert_batch_template_collision(fadir):
+    fafiles = batch.collect_fa_paths([str(fadir)], filename_regex='PFAR*')
+    with pytest.raises(SystemExit):
+        batch.convert_batch(fafiles, output_template=os.path.join(str(fadir), 'all.nc'),
+                            backend='synthetic')
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the catalogue of FA files.
+
+@author: thoverga
+"""
+
+import os
+
+import pandas as pd
+
+import pyfa_tool.modules.catalogue as catalogue
+from conftest import synthetic_fafiles
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+class _DyingBackend(SyntheticBackend):
+    """A synthetic backend that kills the (worker) process when reading the metadata."""
+
+    def read_metadata(self, fafile):
+        os._exit(1)
+
+
+def test_build_catalogue():
+    fafiles = synthetic_fafiles([1, 0])
+    table = catalogue.build_catalogue(fafiles, backend='synthetic')
+    assert list(table.columns) == catalogue.CATALOGUE_COLUMNS
+    assert list(table['file'].unique()) == [fafiles[1], fafiles[0]]
+    assert 'SYNTH3D.000' in set(table['field'])
+    assert (table['validate'] - table['basedate'] == pd.to_timedelta(table['leadtime'], unit='h')).all()
+
+
+def test_build_catalogue_survives_dying_workers(capsys):
+    table = catalogue.build_catalogue(synthetic_fafiles([0, 1, 2]), n_jobs=2,
+                                      backend=_DyingBackend())
+    assert table.empty
+    assert capsys.readouterr().out.count('BrokenProcessPool') == 3
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the field-by-field comparison of FA files.
+
+@author: thoverga
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pyfa_tool.modules.compare as compare
+from pyfa_tool.file import FaFile
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+def _fafile(path):
+    return FaFile(path, backend='synthetic')
+
+
+def test_compare_identical_files():
+    FA = _fafile('run_a/PFAR07csm07+0001')
+    report = FA.compare(_fafile('run_a/PFAR07csm07+0001'), verbose=False)
+    assert set(report['status']) == {'identical'}
+    assert (report['max_abs_diff'] == 0.).all()
+    # one row per level of the 3D fields
+    assert (report['field'] == 'SYNTH3D.000').sum() == FA.metadata['nlev'][0]
+
+
+def test_compare_different_files():
+    report, metadata_diff = compare.compare_fafiles(_fafile('run_a/PFAR07csm07+0001'),
+                                                    _fafile('run_b/PFAR07csm07+0001'))
+    assert not bool(metadata_diff)
+    different = report[report['status'] == 'different']
+    assert not different.empty
+    assert (different['max_abs_diff'] > 0.).all()
+    assert (different['rmse'] <= different['max_abs_diff']).all()
+
+
+def test_compare_metadata_differences():
+    _report, metadata_diff = compare.compare_fafiles(_fafile('run_a/PFAR07csm07+0001'),
+                                                     _fafile('run_a/PFAR07csm07+0002'),
+                                                     fields=['SYNTH2D.000'])
+    assert 'validate' in metadata_diff
+    assert 'filepath' not in metadata_diff
+
+
+def test_compare_arrays():
+    values_a = np.array([[[1., 2.], [np.nan, 4.]], [[1., 1.], [1., 1.]]])
+    values_b = np.array([[[1., 2.], [np.nan, 4.]], [[1., 3.], [1., 1.]]])
+    result = compare.compare_arrays(values_a.copy(), values_b)
+    np.testing.assert_array_equal(result['identical'], [True, False])
+    np.testing.assert_array_equal(result['n_points'], [3, 4])
+    np.testing.assert_allclose(result['max_abs_diff'], [0., 2.])
+    np.testing.assert_allclose(result['mean_diff'], [0., -0.5])
+
+    with pytest.raises(SystemExit):
+        compare.compare_arrays(values_a, values_b[:, :1])
+
+
+def test_compare_other_geometries():
+    other = FaFile('run_a/PFAR07csm07+0001', backend=SyntheticBackend(nx=20))
+    with pytest.raises(SystemExit):
+        compare.compare_fafiles(_fafile('run_a/PFAR07csm07+0001'), other)
+
+
+def test_compare_identical_records_are_not_decoded(monkeypatch):
+    def _fail(*args, **kwargs):
+        raise AssertionError('identical records are decoded')
+
+    monkeypatch.setattr(compare, '_decode_field', _fail)
+    FA = _fafile('run_a/PFAR07csm07+0001')
+    report = FA.compare('run_a/PFAR07csm07+0001', verbose=False)
+    assert set(report['status']) == {'identical'}
+    assert (report['field'] == 'SYNTH3D.000').sum() == FA.metadata['nlev'][0]
+    assert (report['n_points'] == FA.metadata['nx'][0] * FA.metadata['ny'][0]).all()
+
+
+def test_checksum_range(tmp_path):
+    import tarfile
+    import pyfa_tool.modules.archive as archive
+
+    path = tmp_path / 'PFAR07csm07+0001'
+    path.write_bytes(bytes(range(256)) * 4)
+    with tarfile.open(tmp_path / 'run.tar', 'w') as tar:
+        tar.add(path, arcname='PFAR07csm07+0001')
+
+    checksum = archive.checksum_range(str(path), offset=256, length=256)
+    assert checksum == archive.checksum_range(str(path), offset=0, length=256)
+    assert checksum != archive.checksum_range(str(path), offset=1, length=256)
+    member = f'{tmp_path / "run.tar"}::PFAR07csm07+0001'
+    assert archive.checksum_range(member, offset=256, length=256) == checksum
+    assert archive.checksum_range(member, offset=1000, length=256) is None
+
+
+def test_compare_defaults_to_the_rworker_backend(monkeypatch):
+    import pyfa_tool.modules.backends as backends
+
+    FA = _fafile('run_a/PFAR07csm07+0001')
+    FA.backend = backends.RscriptBackend()
+    used = {}
+
+    def _compare_fafiles(FA_a, FA_b, fields=None, backend=None):
+        used['backend'] = backend
+        return pd.DataFrame(columns=compare.COMPARE_COLUMNS), {}
+
+    # the R process is not started
+    monkeypatch.setattr(compare, 'compare_fafiles', _compare_fafiles)
+    FA.compare(_fafile('run_a/PFAR07csm07+0001'), verbose=False)
+    assert isinstance(used['backend'], backends.RworkerBackend)
+
+
+def test_diff_exit_code_on_metadata_differences(monkeypatch):
+    import pyfa_tool.main as main
+
+    assert main._run_diff(['run_a/PFAR07csm07+0001', 'run_a/PFAR07csm07+0001',
+                           '--backend', 'synthetic']) == 0
+    # same fields (the seed of the path), other validate
+    monkeypatch.setattr('pyfa_tool.modules.backends._seed_from_path', lambda fafile: 0)
+    report = _fafile('run_a/PFAR07csm07+0001').compare('run_a/PFAR07csm07+0002', verbose=False)
+    assert set(report['status']) == {'identical'}
+    assert 'validate' in report.attrs['metadata_diff']
+    assert main._run_diff(['run_a/PFAR07csm07+0001', 'run_a/PFAR07csm07+0002',
+                           '--backend', 'synthetic']) == 1
+
+
+def test_rscript_record_checksums(tmp_path, monkeypatch):
+    import pyfa_tool.modules.backends as backends
+
+    path = tmp_path / 'PFAR07csm07+0001'
+    path.write_bytes(b'header' + b'A' * 10 + b'A' * 10 + b'B' * 10)
+    backend = backends.RscriptBackend()
+    fielddata = pd.DataFrame({'name': ['F1', 'F2', 'F3'], 'offset': [6, 16, 26],
+                              'length': [10, 10, 10]})
+    monkeypatch.setattr(backend, 'list_fields', lambda fafile: fielddata.copy())
+
+    # the units of the field list of RFa are not verified: decode
+    assert backend.record_checksums(str(path), ['F1', 'F2']) == {}
+
+    monkeypatch.setattr(backend, 'checksum_records', True)
+    checksums = backend.record_checksums(str(path), ['F1', 'F2', 'F3'])
+    assert checksums['F1'] == checksums['F2'] != checksums['F3']
+    # records that overlap or end after the file (other units): decode
+    fielddata['length'] = [10, 20, 10]
+    assert backend.record_checksums(str(path), ['F1', 'F2']) == {}
+    fielddata['length'] = [10, 10, 100]
+    assert backend.record_checksums(str(path), ['F1', 'F2']) == {}
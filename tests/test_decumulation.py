@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the decumulation of accumulated fields.
+
+@author: thoverga
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import pyfa_tool.modules.decumulation as decumulation
+from conftest import import_synthetic, synthetic_fafiles
+from pyfa_tool.collection import FaCollection
+
+
+BASEDATE = pd.Timestamp('2024-01-01')
+FIELDS = ['SYNTH2D.000', 'SYNTH3D.000']
+
+
+def test_interval_sources_previous_validate():
+    validates = BASEDATE + pd.to_timedelta([0, 1, 2, 4], unit='h')
+    sources = decumulation.interval_sources(validates, BASEDATE)
+    assert list(sources) == [decumulation.FROM_BASEDATE, decumulation.FROM_BASEDATE, 1, 2]
+
+
+def test_interval_sources_period_at_basedate():
+    validates = BASEDATE + pd.to_timedelta([0, 1, 2, 4], unit='h')
+    sources = decumulation.interval_sources(validates, BASEDATE, period='1h')
+    # +0000 has nothing accumulated, +0004 misses +0003
+    assert list(sources) == [decumulation.FROM_BASEDATE, decumulation.FROM_BASEDATE,
+                             1, decumulation.MISSING]
+
+
+@pytest.mark.parametrize('period', [None, '1h'])
+def test_decumulate(collection, period):
+    accumulated = collection.ds[FIELDS].copy(deep=True)
+    collection.decumulate(FIELDS, period=period)
+
+    for field in FIELDS:
+        result = collection.ds[field]
+        assert result.attrs['accumulation_period'] == ('previous validate' if period is None else '0 days 01:00:00')
+        # the +0000 step is kept (not NaN), the others are differenced
+        np.testing.assert_array_equal(result.isel(validate=0).values,
+                                      accumulated[field].isel(validate=0).values)
+        expected = accumulated[field].isel(validate=2) - accumulated[field].isel(validate=1)
+        np.testing.assert_allclose(result.isel(validate=2).values, expected.values, equal_nan=True)
+
+
+def test_decumulate_missing_leadtime():
+    Collection = FaCollection([import_synthetic(fafile) for fafile in synthetic_fafiles([0, 1, 3])])
+    Collection.combine_by_validate()
+    Collection.decumulate('SYNTH2D.000', period='1h')
+    assert not Collection.ds['SYNTH2D.000'].isel(validate=0).isnull().any()
+    assert Collection.ds['SYNTH2D.000'].isel(validate=2).isnull().all()
+
+
+def test_decumulate_opened_store(collection, tmp_path):
+    # the fields of an opened netCDF are not in memory, .values is a copy
+    collection.save_nc(str(tmp_path), 'store.nc')
+    with xr.open_dataset(tmp_path / 'store.nc', cache=False) as stored:
+        accumulated = collection.ds['SYNTH2D.000'].copy(deep=True)
+        collection.ds = stored
+        collection.decumulate('SYNTH2D.000')
+        expected = accumulated.isel(validate=3) - accumulated.isel(validate=2)
+        np.testing.assert_allclose(collection.ds['SYNTH2D.000'].isel(validate=3).values,
+                                   expected.values)
+
+
+def test_decumulate_refuses_lazy(collection):
+    pytest.importorskip('dask')
+    collection.ds = collection.ds.chunk({'validate': 1})
+    with pytest.raises(SystemExit):
+        collection.decumulate('SYNTH2D.000')
+    assert 'accumulation_period' not in collection.ds['SYNTH2D.000'].attrs
+
+
+def test_iter_decumulated_matches_decumulate(collection):
+    fafiles = synthetic_fafiles(range(4))
+    Streaming = FaCollection()
+    Streaming.set_fafiles(fafiles, backend='synthetic')
+    streamed = [Dataset.ds['SYNTH2D.000'].values.copy()
+                for Dataset in Streaming.iter_decumulated('SYNTH2D.000', period='1h')]
+
+    collection.decumulate('SYNTH2D.000', period='1h')
+    for idx, values in enumerate(streamed):
+        np.testing.assert_allclose(values, collection.ds['SYNTH2D.000'].isel(validate=idx).values)
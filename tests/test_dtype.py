@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the dtype of the imported fields (resolved from the packing bits).
+
+@author: thoverga
+"""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from conftest import import_synthetic
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+FIELDS = ['SYNTH2D.000', 'SYNTH3D.000', 'SYNTHPS.000']
+
+
+@pytest.mark.parametrize('nbits, expected', [(16, np.float32), (24, np.float32),
+                                             (25, np.float64), (32, np.float64)])
+def test_auto_dtype_from_nbits(nbits, expected):
+    Dataset = import_synthetic('run/PFAR07csm07+0001', backend=SyntheticBackend(nbits=nbits))
+    for field in FIELDS:
+        assert Dataset.ds[field].dtype == expected
+
+
+def test_explicit_dtype():
+    Dataset = import_synthetic('run/PFAR07csm07+0001', backend=SyntheticBackend(nbits=16),
+                               dtype='float64')
+    assert all(Dataset.ds[field].dtype == np.float64 for field in FIELDS)
+
+
+@pytest.mark.parametrize('nbits, expected', [(16, np.float32), (32, np.float64)])
+def test_dtype_survives_save_nc(tmp_path, nbits, expected):
+    Dataset = import_synthetic('run/PFAR07csm07+0001', backend=SyntheticBackend(nbits=nbits))
+    Dataset.save_nc(str(tmp_path), 'dataset.nc')
+    with xr.open_dataset(str(tmp_path / 'dataset.nc')) as ds:
+        for field in FIELDS:
+            assert ds[field].dtype == expected
+            np.testing.assert_array_equal(ds[field].values, Dataset.ds[field].values)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the one-pass ensemble statistics.
+
+@author: thoverga
+"""
+
+import numpy as np
+import pytest
+
+import pyfa_tool.modules.streaming_stats as streaming_stats
+from conftest import import_synthetic
+from pyfa_tool.ensemble import FaEnsemble
+
+
+QS = [0, 10, 50, 90, 100]
+
+
+def _members(n_members, spread=0.5, seed=0):
+    """Members with the same synthetic fields plus noise (a small spread)."""
+    rng = np.random.default_rng(seed)
+    template = import_synthetic('run/PFAR07csm07+0001')
+    members = []
+    for _ in range(n_members):
+        member = import_synthetic('run/PFAR07csm07+0001')
+        for field in ['SYNTH2D.000', 'SYNTH3D.000']:
+            noise = rng.normal(0., spread, size=member.ds[field].shape)
+            member.ds[field] = template.ds[field] + noise.astype(np.float32)
+        members.append(member)
+    return members
+
+
+def _stack(members, field):
+    return np.stack([member.ds[field].values for member in members]).astype(np.float64)
+
+
+def test_running_stats():
+    rng = np.random.default_rng(1)
+    arrays = rng.normal(size=(20, 6, 5))
+    arrays[3, 0, 0] = np.nan
+    running = streaming_stats.RunningStats(shape=(6, 5), stats=['mean', 'std', 'min', 'max', 'count'])
+    for values in arrays:
+        running.update(values)
+    np.testing.assert_allclose(running.result('mean'), np.nanmean(arrays, axis=0))
+    np.testing.assert_allclose(running.result('std'), np.nanstd(arrays, axis=0))
+    np.testing.assert_allclose(running.result('min'), np.nanmin(arrays, axis=0))
+    assert running.result('count')[0, 0] == 19
+
+
+def test_running_percentiles_exact_for_few_arrays():
+    rng = np.random.default_rng(2)
+    arrays = rng.normal(size=(30, 8, 7)).astype(np.float32)
+    running = streaming_stats.RunningPercentiles(shape=(8, 7), nbins=100)
+    for values in arrays:
+        running.update(values)
+    assert running.is_exact
+    np.testing.assert_allclose(running.percentiles(QS), np.percentile(arrays, QS, axis=0), rtol=1e-6)
+
+
+def test_running_percentiles_histogram_accuracy():
+    # a large offset between the points and a small spread per point
+    rng = np.random.default_rng(3)
+    offsets = np.linspace(0., 100., 8 * 7).reshape((8, 7))
+    arrays = offsets + rng.normal(scale=0.5, size=(400, 8, 7))
+    running = streaming_stats.RunningPercentiles(shape=(8, 7), nbins=100)
+    for values in arrays:
+        running.update(values)
+    assert not running.is_exact
+    assert running.n_outside < 0.01 * arrays.size
+
+    # the estimate is in the bin of the value at the percentile
+    expected = np.percentile(arrays, [10, 50, 90], axis=0, method='inverted_cdf')
+    error = np.abs(running.percentiles([10, 50, 90]) - expected)
+    assert np.all(error <= running.histogram.width * (1. + 1e-9))
+    assert np.all(running.histogram.width < 0.2 * arrays.std(axis=0))
+
+
+def test_histogram_percentiles_match_percentile():
+    rng = np.random.default_rng(4)
+    arrays = rng.uniform(size=(200, 4, 3))
+    histogram = streaming_stats.RunningHistogram(shape=(4, 3), lower=0., upper=1., nbins=50)
+    for values in arrays:
+        histogram.update(values)
+    stacked = histogram.percentiles(QS)
+    for idx, q in enumerate(QS):
+        np.testing.assert_array_equal(stacked[idx], histogram.percentile(q))
+    assert np.all(np.abs(stacked[1:-1] - np.percentile(arrays, QS[1:-1], axis=0)) < 0.05)
+
+
+@pytest.mark.parametrize('n_members', [10, 80])
+def test_ensemble_percentiles(n_members):
+    members = _members(n_members)
+    result = FaEnsemble(members).compute_statistics(stats=['mean', 'std'],
+                                                    fields=['SYNTH2D.000', 'SYNTH3D.000'],
+                                                    percentiles=[10, 50, 90])
+    for field in ['SYNTH2D.000', 'SYNTH3D.000']:
+        stacked = _stack(members, field)
+        np.testing.assert_allclose(result[f'{field}_mean'].isel(validate=0).values,
+                                   stacked.mean(axis=0), atol=1e-4)
+        np.testing.assert_allclose(result[f'{field}_std'].isel(validate=0).values,
+                                   stacked.std(axis=0), atol=1e-4)
+
+        percentiles = result[f'{field}_percentile'].isel(validate=0).values
+        if n_members <= 50:
+            expected = np.percentile(stacked, [10, 50, 90], axis=0)
+            valid = ~np.isnan(expected)
+            np.testing.assert_allclose(percentiles[valid], expected[valid], atol=1e-4)
+        else:
+            # estimated, within a bin (a small part of the spread, 0.5) of
+            # the value at the percentile
+            expected = np.percentile(stacked, [10, 50, 90], axis=0, method='inverted_cdf')
+            valid = ~np.isnan(expected)
+            assert np.abs(percentiles[valid] - expected[valid]).max() < 0.1
+        np.testing.assert_array_equal(np.isnan(percentiles), ~valid)
+
+
+def test_ensemble_exceedance():
+    members = _members(5)
+    result = FaEnsemble(members).compute_statistics(stats=['mean'], fields=['SYNTH2D.000'],
+                                                    thresholds={'SYNTH2D.000': [280.]})
+    expected = (_stack(members, 'SYNTH2D.000') > 280.).mean(axis=0)
+    np.testing.assert_allclose(result['SYNTH2D.000_exceedance'].isel(validate=0).values[0], expected)
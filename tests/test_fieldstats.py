@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the on-disk index of the field statistics.
+
+@author: thoverga
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import pyfa_tool.modules.fieldstats as fieldstats
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Store the indexes in a temporary folder (and restore the settings)."""
+    folder = str(tmp_path / 'fieldstats')
+    monkeypatch.setattr(fieldstats, 'FIELDSTATS_CACHE_DIR', folder)
+    monkeypatch.setitem(fieldstats._settings, 'enabled', None)
+    monkeypatch.delenv('PYFA_FIELDSTATS', raising=False)
+    monkeypatch.delenv('PYFA_FIELDSTATS_MAX_FILES', raising=False)
+    return folder
+
+
+def _fafile(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'FA')
+    return str(path)
+
+
+def _stats(name='SURFTEMPERATURE'):
+    import pandas as pd
+    return pd.DataFrame(fieldstats.compute_fieldstats(name, np.arange(6.).reshape(2, 3)))
+
+
+def test_update_and_read(tmp_path, cache_dir):
+    fafile = _fafile(tmp_path, 'PFAR07csm07+0001')
+    fieldstats.update_fieldstats(fafile, _stats('SURFTEMPERATURE'))
+    fieldstats.update_fieldstats(fafile, _stats('SURFPRESSION'))
+    stored = fieldstats.read_fieldstats(fafile)
+    assert sorted(stored['name']) == ['SURFPRESSION', 'SURFTEMPERATURE']
+    assert stored['mean'].tolist() == [2.5, 2.5]
+    # no temporary files are left behind
+    assert [name for name in os.listdir(cache_dir) if name.endswith('.tmp')] == []
+
+
+@pytest.mark.parametrize('disable', ['env', 'setting'])
+def test_opt_out(tmp_path, cache_dir, monkeypatch, disable):
+    if disable == 'env':
+        monkeypatch.setenv('PYFA_FIELDSTATS', '0')
+    else:
+        fieldstats.set_fieldstats(False)
+    assert not fieldstats.is_enabled()
+    fafile = _fafile(tmp_path, 'PFAR07csm07+0001')
+    fieldstats.update_fieldstats(fafile, _stats())
+    assert fieldstats.read_fieldstats(fafile).empty
+    assert not os.path.isdir(cache_dir)
+
+
+def test_max_files(tmp_path, cache_dir, monkeypatch):
+    monkeypatch.setenv('PYFA_FIELDSTATS_MAX_FILES', '2')
+    fafiles = [_fafile(tmp_path, f'PFAR07csm07+000{idx}') for idx in range(4)]
+    for idx, fafile in enumerate(fafiles):
+        fieldstats.update_fieldstats(fafile, _stats())
+        # distinct modification times
+        index = fieldstats._index_path(fafile)
+        os.utime(index, (idx, idx))
+    assert len([name for name in os.listdir(cache_dir) if name.endswith('.csv')]) == 2
+    # the least recently written are removed
+    assert fieldstats.read_fieldstats(fafiles[0]).empty
+    assert not fieldstats.read_fieldstats(fafiles[-1]).empty
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the (cached) latitude and longitude of the grid points.
+
+@author: thoverga
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import pyfa_tool.modules.geospatial_functions as geospatial_func
+from conftest import import_synthetic
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """An empty memory and disk cache (in a tmp directory)."""
+    monkeypatch.setattr(geospatial_func, 'LATLON_CACHE_DIR', str(tmp_path / 'latlon'))
+    monkeypatch.setattr(geospatial_func, '_latlon_cache', {})
+    return tmp_path / 'latlon'
+
+
+@pytest.fixture
+def ds():
+    return import_synthetic('run/PFAR07csm07+0001', whitelist=['SYNTH2D.000']).ds
+
+
+def _no_compute(dataset):
+    raise AssertionError('the lat/lon coordinates are computed again')
+
+
+def test_memory_cache(cache_dir, ds, monkeypatch):
+    lat, lon = geospatial_func.get_latlon(ds, disk_cache=False)
+    assert lat.shape == (ds.sizes['y'], ds.sizes['x'])
+    assert not lat.flags.writeable
+    assert not cache_dir.exists()
+
+    # the same grid (other validate) uses the cached arrays
+    monkeypatch.setattr(geospatial_func, '_compute_latlon', _no_compute)
+    other = import_synthetic('run/PFAR07csm07+0002', whitelist=['SYNTH2D.000']).ds
+    cached_lat, cached_lon = geospatial_func.get_latlon(other, disk_cache=False)
+    assert (cached_lat is lat) & (cached_lon is lon)
+
+
+def test_disk_cache(cache_dir, ds, monkeypatch):
+    lat, lon = geospatial_func.get_latlon(ds)
+    cachefile = cache_dir / f'{geospatial_func.geometry_hash(ds)}.npz'
+    assert cachefile.is_file()
+
+    # a new process (empty memory cache) reads the disk cache
+    monkeypatch.setattr(geospatial_func, '_latlon_cache', {})
+    monkeypatch.setattr(geospatial_func, '_compute_latlon', _no_compute)
+    cached_lat, cached_lon = geospatial_func.get_latlon(ds)
+    np.testing.assert_array_equal(cached_lat, lat)
+    np.testing.assert_array_equal(cached_lon, lon)
+
+
+def test_unreadable_disk_cache(cache_dir, ds, capsys):
+    os.makedirs(cache_dir)
+    cachefile = cache_dir / f'{geospatial_func.geometry_hash(ds)}.npz'
+    cachefile.write_bytes(b'not a npz file')
+    lat, _lon = geospatial_func.get_latlon(ds)
+    assert 'not readable' in capsys.readouterr().out
+    assert np.isfinite(lat).all()
+    with np.load(cachefile) as cached: # rewritten
+        np.testing.assert_array_equal(cached['lat'], lat)
+
+
+def test_other_grids_have_other_keys(cache_dir, ds):
+    other = import_synthetic('run/PFAR07csm07+0001', backend=SyntheticBackend(nx=20),
+                             whitelist=['SYNTH2D.000']).ds
+    assert geospatial_func.geometry_hash(ds) != geospatial_func.geometry_hash(other)
+    assert geospatial_func.get_latlon(other)[0].shape == (other.sizes['y'], 20)
+
+
+def test_geometry_hash_without_crs(ds):
+    with pytest.raises(SystemExit):
+        geospatial_func.geometry_hash(ds.drop_vars('spatial_ref'))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the dask-backed (lazy) imports and memory-limited writes.
+
+@author: thoverga
+"""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import pyfa_tool.modules.lazy as lazy
+from conftest import import_synthetic, synthetic_fafiles
+from pyfa_tool.collection import FaCollection
+from pyfa_tool.dataset import FaDataset
+
+
+FAFILE = 'run/PFAR07csm07+0002'
+PSEUDO_FIELDNAMES = ['S001SYNTHPS.000', 'S002SYNTHPS.000', 'S003SYNTHPS.000']
+
+
+def _lazy_dataset(fafile=FAFILE, **kwargs):
+    Dataset = FaDataset(fafile=fafile, backend='synthetic')
+    Dataset.lazy_import_fa(**kwargs)
+    return Dataset
+
+
+def test_lazy_selection_without_dask():
+    # the selection is done on the (not dask) lazily indexed dataset
+    ds = lazy._open_selection(FAFILE, backend='synthetic', whitelist=['SYNTH2D.001', 'S002SYNTHPS.000'],
+                              levels=[2, 3], window=(5, 25, 0, 10))
+    reference = import_synthetic(FAFILE, whitelist=['SYNTH2D.001'] + PSEUDO_FIELDNAMES,
+                                 levels=[2, 3], window=(5, 25, 0, 10)).ds
+    assert set(ds.data_vars) == {'SYNTH2D.001', 'SYNTHPS.000'}
+    for name in ds.data_vars:
+        np.testing.assert_array_equal(ds[name].values, reference[name].values)
+    assert 'validate' in ds.coords
+
+
+def test_require_dask_message(monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def no_dask(name, *args, **kwargs):
+        if name.startswith('dask'):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', no_dask)
+    with pytest.raises(SystemExit, match='dask'):
+        lazy.require_dask()
+
+
+@pytest.mark.parametrize('decode_per', ['field', 'file'])
+def test_lazy_import_matches_import_fa(decode_per):
+    pytest.importorskip('dask')
+    Dataset = _lazy_dataset(whitelist=['SYNTH2D.000', 'SYNTH3D.001', 'SYNTHPS.000'],
+                            decode_per=decode_per)
+    assert lazy.is_lazy(Dataset.ds)
+    reference = import_synthetic(FAFILE, whitelist=['SYNTH2D.000', 'SYNTH3D.001'] + PSEUDO_FIELDNAMES).ds
+    computed = Dataset.ds.compute()
+    for name in reference.data_vars:
+        np.testing.assert_array_equal(computed[name].values, reference[name].values)
+
+
+def test_lazy_collection_save_nc(tmp_path):
+    pytest.importorskip('dask')
+    Lazy = FaCollection([_lazy_dataset(fafile) for fafile in synthetic_fafiles(range(3))])
+    Lazy.combine_by_validate()
+    assert lazy.is_lazy(Lazy.ds)
+    Lazy.save_nc(str(tmp_path), 'lazy.nc', max_memory='64M')
+
+    Eager = FaCollection([import_synthetic(fafile) for fafile in synthetic_fafiles(range(3))])
+    Eager.combine_by_validate()
+    with xr.open_dataset(tmp_path / 'lazy.nc') as saved:
+        for name in Eager.ds.data_vars:
+            np.testing.assert_array_equal(saved[name].values, Eager.ds[name].values)
+
+
+def test_num_workers():
+    pytest.importorskip('dask')
+    Dataset = _lazy_dataset()
+    size = max([var.nbytes for var in Dataset.ds.data_vars.values()])
+    assert lazy.get_num_workers(Dataset.ds, max_memory=1) == 1
+    assert lazy.get_num_workers(Dataset.ds, max_memory=10**12) >= 1
+    assert lazy.get_num_workers(Dataset.ds, max_memory=lazy._DECODE_MEMORY_FACTOR * size) == 1
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the stage profiler.
+
+@author: thoverga
+"""
+
+import asyncio
+
+import numpy as np
+
+from pyfa_tool.modules.profiling import StageProfiler
+
+
+def test_memory_columns():
+    profiler = StageProfiler(trace_memory=True)
+    with profiler.stage('outer'):
+        with profiler.stage('inner'):
+            data = np.ones((1000, 1000)) # 8 MB
+        del data
+
+    report = profiler.get_report().set_index('stage')
+    assert list(report.index) == ['inner', 'outer']
+    assert report.loc['inner', 'peak_traced_mb'] > 7.
+    # the peak of the inner stage is part of the peak of the outer stage
+    assert report.loc['outer', 'peak_traced_mb'] >= report.loc['inner', 'peak_traced_mb']
+    for column in ['rss_delta_mb', 'process_peak_rss_mb', 'process_peak_rss_children_mb']:
+        assert column in report.columns
+    assert 'process_peak_rss_mb' in profiler.get_summary().columns
+
+
+def test_stages_of_concurrent_tasks():
+    profiler = StageProfiler(trace_memory=True)
+
+    async def task(name):
+        with profiler.stage('outer', task=name):
+            await asyncio.sleep(0.01)
+            with profiler.stage('inner', task=name):
+                await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[task(name) for name in ['a', 'b', 'c']])
+
+    asyncio.run(main())
+    report = profiler.get_report()
+    assert len(report) == 6
+    # the interleaved tasks do not pop each other's stages
+    assert sorted(report[report['stage'] == 'outer']['task']) == ['a', 'b', 'c']
+    assert profiler._stack.get() == ()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the scratch directories of the decoders.
+
+@author: thoverga
+"""
+
+import os
+import tempfile
+
+import pytest
+
+import pyfa_tool.modules.scratch as scratch
+
+
+@pytest.fixture(autouse=True)
+def no_scratch_settings(monkeypatch):
+    monkeypatch.delenv('PYFA_SCRATCH_DIR', raising=False)
+    monkeypatch.delenv('PYFA_SCRATCH_QUOTA', raising=False)
+
+
+@pytest.fixture
+def shm(tmp_path, monkeypatch):
+    """A /dev/shm stand-in, with (by default) room for everything."""
+    shm = tmp_path / 'shm'
+    shm.mkdir()
+    monkeypatch.setattr(scratch, 'SHM_DIR', str(shm))
+    monkeypatch.setattr(scratch, '_shm_fits', lambda expected_size: True)
+    return shm
+
+
+@pytest.mark.parametrize('size, expected', [('1024', 1024), (2048, 2048), ('4K', 4096),
+                                            ('1.5M', 3 * 512 * 1024), ('2g', 2 * 1024**3),
+                                            ('1TB', 1024**4), (' 500M ', 500 * 1024**2)])
+def test_parse_size(size, expected):
+    assert scratch._parse_size(size) == expected
+
+
+@pytest.mark.parametrize('size', ['', 'many', '4X'])
+def test_parse_invalid_size(size):
+    with pytest.raises(SystemExit):
+        scratch._parse_size(size)
+
+
+def test_root_from_environment(tmp_path, monkeypatch, shm):
+    monkeypatch.setenv('PYFA_SCRATCH_DIR', str(tmp_path))
+    assert scratch.get_scratch_root() == str(tmp_path)
+    monkeypatch.setenv('PYFA_SCRATCH_DIR', str(tmp_path / 'missing'))
+    with pytest.raises(SystemExit):
+        scratch.get_scratch_root()
+
+
+def test_root_in_shm_if_it_fits(shm, monkeypatch):
+    assert scratch.get_scratch_root(expected_size=10) == str(shm)
+    monkeypatch.setattr(scratch, '_shm_fits', lambda expected_size: False)
+    assert scratch.get_scratch_root(expected_size=10) == tempfile.gettempdir()
+
+
+def test_root_falls_back_when_the_shm_quota_is_used(shm, monkeypatch):
+    used = shm / 'pyfa_member_abc'
+    used.mkdir()
+    (used / 'FA').write_bytes(b'x' * 1000)
+    (shm / 'other').write_bytes(b'x' * 5000) # not a pyfa scratch directory
+    assert scratch.get_used_size(str(shm)) == 1000
+
+    monkeypatch.setenv('PYFA_SCRATCH_QUOTA', '1500')
+    assert scratch.get_scratch_root(expected_size=400) == str(shm)
+    assert scratch.get_scratch_root(expected_size=600) == tempfile.gettempdir()
+
+
+def test_quota_exceeded(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYFA_SCRATCH_DIR', str(tmp_path))
+    monkeypatch.setenv('PYFA_SCRATCH_QUOTA', '1K')
+    with pytest.raises(SystemExit):
+        scratch.new_scratch_dir(expected_size=2048)
+    assert os.listdir(tmp_path) == []
+
+
+def test_scratch_dir_is_removed_on_error(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYFA_SCRATCH_DIR', str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with scratch.scratch_dir(name='json') as path:
+            assert os.path.basename(path).startswith('pyfa_json_')
+            with open(os.path.join(path, 'FA.json'), 'w') as f:
+                f.write('{}')
+            raise RuntimeError('decode failed')
+    assert not os.path.exists(path)
+    assert path not in scratch._active_dirs
+
+
+def test_scratch_dir_keep(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('PYFA_SCRATCH_DIR', str(tmp_path))
+    with scratch.scratch_dir(keep=True) as path:
+        pass
+    assert os.path.isdir(path)
+    assert path not in scratch._active_dirs
+    assert 'is kept' in capsys.readouterr().out
+
+
+def test_parallel_scratch_dirs_are_unique(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYFA_SCRATCH_DIR', str(tmp_path))
+    paths = [scratch.new_scratch_dir(name='tmp') for _ in range(5)]
+    assert len(set(paths)) == 5
+    for path in paths:
+        scratch.remove_scratch_dir(path)
+    assert os.listdir(tmp_path) == []
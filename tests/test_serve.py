@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the field server (pyfa serve) and its client (FaClient).
+
+@author: thoverga
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import pyfa_tool.modules.serve as serve
+from conftest import import_synthetic
+from pyfa_tool.client import FaClient
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+FAFILE = 'run/PFAR07csm07+0002'
+
+
+def test_pack_unpack_arrays():
+    arrays = {'values': np.arange(24, dtype=np.float32).reshape(2, 3, 4),
+              'x': np.linspace(0., 1., 4),
+              'level': np.array([1, 3], dtype='>i8')} # big-endian is packed little-endian
+    header, unpacked = serve.unpack_arrays(bytearray(serve.pack_arrays({'field': 'A'}, arrays)))
+    assert header['field'] == 'A'
+    assert list(unpacked) == ['values', 'x', 'level']
+    for name, arr in arrays.items():
+        np.testing.assert_array_equal(unpacked[name], arr)
+    assert unpacked['values'].dtype == np.float32
+
+    with pytest.raises(SystemExit):
+        serve.unpack_arrays(b'NOPYFA')
+
+
+def test_field_cache():
+    cache = serve.FieldCache(max_bytes=100)
+    loads = []
+
+    def _loader(key, nbytes):
+        def load():
+            loads.append(key)
+            return key, nbytes
+        return load
+
+    assert cache.get('a', _loader('a', 40)) == 'a'
+    assert cache.get('b', _loader('b', 40)) == 'b'
+    assert cache.get('a', _loader('a', 40)) == 'a' # hit, 'b' is now the oldest
+    assert cache.get('c', _loader('c', 40)) == 'c' # 'b' is evicted
+    assert cache.get('d', _loader('d', 200)) == 'd' # too large to cache
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses']) == (1, 4)
+    assert (stats['fields'], stats['nbytes']) == (2, 80)
+    cache.get('b', _loader('b', 40))
+    assert loads == ['a', 'b', 'c', 'd', 'b']
+
+
+@pytest.fixture
+def field():
+    return import_synthetic(FAFILE).ds['SYNTH3D.000']
+
+
+def test_slice_field(field):
+    sliced = serve.slice_field(field, levels=[2, 5], window=(3, 20, 5, 30), stride=2)
+    np.testing.assert_array_equal(sliced.values,
+                                  field.sel(level=[2, 5]).values[:, 5:30:2, 3:20:2])
+
+    x, y = field['x'].values, field['y'].values
+    bbox = (x[4], min(y[10], y[20]), x[9], max(y[10], y[20]))
+    sliced = serve.slice_field(field, bbox=bbox)
+    assert sliced.sizes['x'] == 6
+    assert sliced.sizes['y'] == 11
+
+
+@pytest.mark.parametrize('kwargs', [{'levels': [99]}, {'stride': 0},
+                                    {'bbox': (1e9, 1e9, 2e9, 2e9)}])
+def test_slice_field_errors(field, kwargs):
+    with pytest.raises(SystemExit):
+        serve.slice_field(field, **kwargs)
+
+
+def test_slice_field_levels_of_2d_field():
+    field = import_synthetic(FAFILE).ds['SYNTH2D.000']
+    with pytest.raises(SystemExit):
+        serve.slice_field(field, levels=[1])
+
+
+class _FailingBackend(SyntheticBackend):
+    """A backend that fails on decoding (e.g. a crashing decoder)."""
+
+    def read_fields(self, fafile, fields, **kwargs):
+        raise RuntimeError('the decoder crashed')
+
+
+def _serving(server, **kwargs):
+    """Serve in a thread, returns the (running) socket server."""
+    httpd = server.make_server(**kwargs)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+@pytest.fixture(params=['http', 'unix'])
+def address(request, tmp_path):
+    server = serve.FaServer(backend=SyntheticBackend(), max_cache_bytes=10**8)
+    if request.param == 'http':
+        httpd = _serving(server, port=0)
+        address = f'http://127.0.0.1:{httpd.server_address[1]}'
+    else:
+        socket_path = str(tmp_path / 'pyfa.sock')
+        httpd = _serving(server, socket_path=socket_path)
+        address = socket_path
+    yield address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_client_round_trip(address):
+    reference = import_synthetic(FAFILE).ds
+    client = FaClient(FAFILE, address=address)
+    assert set(client.get_available_fields()['field']) == set(reference.data_vars)
+
+    client.import_fa(whitelist=['SYNTH2D.001', 'SYNTH3D.000'], levels=[1, 4], stride=2)
+    np.testing.assert_array_equal(client.ds['SYNTH2D.001'].values,
+                                  reference['SYNTH2D.001'].values[::2, ::2])
+    np.testing.assert_array_equal(client.ds['SYNTH3D.000'].values,
+                                  reference['SYNTH3D.000'].sel(level=[1, 4]).values[:, ::2, ::2])
+    assert client.ds.rio.crs == reference.rio.crs
+
+    # an unknown field is refused, the server keeps running
+    with pytest.raises(SystemExit, match='refused'):
+        client.get_slice('UNKNOWN')
+    assert client.get_slice('SYNTH2D.001').shape == reference['SYNTH2D.001'].shape
+
+
+def test_server_errors_reach_the_client(tmp_path):
+    httpd = _serving(serve.FaServer(backend=_FailingBackend()), port=0)
+    try:
+        client = FaClient(FAFILE, address=f'http://127.0.0.1:{httpd.server_address[1]}')
+        with pytest.raises(SystemExit, match='RuntimeError: the decoder crashed'):
+            client.get_slice('SYNTH2D.001')
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_root(tmp_path):
+    server = serve.FaServer(backend=SyntheticBackend(), root=str(tmp_path))
+    assert server._resolve('run/PFAR07csm07+0001') == os.path.join(str(tmp_path), 'run', 'PFAR07csm07+0001')
+    with pytest.raises(SystemExit):
+        server._resolve('../PFAR07csm07+0001')
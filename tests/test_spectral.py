@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the spectral to grid-point transform.
+
+@author: thoverga
+"""
+
+import numpy as np
+
+import pyfa_tool.modules.spectral as spectral
+from conftest import import_synthetic
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+def test_roundtrip_of_resolved_field():
+    ny, nx = 30, 36
+    y, x = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+    grid = 2. + np.cos(2 * np.pi * 3 * x / nx) * np.sin(2 * np.pi * 2 * y / ny)
+    coeffs = spectral.gridpoint_to_spectral(grid, nsmax=(ny - 1) // 2, nmsmax=(nx - 1) // 2)
+    np.testing.assert_allclose(spectral.spectral_to_gridpoint(coeffs, ny=ny, nx=nx), grid, atol=1e-10)
+
+
+def test_transform_on_extended_grid_is_cropped():
+    # the truncation of the C+I+E grid does not fit on the C+I zone
+    Dataset = import_synthetic('run/PFAR07csm07+0001', backend=SyntheticBackend(spectral=True))
+    reference = import_synthetic('run/PFAR07csm07+0001')
+    assert Dataset.ds.attrs['nsmax'] * 2 + 1 > Dataset.ds.sizes['y']
+
+    spectral_field = Dataset.ds['SYNTH3D.000']
+    assert spectral_field.shape == reference.ds['SYNTH3D.000'].shape
+    # only the smallest scales are truncated
+    error = np.abs(spectral_field.values - reference.ds['SYNTH3D.000'].values)
+    assert error.mean() < 0.3
+
+
+def test_window_of_spectral_field():
+    backend = SyntheticBackend(spectral=True)
+    full = import_synthetic('run/PFAR07csm07+0001', backend=backend, whitelist=['SYNTH3D.000'])
+    window = import_synthetic('run/PFAR07csm07+0001', backend=backend, whitelist=['SYNTH3D.000'],
+                              window=(5, 20, 10, 30))
+    np.testing.assert_allclose(window.ds['SYNTH3D.000'].values,
+                               full.ds['SYNTH3D.000'].values[:, 10:30, 5:20], rtol=1e-6)
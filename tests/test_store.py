@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental appends to a combined store (FaCollection.append_to).
+
+@author: thoverga
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from conftest import import_synthetic, synthetic_fafiles
+from pyfa_tool.collection import FaCollection
+from pyfa_tool.modules.backends import SyntheticBackend
+
+
+@pytest.fixture
+def store(collection, tmp_path):
+    """A netCDF store of the leadtimes +0000 up to +0003."""
+    collection.save_nc(str(tmp_path), 'store.nc', appendable=True)
+    return str(tmp_path / 'store.nc')
+
+
+def _validates(store):
+    with xr.open_dataset(store) as ds:
+        return list(pd.DatetimeIndex(ds['validate'].values).hour)
+
+
+def test_append_new_validates(store):
+    FaCollection().append_to(store, synthetic_fafiles([4, 5]), backend='synthetic')
+    assert _validates(store) == [0, 1, 2, 3, 4, 5]
+
+    reference = import_synthetic(synthetic_fafiles([5])[0]).ds
+    with xr.open_dataset(store) as ds:
+        assert list(ds.attrs['filepaths'])[-1] == synthetic_fafiles([5])[0]
+        for name in ['SYNTH2D.000', 'SYNTH3D.000', 'SYNTHPS.000']:
+            np.testing.assert_array_equal(ds[name].isel(validate=-1).values, reference[name].values)
+        assert 'crs_wkt' in ds['spatial_ref'].attrs
+
+
+def test_append_replaces_and_inserts(store):
+    FaCollection().append_to(store, synthetic_fafiles([5]), backend='synthetic')
+    FaCollection().append_to(store, synthetic_fafiles([2, 4]), backend='synthetic')
+    assert _validates(store) == [0, 1, 2, 3, 4, 5]
+    with xr.open_dataset(store) as ds:
+        assert len(ds.attrs['filepaths']) == 6
+
+
+def test_append_imported_datasets(store):
+    Collection = FaCollection([import_synthetic(fafile) for fafile in synthetic_fafiles([4, 5])])
+    Collection.append_to(store)
+    assert _validates(store) == [0, 1, 2, 3, 4, 5]
+
+
+def test_append_creates_store(tmp_path):
+    store = str(tmp_path / 'new.nc')
+    FaCollection().append_to(store, synthetic_fafiles([1]), backend='synthetic')
+    FaCollection().append_to(store, synthetic_fafiles([2]), backend='synthetic')
+    assert _validates(store) == [1, 2]
+
+
+def test_append_other_fields(store):
+    FaCollection().append_to(store, synthetic_fafiles([4]), backend='synthetic',
+                             whitelist=['SYNTH2D.000'])
+    with xr.open_dataset(store) as ds:
+        assert ds['SYNTH2D.001'].isel(validate=-1).isnull().all()
+        assert not ds['SYNTH2D.000'].isel(validate=-1).isnull().any()
+
+
+@pytest.mark.parametrize('backend', [SyntheticBackend(nx=20), SyntheticBackend(nlev=5)])
+def test_append_incompatible(store, backend):
+    with pytest.raises(SystemExit):
+        FaCollection().append_to(store, synthetic_fafiles([4]), backend=backend)
+    assert _validates(store) == [0, 1, 2, 3]
+
+
+def test_append_to_store_with_old_b_list(store, capsys):
+    import netCDF4
+
+    # stores of older versions have the A list as B list
+    with netCDF4.Dataset(store, mode='a') as nc:
+        nc.setncattr('B_list', nc.getncattr('A_list'))
+    FaCollection().append_to(store, synthetic_fafiles([4]), backend='synthetic')
+    assert 'WARNING' in capsys.readouterr().out
+    assert _validates(store) == [0, 1, 2, 3, 4]
+    reference = import_synthetic(synthetic_fafiles([4])[0]).ds
+    with xr.open_dataset(store) as ds:
+        np.testing.assert_allclose(ds.attrs['B_list'], reference.attrs['B_list'])
+
+
+def test_append_after_interrupted_append(store, capsys):
+    import netCDF4
+
+    # an append that stopped after writing the fields (the filepaths are not updated)
+    with netCDF4.Dataset(store, mode='a') as nc:
+        nc['validate'][4] = nc['validate'][3] + 3600
+        nc['SYNTH2D.000'][4] = 0.
+    FaCollection().append_to(store, synthetic_fafiles([4]), backend='synthetic')
+    assert 'incomplete' in capsys.readouterr().out
+    assert _validates(store) == [0, 1, 2, 3, 4]
+    reference = import_synthetic(synthetic_fafiles([4])[0]).ds
+    with xr.open_dataset(store) as ds:
+        assert len(ds.attrs['filepaths']) == 5
+        np.testing.assert_array_equal(ds['SYNTH2D.000'].isel(validate=-1).values,
+                                      reference['SYNTH2D.000'].values)
+
+
+def test_save_nc_is_not_appendable_by_default(collection, tmp_path, capsys):
+    import netCDF4
+
+    collection.save_nc(str(tmp_path), 'plain.nc')
+    store = str(tmp_path / 'plain.nc')
+    with netCDF4.Dataset(store) as nc:
+        assert not nc.dimensions['validate'].isunlimited()
+
+    # the store is rewritten (once) with an unlimited validate dimension
+    FaCollection().append_to(store, synthetic_fafiles([4]), backend='synthetic')
+    assert 'not unlimited' in capsys.readouterr().out
+    with netCDF4.Dataset(store) as nc:
+        assert nc.dimensions['validate'].isunlimited()
+    FaCollection().append_to(store, synthetic_fafiles([5]), backend='synthetic')
+    assert 'rewritten' not in capsys.readouterr().out
+    assert _validates(store) == [0, 1, 2, 3, 4, 5]
+
+
+@pytest.fixture
+def zarr_store(collection, tmp_path):
+    """A zarr store of the leadtimes +0000 up to +0003."""
+    pytest.importorskip('zarr')
+    store = str(tmp_path / 'store.zarr')
+    collection.save_zarr(store)
+    return store
+
+
+def _zarr_validates(store):
+    with xr.open_zarr(store) as ds:
+        return list(pd.DatetimeIndex(ds['validate'].values).hour), list(ds.attrs['filepaths'])
+
+
+def test_append_to_zarr_store(zarr_store, capsys):
+    FaCollection().append_to(zarr_store, synthetic_fafiles([4, 5]), backend='synthetic')
+    assert 'appended' in capsys.readouterr().out
+    hours, filepaths = _zarr_validates(zarr_store)
+    assert hours == [0, 1, 2, 3, 4, 5]
+    assert filepaths[-1] == synthetic_fafiles([5])[0]
+
+    reference = import_synthetic(synthetic_fafiles([5])[0]).ds
+    with xr.open_zarr(zarr_store) as ds:
+        np.testing.assert_array_equal(ds['SYNTH3D.000'].isel(validate=-1).values,
+                                      reference['SYNTH3D.000'].values)
+
+
+def test_append_to_zarr_store_after_interrupted_append(zarr_store, capsys):
+    # an append that stopped after writing the fields (the filepaths are not updated)
+    with xr.open_zarr(zarr_store) as ds:
+        extra = ds.isel(validate=[-1]).load()
+    extra = extra.assign_coords(validate=extra['validate'] + np.timedelta64(1, 'h'))
+    for var in extra.variables.values():
+        var.encoding = {}
+    extra.to_zarr(zarr_store, append_dim='validate')
+
+    FaCollection().append_to(zarr_store, synthetic_fafiles([4]), backend='synthetic')
+    assert 'incomplete' in capsys.readouterr().out
+    hours, filepaths = _zarr_validates(zarr_store)
+    assert hours == [0, 1, 2, 3, 4]
+    assert len(filepaths) == 5
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of watching a directory for new FA files.
+
+@author: thoverga
+"""
+
+import os
+
+import pytest
+import xarray as xr
+
+import pyfa_tool.modules.watch as watch
+
+
+class _Clock():
+    """A clock that only moves when it is told to."""
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(watch.time, 'time', clock)
+    return clock
+
+
+def _write(path, content='FA'):
+    with open(path, 'w') as f:
+        f.write(content)
+    return os.path.abspath(str(path))
+
+
+def test_poll_returns_complete_files(tmp_path):
+    first = _write(tmp_path / 'PFAR07csm07+0001')
+    _write(tmp_path / 'PFAR07csm07+0002', content='') # still empty
+    watcher = watch.DirectoryWatcher(str(tmp_path), settle_time=0)
+    assert watcher.poll() == [first]
+
+    watcher.mark_done(first)
+    assert watcher.poll() == []
+    # a handled file is returned again when it changes
+    _write(first, content='FA file')
+    assert watcher.poll() == [first]
+
+
+def test_poll_waits_for_the_settle_time(tmp_path, clock):
+    path = _write(tmp_path / 'PFAR07csm07+0001')
+    watcher = watch.DirectoryWatcher(str(tmp_path), settle_time=10)
+    assert watcher.poll() == []
+    clock.now += 5
+    assert watcher.poll() == []
+
+    # still being written: the settle time starts again
+    _write(path, content='FA file')
+    clock.now += 6
+    assert watcher.poll() == []
+    clock.now += 9
+    assert watcher.poll() == []
+    clock.now += 1
+    assert watcher.poll() == [path]
+
+
+def test_skip_existing(tmp_path):
+    _write(tmp_path / 'PFAR07csm07+0001')
+    watcher = watch.DirectoryWatcher(str(tmp_path), settle_time=0, skip_existing=True)
+    assert watcher.poll() == []
+    new = _write(tmp_path / 'PFAR07csm07+0002')
+    assert watcher.poll() == [new]
+
+
+def test_store_and_temporary_files_are_excluded(tmp_path):
+    fafile = _write(tmp_path / 'PFAR07csm07+0001')
+    store = _write(tmp_path / 'collection.nc')
+    for name in ['.collection.nc.tmp.nc', 'PFAR07csm07+0002.part', 'PFAR07csm07+0003.tmp']:
+        _write(tmp_path / name)
+    watcher = watch.DirectoryWatcher(str(tmp_path), settle_time=0, exclude=[store])
+    assert watcher.poll() == [fafile]
+
+
+def test_watch_and_convert(tmp_path):
+    for leadtime in range(2):
+        _write(tmp_path / f'PFAR07csm07+000{leadtime}')
+    store = str(tmp_path / 'collection.nc')
+    converted = watch.watch_and_convert(str(tmp_path), store=store, backend='synthetic',
+                                        interval=0, settle_time=0, idle_timeout=0,
+                                        whitelist=['SYNTH2D.000'])
+    assert len(converted) == 2
+    with xr.open_dataset(store) as ds:
+        assert ds.sizes['validate'] == 2
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the xarray backend entrypoint (engine="pyfa").
+
+@author: thoverga
+"""
+
+import pickle
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from conftest import import_synthetic
+from pyfa_tool.modules.xarray_backend import PyfaBackendEntrypoint
+
+
+FAFILE = 'run/PFAR07csm07+0003'
+
+
+def _open(fafile, **kwargs):
+    return xr.open_dataset(fafile, engine=PyfaBackendEntrypoint, backend='synthetic', **kwargs)
+
+
+@pytest.fixture
+def opened():
+    # (the fields have the basedate and validate dimensions)
+    return _open(FAFILE).isel(basedate=0, validate=0)
+
+
+@pytest.fixture
+def reference():
+    return import_synthetic(FAFILE).ds
+
+
+def test_lazy_variables(opened):
+    for var in opened.data_vars.values():
+        assert not isinstance(var.variable._data, np.ndarray)
+
+
+def test_values_match_import_fa(opened, reference):
+    assert set(opened.data_vars) == set(reference.data_vars)
+    for name in reference.data_vars:
+        np.testing.assert_array_equal(opened[name].values, reference[name].values)
+    np.testing.assert_array_equal(opened['level'].values, reference['level'].values)
+    assert opened.rio.crs == reference.rio.crs
+
+
+def test_indexing_decodes_a_selection(opened, reference):
+    selection = dict(x=slice(3, 20, 2), y=slice(30, 5, -3))
+    for name in ['SYNTH2D.001', 'SYNTH3D.000', 'SYNTHPS.000']:
+        np.testing.assert_array_equal(opened[name].isel(**selection).values,
+                                      reference[name].isel(**selection).values)
+    np.testing.assert_array_equal(opened['SYNTH3D.001'].isel(level=2, x=4).values,
+                                  reference['SYNTH3D.001'].isel(level=2, x=4).values)
+
+
+def test_time_dims():
+    opened = _open(FAFILE)
+    assert opened['SYNTH2D.001'].dims == ('basedate', 'validate', 'y', 'x')
+    assert opened['SYNTH3D.000'].dims == ('basedate', 'validate', 'level', 'y', 'x')
+    assert opened['SYNTH2D.001'].isel(validate=slice(1, None)).values.shape == (1, 0, 40, 50)
+
+
+def test_concat_on_validate(reference):
+    # the files of a run are concatenated on validate (as open_mfdataset does)
+    other = 'run/PFAR07csm07+0004'
+    combined = xr.concat([_open(FAFILE), _open(other)], dim='validate',
+                         data_vars='minimal', coords='minimal', compat='override')
+    assert combined.sizes['validate'] == 2
+    np.testing.assert_array_equal(combined['SYNTH3D.000'].isel(basedate=0, validate=0).values,
+                                  reference['SYNTH3D.000'].values)
+    np.testing.assert_array_equal(combined['SYNTH2D.000'].isel(basedate=0, validate=1).values,
+                                  import_synthetic(other).ds['SYNTH2D.000'].values)
+
+
+def test_drop_variables():
+    opened = _open(FAFILE, drop_variables=['SYNTH2D.000', 'SYNTH3D.000'])
+    assert 'SYNTH2D.000' not in opened.data_vars
+    assert 'SYNTH3D.000' not in opened.data_vars
+    assert 'SYNTH2D.001' in opened.data_vars
+
+
+def test_pickle(opened, reference):
+    unpickled = pickle.loads(pickle.dumps(opened))
+    np.testing.assert_array_equal(unpickled['SYNTH2D.002'].values, reference['SYNTH2D.002'].values)
+
+
+def test_guess_can_open():
+    entrypoint = PyfaBackendEntrypoint()
+    assert entrypoint.guess_can_open('archive.tar::PFAR07csm07+0001')
+    assert not entrypoint.guess_can_open('data.nc')